@@ -0,0 +1,307 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from typing import BinaryIO, Optional, Set
+from constants import ARCHIVE_FORMATS, ARCHIVE_SPOOL_SIZE, ARCHIVE_CHECKPOINT_ENTRIES
+from downloadwriter import IncompleteDownloadError, active_writers
+from jobs import current_job
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # Only needed for .tar.zst archives.
+
+class ArchiveError(Exception):
+    """
+    Raised when an existing archive cannot be read or appended to.
+    """
+
+def archive_format(path: str) -> Optional[str]:
+    """
+    Get the format of an archive from its file name.
+
+    Args:
+        path (str): The path of the archive.
+
+    Returns:
+        Optional[str]: One of ARCHIVE_FORMATS (e.g. '.zip'), or None if the format is not supported.
+    """
+    name = path.lower()
+    return next((suffix for suffix in ARCHIVE_FORMATS if name.endswith(suffix)), None)
+
+def archive_available(path: str) -> bool:
+    """
+    Check whether the package needed to write an archive's format is installed.
+
+    Args:
+        path (str): The path of the archive.
+
+    Returns:
+        bool: True if the archive can be written.
+    """
+    return archive_format(path) != ".tar.zst" or zstandard is not None
+
+class ArchiveWriter:
+    """
+    Writes downloaded papers into a zip or tar archive instead of the download folder, appending to the archive
+    if it already exists. Papers already in the archive are left alone, so an interrupted 'getmany' can be run again.
+
+    Entries are named by their path relative to the download folder, so the archive has the same layout as the library.
+    Thread-safe, so several downloads can write into the same archive; each entry is written in one go under a lock.
+
+    Appending never rewrites what is already in the archive:
+    - Zip archives get new entries and a new central directory after the old entries.
+    - Tar archives get new entries written over their end of archive marker.
+    - Zstandard compressed tar archives get a new compressed frame. The tar end of archive marker is never written,
+      so that later frames can still be read; tar (and Python's tarfile) read to the end of the file without it.
+
+    The archive is checkpointed every ARCHIVE_CHECKPOINT_ENTRIES entries: the entries are flushed to disk, the zip central
+    directory is written and the compressed frame is ended. If the program is killed, tar archives can be read up to the
+    last checkpoint. A zip archive loses its central directory as soon as the next entry is written over it, but the
+    entries themselves are intact and can be recovered with 'zip -FF'.
+
+    Attributes:
+        path (str): The path of the archive.
+        root (str): The folder entry names are relative to.
+        format (str): One of ARCHIVE_FORMATS.
+        names (Set[str]): The names of the entries in the archive.
+    """
+
+    def __init__(self, path: str, root: str) -> None:
+        """
+        Initialize the ArchiveWriter, reading the entries of the archive if it already exists.
+
+        Args:
+            path (str): The path of the archive.
+            root (str): The folder entry names are relative to, i.e. the download folder.
+
+        Raises:
+            ArchiveError: If the format is not supported or the existing archive cannot be read.
+            OSError: If the archive cannot be opened.
+        """
+        self.path: str = path
+        self.root: str = root
+        self.format: Optional[str] = archive_format(path)
+        if not self.format or not archive_available(path):
+            raise ArchiveError(f"Unsupported archive format: {path}")
+        self.names: Set[str] = set()
+        self._lock = threading.Lock()
+        self._since_checkpoint: int = 0
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._file: Optional[BinaryIO] = None
+        self._stream = None
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok = True)
+        try:
+            self._open()
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as err:
+            raise ArchiveError(f"{path} is not a valid {self.format} archive: {err}")
+        except Exception as err:
+            if zstandard and isinstance(err, zstandard.ZstdError):
+                raise ArchiveError(f"{path} is not a valid {self.format} archive: {err}")
+            raise
+
+    def _open(self) -> None:
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if self.format == ".zip":
+            self._zip = zipfile.ZipFile(self.path, "a" if exists else "w", zipfile.ZIP_STORED) # PDFs are already compressed.
+            self.names = set(self._zip.namelist())
+        elif self.format == ".tar":
+            end = 0
+            if exists:
+                with tarfile.open(self.path, "r:") as tar:
+                    self.names = set(tar.getnames())
+                    end = tar.offset # Just after the last entry, where the end of archive marker starts.
+            self._file = open(self.path, "r+b" if exists else "wb")
+            self._file.seek(end)
+            self._file.truncate()
+            self._stream = self._file
+        else:
+            if exists:
+                with open(self.path, "rb") as f:
+                    reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames = True)
+                    with tarfile.open(fileobj = reader, mode = "r|", ignore_zeros = True) as tar:
+                        self.names = {member.name for member in tar}
+            self._file = open(self.path, "ab")
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._file, closefd = False)
+
+    def entry_name(self, path: str) -> str:
+        """
+        Get the name of the entry a file in the download folder is written to.
+
+        Args:
+            path (str): The path the file would be downloaded to.
+
+        Returns:
+            str: The path relative to the download folder, with '/' separators.
+        """
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.root)).replace(os.sep, "/")
+
+    def contains(self, path: str) -> bool:
+        """
+        Check whether a file is already in the archive.
+
+        Args:
+            path (str): The path the file would be downloaded to.
+
+        Returns:
+            bool: True if the archive has an entry for the file.
+        """
+        with self._lock:
+            return self.entry_name(path) in self.names
+
+    def add(self, path: str, data: BinaryIO, size: int) -> None:
+        """
+        Write a file into the archive.
+
+        Args:
+            path (str): The path the file would be downloaded to, which gives the entry's name.
+            data (BinaryIO): The file's contents, read from the current position.
+            size (int): The size of the file in bytes.
+
+        Raises:
+            OSError: If the archive could not be written.
+        """
+        name = self.entry_name(path)
+        with self._lock:
+            if name in self.names:
+                return
+            if self._zip:
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with self._zip.open(info, "w", force_zip64 = size >= zipfile.ZIP64_LIMIT) as entry:
+                    shutil.copyfileobj(data, entry)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                self._stream.write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+                shutil.copyfileobj(data, self._stream)
+                remainder = size % tarfile.BLOCKSIZE
+                if remainder:
+                    self._stream.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            self.names.add(name)
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= ARCHIVE_CHECKPOINT_ENTRIES:
+                self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        self._since_checkpoint = 0
+        if self._zip:
+            # Closing writes the central directory; reopening appends after the entries again.
+            self._zip.close()
+            self._zip = zipfile.ZipFile(self.path, "a", zipfile.ZIP_STORED)
+        elif self.format == ".tar":
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        else:
+            self._stream.flush(zstandard.FLUSH_FRAME)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """
+        Finish the archive so it can be read.
+        """
+        with self._lock:
+            if self._zip:
+                self._zip.close()
+                self._zip = None
+            elif self._file:
+                if self.format == ".tar":
+                    self._stream.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2)) # End of archive marker
+                else:
+                    self._stream.flush(zstandard.FLUSH_FRAME)
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+class ArchiveEntryWriter:
+    """
+    Collects a download and writes it into an archive once it is complete, so a failed or cancelled
+    download never leaves a broken entry behind. Used in place of a DownloadWriter.
+
+    The download is held in memory up to ARCHIVE_SPOOL_SIZE bytes (enough for almost every paper)
+    and spills over to a temporary file beyond that, so memory use stays bounded.
+
+    Downloads are spooled rather than streamed into their entry as they arrive: an entry has to be written
+    in one go under the archive's lock, so streaming would hold every other download back for as long as the
+    slowest one takes, and an entry cut short by a failed or cancelled download cannot be taken back out of
+    a zip or compressed archive without rewriting it. Each paper is still only written to the archive once.
+
+    Attributes:
+        archive (ArchiveWriter): The archive to write to.
+        final_path (str): The path the file would be downloaded to, which gives the entry's name.
+        expected_size (int): The expected size in bytes (0 if unknown).
+        written (int): The number of bytes written so far.
+    """
+
+    def __init__(self, archive: ArchiveWriter, final_path: str, expected_size: int = 0) -> None:
+        """
+        Initialize the ArchiveEntryWriter.
+
+        Args:
+            archive (ArchiveWriter): The archive to write to.
+            final_path (str): The path the file would be downloaded to.
+            expected_size (int): The expected size in bytes (0 if unknown).
+        """
+        self.archive: ArchiveWriter = archive
+        self.final_path: str = final_path
+        self.expected_size: int = expected_size
+        self.written: int = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size = ARCHIVE_SPOOL_SIZE)
+        active_writers.add(self)
+        self._job = current_job()
+        if self._job:
+            self._job.writers.add(self)
+
+    def write(self, chunk: bytes) -> None:
+        """
+        Write a chunk of the download.
+
+        Args:
+            chunk (bytes): The data to write.
+        """
+        self._file.write(chunk)
+        self.written += len(chunk)
+
+    def publish(self) -> None:
+        """
+        Write the download into the archive.
+
+        Raises:
+            IncompleteDownloadError: If fewer bytes than expected were written.
+            OSError: If the archive could not be written.
+        """
+        if self.expected_size and self.written < self.expected_size:
+            raise IncompleteDownloadError(f"Download incomplete: received {self.written} of {self.expected_size} bytes")
+        self._file.seek(0)
+        self.archive.add(self.final_path, self._file, self.written)
+        self.abort()
+
+    def abort(self) -> None:
+        """
+        Discard the download. Does nothing if it was already written into the archive.
+        """
+        if self not in active_writers:
+            return
+        active_writers.discard(self)
+        if self._job:
+            self._job.writers.discard(self)
+        self._file.close()
+
+    def __enter__(self) -> "ArchiveEntryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.abort()
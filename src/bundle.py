@@ -0,0 +1,211 @@
+import json
+import os
+import re
+import time
+import zipfile
+from typing import Any, Dict, List, NamedTuple, Optional
+from constants import (BUNDLE_FORMAT, BUNDLE_VERSION, CATALOGUE_PATH, PAGE_CACHE_FOLDER, PARTIAL_DOWNLOAD_SUFFIX,
+                       SYNC_FOLDER)
+from integrity import LibraryManifest
+from store import atomic_write_text, read_json, update_json, write_json
+
+INFO_NAME: str = "bundle.json"
+CATALOGUE_NAME: str = "catalogue.json"
+MANIFEST_NAME: str = "manifest.jsonl"
+PAGES_PREFIX: str = "pages/"
+SYNC_PREFIX: str = "sync/"
+PAGE_NAME_PATTERN = re.compile(r"^[0-9a-f]{40}\.html$")
+SNAPSHOT_NAME_PATTERN = re.compile(r"^\d{4}\.json$")
+
+class BundleError(Exception):
+    """
+    Raised when a file is not a cache bundle, or is one this version cannot read.
+    """
+
+class BundleContents(NamedTuple):
+    """
+    What was exported to or imported from a cache bundle.
+
+    Attributes:
+        catalogue (bool): Whether the subject catalogue was exported or imported.
+        catalogue_updated (float): When the catalogue was crawled from the website (0 if there is none).
+        pages (int): The number of cached index pages.
+        snapshots (int): The number of subjects' sync snapshots (the links found on their index pages).
+        papers (int): The number of papers recorded in the library manifest.
+        base_url (str): The website the pages were cached from.
+    """
+    catalogue: bool
+    catalogue_updated: float
+    pages: int
+    snapshots: int
+    papers: int
+    base_url: str
+
+def _list_folder(folder: str, pattern: re.Pattern) -> List[str]:
+    try:
+        return sorted(name for name in os.listdir(folder) if pattern.match(name))
+    except OSError:
+        return []
+
+def _write_file(bundle: zipfile.ZipFile, name: str, path: str) -> bool:
+    try:
+        bundle.write(path, name)
+        return True
+    except OSError:
+        return False # e.g. the page was replaced by another process while the bundle was being written.
+
+def export_bundle(path: str, library_folder: str, base_url: str) -> BundleContents:
+    """
+    Pack everything a new install needs to start without crawling the website into one compressed file:
+    the subject catalogue, the index pages cached on disk, the sync snapshots and the library manifest.
+
+    The bundle is a zip file with a bundle.json describing it, written next to the target and renamed over it.
+
+    Args:
+        path (str): The path of the bundle to write.
+        library_folder (str): The download folder whose manifest is exported.
+        base_url (str): The website the cached pages came from, recorded so a mismatch can be reported on import.
+
+    Returns:
+        BundleContents: What was exported.
+
+    Raises:
+        OSError: If the bundle could not be written.
+    """
+    catalogue = read_json(CATALOGUE_PATH)
+    manifest = LibraryManifest(library_folder)
+    temp_path = path + PARTIAL_DOWNLOAD_SUFFIX
+    try:
+        with zipfile.ZipFile(temp_path, "w", compression = zipfile.ZIP_DEFLATED) as bundle:
+            pages = sum(_write_file(bundle, PAGES_PREFIX + name, os.path.join(PAGE_CACHE_FOLDER, name))
+                        for name in _list_folder(PAGE_CACHE_FOLDER, PAGE_NAME_PATTERN))
+            snapshots = sum(_write_file(bundle, SYNC_PREFIX + name, os.path.join(SYNC_FOLDER, name))
+                            for name in _list_folder(SYNC_FOLDER, SNAPSHOT_NAME_PATTERN))
+            if catalogue is not None:
+                bundle.writestr(CATALOGUE_NAME, json.dumps(catalogue, ensure_ascii = False))
+            bundle.writestr(MANIFEST_NAME, "".join(json.dumps(entry, ensure_ascii = False) + "\n"
+                                                   for entry in manifest.entries.values()))
+            contents = BundleContents(catalogue is not None, (catalogue or {}).get("last_updated", 0),
+                                      pages, snapshots, len(manifest.entries), base_url)
+            # Written last, but read first: a bundle without it was not finished.
+            bundle.writestr(INFO_NAME, json.dumps({"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION,
+                                                   "created": time.time(), "contents": contents._asdict()}))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return contents
+
+def read_bundle_info(bundle: zipfile.ZipFile) -> Dict[str, Any]:
+    """
+    Read the description of a cache bundle, checking it can be imported.
+
+    Args:
+        bundle (zipfile.ZipFile): The open bundle.
+
+    Returns:
+        Dict[str, Any]: The description, with the format, version, creation time and contents.
+
+    Raises:
+        BundleError: If the file is not a cache bundle, or was written by a newer version.
+    """
+    try:
+        info = json.loads(bundle.read(INFO_NAME))
+    except (KeyError, ValueError):
+        raise BundleError("The file is not a cache bundle, or was not completely written")
+    if not isinstance(info, dict) or info.get("format") != BUNDLE_FORMAT:
+        raise BundleError("The file is not a cache bundle")
+    if not isinstance(info.get("version"), int) or info["version"] > BUNDLE_VERSION:
+        raise BundleError(f"The bundle was written by a newer version (bundle version {info.get('version')}, "
+                          f"this version reads up to {BUNDLE_VERSION}); please update Easy Past Papers")
+    return info
+
+def _mtime(member: zipfile.ZipInfo) -> float:
+    return time.mktime(member.date_time + (0, 0, -1))
+
+def _local_mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def _newest_layouts(local: Optional[Dict[str, Any]], imported: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # Each subject keeps whichever of the two layouts was learned last.
+    layouts = dict(imported or {})
+    for subject_code, layout in (local or {}).items():
+        try:
+            if subject_code not in layouts or layout["learned"] >= layouts[subject_code]["learned"]:
+                layouts[subject_code] = layout
+        except (KeyError, TypeError):
+            continue
+    return layouts
+
+def _import_file(bundle: zipfile.ZipFile, member: zipfile.ZipInfo, path: str) -> bool:
+    # Files already on this machine are kept unless the bundle's copy is newer.
+    local_mtime = _local_mtime(path)
+    mtime = _mtime(member)
+    if local_mtime is not None and local_mtime >= mtime:
+        return False
+    atomic_write_text(path, bundle.read(member).decode("utf-8"))
+    # Pages keep the time they were fetched, so they are refetched as usual when online and only used once expired when offline.
+    os.utime(path, (mtime, mtime))
+    return True
+
+def import_bundle(path: str, library_folder: str) -> BundleContents:
+    """
+    Unpack a cache bundle, so this install starts without crawling the website and can browse cached pages offline.
+
+    Only data newer than this machine's is taken: the catalogue if it was crawled more recently, the layout of
+    each subject's pages if it was learned more recently, cached pages and sync snapshots if they were saved
+    more recently, and manifest records of papers this machine's manifest does not have.
+
+    Args:
+        path (str): The path of the bundle.
+        library_folder (str): The download folder whose manifest the records are added to.
+
+    Returns:
+        BundleContents: What was imported.
+
+    Raises:
+        BundleError: If the file is not a cache bundle this version can read.
+        OSError: If the bundle could not be read or the caches could not be written.
+    """
+    try:
+        bundle = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise BundleError("The file is not a cache bundle")
+    with bundle:
+        info = read_bundle_info(bundle)
+        base_url = info.get("contents", {}).get("base_url", "")
+        catalogue_imported = False
+        catalogue_updated = 0
+        pages = snapshots = papers = 0
+        try:
+            for member in bundle.infolist():
+                folder, _, name = member.filename.rpartition("/")
+                # Only names matching the cache's own are unpacked, so a bundle cannot write anywhere else.
+                if folder + "/" == PAGES_PREFIX and PAGE_NAME_PATTERN.match(name):
+                    pages += _import_file(bundle, member, os.path.join(PAGE_CACHE_FOLDER, name))
+                elif folder + "/" == SYNC_PREFIX and SNAPSHOT_NAME_PATTERN.match(name):
+                    snapshots += _import_file(bundle, member, os.path.join(SYNC_FOLDER, name))
+            if CATALOGUE_NAME in bundle.namelist():
+                catalogue = json.loads(bundle.read(CATALOGUE_NAME))
+                catalogue_updated = catalogue.get("last_updated", 0)
+                local = read_json(CATALOGUE_PATH) or {}
+                layouts = _newest_layouts(local.get("layouts"), catalogue.get("layouts"))
+                if "subjects" not in local or local.get("last_updated", 0) < catalogue_updated:
+                    write_json(CATALOGUE_PATH, dict(catalogue, layouts = layouts))
+                    catalogue_imported = True
+                elif layouts != local.get("layouts", {}):
+                    update_json(CATALOGUE_PATH, {"layouts": layouts})
+            if MANIFEST_NAME in bundle.namelist():
+                manifest = LibraryManifest(library_folder)
+                for line in bundle.read(MANIFEST_NAME).decode("utf-8").splitlines():
+                    entry = json.loads(line)
+                    if entry["path"] not in manifest.entries:
+                        manifest.record(os.path.join(library_folder, entry["path"]), entry["size"], entry["sha256"])
+                        papers += 1
+        except (ValueError, KeyError, TypeError, AttributeError, zipfile.BadZipFile) as err:
+            raise BundleError(f"The bundle is damaged: {err}")
+    return BundleContents(catalogue_imported, catalogue_updated, pages, snapshots, papers, base_url)
@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import threading
 from typing import Any
 
 class PageCache:
@@ -26,6 +27,7 @@ class PageCache:
             raise TypeError("max_cache_size must be an integer.")
         self._cache: OrderedDict[Any, Any] = OrderedDict()
         self.max_cache_size: int = max_cache_size
+        self._lock = threading.Lock() # Download jobs share the cache with the shell
 
     def get(self, key: Any) -> Any:
         """
@@ -35,9 +37,11 @@ class PageCache:
         Returns:
             The cached value if present, else None.
         """
-        result = self._cache.get(key)
-        self._cache.move_to_end(key)
-        return result
+        with self._lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
 
     def set(self, key: Any, value: Any) -> None:
         """
@@ -47,9 +51,11 @@ class PageCache:
             key: The key to store the value under.
             value: The value to cache.
         """
-        self._cache[key] = value
-        if len(self._cache) > self.max_cache_size:
-            self._cache.popitem(last = False)
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last = False)
 
     def clear(self) -> None:
         """
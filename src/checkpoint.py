@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from client import AvailablePaper
+from constants import CHECKPOINT_FOLDER, CHECKPOINT_SAVE_INTERVAL, CHECKPOINT_SAVE_PAPERS
+from papercode import parse_paper_code
+from store import FileLock, atomic_write_json, lock_path, read_json
+
+class JobCheckpoint:
+    """
+    How far a bulk download job has got, saved so the job can carry on where it stopped,
+    in this shell or another one, e.g. after waiting for its time window or after the program was closed.
+
+    The papers found on each session's index page are saved the first time the page is read, and every
+    paper is marked as done once it has been downloaded (or found to exist), so carrying on neither
+    fetches the index pages again nor checks the papers already done. Papers marked as done are saved
+    in batches (see CHECKPOINT_SAVE_PAPERS and CHECKPOINT_SAVE_INTERVAL) rather than one by one, and
+    flush() saves the rest when the job stops.
+
+    A checkpoint is claimed by the job running it with a lock held on its lock file,
+    so two shells never carry on the same job.
+
+    Attributes:
+        path (str): The path of the checkpoint file.
+        id (str): The checkpoint's name, shown when listing saved jobs.
+        settings (Dict[str, Any]): What the job was asked to do, e.g. the subject and sessions.
+        created (float): When the job was first started.
+    """
+
+    def __init__(self, path: str, data: Dict[str, Any]) -> None:
+        """
+        Initialize the JobCheckpoint.
+
+        Args:
+            path (str): The path of the checkpoint file.
+            data (Dict[str, Any]): The contents of the checkpoint file.
+        """
+        self.path: str = path
+        self.id: str = os.path.splitext(os.path.basename(path))[0]
+        self.settings: Dict[str, Any] = data.get("settings", {})
+        self._sessions: Dict[str, Dict[str, Any]] = data.get("sessions", {})
+        self._done: set = set(data.get("done", []))
+        self.created: float = data.get("created", time.time())
+        self._removed: bool = False
+        self._unsaved: int = 0 # Papers marked as done since the last save
+        self._saved_at: float = time.monotonic()
+        self._lock = threading.Lock()
+        self._file_lock: Optional[FileLock] = None
+
+    @classmethod
+    def create(cls, settings: Dict[str, Any], folder: str = CHECKPOINT_FOLDER) -> "JobCheckpoint":
+        """
+        Create and save the checkpoint of a new job.
+
+        Args:
+            settings (Dict[str, Any]): What the job was asked to do. Must be JSON serialisable.
+            folder (str): The folder to save the checkpoint in.
+
+        Returns:
+            JobCheckpoint: The checkpoint, already claimed by the caller.
+        """
+        checkpoint = cls(os.path.join(folder, f"{uuid.uuid4().hex[:8]}.json"), {"settings": settings})
+        checkpoint.save()
+        checkpoint.claim()
+        return checkpoint
+
+    @property
+    def done_count(self) -> int:
+        return len(self._done)
+
+    def claim(self) -> bool:
+        """
+        Claim the checkpoint for a job in this process.
+
+        Returns:
+            bool: True if it was claimed, False if a job in another shell holds it.
+        """
+        if self._file_lock:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        file_lock = FileLock(lock_path(self.path))
+        if not file_lock.acquire(blocking = False):
+            return False
+        self._file_lock = file_lock
+        return True
+
+    def release(self) -> None:
+        """
+        Save any unsaved progress and release the claim on the checkpoint, so another job can carry it on.
+        """
+        self.flush()
+        if self._file_lock:
+            self._file_lock.release()
+            self._file_lock = None
+
+    def papers(self, session_range: str) -> Optional[List[AvailablePaper]]:
+        """
+        Get the papers found in a session the last time the job ran.
+
+        Args:
+            session_range (str): The session code (e.g. 's19').
+
+        Returns:
+            Optional[List[AvailablePaper]]: The papers, or None if the session's index page has not been read yet.
+        """
+        with self._lock:
+            session = self._sessions.get(session_range)
+        if session is None:
+            return None
+        return [AvailablePaper(parse_paper_code(file_name), file_name, url, path) for file_name, url, path in session["papers"]]
+
+    def resolved(self, session_range: str, papers: List[AvailablePaper]) -> None:
+        """
+        Save the papers found in a session.
+
+        Args:
+            session_range (str): The session code (e.g. 's19').
+            papers (List[AvailablePaper]): The papers.
+        """
+        with self._lock:
+            self._sessions[session_range] = {"papers": [[paper.file_name, paper.url, paper.path] for paper in papers]}
+        self.save()
+
+    def is_done(self, url: str) -> bool:
+        """
+        Check whether a paper has already been downloaded by the job.
+
+        Args:
+            url (str): The URL of the paper.
+
+        Returns:
+            bool: True if the paper is done.
+        """
+        with self._lock:
+            return url in self._done
+
+    def mark_done(self, url: str) -> None:
+        """
+        Record that a paper has been downloaded by the job (or was found to exist),
+        saving the checkpoint if enough papers or time have passed since it was last saved.
+
+        Args:
+            url (str): The URL of the paper.
+        """
+        with self._lock:
+            self._done.add(url)
+            self._unsaved += 1
+            due = self._unsaved >= CHECKPOINT_SAVE_PAPERS or time.monotonic() - self._saved_at >= CHECKPOINT_SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def flush(self) -> None:
+        """
+        Save the papers marked as done since the checkpoint was last saved, if there are any.
+        Called when the job stops, e.g. to wait for its time window, or when it is cancelled or the program exits.
+        """
+        with self._lock:
+            unsaved = self._unsaved
+        if unsaved:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Write the checkpoint file. Failing to write it only means the job starts further back next time.
+        """
+        with self._lock:
+            if self._removed:
+                return # e.g. the job was cancelled while it was saving.
+            data = {"settings": self.settings, "sessions": self._sessions, "done": sorted(self._done), "created": self.created}
+            self._unsaved = 0
+            self._saved_at = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+            atomic_write_json(self.path, data)
+        except OSError:
+            pass
+
+    def remove(self) -> None:
+        """
+        Delete the checkpoint once the job has finished or been cancelled.
+        """
+        with self._lock:
+            self._removed = True
+        self.release()
+        for path in (self.path, lock_path(self.path)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def saved_checkpoints(folder: str = CHECKPOINT_FOLDER) -> List[JobCheckpoint]:
+    """
+    Get the checkpoints of the jobs which stopped before they finished, oldest first.
+
+    Args:
+        folder (str): The folder the checkpoints are saved in.
+
+    Returns:
+        List[JobCheckpoint]: The checkpoints. Some may be claimed by jobs running in other shells.
+    """
+    checkpoints = []
+    try:
+        file_names = os.listdir(folder)
+    except OSError:
+        return []
+    for file_name in file_names:
+        if not file_name.endswith(".json"):
+            continue
+        path = os.path.join(folder, file_name)
+        data = read_json(path)
+        if isinstance(data, dict) and isinstance(data.get("settings"), dict):
+            checkpoints.append(JobCheckpoint(path, data))
+    return sorted(checkpoints, key = lambda checkpoint: checkpoint.created)
@@ -0,0 +1,817 @@
+import contextlib
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from bs4 import BeautifulSoup, FeatureNotFound
+from requests.exceptions import RequestException
+from constants import (BASE_URL, MIRRORS, HEDGE_REQUESTS, DOWNLOAD_FOLDER, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_PAGE_CACHE,
+                       FSYNC_POLICY, PREALLOCATE_DOWNLOADS, CATALOGUE_PATH, CLAIMS_FOLDER,
+                       PAST_PAPER_PATTERN, SPECIMEN_PAPER_TYPES, NON_SPECIMEN_PAPER_TYPES, PAPER_TYPES_WITHOUT_PAPER_NUM,
+                       PAPER_TYPES_WITH_2_YEARS, DOWNLOAD_DOWNLOADED, DOWNLOAD_EXISTS, DOWNLOAD_FAILED,
+                       EVENT_STARTED, EVENT_PROGRESS, EVENT_ENDED, EVENT_RESULT)
+from cache import PageCache
+from congestion import AdaptiveLimiter
+from downloadwriter import IncompleteDownloadError
+from integrity import IntegrityError, LibraryManifest
+from jobs import check_current_download
+from layout import find_paper, paper_folder
+from mirrors import MirrorPool
+from papercode import PaperCode, PaperCodeMatcher, parse_paper_code
+from requesthandler import fetch_page, fetch_to_file, page_flight, shared_pages
+from sharedcache import DownloadClaim, SingleFlight
+from sitelayout import SiteLayouts, SubjectLayout
+from store import read_json
+
+class PaperError(Exception):
+    """
+    Base class of the errors raised by PaperClient.
+    """
+
+class InvalidPaperCodeError(PaperError):
+    """
+    Raised when a paper code is not in the right format, or its fields do not go together.
+    """
+
+class UnknownSubjectError(PaperError):
+    """
+    Raised when a subject code is not in the catalogue.
+    """
+
+class PaperNotFoundError(PaperError):
+    """
+    Raised when a paper is not on the website.
+    """
+
+class NoIndexPageError(PaperNotFoundError):
+    """
+    Raised when the website has no index page for a subject's session, as learned from its layout,
+    so nothing was requested.
+    """
+
+class FetchError(PaperError):
+    """
+    Raised when a page or paper could not be fetched from the website.
+    """
+
+class ClientSettings(NamedTuple):
+    """
+    The settings of a PaperClient. Immutable, so a client's settings are changed by replacing them as a whole.
+
+    Attributes:
+        base_url (str): The base URL of the website.
+        mirrors (List[str]): Mirrors of the website with the same URL layout, tried after the base URL.
+        hedge_requests (bool): Whether slow index page requests are also sent to a second mirror.
+        download_folder (str): The folder papers are downloaded to.
+        connect_timeout (int): Timeout for establishing network connections.
+        read_timeout (int): Timeout for reading data from network connections.
+        session_folders (bool): Whether papers are put in session folders (e.g. May-June) by default.
+        fsync_policy (str): How downloaded files are flushed to disk (one of FSYNC_POLICIES).
+        preallocate (bool): Whether to reserve disk space for downloads before writing.
+        max_page_cache (int): Maximum number of index pages to keep in memory.
+    """
+    base_url: str = BASE_URL
+    mirrors: List[str] = MIRRORS
+    hedge_requests: bool = HEDGE_REQUESTS
+    download_folder: str = DOWNLOAD_FOLDER
+    connect_timeout: int = CONNECT_TIMEOUT
+    read_timeout: int = READ_TIMEOUT
+    session_folders: bool = True
+    fsync_policy: str = FSYNC_POLICY
+    preallocate: bool = PREALLOCATE_DOWNLOADS
+    max_page_cache: int = MAX_PAGE_CACHE
+
+    @property
+    def timeouts(self) -> Tuple[int, int]:
+        return self.connect_timeout, self.read_timeout
+
+class Catalogue(NamedTuple):
+    """
+    The subjects on the website, as scraped by the shell into the catalogue file.
+
+    Attributes:
+        exam_page_links (Dict[str, Optional[str]]): Mapping of exam types to their page links.
+        subject_index (Dict[str, Tuple[str, str]]): Mapping of subject codes to their exam type and subject page link.
+    """
+    exam_page_links: Dict[str, Optional[str]]
+    subject_index: Dict[str, Tuple[str, str]]
+
+    def find_subject(self, subject_code: str) -> Optional[Tuple[str, str]]:
+        """
+        Find the exam type and subject page link of a subject.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+
+        Returns:
+            Optional[Tuple[str, str]]: The exam type and subject page link, or None if the subject is unknown.
+        """
+        return self.subject_index.get(subject_code)
+
+def index_subjects(subjects: Dict[str, Dict[str, str]]) -> Dict[str, Tuple[str, str]]:
+    """
+    Build the index from subject codes to their exam type and subject page link.
+    A subject offered for more than one exam is found under the first.
+
+    Args:
+        subjects (Dict[str, Dict[str, str]]): Mapping of exam types to their subject codes and subject page links.
+
+    Returns:
+        Dict[str, Tuple[str, str]]: The index.
+    """
+    subject_index = {}
+    for exam, exam_subjects in subjects.items():
+        for subject_code, subject_link in exam_subjects.items():
+            subject_index.setdefault(subject_code, (exam, subject_link))
+    return subject_index
+
+def load_catalogue(path: str = CATALOGUE_PATH) -> Catalogue:
+    """
+    Load the catalogue saved by the shell.
+
+    Args:
+        path (str): The path of the catalogue file.
+
+    Returns:
+        Catalogue: The catalogue, which is empty if the file is missing or cannot be read.
+    """
+    catalogue = read_json(path) or {}
+    exam_page_links = catalogue.get("exam_page_links")
+    subjects = catalogue.get("subjects")
+    if not isinstance(exam_page_links, dict) or not isinstance(subjects, dict):
+        return Catalogue({}, {})
+    return Catalogue(exam_page_links, index_subjects(subjects))
+
+def year_page_cache_key(subject_code: str, session: str, year: str) -> Tuple[str, str]:
+    """
+    Get the key the index page for a subject and year is stored under in the page cache.
+    Specimen papers are all on one page, so they are keyed by the session instead of the year.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+        session (str): The session letter.
+        year (str): The 2 digit year.
+
+    Returns:
+        Tuple[str, str]: The cache key.
+    """
+    return (subject_code, session) if session == "y" else (subject_code, year)
+
+class AvailablePaper(NamedTuple):
+    """
+    A paper listed on the website.
+
+    Attributes:
+        code (PaperCode): The paper.
+        file_name (str): The name of the file on the website, with its extension.
+        url (str): The URL to download it from.
+        path (str): The path it is downloaded to.
+    """
+    code: PaperCode
+    file_name: str
+    url: str
+    path: str
+
+class Resolution(NamedTuple):
+    """
+    Where a paper is on the website and where it goes on disk.
+
+    Attributes:
+        code (PaperCode): The paper.
+        file_name (str): The name of the file on the website, with its extension.
+        url (str): The URL to download it from.
+        path (str): The path it is downloaded to.
+        existing (Optional[str]): The path it was already downloaded to, under either folder layout, if any.
+    """
+    code: PaperCode
+    file_name: str
+    url: str
+    path: str
+    existing: Optional[str]
+
+class DownloadResult(NamedTuple):
+    """
+    What happened to one paper asked for with PaperClient.download().
+
+    Attributes:
+        code (str): The paper code as it was asked for.
+        status (str): DOWNLOAD_DOWNLOADED, DOWNLOAD_EXISTS or DOWNLOAD_FAILED.
+        path (Optional[str]): The absolute path of the paper, unless it failed.
+        size (int): The number of bytes downloaded.
+        error (Optional[Exception]): Why it failed: a PaperError, or an OSError if it could not be written.
+    """
+    code: str
+    status: str
+    path: Optional[str] = None
+    size: int = 0
+    error: Optional[Exception] = None
+
+class ProgressEvent(NamedTuple):
+    """
+    Progress of a download, passed to the on_event callback of PaperClient.download() or yielded by download_events().
+
+    Attributes:
+        kind (str): EVENT_STARTED, EVENT_PROGRESS, EVENT_ENDED or EVENT_RESULT.
+        code (str): The paper code as it was asked for.
+        file_name (str): The name of the file being downloaded.
+        received (int): The number of bytes received so far.
+        total (int): The expected size in bytes (0 if unknown).
+        result (Optional[DownloadResult]): The result, for EVENT_RESULT events.
+    """
+    kind: str
+    code: str
+    file_name: str
+    received: int = 0
+    total: int = 0
+    result: Optional[DownloadResult] = None
+
+class PaperClient:
+    """
+    Finds and downloads past papers for other Python programs, such as a web service, and for the shell.
+    Nothing is printed, asked or exited: results are returned as values, failures are raised as PaperErrors
+    (or reported in DownloadResults) and progress is passed to callbacks.
+
+    Safe to share between threads. Each call works with the settings the client had when it was made, even if
+    configure() is called meanwhile. Index pages are kept in memory by the client and on disk for every process,
+    concurrent requests for the same page share one fetch, and each file is downloaded by one thread or process at a time.
+    Links to index pages are built from each subject's layout, learned from its subject page, so pages which do not
+    exist are never requested.
+
+    Attributes:
+        settings (ClientSettings): The settings.
+        catalogue (Catalogue): The subjects on the website.
+        pool (MirrorPool): The mirrors requests go to.
+        limiter (AdaptiveLimiter): The limiter of requests to each host.
+        pages (PageCache): The index pages fetched, as (link of the page, parsed page), keyed by year_page_cache_key.
+        layouts (SiteLayouts): The layouts learned for each subject.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[ClientSettings] = None,
+        catalogue: Optional[Catalogue] = None,
+        pool: Optional[MirrorPool] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        layouts: Optional[SiteLayouts] = None
+    ) -> None:
+        """
+        Initialize the PaperClient.
+
+        Args:
+            settings (Optional[ClientSettings]): The settings. Defaults to the default settings.
+            catalogue (Optional[Catalogue]): The subjects on the website. Defaults to the catalogue saved by the shell.
+            pool (Optional[MirrorPool]): The mirrors to use. Defaults to a pool of the client's own, kept pointed at
+                the base URL and mirrors in its settings. A pool passed in is left to its owner to configure.
+            limiter (Optional[AdaptiveLimiter]): The limiter of requests to each host. Defaults to one of the client's own.
+            layouts (Optional[SiteLayouts]): The layouts learned for each subject. Defaults to the layouts saved in the catalogue file.
+        """
+        self.settings: ClientSettings = settings or ClientSettings()
+        self.catalogue: Catalogue = catalogue or load_catalogue()
+        self._owns_pool: bool = pool is None
+        self.pool: MirrorPool = pool or MirrorPool([self.settings.base_url] + list(self.settings.mirrors), self.settings.hedge_requests)
+        self.limiter: AdaptiveLimiter = limiter or AdaptiveLimiter()
+        self.pages: PageCache = PageCache(self.settings.max_page_cache)
+        self.layouts: SiteLayouts = layouts or SiteLayouts()
+        self._downloads: SingleFlight = SingleFlight()
+        self._manifest: Optional[LibraryManifest] = None
+        self._lock = threading.Lock()
+
+    def configure(self, settings: Optional[ClientSettings] = None, catalogue: Optional[Catalogue] = None) -> None:
+        """
+        Change the settings or the catalogue. Calls already running carry on with the old ones.
+
+        Args:
+            settings (Optional[ClientSettings]): The new settings, or None to keep the current ones.
+            catalogue (Optional[Catalogue]): The new catalogue, or None to keep the current one.
+        """
+        with self._lock:
+            old_settings, old_catalogue = self.settings, self.catalogue
+            self.settings = settings or old_settings
+            self.catalogue = catalogue or old_catalogue
+            if self._owns_pool:
+                self.pool.set_mirrors([self.settings.base_url] + list(self.settings.mirrors))
+                self.pool.hedge = self.settings.hedge_requests
+            self.pages.max_cache_size = self.settings.max_page_cache
+            if self.settings.base_url != old_settings.base_url or self.catalogue != old_catalogue:
+                self.pages.clear() # The pages were fetched from other links.
+
+    def manifest(self, settings: Optional[ClientSettings] = None) -> LibraryManifest:
+        """
+        Get the manifest of the download folder, reloading it if the download folder has changed.
+
+        Args:
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            LibraryManifest: The manifest.
+        """
+        settings = settings or self.settings
+        with self._lock:
+            if not self._manifest or self._manifest.library_folder != settings.download_folder:
+                self._manifest = LibraryManifest(settings.download_folder)
+            return self._manifest
+
+    def parse(self, code: Union[str, PaperCode]) -> PaperCode:
+        """
+        Parse and check a paper code.
+
+        Args:
+            code (Union[str, PaperCode]): The paper code (e.g. '0452_s19_qp_12').
+
+        Returns:
+            PaperCode: The parsed paper code.
+
+        Raises:
+            InvalidPaperCodeError: If the code is not valid.
+        """
+        if isinstance(code, PaperCode):
+            code = str(code)
+        match = PAST_PAPER_PATTERN.search(code.strip())
+        if not match:
+            raise InvalidPaperCodeError(f"'{code}' is not a paper code.")
+        subject_code, session, year, paper_type, paper_num = match.groups()
+        session = session.lower()
+        paper_type = paper_type.lower()
+        if session == "y" and paper_type not in SPECIMEN_PAPER_TYPES:
+            raise InvalidPaperCodeError(f"Specimen paper cannot have paper type '{paper_type}'. "
+                                        f"Must be one of '{', '.join(sorted(SPECIMEN_PAPER_TYPES))}'.")
+        if session != "y" and paper_type in SPECIMEN_PAPER_TYPES:
+            raise InvalidPaperCodeError(f"Non specimen paper cannot have paper type '{paper_type}'. "
+                                        f"Must be one of '{', '.join(sorted(NON_SPECIMEN_PAPER_TYPES))}'.")
+        if paper_type not in PAPER_TYPES_WITHOUT_PAPER_NUM and not paper_num:
+            raise InvalidPaperCodeError(f"Paper of type '{paper_type}' must have paper number.")
+        if paper_type in PAPER_TYPES_WITHOUT_PAPER_NUM and paper_num:
+            raise InvalidPaperCodeError(f"Paper of type '{paper_type}' cannot have paper number.")
+        if paper_type not in PAPER_TYPES_WITH_2_YEARS and re.search(r"\d{2}-\d{2}", year):
+            raise InvalidPaperCodeError(f"Paper of type '{paper_type}' must not have a range of years. "
+                                        f"Must be one of '{', '.join(sorted(PAPER_TYPES_WITH_2_YEARS))}'.")
+        return PaperCode(subject_code, session, year, paper_type, (paper_num or "").lower())
+
+    def find_subject(self, subject_code: str) -> Tuple[str, str]:
+        """
+        Find the exam type and subject page link of a subject.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+
+        Returns:
+            Tuple[str, str]: The exam type and subject page link.
+
+        Raises:
+            UnknownSubjectError: If the subject is not in the catalogue.
+        """
+        subject = self.catalogue.find_subject(subject_code)
+        if not subject:
+            raise UnknownSubjectError(f"Unknown subject code '{subject_code}'.")
+        return subject
+
+    def subject_folder(self, subject_code: str, settings: Optional[ClientSettings] = None) -> str:
+        """
+        Get the folder a subject's papers are downloaded to.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            str: The path of the folder.
+
+        Raises:
+            UnknownSubjectError: If the subject is not in the catalogue.
+        """
+        settings = settings or self.settings
+        return f"{settings.download_folder}/{self.find_subject(subject_code)[1]}"
+
+    def subject_layout(
+        self,
+        subject_code: str,
+        on_fetch: Optional[Callable[[int], None]] = None,
+        settings: Optional[ClientSettings] = None,
+        relearn: bool = False
+    ) -> SubjectLayout:
+        """
+        Get where a subject's papers are on the website, learning it from the subject page the first time.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            on_fetch (Optional[Callable[[int], None]]): As for year_page().
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+            relearn (bool): Whether to read the subject page again even if the layout is already known.
+
+        Returns:
+            SubjectLayout: The layout.
+
+        Raises:
+            UnknownSubjectError: If the subject is not in the catalogue.
+            FetchError: If the subject page could not be fetched.
+        """
+        layout = None if relearn else self.layouts.get(subject_code)
+        if layout is None:
+            html = self.fetch_html(self.subject_page_link(subject_code, settings), on_fetch, settings)
+            layout = self.layouts.learn(subject_code, [anchor.get("href") for anchor in html.find_all("a")])
+        return layout
+
+    def subject_page_link(self, subject_code: str, settings: Optional[ClientSettings] = None) -> str:
+        """
+        Get the link to a subject's page.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            str: The link to the subject page.
+
+        Raises:
+            UnknownSubjectError: If the subject is not in the catalogue.
+        """
+        settings = settings or self.settings
+        subject_exam, subject_link = self.find_subject(subject_code)
+        return settings.base_url + "/" + self.catalogue.exam_page_links[subject_exam] + "/" + subject_link
+
+    def year_page_links(
+        self,
+        subject_code: str,
+        session: str,
+        year: str,
+        on_fetch: Optional[Callable[[int], None]] = None,
+        settings: Optional[ClientSettings] = None
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Get the links to a subject's page and to the index page listing its papers for a year, from the subject's layout.
+
+        A year missing from the layout is taken not to exist, unless the layout is old enough that the year's folder
+        may have been added since, in which case the subject page is read again first.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            session (str): The session letter.
+            year (str): The 2 digit year.
+            on_fetch (Optional[Callable[[int], None]]): As for year_page().
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            Tuple[str, Optional[str]]: The link to the subject page, and the link to the year's index page
+                (the subject page itself if the papers are listed there), or None if the subject has no papers for the year.
+
+        Raises:
+            UnknownSubjectError: If the subject is not in the catalogue.
+            FetchError: If the subject page had to be read and could not be fetched.
+        """
+        link_for_subject = self.subject_page_link(subject_code, settings)
+        layout = self.subject_layout(subject_code, on_fetch, settings)
+        folder = layout.folder(session, year)
+        if folder is None and layout.is_stale():
+            folder = self.subject_layout(subject_code, on_fetch, settings, relearn = True).folder(session, year)
+        if folder is None:
+            return link_for_subject, None
+        return link_for_subject, (link_for_subject + "/" + folder if folder else link_for_subject)
+
+    def year_page(
+        self,
+        subject_code: str,
+        session: str,
+        year: str,
+        on_fetch: Optional[Callable[[int], None]] = None,
+        settings: Optional[ClientSettings] = None
+    ) -> Tuple[str, BeautifulSoup]:
+        """
+        Get the index page listing a subject's papers for a year, from the cache if it was already fetched.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            session (str): The session letter.
+            year (str): The 2 digit year.
+            on_fetch (Optional[Callable[[int], None]]): Called with the size of each page requested from the website,
+                as for safe_get_html.
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            Tuple[str, BeautifulSoup]: The link of the page, which the papers' links are relative to, and the parsed page.
+
+        Raises:
+            UnknownSubjectError: If the subject is not in the catalogue.
+            NoIndexPageError: If the subject has no papers for the session, so there is no page to fetch.
+            FetchError: If the page could not be fetched.
+        """
+        settings = settings or self.settings
+        cache_key = year_page_cache_key(subject_code, session, year)
+        page = self.pages.get(cache_key)
+        if page:
+            return page
+        _, link_for_year = self.year_page_links(subject_code, session, year, on_fetch, settings)
+        if link_for_year is None:
+            raise NoIndexPageError(f"The website has no {subject_code} papers for '{session}{year}'.")
+        page = (link_for_year, self.fetch_html(link_for_year, on_fetch, settings))
+        self.pages[cache_key] = page
+        return page
+
+    def fetch_html(self, url: str, on_fetch: Optional[Callable[[int], None]] = None, settings: Optional[ClientSettings] = None) -> BeautifulSoup:
+        """
+        Get and parse a page, sharing the fetch with other threads and processes asking for it.
+
+        Args:
+            url (str): The URL of the page.
+            on_fetch (Optional[Callable[[int], None]]): As for year_page().
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            BeautifulSoup: The parsed page.
+
+        Raises:
+            FetchError: If the page could not be fetched or parsed.
+        """
+        settings = settings or self.settings
+        errors = []
+        def fetch() -> Optional[str]:
+            try:
+                response = fetch_page(url, settings.timeouts, self.pool, self.limiter)
+            except RequestException as err:
+                errors.append(err)
+                if on_fetch:
+                    on_fetch(0)
+                return None
+            if on_fetch:
+                on_fetch(len(response.content))
+            response.encoding = "utf-8"
+            return response.text
+        text = page_flight.do(url, lambda: shared_pages.get_or_fetch(url, fetch))
+        if text is None:
+            raise FetchError(f"Could not fetch {url}" + (f": {errors[0]}" if errors else "."))
+        try:
+            return BeautifulSoup(text, 'html.parser')
+        except FeatureNotFound as err:
+            raise FetchError(f"Could not parse {url}: {err}")
+
+    def find_downloaded(self, code: Union[str, PaperCode], settings: Optional[ClientSettings] = None) -> Optional[str]:
+        """
+        Find a paper already downloaded, under either folder layout and whatever its file extension.
+
+        Args:
+            code (Union[str, PaperCode]): The paper code.
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            Optional[str]: The path of the paper, or None if it has not been downloaded.
+
+        Raises:
+            InvalidPaperCodeError: If the code is not valid.
+            UnknownSubjectError: If the subject is not in the catalogue.
+        """
+        paper = self.parse(code)
+        return find_paper(self.subject_folder(paper.subject_code, settings), paper)
+
+    def paper_folder(self, code: Union[str, PaperCode], session_folders: Optional[bool] = None, settings: Optional[ClientSettings] = None) -> str:
+        """
+        Get the folder a paper is downloaded to.
+
+        Args:
+            code (Union[str, PaperCode]): The paper code.
+            session_folders (Optional[bool]): Whether to use session folders. Defaults to the settings.
+            settings (Optional[ClientSettings]): The settings to use. Defaults to the current settings.
+
+        Returns:
+            str: The path of the folder.
+
+        Raises:
+            InvalidPaperCodeError: If the code is not valid.
+            UnknownSubjectError: If the subject is not in the catalogue.
+        """
+        settings = settings or self.settings
+        paper = self.parse(code)
+        session_folders = settings.session_folders if session_folders is None else session_folders
+        return paper_folder(self.subject_folder(paper.subject_code, settings), paper, session_folders)
+
+    def resolve(self, code: Union[str, PaperCode], session_folders: Optional[bool] = None) -> Resolution:
+        """
+        Find where a paper is on the website and where it goes on disk, without downloading it.
+
+        Args:
+            code (Union[str, PaperCode]): The paper code.
+            session_folders (Optional[bool]): Whether to use session folders. Defaults to the settings.
+
+        Returns:
+            Resolution: Where the paper is.
+
+        Raises:
+            InvalidPaperCodeError: If the code is not valid.
+            UnknownSubjectError: If the subject is not in the catalogue.
+            FetchError: If the index page could not be fetched.
+            PaperNotFoundError: If the paper is not on the index page, or the subject has no papers for its session.
+        """
+        settings = self.settings
+        paper = self.parse(code)
+        link, html = self.year_page(paper.subject_code, paper.session, paper.year, settings = settings)
+        file_name = find_paper_link(html, paper)
+        if not file_name:
+            raise PaperNotFoundError(f"Could not find '{paper}' on {link}.")
+        folder = self.paper_folder(paper, session_folders, settings)
+        existing = find_paper(self.subject_folder(paper.subject_code, settings), paper)
+        return Resolution(paper, file_name, f"{link}/{file_name}", f"{folder}/{file_name}", existing)
+
+    def iter_available(
+        self,
+        subject_code: str,
+        sessions: Iterable[str],
+        paper_types: Optional[set] = None,
+        paper_nums: Optional[set] = None,
+        session_folders: Optional[bool] = None,
+        skip_missing: bool = False
+    ) -> Iterator[AvailablePaper]:
+        """
+        List the papers on the website for a subject in some sessions, fetching each index page as it is reached.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            sessions (Iterable[str]): The session codes (e.g. ['s19', 'w19']; see parse_sessions_range).
+            paper_types (Optional[set]): Allowed paper types, or None to allow all.
+            paper_nums (Optional[set]): Allowed paper numbers, or None to allow all.
+                Single digit entries match every variant of that paper.
+            session_folders (Optional[bool]): Whether the paths use session folders. Defaults to the settings.
+            skip_missing (bool): Whether to skip sessions whose index page cannot be fetched rather than raising FetchError.
+                Sessions the subject has no papers for are always skipped, without a request.
+
+        Yields:
+            AvailablePaper: The papers, in the order they are listed.
+
+        Raises:
+            UnknownSubjectError: If the subject is not in the catalogue.
+            FetchError: If an index page could not be fetched, unless skip_missing is set.
+        """
+        settings = self.settings
+        session_folders = settings.session_folders if session_folders is None else session_folders
+        subject_folder = self.subject_folder(subject_code, settings)
+        for session_code in sessions:
+            session, year = session_code[0], session_code[1:]
+            try:
+                link, html = self.year_page(subject_code, session, year, settings = settings)
+            except NoIndexPageError:
+                continue
+            except FetchError:
+                if skip_missing:
+                    continue
+                raise
+            # Match on the parsed paper code so unwanted files are never requested.
+            matcher = PaperCodeMatcher(subject_code, session, year, paper_types, paper_nums)
+            for anchor in html.find_all('a'):
+                link_str = anchor.get('href')
+                if not matcher.match(link_str):
+                    continue
+                file_name = link_str.strip("/")
+                paper = parse_paper_code(file_name)
+                yield AvailablePaper(paper, file_name, f"{link}/{file_name}",
+                                     f"{paper_folder(subject_folder, paper, session_folders)}/{file_name}")
+
+    def download(
+        self,
+        codes: Union[str, PaperCode, Iterable[Union[str, PaperCode]]],
+        overwrite: bool = False,
+        session_folders: Optional[bool] = None,
+        on_event: Optional[Callable[[ProgressEvent], None]] = None,
+        max_workers: int = 1
+    ) -> List[DownloadResult]:
+        """
+        Download papers. Papers already downloaded, under either folder layout, are left alone unless overwrite is set.
+
+        Args:
+            codes (Union[str, PaperCode, Iterable[Union[str, PaperCode]]]): The paper code, or paper codes, to download.
+            overwrite (bool): Whether to download papers again if they were already downloaded.
+            session_folders (Optional[bool]): Whether to use session folders. Defaults to the settings.
+            on_event (Optional[Callable[[ProgressEvent], None]]): Called with the progress of each download,
+                from the thread downloading it.
+            max_workers (int): The number of papers to download at once.
+
+        Returns:
+            List[DownloadResult]: The result for each paper, in the order they were asked for.
+        """
+        settings = self.settings
+        codes = [codes] if isinstance(codes, (str, PaperCode)) else list(codes)
+        emit = on_event or (lambda event: None)
+        def run(code: Union[str, PaperCode]) -> DownloadResult:
+            return self._download(str(code), overwrite, session_folders, emit, settings)
+        if max_workers <= 1 or len(codes) <= 1:
+            return [run(code) for code in codes]
+        with ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "paper-download") as executor:
+            return list(executor.map(run, codes))
+
+    def download_events(
+        self,
+        codes: Union[str, PaperCode, Iterable[Union[str, PaperCode]]],
+        overwrite: bool = False,
+        session_folders: Optional[bool] = None,
+        max_workers: int = 1
+    ) -> Iterator[ProgressEvent]:
+        """
+        Download papers in the background, yielding their progress as it happens. As for download(), but the
+        results come as EVENT_RESULT events. The downloads carry on if the iterator is not read to the end.
+
+        Args:
+            codes (Union[str, PaperCode, Iterable[Union[str, PaperCode]]]): The paper code, or paper codes, to download.
+            overwrite (bool): Whether to download papers again if they were already downloaded.
+            session_folders (Optional[bool]): Whether to use session folders. Defaults to the settings.
+            max_workers (int): The number of papers to download at once.
+
+        Yields:
+            ProgressEvent: The progress of the downloads.
+        """
+        events: "queue.Queue[Optional[ProgressEvent]]" = queue.Queue()
+        def run() -> None:
+            try:
+                self.download(codes, overwrite, session_folders, events.put, max_workers)
+            finally:
+                events.put(None)
+        threading.Thread(target = run, daemon = True).start()
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield event
+
+    def _download(
+        self,
+        code: str,
+        overwrite: bool,
+        session_folders: Optional[bool],
+        emit: Callable[[ProgressEvent], None],
+        settings: ClientSettings
+    ) -> DownloadResult:
+        try:
+            paper = self.parse(code)
+            if not overwrite:
+                existing = find_paper(self.subject_folder(paper.subject_code, settings), paper)
+                if existing:
+                    return self._result(emit, code, DOWNLOAD_EXISTS, os.path.abspath(existing))
+            folder = self.paper_folder(paper, session_folders, settings)
+            # The file is looked up on the index page (fetched once, or already cached e.g. while the code was being typed),
+            # so its real name is requested rather than a guess, which fails for missing papers and files which are not PDFs.
+            link, html = self.year_page(paper.subject_code, paper.session, paper.year, settings = settings)
+            file_name = find_paper_link(html, paper)
+            if not file_name:
+                raise PaperNotFoundError(f"Could not find '{paper}' on {link}.")
+            return self._fetch_paper(code, f"{link}/{file_name}", f"{folder}/{file_name}", emit, settings)
+        except (PaperError, IncompleteDownloadError, IntegrityError, OSError) as err:
+            return self._result(emit, code, DOWNLOAD_FAILED, error = err)
+
+    def _fetch_paper(self, code: str, url: str, path: str, emit: Callable[[ProgressEvent], None], settings: ClientSettings) -> DownloadResult:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        # Threads asking for the same file share one download, and other processes wait for it.
+        status, size = self._downloads.do(os.path.abspath(path), lambda: self._claimed_fetch(code, url, path, emit, settings))
+        return self._result(emit, code, status, os.path.abspath(path), size)
+
+    def _claimed_fetch(self, code: str, url: str, path: str, emit: Callable[[ProgressEvent], None], settings: ClientSettings) -> Tuple[str, int]:
+        with contextlib.ExitStack() as stack:
+            claim = DownloadClaim(CLAIMS_FOLDER, path, lambda first: check_current_download())
+            try:
+                stack.enter_context(claim)
+            except OSError:
+                claim = None # The claims folder cannot be written to, so download without a claim.
+            if claim and claim.published_meanwhile():
+                return DOWNLOAD_EXISTS, 0
+            file_name = os.path.basename(path)
+            progress = []
+            def on_progress(received: int, total: int) -> None:
+                progress[:] = [received, total]
+                emit(ProgressEvent(EVENT_PROGRESS if received else EVENT_STARTED, code, file_name, received, total))
+            try:
+                size, sha256 = fetch_to_file(url, path, settings.timeouts, settings.fsync_policy, settings.preallocate,
+                                             on_progress, self.pool, self.limiter)
+            except RequestException as err:
+                raise FetchError(f"Could not download {url}: {err}")
+            finally:
+                if progress:
+                    emit(ProgressEvent(EVENT_ENDED, code, file_name, *progress))
+            self.manifest(settings).record(path, size, sha256)
+            return DOWNLOAD_DOWNLOADED, size
+
+    def _result(
+        self,
+        emit: Callable[[ProgressEvent], None],
+        code: str,
+        status: str,
+        path: Optional[str] = None,
+        size: int = 0,
+        error: Optional[Exception] = None
+    ) -> DownloadResult:
+        result = DownloadResult(code, status, path, size, error)
+        emit(ProgressEvent(EVENT_RESULT, code, os.path.basename(path) if path else "", size, size, result))
+        return result
+
+def find_paper_link(html: BeautifulSoup, paper: PaperCode) -> Optional[str]:
+    """
+    Find the link to a paper on an index page.
+
+    Args:
+        html (BeautifulSoup): The parsed index page.
+        paper (PaperCode): The paper.
+
+    Returns:
+        Optional[str]: The file name the paper is linked as, relative to the page, or None if it is not on the page.
+    """
+    matcher = PaperCodeMatcher.for_paper(paper)
+    for link in html.find_all('a'):
+        link_str = link.get('href')
+        if matcher.match(link_str):
+            return link_str.strip("/")
+    return None
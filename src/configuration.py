@@ -1,7 +1,9 @@
-import json
 import re
-from typing import Optional, Dict, Any
-from requesthandler import get_html
+from typing import Optional, Dict, Any, Callable, List, Tuple
+from requesthandler import get_html, mirror_pool
+from client import Catalogue, ClientSettings, index_subjects
+from store import read_json, write_json, update_json
+from progress import clear_previous_lines
 from constants import *
 import time
 import sys
@@ -10,87 +12,240 @@ class Configuration:
     """
     Handles loading and storing configuration for EasyPastPapers.
 
+    Settings are kept in the small config file, and the subject catalogue scraped from
+    the website is kept in a separate catalogue file, so changing a setting never rewrites the catalogue.
+
     Attributes:
         base_url (str): The base URL for downloading papers.
+        mirrors (list): Mirrors of the website with the same URL layout, tried after the base URL.
+        hedge_requests (bool): Whether slow index page requests are also sent to a second mirror.
         download_folder (str): The folder where papers are downloaded.
         connect_timeout (int): Timeout for establishing network connections.
         read_timeout (int): Timeout for reading data from network connections.
         max_page_cache (int): Maximum number of HTML pages to cache.
+        fsync_policy (str): How downloaded files are flushed to disk (one of FSYNC_POLICIES).
+        preallocate_downloads (bool): Whether to reserve disk space for downloads before writing.
+        prefetch_requests (int): Requests each shell may make to prefetch the index pages the user usually needs (0 turns it off).
+        prefetch_bytes (int): Bytes each shell may download to prefetch index pages.
+        optimize_downloads (bool): Whether PDFs are optimised in the background after they are downloaded.
         exam_page_links (dict): Mapping of exam types to their page links.
         subjects (dict): Mapping of exam types to their subjects.
+        subject_index (dict): Mapping of subject codes to their exam type and subject page link.
     """
     base_url: str = BASE_URL
+    mirrors: List[str] = MIRRORS
+    hedge_requests: bool = HEDGE_REQUESTS
     download_folder: str = DOWNLOAD_FOLDER
     connect_timeout: int = CONNECT_TIMEOUT
     read_timeout: int = READ_TIMEOUT
     max_page_cache: int = MAX_PAGE_CACHE
+    fsync_policy: str = FSYNC_POLICY
+    preallocate_downloads: bool = PREALLOCATE_DOWNLOADS
+    prefetch_requests: int = PREFETCH_MAX_REQUESTS
+    prefetch_bytes: int = PREFETCH_MAX_BYTES
+    optimize_downloads: bool = OPTIMIZE_DOWNLOADS
     exam_page_links: Dict[str, Optional[str]] = {}
     subjects: Dict[str, Dict[str, str]] = {}
+    subject_index: Dict[str, Tuple[str, str]] = {}
 
     @classmethod
-    def load_config(cls) -> None:
+    def load_config(cls, crawl: bool = True) -> None:
         """
-        Loads configuration from the config file. If the config file is missing or incomplete,
-        it regenerates and saves a new config file.
+        Loads configuration from the config and catalogue files. If the catalogue is missing or incomplete,
+        it regenerates and saves a new one. If a stale catalogue cannot be reloaded (e.g. offline), it is kept.
+
+        Args:
+            crawl (bool): Whether a missing or stale catalogue may be crawled from the website. If False, a missing
+                catalogue is left empty, e.g. while a cache bundle is imported to provide one.
 
         Raises:
-            SystemExit: If the configuration file cannot be saved.
+            SystemExit: If the configuration file cannot be saved, or a missing catalogue cannot be crawled.
         """
+        settings = read_json(CONFIG_PATH) or {}
+        cls.apply_settings(settings)
+        catalogue = read_json(CATALOGUE_PATH)
+        if catalogue is None and "subjects" in settings:
+            # Config files from older versions stored the catalogue alongside the settings.
+            catalogue = {key: settings[key] for key in ("exam_page_links", "subjects", "last_updated") if key in settings}
+            cls.save(lambda: write_json(CATALOGUE_PATH, catalogue))
+            cls.save(lambda: write_json(CONFIG_PATH, cls.settings(), indent = 4))
         try:
-            with open(CONFIG_PATH, "r") as f:
-                obj = json.load(f)
-                cls.download_folder = obj.get("download_folder", DOWNLOAD_FOLDER)
-                cls.base_url = obj.get("base_url", BASE_URL)
-                cls.connect_timeout = obj.get("connect_timeout", CONNECT_TIMEOUT)
-                cls.read_timeout = obj.get("read_timeout", READ_TIMEOUT)
-                cls.max_page_cache = obj.get("max_page_cache", MAX_PAGE_CACHE)
-                cls.exam_page_links = obj["exam_page_links"] # These 2 are not stored within the program so if missing must be generated.
-                cls.subjects = obj["subjects"]
-                
-                last_updated = obj.get("last_updated", 0)
-                current_time = time.time()
-                if current_time - last_updated > MAX_CONFIG_AGE:
-                    sys.stdout.write('\x1b[1A')  # Move cursor up
-                    sys.stdout.write('\x1b[2K')  # Clear entire line
-                    sys.stdout.flush()
-                    print(f"\r{YELLOW}Config is stale - reloading...{RESET}")
-                    cls.store_config()
-        except (KeyError, FileNotFoundError):
-            cls.store_config()
+            cls.exam_page_links = catalogue["exam_page_links"] # These 2 are not stored within the program so if missing must be generated.
+            cls.subjects = catalogue["subjects"]
+        except (KeyError, TypeError):
+            cls.exam_page_links, cls.subjects = {}, {}
+            cls.build_subject_index()
+            if crawl:
+                cls.store_config()
+            return
+        cls.build_subject_index()
+
+        last_updated = catalogue.get("last_updated", 0)
+        current_time = time.time()
+        if crawl and current_time - last_updated > MAX_CONFIG_AGE:
+            clear_previous_lines()
+            print(f"\r{YELLOW}Config is stale - reloading...{RESET}")
+            try:
+                cls.store_config()
+            except SystemExit:
+                # Carry on with the old catalogue, e.g. on a machine set up from a bundle without a connection.
+                cls.exam_page_links, cls.subjects = catalogue["exam_page_links"], catalogue["subjects"]
+                cls.build_subject_index()
+                print(f"{YELLOW}Could not reload the catalogue - using the one from {time.strftime('%Y-%m-%d', time.localtime(last_updated))}.{RESET}")
 
     @classmethod
-    def store_config(cls, skip_reload: bool = False) -> None:
+    def apply_settings(cls, settings: Dict[str, Any]) -> None:
         """
-        Stores the current configuration to the config file.
+        Sets the settings from a loaded config file, using defaults for missing or invalid values.
 
         Args:
-            skip_reload (bool): If True, skips reloading exam page links and subjects.
-        Raises:
-            SystemExit: If the configuration file cannot be saved.
+            settings (dict): The contents of the config file.
         """
-        # Sometimes we don't want to reload the exam page links and subjects, e.g. when changing the download folder.
-        if not skip_reload:
-            html_page = get_html(cls.base_url, (cls.connect_timeout, cls.read_timeout))
-            exam_page_links = find_link_extensions(html_page)
-            subjects = find_subjects(cls, cls.base_url, exam_page_links)
-        else:
-            exam_page_links = cls.exam_page_links
-            subjects = cls.subjects
-        config_json = {
+        cls.download_folder = settings.get("download_folder", DOWNLOAD_FOLDER)
+        cls.base_url = settings.get("base_url", BASE_URL)
+        cls.connect_timeout = settings.get("connect_timeout", CONNECT_TIMEOUT)
+        cls.read_timeout = settings.get("read_timeout", READ_TIMEOUT)
+        cls.max_page_cache = settings.get("max_page_cache", MAX_PAGE_CACHE)
+        cls.fsync_policy = settings.get("fsync_policy", FSYNC_POLICY)
+        if cls.fsync_policy not in FSYNC_POLICIES:
+            cls.fsync_policy = FSYNC_POLICY
+        cls.preallocate_downloads = settings.get("preallocate_downloads", PREALLOCATE_DOWNLOADS)
+        cls.prefetch_requests = settings.get("prefetch_requests", PREFETCH_MAX_REQUESTS)
+        cls.prefetch_bytes = settings.get("prefetch_bytes", PREFETCH_MAX_BYTES)
+        cls.optimize_downloads = settings.get("optimize_downloads", OPTIMIZE_DOWNLOADS)
+        cls.mirrors = settings.get("mirrors", MIRRORS)
+        cls.hedge_requests = settings.get("hedge_requests", HEDGE_REQUESTS)
+        cls.apply_mirrors()
+
+    @classmethod
+    def apply_mirrors(cls) -> None:
+        """
+        Points the mirror pool used for all requests at the base URL and the configured mirrors.
+        """
+        mirror_pool.set_mirrors([cls.base_url] + cls.mirrors)
+        mirror_pool.hedge = cls.hedge_requests
+
+    @classmethod
+    def settings(cls) -> Dict[str, Any]:
+        """
+        Gets the current settings in the format of the config file.
+
+        Returns:
+            dict: The settings.
+        """
+        return {
             "base_url" : cls.base_url,
             "download_folder" : cls.download_folder,
             "connect_timeout" : cls.connect_timeout,
             "read_timeout" : cls.read_timeout,
             "max_page_cache" : cls.max_page_cache,
-            "exam_page_links" : exam_page_links, 
-            "subjects" : subjects,
-            "last_updated" : time.time()
+            "fsync_policy" : cls.fsync_policy,
+            "preallocate_downloads" : cls.preallocate_downloads,
+            "prefetch_requests" : cls.prefetch_requests,
+            "prefetch_bytes" : cls.prefetch_bytes,
+            "optimize_downloads" : cls.optimize_downloads,
+            "mirrors" : cls.mirrors,
+            "hedge_requests" : cls.hedge_requests
         }
-        cls.exam_page_links = exam_page_links
-        cls.subjects = subjects
+
+    @classmethod
+    def build_subject_index(cls) -> None:
+        """
+        Builds the index from subject codes to their exam type and subject page link.
+        """
+        cls.subject_index = index_subjects(cls.subjects)
+
+    @classmethod
+    def find_subject(cls, subject_code: str) -> Optional[Tuple[str, str]]:
+        """
+        Finds the exam type and subject page link of a subject.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+
+        Returns:
+            Optional[Tuple[str, str]]: The exam type and subject page link, or None if the subject is unknown.
+        """
+        return cls.subject_index.get(subject_code)
+
+    @classmethod
+    def client_settings(cls, session_folders: bool = True) -> ClientSettings:
+        """
+        Gets the current settings for a PaperClient.
+
+        Args:
+            session_folders (bool): Whether papers are put in session folders by default.
+
+        Returns:
+            ClientSettings: The settings.
+        """
+        return ClientSettings(cls.base_url, list(cls.mirrors), cls.hedge_requests, cls.download_folder, cls.connect_timeout,
+                              cls.read_timeout, session_folders, cls.fsync_policy, cls.preallocate_downloads, cls.max_page_cache)
+
+    @classmethod
+    def catalogue(cls) -> Catalogue:
+        """
+        Gets the current catalogue for a PaperClient.
+
+        Returns:
+            Catalogue: The catalogue.
+        """
+        return Catalogue(cls.exam_page_links, cls.subject_index)
+
+    @classmethod
+    def update_settings(cls, **settings: Any) -> None:
+        """
+        Changes some settings and saves only those keys to the config file, leaving the catalogue untouched.
+
+        Args:
+            **settings: The settings to change, e.g. connect_timeout=10.
+
+        Raises:
+            SystemExit: If the configuration file cannot be saved.
+        """
+        for key, value in settings.items():
+            setattr(cls, key, value)
+        cls.apply_mirrors()
+        cls.save(lambda: update_json(CONFIG_PATH, settings, indent = 4))
+
+    @classmethod
+    def store_config(cls, skip_reload: bool = False) -> None:
+        """
+        Stores the current configuration to the config file and reloads the catalogue from the website.
+
+        Args:
+            skip_reload (bool): If True, skips reloading exam page links and subjects and only stores the settings.
+        Raises:
+            SystemExit: If the configuration file cannot be saved.
+        """
+        # Sometimes we don't want to reload the exam page links and subjects, e.g. when changing the download folder.
+        if not skip_reload:
+            html_page = get_html(cls.base_url, (cls.connect_timeout, cls.read_timeout))
+            cls.exam_page_links = find_link_extensions(html_page)
+            cls.subjects = find_subjects(cls, cls.base_url, cls.exam_page_links)
+            cls.build_subject_index()
+            catalogue = {
+                "exam_page_links" : cls.exam_page_links,
+                "subjects" : cls.subjects,
+                "last_updated" : time.time()
+            }
+            # Only the crawled keys are replaced, keeping the layouts learned for each subject.
+            cls.save(lambda: update_json(CATALOGUE_PATH, catalogue))
+        cls.save(lambda: update_json(CONFIG_PATH, cls.settings(), indent = 4))
+
+    @classmethod
+    def save(cls, write: Callable[[], Any]) -> None:
+        """
+        Runs a write to a configuration file, exiting if it fails.
+
+        Args:
+            write (Callable): The function which writes the file.
+
+        Raises:
+            SystemExit: If the configuration file cannot be saved.
+        """
         try:
-            with open(CONFIG_PATH, "w") as f:
-                json.dump(config_json, f, indent= 4, ensure_ascii = False)
+            write()
         except OSError:
             print(f"{RED}Fatal: Could not save configuration file.{RESET}")
             sys.stdout.flush()
@@ -0,0 +1,341 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+import requests
+from requests.exceptions import ConnectionError, Timeout
+from constants import (ADAPTIVE_INITIAL_CONCURRENCY, ADAPTIVE_MIN_CONCURRENCY, ADAPTIVE_MAX_CONCURRENCY, ADAPTIVE_DECREASE_FACTOR,
+                       ADAPTIVE_DECREASE_INTERVAL, ADAPTIVE_LATENCY_TOLERANCE, ADAPTIVE_LATENCY_SAMPLES, ADAPTIVE_TIMEOUT_MULTIPLIER,
+                       ADAPTIVE_MIN_READ_TIMEOUT, ADAPTIVE_THROUGHPUT_SMOOTHING, ADAPTIVE_MIN_THROUGHPUT_BYTES,
+                       ADAPTIVE_DEADLINE_SLACK, ADAPTIVE_WAIT_INTERVAL)
+
+class HostStatus(NamedTuple):
+    """
+    What is known about a host, for display.
+
+    Attributes:
+        host (str): The host name (and port, if any).
+        limit (float): How many requests may be in flight to the host at once.
+        in_flight (int): How many requests are in flight to the host.
+        latency (Optional[float]): The median time to the first response in seconds, or None if unknown.
+        throughput (Optional[float]): The smoothed speed of downloads from the host in bytes per second, or None if unknown.
+    """
+    host: str
+    limit: float
+    in_flight: int
+    latency: Optional[float]
+    throughput: Optional[float]
+
+class HostLimiter:
+    """
+    Limits the requests in flight to one host, adapting the limit to how the host is coping (AIMD).
+
+    Each request that succeeds without its latency rising well above the best recently seen adds
+    1/limit to the limit, so it grows by one per round of requests. A timeout, a connection error,
+    a 429 or a 5xx halves it, at most once every ADAPTIVE_DECREASE_INTERVAL seconds so a burst of
+    failures from the same overload only counts once. A 429 with Retry-After also holds back every
+    new request to the host for that long.
+
+    The same observations give the host's read timeout and the deadline for a download of a given size.
+
+    Attributes:
+        host (str): The host name (and port, if any).
+        limit (float): How many requests may be in flight at once. Only the whole part is used.
+        in_flight (int): How many requests are in flight.
+        latencies (Deque[float]): The times to the first response of recent successful requests.
+        throughput (Optional[float]): The smoothed speed of recent downloads in bytes per second.
+    """
+
+    def __init__(self, host: str) -> None:
+        """
+        Initialize the HostLimiter.
+
+        Args:
+            host (str): The host name (and port, if any).
+        """
+        self.host: str = host
+        self.limit: float = ADAPTIVE_INITIAL_CONCURRENCY
+        self.in_flight: int = 0
+        self.latencies: Deque[float] = deque(maxlen = ADAPTIVE_LATENCY_SAMPLES)
+        self.throughput: Optional[float] = None
+        self._condition = threading.Condition()
+        self._last_decrease: float = 0
+        self._blocked_until: float = 0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Get a percentile of the recent latencies.
+
+        Args:
+            fraction (float): The percentile as a fraction (e.g. 0.95).
+
+        Returns:
+            Optional[float]: The latency in seconds, or None if there are no samples.
+        """
+        with self._condition:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def acquire(self, on_wait: Optional[Callable[[], None]] = None) -> None:
+        """
+        Wait for a free slot and take it.
+
+        Args:
+            on_wait (Optional[Callable[[], None]]): Called every ADAPTIVE_WAIT_INTERVAL seconds while waiting.
+                It may raise to stop waiting.
+        """
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit) and time.monotonic() >= self._blocked_until:
+                    self.in_flight += 1
+                    return
+                self._condition.wait(ADAPTIVE_WAIT_INTERVAL)
+            # Called without the lock, as it may stop for a while (e.g. while the job is paused).
+            if on_wait:
+                on_wait()
+
+    def try_acquire(self) -> bool:
+        """
+        Take a slot if one is free right now, without waiting.
+
+        Returns:
+            bool: True if a slot was taken; it must be given back with release().
+        """
+        with self._condition:
+            if self.in_flight >= int(self.limit) or time.monotonic() < self._blocked_until:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        """
+        Give back a slot taken with acquire().
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def succeeded(self, latency: float) -> None:
+        """
+        Record a request which got a response that was not a sign of overload.
+
+        Args:
+            latency (float): The time to the first response in seconds.
+        """
+        with self._condition:
+            best = min(self.latencies) if self.latencies else latency
+            self.latencies.append(latency)
+            if latency <= best * ADAPTIVE_LATENCY_TOLERANCE:
+                self.limit = min(ADAPTIVE_MAX_CONCURRENCY, self.limit + 1 / self.limit)
+                self._condition.notify()
+
+    def overloaded(self, retry_after: Optional[float] = None) -> None:
+        """
+        Record a timeout, connection error, 429 or 5xx.
+
+        Args:
+            retry_after (Optional[float]): Seconds the host asked to be left alone for, if it did.
+        """
+        now = time.monotonic()
+        with self._condition:
+            if now - self._last_decrease >= ADAPTIVE_DECREASE_INTERVAL:
+                self.limit = max(ADAPTIVE_MIN_CONCURRENCY, self.limit * ADAPTIVE_DECREASE_FACTOR)
+                self._last_decrease = now
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    def transferred(self, size: int, seconds: float) -> None:
+        """
+        Record the speed of a finished download.
+
+        Args:
+            size (int): The number of bytes downloaded.
+            seconds (float): How long the body took to download.
+        """
+        if size < ADAPTIVE_MIN_THROUGHPUT_BYTES or seconds <= 0:
+            return # Too small to say anything about the speed of the link.
+        with self._condition:
+            rate = size / seconds
+            if self.throughput is None:
+                self.throughput = rate
+            else:
+                self.throughput += ADAPTIVE_THROUGHPUT_SMOOTHING * (rate - self.throughput)
+
+    def timeouts(self, timeouts: Tuple[int, int]) -> Tuple[float, float]:
+        """
+        Get the timeouts for a request, with the read timeout a few times the host's usual (95th percentile) latency.
+
+        Args:
+            timeouts (Tuple[int, int]): The configured (connect_timeout, read_timeout). The read timeout is used
+                until the host's latency is known, and is never exceeded.
+
+        Returns:
+            Tuple[float, float]: (connect_timeout, read_timeout).
+        """
+        connect_timeout, read_timeout = timeouts
+        latency = self.percentile(0.95)
+        if latency is None:
+            return connect_timeout, read_timeout
+        return connect_timeout, min(read_timeout, max(ADAPTIVE_MIN_READ_TIMEOUT, latency * ADAPTIVE_TIMEOUT_MULTIPLIER))
+
+    def deadline(self, expected_size: int, read_timeout: float) -> Optional[float]:
+        """
+        Get how long a download of a given size may take before it is given up on, allowing it to run
+        ADAPTIVE_DEADLINE_SLACK times slower than downloads from the host usually do.
+
+        Args:
+            expected_size (int): The size of the download in bytes (0 if unknown).
+            read_timeout (float): The read timeout of the request, added to allow for a slow start.
+
+        Returns:
+            Optional[float]: The time allowed in seconds, or None if there is no deadline because the size
+                or the host's speed is unknown.
+        """
+        with self._condition:
+            throughput = self.throughput
+        if not expected_size or not throughput:
+            return None
+        return read_timeout + expected_size / throughput * ADAPTIVE_DEADLINE_SLACK
+
+    def status(self) -> HostStatus:
+        """
+        Get what is known about the host.
+
+        Returns:
+            HostStatus: The host's status.
+        """
+        return HostStatus(self.host, self.limit, self.in_flight, self.percentile(0.5), self.throughput)
+
+class HostSlot:
+    """
+    A slot for one request to a host, used as a context manager around the request and reading its body.
+
+    Timeouts and connection errors raised inside the with block are recorded as overload. The response
+    must be passed to record() so its status and latency are recorded too.
+
+    Attributes:
+        limiter (HostLimiter): The limiter of the host.
+        held (bool): Whether the slot is taken, i.e. it was entered and has not been released yet.
+    """
+
+    def __init__(self, limiter: HostLimiter, on_wait: Optional[Callable[[], None]] = None, reserved: bool = False) -> None:
+        """
+        Initialize the HostSlot.
+
+        Args:
+            limiter (HostLimiter): The limiter of the host.
+            on_wait (Optional[Callable[[], None]]): Called regularly while waiting for the slot. It may raise to stop waiting.
+            reserved (bool): Whether the slot was already taken with try_acquire(), so entering does not take another.
+        """
+        self.limiter: HostLimiter = limiter
+        self._on_wait = on_wait
+        self._reserved: bool = reserved
+        self._started: float = 0
+        self.held: bool = False
+
+    def record(self, response: requests.Response) -> None:
+        """
+        Record how the host answered the request.
+
+        Args:
+            response (requests.Response): The response.
+        """
+        if response.status_code == 429 or response.status_code >= 500:
+            self.limiter.overloaded(retry_after_seconds(response.headers.get("retry-after")))
+        else:
+            elapsed = getattr(response, "elapsed", None)
+            self.limiter.succeeded(elapsed.total_seconds() if elapsed else time.monotonic() - self._started)
+
+    def release(self) -> None:
+        """
+        Give back the slot before the with block ends, e.g. before waiting on purpose while reading the body,
+        so other requests to the host can use it meanwhile. Does nothing if it was already given back.
+        """
+        if self.held:
+            self.held = False
+            self.limiter.release()
+
+    def __enter__(self) -> "HostSlot":
+        if not self._reserved:
+            self.limiter.acquire(self._on_wait)
+        self.held = True
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if isinstance(exc_value, (Timeout, ConnectionError)):
+            self.limiter.overloaded()
+        self.release()
+
+class AdaptiveLimiter:
+    """
+    A HostLimiter for every host requested, created when the host is first seen.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the AdaptiveLimiter.
+        """
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, HostLimiter] = {}
+
+    def for_url(self, url: str) -> HostLimiter:
+        """
+        Get the limiter for the host of a URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            HostLimiter: The host's limiter.
+        """
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            limiter = self._hosts.get(host)
+            if limiter is None:
+                limiter = self._hosts[host] = HostLimiter(host)
+            return limiter
+
+    def slot(self, url: str, on_wait: Optional[Callable[[], None]] = None) -> HostSlot:
+        """
+        Get a slot for a request to the host of a URL, to be used as a context manager.
+
+        Args:
+            url (str): The URL to be requested.
+            on_wait (Optional[Callable[[], None]]): Called regularly while waiting for the slot. It may raise to stop waiting.
+
+        Returns:
+            HostSlot: The slot.
+        """
+        return HostSlot(self.for_url(url), on_wait)
+
+    def status(self) -> Dict[str, HostStatus]:
+        """
+        Get what is known about every host.
+
+        Returns:
+            Dict[str, HostStatus]: Mapping of host names to their status.
+        """
+        with self._lock:
+            limiters = list(self._hosts.values())
+        return {limiter.host: limiter.status() for limiter in limiters}
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given in seconds. Dates are ignored, as the limit is halved anyway.
+
+    Args:
+        value (Optional[str]): The header's value.
+
+    Returns:
+        Optional[float]: The number of seconds, or None if there is none.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
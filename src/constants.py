@@ -44,12 +44,195 @@ def get_config_path() -> str:
         base = os.path.join(os.path.expanduser("~"), ".config")
     return os.path.join(base, "config.json")
 CONFIG_PATH: str = get_config_path()
+CATALOGUE_PATH: str = os.path.join(os.path.dirname(CONFIG_PATH), "easypastpapers-catalogue.json") # Subjects scraped from the website
+CACHE_FOLDER: str = os.path.join(os.path.dirname(CONFIG_PATH), "easypastpapers-cache") # Cached index pages
     
 CONNECT_TIMEOUT: int = 5
 READ_TIMEOUT: int = 15
 MAX_PAGE_CACHE: int = 20 #Maximum number of HTML Pages to be cached
 MAX_CONFIG_AGE: int = 60 * 60 * 24 * 28 # 1 month in seconds
 
+# --- For using mirrors of the website
+
+MIRRORS: list[str] = [] # Mirrors tried after the base URL, with the same URL layout
+HEDGE_REQUESTS: bool = True # Send slow index page requests to a second mirror as well
+MIRROR_PROBE_INTERVAL: int = 5 * 60 # Mirrors are re-probed in the background every 5 minutes
+MIRROR_FAILURE_COOLDOWN: int = 60 # A mirror which fails is tried last for 1 minute
+MIRROR_LATENCY_SAMPLES: int = 20 # Number of recent request latencies kept per mirror
+MIRROR_HEDGE_DEFAULT_DELAY: float = 1.0 # Hedging delay before a mirror's latency is known
+MIRROR_HEDGE_MIN_DELAY: float = 0.05
+
+# --- For adapting concurrency and timeouts to each host
+
+ADAPTIVE_INITIAL_CONCURRENCY: float = 4 # Requests in flight to a host before anything is known about it
+ADAPTIVE_MIN_CONCURRENCY: float = 1
+ADAPTIVE_MAX_CONCURRENCY: float = 16
+ADAPTIVE_DECREASE_FACTOR: float = 0.5 # The limit is halved on a timeout, 429 or 5xx
+ADAPTIVE_DECREASE_INTERVAL: float = 1.0 # Failures within this many seconds of a decrease do not decrease it again
+ADAPTIVE_LATENCY_TOLERANCE: float = 2.0 # The limit only grows while latency is within this multiple of the best recent latency
+ADAPTIVE_LATENCY_SAMPLES: int = 50 # Number of recent latencies kept per host
+ADAPTIVE_TIMEOUT_MULTIPLIER: float = 4.0 # Read timeout as a multiple of the host's 95th percentile latency
+ADAPTIVE_MIN_READ_TIMEOUT: float = 3.0
+ADAPTIVE_THROUGHPUT_SMOOTHING: float = 0.3 # Weight of the newest download in a host's smoothed throughput
+ADAPTIVE_MIN_THROUGHPUT_BYTES: int = 64 * 1024 # Smaller downloads are dominated by latency, so their speed is not recorded
+ADAPTIVE_DEADLINE_SLACK: float = 4.0 # A download may run this many times slower than usual before it is given up on
+ADAPTIVE_WAIT_INTERVAL: float = 0.2 # Seconds between checks for cancellation while waiting for a free slot
+
+# --- For warming up connections while the shell waits for input
+
+PREWARM_QUEUE_SIZE: int = 4 # Speculative requests waiting at once; more are dropped
+PREWARM_TIMEOUTS: tuple[int, int] = (3, 5) # Short, so a slow website never ties up the warm-up thread
+
+# --- For prefetching the index pages the user usually needs
+
+HISTORY_PATH: str = os.path.join(os.path.dirname(CONFIG_PATH), "easypastpapers-history.json") # Which index pages papers were downloaded from
+HISTORY_HALF_LIFE: int = 60 * 60 * 24 * 30 # A page used a month ago counts half as much as one used now
+HISTORY_MAX_PAGES: int = 200 # The least used pages are forgotten beyond this
+PREFETCH_PAGES: int = 8 # Most likely index pages fetched when the shell starts or is idle
+PREFETCH_PER_IDLE: int = 2 # Pages queued at once, leaving room for the pages of paper codes being typed
+PREFETCH_MAX_REQUESTS: int = 8 # Requests prefetching may make per shell session
+PREFETCH_MAX_BYTES: int = 4 * 1024 * 1024 # Bytes prefetching may download per shell session
+
+# --- For drawing download progress
+
+PROGRESS_FPS: int = 10 # Frames drawn per second
+PROGRESS_BAR_WIDTH: int = 24
+PROGRESS_MAX_ROWS: int = 8 # Most transfers shown at once; the rest are counted
+PROGRESS_RATE_WINDOW: float = 3.0 # Seconds of history used for the total throughput
+PROGRESS_LINE_INTERVAL: float = 5.0 # Seconds between progress lines when stdout is not a terminal
+
+# --- For sharing fetches between threads and processes
+
+PAGE_CACHE_FOLDER: str = os.path.join(CACHE_FOLDER, "pages") # Index pages shared by every process on the machine
+PAGE_CACHE_TTL: int = 60 * 60 # Cached index pages are refetched after 1 hour
+CLAIMS_FOLDER: str = os.path.join(CACHE_FOLDER, "claims") # Lock files claiming downloads in progress
+LOCK_BUCKETS: int = 256 # Keys share this many lock files, so the lock folders stay small
+CLAIM_POLL_INTERVAL: float = 0.2 # Seconds between checks while another process holds a download claim
+
+# --- For writing downloads to disk
+
+FSYNC_NONE: str = "none" # Leave flushing to the OS
+FSYNC_PER_FILE: str = "per-file" # fsync every file before it is renamed into place
+FSYNC_BATCHED: str = "batched" # fsync published files in batches of FSYNC_BATCH_SIZE
+FSYNC_POLICIES: list[str] = [FSYNC_NONE, FSYNC_PER_FILE, FSYNC_BATCHED]
+FSYNC_POLICY: str = FSYNC_BATCHED
+FSYNC_BATCH_SIZE: int = 32
+PREALLOCATE_DOWNLOADS: bool = False
+PARTIAL_DOWNLOAD_SUFFIX: str = ".part"
+DOWNLOAD_CHUNK_SIZE: int = 64 * 1024 # Bytes read from a download at a time
+
+# --- For downloading large files over several connections at once
+
+SEGMENTED_MIN_SIZE: int = 8 * 1024 * 1024 # Smaller files are downloaded over one connection
+SEGMENT_CONNECTIONS: int = 4 # Most connections used for one file, if the host's limit has room for them
+SEGMENT_ATTEMPTS: int = 3 # Times each part is tried, resuming from where the last try stopped
+SEGMENT_POLL_INTERVAL: float = 0.2 # Seconds between progress updates while waiting for the other parts
+
+# --- For downloading into archives
+
+ARCHIVE_FORMATS: list[str] = [".zip", ".tar", ".tar.zst"]
+ARCHIVE_SPOOL_SIZE: int = 16 * 1024 * 1024 # Downloads larger than this are held in a temporary file until complete
+ARCHIVE_CHECKPOINT_ENTRIES: int = 100 # The archive is made readable after this many new entries
+
+# --- For checking the integrity of downloads
+
+PDF_HEADER: bytes = b"%PDF-"
+PDF_TRAILER: bytes = b"%%EOF"
+PDF_TRAILER_WINDOW: int = 1024 # The end of file marker must be within the last 1KB of a PDF
+MANIFEST_FILE_NAME: str = ".easypastpapers-manifest.jsonl" # Stored at the root of the download folder
+MANIFEST_COMPACT_MIN_LINES: int = 1000 # The manifest is only rewritten once this many of its lines are superseded, and at least as many as are current
+
+# --- For serving the library to other machines
+
+SERVE_HOST: str = "0.0.0.0"
+SERVE_PORT: int = 8080
+SERVE_INDEX_TTL: int = 60 * 60 # Index pages are refetched from the website after 1 hour
+SERVE_CHUNK_SIZE: int = 64 * 1024
+
+# --- For running downloads in the background
+
+JOB_WORKERS: int = 2 # Number of jobs which can run at once
+PRIORITY_INTERACTIVE: int = 0 # Jobs with a higher number give way to interactive jobs while they run
+PRIORITY_HIGH: int = 1
+PRIORITY_NORMAL: int = 2
+PRIORITY_LOW: int = 3
+PRIORITY_NAMES: dict[str, int] = {"high": PRIORITY_HIGH, "normal": PRIORITY_NORMAL, "low": PRIORITY_LOW}
+
+JOB_QUEUED: str = "queued"
+JOB_RUNNING: str = "running"
+JOB_PAUSED: str = "paused"
+JOB_CANCELLED: str = "cancelled"
+JOB_DONE: str = "done"
+JOB_FAILED: str = "failed"
+JOB_WAITING: str = "waiting" # Outside the time windows the job may download in
+
+# --- For scheduling bulk downloads
+
+CHECKPOINT_FOLDER: str = os.path.join(os.path.dirname(CONFIG_PATH), "easypastpapers-checkpoints") # Where unfinished getmany jobs are saved
+SCHEDULE_POLL_INTERVAL: float = 30.0 # Seconds between checking whether a waiting job's time window has opened
+THROTTLE_BURST_SECONDS: float = 1.0 # A rate limited job may receive this many seconds' worth of bytes at once
+CHECKPOINT_SAVE_PAPERS: int = 50 # A job's checkpoint is saved after this many papers are done...
+CHECKPOINT_SAVE_INTERVAL: float = 10.0 # ...or this many seconds after the last save, whichever comes first
+
+# --- For sharing bulk downloads between machines
+
+WORK_LEASE_SECONDS: int = 60 # A claimed paper goes back to the queue if its worker has not been heard from for this long
+WORK_HEARTBEAT_INTERVAL: int = 15 # Seconds between a worker renewing the leases of the papers it holds
+WORK_MAX_ATTEMPTS: int = 2 # A paper whose worker is lost is retried once, then marked as failed
+WORK_CLAIM_BATCH: int = 4 # Papers a worker claims at once
+WORK_POLL_INTERVAL: float = 5.0 # Seconds a worker waits before checking again when other workers hold the remaining papers
+WORK_QUEUE_TIMEOUT: int = 30 # Seconds to wait for the queue, e.g. while another machine holds the database lock
+
+# --- For using the library from other Python programs
+
+DOWNLOAD_DOWNLOADED: str = "downloaded"
+DOWNLOAD_EXISTS: str = "exists" # Already downloaded, so left alone
+DOWNLOAD_FAILED: str = "failed"
+
+EVENT_STARTED: str = "started" # A transfer got its response and is about to receive the file
+EVENT_PROGRESS: str = "progress" # More of the file was received
+EVENT_ENDED: str = "ended" # A transfer finished or failed; another may follow for the same paper
+EVENT_RESULT: str = "result" # A paper is done with, one way or another
+
+# --- For syncing newly published papers
+
+SYNC_FOLDER: str = os.path.join(CACHE_FOLDER, "sync") # One snapshot of index pages per subject
+SYNC_RECENT_YEARS: int = 2 # Year folders older than this are not checked unless asked to
+SYNC_WORKERS: int = 8 # Number of subjects checked at once
+SPECIMEN_FOLDER_NAME: str = "Specimen Papers" # Folder specimen papers are downloaded into, whatever it is called on the website
+
+# --- For learning where each subject's papers are on the website
+
+LAYOUT_RECHECK_AGE: int = 60 * 60 * 24 # A year missing from a subject's layout is looked for again if the layout is older than 1 day
+
+# --- For exporting and importing cache bundles
+
+BUNDLE_FORMAT: str = "easypastpapers-cache" # Written in every bundle, so other zip files are not mistaken for one
+BUNDLE_VERSION: int = 1 # Bumped when the layout of bundles changes; bundles from newer versions are refused
+DEFAULT_BUNDLE_NAME: str = "easypastpapers-cache.zip" # Written to the current folder if no file is given
+
+# --- For merging downloaded papers
+
+MERGED_FOLDER_NAME: str = "Merged" # Created in each subject's download folder
+MERGE_BATCH_SIZE: int = 50 # Maximum number of PDFs open at once while merging
+# Order of paper types within a paper number when merging, e.g. the question paper before its mark scheme.
+MERGE_PAPER_TYPE_ORDER: list[str] = ["qp", "in", "i2", "sf", "ci", "ir", "ms", "qr", "rp", "tn", "er", "gt",
+                                     "sp", "si", "sci", "sc", "sm", "sy", "su"]
+
+# --- For optimising downloaded PDFs
+
+OPTIMIZE_DOWNLOADS: bool = False # Optimise every PDF in the background after it is downloaded
+OPTIMIZE_MAX_GROWTH: float = 0.02 # Optimised PDFs more than this fraction larger than the original are not kept
+OPTIMIZE_NICENESS: int = 10 # How much lower the priority of the optimising processes is
+
+# --- For searching the text of downloaded papers
+
+SEARCH_INDEX_FILE_NAME: str = ".easypastpapers-search.sqlite" # Kept in the download folder, next to the papers
+SEARCH_COMMIT_BATCH: int = 200 # Papers indexed per database transaction
+SEARCH_INDEX_DELAY: float = 2.0 # Seconds to collect downloaded papers before indexing them together
+SEARCH_SNIPPET_TOKENS: int = 12 # Words of context shown around each match
+SEARCH_DEFAULT_LIMIT: int = 20
+
 # --- For getting the link extensions and subjects
 
 # In between a and level, match any non-word character (i.e., symbol — not letter/digit/underscore)
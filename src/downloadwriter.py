@@ -0,0 +1,201 @@
+import os
+import tempfile
+import threading
+from typing import List, Set
+from constants import FSYNC_NONE, FSYNC_PER_FILE, FSYNC_BATCHED, FSYNC_BATCH_SIZE, PARTIAL_DOWNLOAD_SUFFIX
+from jobs import current_job
+
+# Writers which have not been published or aborted yet, so they can be cleaned up on exit.
+active_writers: Set["DownloadWriter"] = set()
+# Files published under the batched fsync policy that have not been synced yet.
+pending_syncs: List[str] = []
+pending_syncs_lock = threading.Lock() # Downloads are published by several job threads at once.
+
+class IncompleteDownloadError(Exception):
+    """
+    Raised when a download ends before the expected number of bytes was received.
+    """
+
+class DownloadWriter:
+    """
+    Streams a download into a temporary file in the destination folder and atomically
+    renames it into place once it is complete.
+
+    A file at the final path is therefore always a complete download, even if the
+    program is interrupted or several runs download the same paper at once.
+
+    Attributes:
+        final_path (str): The path the file is published to.
+        expected_size (int): The expected size in bytes (0 if unknown).
+        fsync_policy (str): One of FSYNC_NONE, FSYNC_PER_FILE or FSYNC_BATCHED.
+        temp_path (str): The path of the temporary file being written.
+        written (int): The number of bytes written so far.
+    """
+
+    def __init__(self, final_path: str, expected_size: int = 0, fsync_policy: str = FSYNC_NONE, preallocate: bool = False) -> None:
+        """
+        Initialize the DownloadWriter and create the temporary file.
+
+        Args:
+            final_path (str): The path to publish the file to.
+            expected_size (int): The expected size in bytes (0 if unknown).
+            fsync_policy (str): How the file should be flushed to disk when published.
+            preallocate (bool): Whether to reserve the expected size on disk up front.
+
+        Raises:
+            OSError: If the temporary file cannot be created.
+        """
+        self.final_path: str = final_path
+        self.expected_size: int = expected_size
+        self.fsync_policy: str = fsync_policy
+        self.written: int = 0
+        folder, file_name = os.path.split(os.path.abspath(final_path))
+        # The temporary file must be in the same folder so the rename is atomic.
+        fd, self.temp_path = tempfile.mkstemp(prefix = f".{file_name}.", suffix = PARTIAL_DOWNLOAD_SUFFIX, dir = folder)
+        self._file = os.fdopen(fd, "wb")
+        self._lock = threading.Lock()
+        active_writers.add(self)
+        # Register with the job downloading the file, so cancelling the job discards only its own partial files.
+        self._job = current_job()
+        if self._job:
+            self._job.writers.add(self)
+        if preallocate:
+            self.reserve(expected_size)
+
+    def reserve(self, size: int) -> None:
+        """
+        Reserve space on disk for the download, so it is not fragmented or left half written when the disk fills up.
+
+        Args:
+            size (int): The size of the download in bytes (0 if unknown).
+        """
+        if size > 0 and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, size)
+            except OSError:
+                pass # Preallocation is only an optimisation, e.g. not supported on some file systems.
+
+    def write(self, chunk: bytes) -> None:
+        """
+        Write a chunk of the download to the temporary file.
+
+        Args:
+            chunk (bytes): The data to write.
+        """
+        self._file.write(chunk)
+        self.written += len(chunk)
+
+    def write_at(self, offset: int, chunk: bytes) -> None:
+        """
+        Write a chunk of the download at an offset in the temporary file, for downloads fetched in parts at once.
+        Safe to call from several threads, as long as the parts do not overlap.
+
+        Args:
+            offset (int): The position of the chunk in the file.
+            chunk (bytes): The data to write.
+        """
+        with self._lock:
+            self._file.seek(offset)
+            self._file.write(chunk)
+            self.written += len(chunk)
+
+    def flush(self) -> None:
+        """
+        Flush written data to the temporary file so other readers of it can see it.
+        """
+        self._file.flush()
+
+    def publish(self) -> None:
+        """
+        Flush the temporary file according to the fsync policy and atomically rename it to the final path.
+
+        Raises:
+            IncompleteDownloadError: If fewer bytes than expected were written.
+            OSError: If the file could not be written or renamed.
+        """
+        if self.expected_size and self.written < self.expected_size:
+            raise IncompleteDownloadError(f"Download incomplete: received {self.written} of {self.expected_size} bytes")
+        # Preallocated space beyond the end of the data must not be kept.
+        self._file.truncate(self.written)
+        self._file.flush()
+        if self.fsync_policy == FSYNC_PER_FILE:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.final_path)
+        active_writers.discard(self)
+        if self._job:
+            self._job.writers.discard(self)
+        if self.fsync_policy == FSYNC_PER_FILE:
+            sync_directory(os.path.dirname(os.path.abspath(self.final_path)))
+        elif self.fsync_policy == FSYNC_BATCHED:
+            with pending_syncs_lock:
+                pending_syncs.append(self.final_path)
+                batch_full = len(pending_syncs) >= FSYNC_BATCH_SIZE
+            if batch_full:
+                flush_pending_syncs()
+
+    def abort(self) -> None:
+        """
+        Discard the temporary file. Does nothing if the file was already published.
+        """
+        if self not in active_writers:
+            return
+        active_writers.discard(self)
+        if self._job:
+            self._job.writers.discard(self)
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+    def __enter__(self) -> "DownloadWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # If publish was never reached the download is incomplete and must not be kept.
+        self.abort()
+
+def sync_directory(folder: str) -> None:
+    """
+    Flush a directory entry to disk so renames within it survive a crash. Not supported on Windows.
+
+    Args:
+        folder (str): The directory to sync.
+    """
+    if os.name == "nt":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def flush_pending_syncs() -> None:
+    """
+    Flush all files published under the batched fsync policy (and their folders) to disk.
+    """
+    # Taken in one go, so each file is synced by one thread, while others carry on publishing into the next batch.
+    with pending_syncs_lock:
+        paths = pending_syncs[:]
+        pending_syncs.clear()
+    folders = set()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                os.fsync(f.fileno())
+            folders.add(os.path.dirname(os.path.abspath(path)))
+        except OSError:
+            pass # The file may have been moved or deleted since it was published.
+    for folder in folders:
+        try:
+            sync_directory(folder)
+        except OSError:
+            pass
+
+def abort_active_downloads() -> None:
+    """
+    Discard the temporary files of all downloads which have not been published.
+    """
+    for writer in list(active_writers):
+        writer.abort()
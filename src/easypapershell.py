@@ -5,11 +5,31 @@ import cmd
 import shlex
 import os
 from utils import * 
-from cache import *
+from client import (AvailablePaper, DownloadResult, FetchError, InvalidPaperCodeError, PaperClient, PaperError,
+                    PaperNotFoundError, ProgressEvent, year_page_cache_key)
+from papercode import PaperCodeMatcher, parse_paper_code
+from integrity import LibraryManifest, check_files, find_library_files, is_pdf
+from layout import apply_moves, plan_relayout, remove_empty_folders
+from merge import group_papers, merge_available, merge_groups
+from optimize import BackgroundOptimizer, OptimizeResult, available_cores, optimize_available, optimize_pdfs
+from server import PaperServer
+from jobs import JobQueue, Job, JobDeferred, check_current_job, wait_for_current_window
+from checkpoint import JobCheckpoint, saved_checkpoints
+from schedule import BandwidthSchedule
+from workqueue import WorkItem, WorkQueue, WorkQueueError, Worker, open_work_queue
+from sync import Addition, forget_links, plan_syncs, save_snapshot, synced_subjects
+from prewarm import Prewarmer
+from history import PrefetchBudget, UsageHistory
+from progress import renderer, clear_previous_lines, format_eta, format_size
+from bundle import BundleContents, BundleError, export_bundle, import_bundle
+from archive import ArchiveError, ArchiveWriter, archive_available, archive_format
+from search import SNIPPET_END, SNIPPET_START, IndexUpdater, SearchIndex, search_available
+import sqlite3
+import time
 import datetime
 import tkinter as tk
 from tkinter import filedialog, PhotoImage
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 class EasyPaperShell(cmd.Cmd):
     """
@@ -30,18 +50,74 @@ class EasyPaperShell(cmd.Cmd):
     )
     
     GET_MANY_USAGE: str = (
-        f"Usage: {YELLOW}getmany (subject code) (range) [-f/--force] [-s/--skip-existing] [-ns/--no-session-folders]{RESET}\n"
+        f"Usage: {YELLOW}getmany (subject code) (range) [-f/--force] [-s/--skip-existing] [-ns/--no-session-folders] [-t/--types (paper types)] [-p/--papers (paper numbers)] [-a/--archive (archive file)] [-w/--schedule (windows)]{RESET}\n"
         f"Range can be a single session code, a range of years, or a combination of both.\n"
         f"Range can be in the format:\n"
         f"{YELLOW}(session letter)(2 digit year code){RESET}\n"
         f"{YELLOW}(session letter)(2 digit year code){RESET}-{YELLOW}(2 digit year code){RESET}\n"
-        f"{YELLOW}(2 digit year code){RESET}-{YELLOW}(2 digit year code){RESET}"
+        f"{YELLOW}(2 digit year code){RESET}-{YELLOW}(2 digit year code){RESET}\n"
+        f"Paper types and paper numbers are comma separated lists, e.g. {YELLOW}-t qp,ms -p 1,3,4x{RESET}.\n"
+        f"A single digit or a digit followed by {YELLOW}x{RESET} matches every variant of that paper.\n"
+        f"The schedule is a comma separated list of time windows, each with an optional rate, then an optional rate for the rest of the day,\n"
+        f"e.g. {YELLOW}18:00-07:00,100KB{RESET} for full speed from 18:00 to 07:00 and 100 KB/s otherwise, or {YELLOW}18:00-07:00{RESET} to only download from 18:00 to 07:00.\n"
+        f"Rates are {YELLOW}full{RESET}, {YELLOW}pause{RESET} or a number of B, KB (the default) or MB per second, e.g. {YELLOW}12:00-13:00=1MB{RESET}."
     )
     GET_MANY_EXAMPLE: str = f"Example: {YELLOW}getmany 0452 14-17{RESET}"
 
+    MERGE_USAGE: str = (
+        f"Usage: {YELLOW}merge (subject code) (range) [-i/--interleave] [-t/--types (paper types)] [-p/--papers (paper numbers)]{RESET}\n"
+        f"or: {YELLOW}merge last [-i/--interleave]{RESET} to merge the papers from the last getmany.\n"
+        f"Range is in the same format as for {YELLOW}getmany{RESET}."
+    )
+    MERGE_EXAMPLE: str = f"Example: {YELLOW}merge 9702 s19-21 -i -t qp,ms{RESET}"
+    SERVE_USAGE: str = (
+        f"Usage: {YELLOW}serve [port] [--host (address)]{RESET}\n"
+        f"Other machines can then use {YELLOW}setbaseurl http://(this machine's address):(port){RESET}."
+    )
+    JOBS_USAGE: str = f"Usage: {YELLOW}jobs [-w/--watch]{RESET}"
+    JOB_ID_USAGE: str = f"Usage: {YELLOW}{{command}} (job id){RESET}"
+    RESUME_USAGE: str = f"Usage: {YELLOW}resume (job id){RESET} or {YELLOW}resume saved{RESET}"
+    PRIORITY_USAGE: str = f"Usage: {YELLOW}priority (job id) ({'/'.join(PRIORITY_NAMES)}){RESET}"
+    SYNC_USAGE: str = f"Usage: {YELLOW}sync [subject codes...] [-a/--all] [-ns/--no-session-folders]{RESET}"
+    VERIFY_USAGE: str = f"Usage: {YELLOW}verify [subject code] [-f/--fix]{RESET}"
+    SEARCH_USAGE: str = (
+        f"Usage: {YELLOW}search (words...) [-s/--subject (subject code)] [-y/--year (year)] [--session (session letter)] [-t/--types (paper types)] [-n/--limit (number)]{RESET}\n"
+        f"or: {YELLOW}search -r/--reindex{RESET} to index every paper in the download folder."
+    )
+    ENQUEUE_USAGE: str = (
+        f"Usage: {YELLOW}enqueue (queue) (subject codes/all) (range) [-ns/--no-session-folders] [-t/--types (paper types)] [-p/--papers (paper numbers)]{RESET}\n"
+        f"The queue is the path of a work queue database, e.g. on a drive shared with the workers, or {YELLOW}tcp://host:port{RESET}.\n"
+        f"Subject codes are comma separated (e.g. 0580,0620). The range is as for {YELLOW}getmany{RESET}."
+    )
+    WORK_USAGE: str = f"Usage: {YELLOW}work (queue){RESET}"
+    WORK_QUEUE_USAGE: str = f"Usage: {YELLOW}workqueue (queue){RESET}"
+    OPTIMIZE_USAGE: str = f"Usage: {YELLOW}optimize [subject code] [-f/--force]{RESET}"
+    EXPORT_CACHE_USAGE: str = f"Usage: {YELLOW}exportcache [bundle file]{RESET}"
+    IMPORT_CACHE_USAGE: str = (
+        f"Usage: {YELLOW}importcache (bundle file){RESET}\n"
+        f"To set up a new machine without crawling the website, run {YELLOW}main.py importcache (bundle file){RESET} before its first start."
+    )
+    RELAYOUT_USAGE: str = f"Usage: {YELLOW}relayout [-ns/--no-session-folders] [--from (old download folder)] [-l/--link] [-d/--dry-run]{RESET}"
+    SEARCH_EXAMPLE: str = f"Example: {YELLOW}search \"moment of inertia\" torque -s 9702 -t qp{RESET}"
+
     SET_CONNECT_TIMEOUT_USAGE: str = f"Usage: {YELLOW}setconnecttimeout (seconds){RESET}"
     SET_READ_TIMEOUT_USAGE: str = f"Usage: {YELLOW}setreadtimeout (seconds){RESET}"
     SET_BASE_URL_USAGE: str = f"Usage: {YELLOW}setbaseurl (base url){RESET}"
+    MIRRORS_USAGE: str = f"Usage: {YELLOW}mirrors [-p/--probe]{RESET}"
+    ADD_MIRROR_USAGE: str = f"Usage: {YELLOW}addmirror (mirror url){RESET}"
+    REMOVE_MIRROR_USAGE: str = f"Usage: {YELLOW}removemirror (mirror url){RESET}"
+    SET_HEDGING_USAGE: str = f"Usage: {YELLOW}sethedging (on/off){RESET}"
+    SET_FSYNC_POLICY_USAGE: str = (
+        f"Usage: {YELLOW}setfsyncpolicy ({'/'.join(FSYNC_POLICIES)}){RESET}\n"
+        f"{YELLOW}{FSYNC_NONE}{RESET}: leave flushing downloads to disk to the operating system.\n"
+        f"{YELLOW}{FSYNC_PER_FILE}{RESET}: flush every download to disk before it is saved (safest, slowest).\n"
+        f"{YELLOW}{FSYNC_BATCHED}{RESET}: flush downloads to disk in batches of {FSYNC_BATCH_SIZE}."
+    )
+    SET_OPTIMIZE_USAGE: str = f"Usage: {YELLOW}setoptimize (on/off){RESET}"
+    SET_PREFETCH_USAGE: str = (
+        f"Usage: {YELLOW}setprefetch (requests) [(megabytes)]{RESET} or {YELLOW}setprefetch off{RESET}\n"
+        f"Sets how many requests and megabytes each session may use to prefetch the index pages you usually need."
+    )
     SET_DOWNLOAD_FOLDER_USAGE: str = (
         f"Usage: {YELLOW}setdownloadfolder (path to download folder){RESET}.\n"
         f"If no folder is specified, a dialog will open to choose a folder.\n"
@@ -53,9 +129,175 @@ class EasyPaperShell(cmd.Cmd):
         Initialize the EasyPaperShell.
         """
         super().__init__()
-        self.page_cache = PageCache() # Use this in order to enforce max size for cache pool
-        self.max_cache_size = Configuration.max_page_cache
+        # Everything the shell finds and downloads goes through the same client other programs can use.
+        self.client: PaperClient = PaperClient(Configuration.client_settings(), Configuration.catalogue(), mirror_pool, host_limits)
+        self.redownload_queue: List[str] = [] # Paths of files which failed verification
+        # Subject code and paths of the files saved by the last getmany started from the prompt. Only set from the prompt;
+        # the job fills in the paths, so other getmany jobs running at the same time cannot replace it.
+        self.last_getmany: Optional[Tuple[str, List[str]]] = None
+        self.job_queue: JobQueue = JobQueue()
+        self.checkpoints: Dict[int, JobCheckpoint] = {} # Checkpoints of the getmany jobs in this shell, by job id
+        self.prewarmer: Prewarmer = Prewarmer()
+        self.history: UsageHistory = UsageHistory(HISTORY_PATH)
+        self.prefetch_budget: PrefetchBudget = PrefetchBudget(Configuration.prefetch_requests, Configuration.prefetch_bytes)
+        self.index: Optional[SearchIndex] = None
+        if search_available():
+            # Papers are added to the search index as they are downloaded.
+            download_listeners.append(IndexUpdater(self.search_index).add)
+        # Optimising runs in its own processes, so downloads carry on while it works.
+        self.optimizer: BackgroundOptimizer = BackgroundOptimizer(self.record_optimized)
+        download_listeners.append(self.optimize_downloaded)
+        renderer.queue_depth = lambda: sum(job.state == JOB_QUEUED for job in self.job_queue.jobs.values())
+
+    def preloop(self) -> None:
+        """
+        Open a connection to the website in the background once the prompt is shown, so the first command does not wait for it,
+        then start prefetching the index pages the user usually needs.
+        """
+        self.prewarmer.submit("connection", lambda: mirror_pool.warm(PREWARM_TIMEOUTS))
+        self.prefetch_history()
+        saved = len(saved_checkpoints())
+        if saved:
+            print(f"{YELLOW}{saved} download job{'s' if saved > 1 else ''} stopped before finishing. "
+                  f"Type {RESET}resume saved{YELLOW} to carry on.{RESET}")
+
+    def postcmd(self, stop: bool, line: str) -> bool:
+        """
+        Carry on prefetching the index pages the user usually needs while the shell waits for the next command.
+
+        Args:
+            stop (bool): Whether the command loop should stop.
+            line (str): The command which was run.
+
+        Returns:
+            bool: Whether the command loop should stop.
+        """
+        if not stop:
+            self.prefetch_history()
+        return stop
+
+    def prefetch_history(self) -> None:
+        """
+        Queue the index pages the user is most likely to need next, ranked by the usage history, so that a typical 'get'
+        finds its page already cached. Only a few pages are queued at a time, leaving room for the pages of paper codes
+        being typed, and nothing more is fetched once the session's prefetch budget is spent.
+        """
+        self.prefetch_budget.max_requests = Configuration.prefetch_requests # The budget may have been changed with 'setprefetch'.
+        self.prefetch_budget.max_bytes = Configuration.prefetch_bytes
+        if self.prefetch_budget.exhausted():
+            return
+        queued = 0
+        # Leave at least half of the page cache to the pages the user actually opened.
+        for subject_code, page in self.history.top(min(PREFETCH_PAGES, Configuration.max_page_cache // 2)):
+            session, year = ("y", "") if page == "y" else ("", page)
+            if self.prefetch_year_page(subject_code, session, year, self.prefetch_budget):
+                queued += 1
+                if queued >= PREFETCH_PER_IDLE:
+                    return
+
+    def prefetch_year_page(self, subject_code: str, session: str, year: str, budget: Optional[PrefetchBudget] = None) -> bool:
+        """
+        Fetch the index page for a subject and year in the background while the user is still typing the paper code,
+        so the download can start as soon as the command is entered.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            session (str): The session letter.
+            year (str): The 2 digit year.
+            budget (Optional[PrefetchBudget]): The budget the request is counted against, for pages prefetched from the usage history.
+                The page is not fetched once the budget is spent.
+
+        Returns:
+            bool: True if the page was queued to be fetched.
+        """
+        client = self.paper_client()
+        cache_key = year_page_cache_key(subject_code, session, year)
+        if not client.catalogue.find_subject(subject_code) or cache_key in client.pages:
+            return False
+        settings = client.settings._replace(connect_timeout = PREWARM_TIMEOUTS[0], read_timeout = PREWARM_TIMEOUTS[1])
+        def fetch() -> None:
+            if budget and budget.exhausted():
+                self.prewarmer.forget(cache_key) # Left for when the code is typed.
+                return
+            try:
+                # Years the subject has no papers for raise NoIndexPageError, so nothing is fetched for them.
+                client.year_page(subject_code, session, year, budget.spend if budget else None, settings)
+            except PaperError:
+                if not budget:
+                    self.prewarmer.forget(cache_key) # Try again next time the code is typed.
+                # Pages prefetched from the history are not retried, so a missing page cannot use up the budget.
+        return self.prewarmer.submit(cache_key, fetch)
+
+    def cmdloop(self, intro: Optional[str] = None) -> None:
+        """
+        Run the command loop. Ctrl+C at the prompt only exits the program if no background jobs are running.
+
+        Args:
+            intro (Optional[str]): The intro message to print first.
+        """
+        while True:
+            try:
+                super().cmdloop(intro)
+                return
+            except KeyboardInterrupt:
+                if not self.job_queue.active_jobs():
+                    raise
+                print(f"\n{YELLOW}Background jobs are still running. Use {RESET}cancel (job id){YELLOW} to stop one or {RESET}exit{YELLOW} to quit.{RESET}")
+                intro = "" # Do not print the welcome message again.
     
+    def paper_client(self, session_folders: bool = True) -> PaperClient:
+        """
+        Get the client, brought up to date with any settings changed since it was last used.
+
+        Args:
+            session_folders (bool): Whether papers are put in session folders.
+
+        Returns:
+            PaperClient: The client.
+        """
+        self.client.configure(Configuration.client_settings(session_folders), Configuration.catalogue())
+        return self.client
+
+    def library_manifest(self) -> LibraryManifest:
+        """
+        Get the manifest of the current download folder, reloading it if the download folder has changed.
+
+        Returns:
+            LibraryManifest: The manifest.
+        """
+        return self.paper_client().manifest()
+
+    def optimize_downloaded(self, path: str) -> None:
+        """
+        Queue a downloaded paper to be optimised in the background, if that is turned on.
+
+        Args:
+            path (str): The path of the paper.
+        """
+        if Configuration.optimize_downloads and optimize_available():
+            self.optimizer.add(path)
+
+    def record_optimized(self, result: OptimizeResult) -> None:
+        """
+        Record the new checksum of an optimised paper, so 'verify' does not report it as changed.
+
+        Args:
+            result (OptimizeResult): The result of optimising the paper.
+        """
+        self.client.manifest().record(result.path, result.size, result.sha256) # Not paper_client(), as this runs in a background thread.
+
+    def search_index(self) -> SearchIndex:
+        """
+        Get the search index of the current download folder, reopening it if the download folder has changed.
+
+        Returns:
+            SearchIndex: The search index.
+        """
+        index = self.index
+        if not index or index.library_folder != Configuration.download_folder:
+            index = self.index = SearchIndex(Configuration.download_folder)
+        return index
+
     def do_help(self, arg: str) -> None:
         """
         List available commands with 'help' or detailed help with 'help command'.
@@ -66,7 +308,7 @@ class EasyPaperShell(cmd.Cmd):
         super().do_help(arg)
         if not arg.strip():
             print(f"{YELLOW}Example:{RESET} 'help get'")
-            print(f"For more info, visit https://github.com/nkzzz-xD/EasyPastPapers.")
+            print("For more info, visit https://github.com/nkzzz-xD/EasyPastPapers.")
 
     def do_get(self, arg: str) -> None:
         """Download a specific paper.\n{USAGE}\
@@ -97,7 +339,14 @@ class EasyPaperShell(cmd.Cmd):
         skip_existing =  (expected_flags[2][0] in args) or  (expected_flags[2][1] in args)
         session_folders = not (expected_flags[3][0] in args or expected_flags[3][1] in args) # If the user specifies -ns or --no-session-folders, we will not create session folders
         force_download = force_download if force_download else not skip_existing if skip_existing else None # If force_download is None, it means that the user did not specify any flags
-        download_paper(self, file_name, open_after, force_download, session_folders)
+        # Run in front of the prompt so the overwrite question can be asked; background jobs give way to it.
+        with renderer.shown():
+            job = self.job_queue.run_foreground(f"get {arg.strip()}",
+                                                lambda: download_paper(self, file_name, open_after, force_download, session_folders))
+        if job.state == JOB_CANCELLED:
+            print(f"\n{YELLOW}Download of {file_name} cancelled.{RESET}")
+        elif job.state == JOB_FAILED and job.error:
+            print_error(f"Download of {YELLOW}'{file_name}'{RED} failed", f"\n{job.error}", None, True)
 
     def help_get(self) -> None:
         """Manually print the help text for 'get' with color support."""
@@ -119,6 +368,10 @@ class EasyPaperShell(cmd.Cmd):
         if not text:
             return []
         text = text.lower()
+        # Once the subject and year have been typed, fetch their index page while the rest is typed.
+        year_typed = re.match(f"^{SUBJECT_CODE_REGEX}_{SESSION_REGEX}(?:_|$)", text)
+        if year_typed:
+            self.prefetch_year_page(*year_typed.groups())
         # Otherwise, we will provide suggestions for the file name.
         if re.match(f"^{SUBJECT_CODE_REGEX}$", text):
             return [f"{text}_"]
@@ -142,177 +395,1219 @@ class EasyPaperShell(cmd.Cmd):
         # If the user has entered a file name, we will not provide any suggestions.
         if PAST_PAPER_PATTERN.match(text):
             return []
-        subject_code_suggestions = []
-        for subject_codes in Configuration.subjects.values():
-            for subject_code in subject_codes.keys():
-                if subject_code.startswith(text):
-                    subject_code_suggestions.append(f"{subject_code}")
-        return subject_code_suggestions
+        return [subject_code for subject_code in Configuration.subject_index if subject_code.startswith(text)]
+
+
+    def do_getmany(self, arg: str) -> None:
+        """Download all past papers for a given range.\n{USAGE}\
+        \n{GET_MANY_EXAMPLE} -o -f{RESET}\
+        \nOptional flags:\
+        \n-f / --force flag: download the files without asking for confirmation if they already exist.\
+        \n                   Re-downloads files which already exist in the download folder.\
+        \n-s / --skip-existing flag: skip downloading the files if they already exist in the download folder.\
+        \n-ns / --no-session-folders flag: do not create session folders (e.g. May-June, Feb-March, etc) in the download folder.\
+        \n-t / --types option: only download the given comma separated paper types (e.g. qp,ms).\
+        \n-p / --papers option: only download the given comma separated paper numbers (e.g. 1,3,4x).\
+        \n-a / --archive option: save the papers into a {ARCHIVE_FORMATS} archive instead of the download folder.\
+        \n                       An existing archive is added to, and papers already in it are skipped.\
+        \n-w / --schedule option: only download in the given time windows, at the given rates (see above).\
+        \n                        Outside them the job waits, and a paper being downloaded when a window closes is finished first.\
+        \nThe download runs in the background; see {YELLOW}jobs{RESET}. Files which already exist are skipped unless -f is used.\
+        \nThe job's progress is saved every {CHECKPOINT_SAVE_PAPERS} papers or {CHECKPOINT_SAVE_INTERVAL} seconds, whichever comes first,\
+        \nand when the job stops or the program exits. If it is stopped (e.g. by closing the program), {YELLOW}resume saved{RESET}\
+        \ncarries on from the last save without reading the index pages again; if the program was killed, the papers done\
+        \nsince the last save are looked at again."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        args, types_value = pop_option_value(args, ("-t", "--types"), EasyPaperShell.GET_MANY_USAGE)
+        if args == False:
+            return
+        args, papers_value = pop_option_value(args, ("-p", "--papers"), EasyPaperShell.GET_MANY_USAGE)
+        if args == False:
+            return
+        args, archive_path = pop_option_value(args, ("-a", "--archive"), EasyPaperShell.GET_MANY_USAGE)
+        if args == False:
+            return
+        args, schedule_value = pop_option_value(args, ("-w", "--schedule"), EasyPaperShell.GET_MANY_USAGE)
+        if args == False:
+            return
+        try:
+            schedule = BandwidthSchedule(schedule_value) if schedule_value is not None else None
+        except ValueError as err:
+            print_error(f"Invalid schedule {YELLOW}'{schedule_value}'{RED}", f"\n{err}", EasyPaperShell.GET_MANY_USAGE)
+            return
+        if archive_path is not None:
+            archive_path = os.path.expanduser(archive_path)
+            if not archive_format(archive_path):
+                print_error(f"Unsupported archive {YELLOW}'{archive_path}'{RED}",
+                            f"\nThe archive must end in one of: {YELLOW}{', '.join(ARCHIVE_FORMATS)}{RESET}",
+                            EasyPaperShell.GET_MANY_USAGE)
+                return
+            if not archive_available(archive_path):
+                print_error(f"Cannot write {YELLOW}'{archive_path}'{RED}: zstandard is not installed",
+                            f"\nInstall it with {YELLOW}pip install zstandard{RESET}, or use a .zip or .tar archive.",
+                            None, True)
+                return
+        paper_types_filter = parse_paper_types_filter(types_value)
+        paper_nums_filter = parse_paper_nums_filter(papers_value)
+        if paper_types_filter == False or paper_nums_filter == False:
+            return
+        subject_code = args[0] if args else None
+        paper_range = args[1] if len(args) > 1 else None
+        expected_flags = [ ("-f", "--force"),
+                           ("-s", "--skip-existing"),
+                           ("-ns", "--no-session-folders")]
+        args = [s.lower() for s in args]
+        if not subject_code:
+            print_error("Please specify a subject code and range", "\n" + EasyPaperShell.GET_MANY_USAGE)
+            return
+        if not paper_range:
+            print_error("Please specify both a range and subject code", "\n" + EasyPaperShell.GET_MANY_USAGE)
+            return
+        paper_range = paper_range.lower()
+        if not check_args("getmany", 2, args, expected_flags, [(0,1)], EasyPaperShell.GET_MANY_USAGE):
+            return
+        if not re.match(f"^{SUBJECT_CODE_REGEX}$", subject_code):
+            print_error(f"Invalid subject code {YELLOW}'{subject_code}'{RED} as parameter to getrange",
+                        "\nSubject code must be a 4 digit number.", 
+                        EasyPaperShell.GET_MANY_USAGE)
+            return
+        
+        sessions_to_download = parse_sessions_range(paper_range, EasyPaperShell.GET_MANY_USAGE + "\n" + EasyPaperShell.GET_MANY_EXAMPLE)
+        if not sessions_to_download:
+            return
+        subject_exam, subject_link = Configuration.find_subject(subject_code) or (None, None)
+        if not subject_link:
+            print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}")
+            return
+        self.history.record({year_page_cache_key(subject_code, session_range[0], session_range[1:]) for session_range in sessions_to_download})
+        
+        force_download = (expected_flags[0][0] in args) or (expected_flags[0][1] in args)
+        skip_existing = (expected_flags[1][0] in args) or (expected_flags[1][1] in args)
+        session_folders = not (expected_flags[2][0] in args or expected_flags[2][1] in args) # If the user specifies -ns or --no-session-folders, we will not create session folders
+        force_download = force_download if force_download else not skip_existing if skip_existing else None # If force_download is None, it means that the user did not specify any flags
+        
+        if force_download is None:
+            force_download = False # Background jobs cannot ask whether to overwrite, so existing files are skipped.
+        checkpoint = JobCheckpoint.create({
+            "description": f"getmany {arg.strip()}",
+            "subject_code": subject_code,
+            "sessions": sessions_to_download,
+            "types": sorted(paper_types_filter) if paper_types_filter else None,
+            "papers": sorted(paper_nums_filter) if paper_nums_filter else None,
+            "force": force_download,
+            "session_folders": session_folders,
+            "archive": archive_path,
+            "schedule": schedule.spec if schedule else None
+        })
+        job = self.submit_getmany(checkpoint, subject_exam, subject_link, schedule)
+        print(f"Started job {YELLOW}{job.id}{RESET}: {job.description}. Type {YELLOW}jobs -w{RESET} to watch its progress.")
+        if schedule and job.rate() == 0:
+            print(f"{YELLOW}The job will start at {schedule.next_change(datetime.datetime.now()):%H:%M}, when its first time window opens.{RESET}")
+
+    def submit_getmany(
+        self,
+        checkpoint: JobCheckpoint,
+        subject_exam: str,
+        subject_link: str,
+        schedule: Optional[BandwidthSchedule]
+    ) -> Job:
+        """
+        Start the job for a 'getmany', new or carried on from its checkpoint.
+
+        Args:
+            checkpoint (JobCheckpoint): The checkpoint of the job, claimed by this shell.
+            subject_exam (str): The exam the subject belongs to.
+            subject_link (str): The link to the subject page.
+            schedule (Optional[BandwidthSchedule]): When the job may download, and how fast.
+
+        Returns:
+            Job: The queued job.
+        """
+        settings = checkpoint.settings
+        types = set(settings["types"]) if settings.get("types") else None
+        nums = set(settings["papers"]) if settings.get("papers") else None
+        saved_paths = None if settings.get("archive") else []
+        job = self.job_queue.submit(settings["description"],
+                                    lambda: self.download_sessions(settings["subject_code"], subject_exam, subject_link, settings["sessions"],
+                                                                   types, nums, settings["force"], settings["session_folders"],
+                                                                   settings.get("archive"), checkpoint, saved_paths),
+                                    PRIORITY_NORMAL, schedule)
+        self.checkpoints[job.id] = checkpoint
+        if saved_paths is not None:
+            self.last_getmany = (settings["subject_code"], saved_paths)
+        return job
+
+    def download_sessions(
+        self,
+        subject_code: str,
+        subject_exam: str,
+        subject_link: str,
+        sessions_to_download: List[str],
+        paper_types_filter: Optional[set],
+        paper_nums_filter: Optional[set],
+        force_download: Optional[bool],
+        session_folders: bool,
+        archive_path: Optional[str] = None,
+        checkpoint: Optional[JobCheckpoint] = None,
+        saved_paths: Optional[List[str]] = None
+    ) -> None:
+        """
+        Download all past papers for a subject in the given sessions. Run as a job by 'getmany'.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            subject_exam (str): The exam the subject belongs to.
+            subject_link (str): The link to the subject page.
+            sessions_to_download (List[str]): The session codes to download (e.g. ['s19', 'w19']).
+            paper_types_filter (Optional[set]): Allowed paper types, or None to allow all.
+            paper_nums_filter (Optional[set]): Allowed paper numbers, or None to allow all.
+            force_download (Optional[bool]): Whether to overwrite files already downloaded.
+            session_folders (bool): Whether to use session folders.
+            archive_path (Optional[str]): The archive to save the papers into instead of the download folder, if any.
+            checkpoint (Optional[JobCheckpoint]): Where the job's progress is saved, so it can carry on after stopping.
+                It is deleted when the job finishes.
+            saved_paths (Optional[List[str]]): Filled in with the paths of the papers in the download folder, for 'merge last'.
+
+        Returns:
+            None
+        """
+        archive = None
+        if archive_path:
+            try:
+                archive = ArchiveWriter(archive_path, Configuration.download_folder)
+            except (ArchiveError, OSError) as err:
+                print_error(f"Could not open archive {YELLOW}'{archive_path}'{RED}", f"\n{err}", None, True)
+                return
+        try:
+            self.download_session_range(subject_code, subject_exam, subject_link, sessions_to_download,
+                                        paper_types_filter, paper_nums_filter, force_download, session_folders, archive, checkpoint,
+                                        saved_paths)
+            if checkpoint:
+                checkpoint.remove()
+        except JobDeferred:
+            if checkpoint:
+                checkpoint.flush()
+            raise # Carried on from the checkpoint when the job's time window opens.
+        except BaseException:
+            if checkpoint:
+                checkpoint.release() # Kept for 'resume saved', in this shell or another.
+            raise
+        finally:
+            if archive:
+                archive.close() # Also when the job is cancelled, so the papers saved so far can be read.
+
+    def download_session_range(
+        self,
+        subject_code: str,
+        subject_exam: str,
+        subject_link: str,
+        sessions_to_download: List[str],
+        paper_types_filter: Optional[set],
+        paper_nums_filter: Optional[set],
+        force_download: Optional[bool],
+        session_folders: bool,
+        archive: Optional[ArchiveWriter],
+        checkpoint: Optional[JobCheckpoint] = None,
+        saved_paths: Optional[List[str]] = None
+    ) -> None:
+        """
+        Download the papers for download_sessions(), into the download folder or an open archive.
+
+        Args:
+            subject_code, subject_exam, subject_link, sessions_to_download, paper_types_filter, paper_nums_filter,
+            force_download, session_folders, checkpoint, saved_paths: As for download_sessions().
+            archive (Optional[ArchiveWriter]): The archive to save the papers into, or None to save them to the download folder.
+
+        Returns:
+            None
+        """
+        total_downloaded = 0
+        total_skipped = 0
+        failed_sessions = []
+        if saved_paths is not None:
+            saved_paths.clear() # Run again from the start after waiting for a time window, finding the same papers.
+        for session_range in sessions_to_download:
+            wait_for_current_window()
+            session = session_range[0]
+            year = session_range[1:]
+            download_folder = f"{Configuration.download_folder}/{session_folder_path(subject_link, session, year, session_folders)}"
+            papers = checkpoint.papers(session_range) if checkpoint else None
+            if papers is None:
+                print(f"\rPreparing for download of all past papers for {YELLOW}'{subject_code}'{RESET} in range {YELLOW}'{session_range}'{RESET}...")
+                try:
+                    papers = self.session_papers(subject_code, session, year, paper_types_filter, paper_nums_filter, session_folders)
+                except PaperError as err:
+                    # The other sessions are still downloaded; this one is left unresolved in the checkpoint for 'resume saved'.
+                    print_error(str(err), f"\n{YELLOW}Make sure you are connected to the internet.{RESET}", None, True)
+                    failed_sessions.append(session_range)
+                    continue
+                if checkpoint:
+                    checkpoint.resolved(session_range, papers)
+
+            successful_downloads = 0
+            skipped = 0
+            for paper in papers:
+                wait_for_current_window()
+                if checkpoint and checkpoint.is_done(paper.url):
+                    # Done before the job last stopped, so not checked again.
+                    if saved_paths is not None:
+                        saved_paths.append(download_folder + "/" + paper.file_name)
+                    skipped += 1
+                    total_skipped += 1
+                    continue
+                content_response = download_with_progress(paper.url,
+                                                Configuration.base_url,
+                                                download_folder,
+                                                paper.file_name,
+                                                force_download,
+                                                (Configuration.connect_timeout, Configuration.read_timeout),
+                                                fsync_policy = Configuration.fsync_policy,
+                                                preallocate = Configuration.preallocate_downloads,
+                                                manifest = self.library_manifest(),
+                                                archive = archive
+                                                )
+                if content_response != FAILED_TO_DOWNLOAD:
+                    if checkpoint:
+                        checkpoint.mark_done(paper.url)
+                    if saved_paths is not None:
+                        saved_paths.append(download_folder + "/" + paper.file_name)
+                if content_response == FILE_DOWNLOADED:
+                    successful_downloads += 1
+                    total_downloaded += 1
+                elif content_response == FILE_EXISTS:
+                    skipped += 1
+                    total_skipped += 1
+            if successful_downloads > 0:
+                print(f"✅{GREEN} Successfully downloaded {successful_downloads} past paper{'s' if successful_downloads > 1 else ''} for {YELLOW}'{subject_link}'{GREEN} in session {YELLOW}'{session_range}'{GREEN} to {YELLOW}'{os.path.abspath(archive.path if archive else download_folder)}'{RESET}")
+            elif skipped == 0:
+                clear_previous_lines()
+                print_error(f"Could not find any past papers for {YELLOW}'{subject_link}'{RED} in session {YELLOW}'{session_range}'{RESET}",
+                            f"\nMay not be available on {YELLOW}{Configuration.base_url}{RESET} or the session code does not exist.\
+                            \nMake sure you have entered the correct subject code and session code.",
+                            EasyPaperShell.GET_MANY_USAGE, True)
+        if total_downloaded == 0 and total_skipped == 0 and not failed_sessions:
+            print_error(f"No past papers could be downloaded for {YELLOW}'{subject_link}'{RED} in the given session/range", None, None, True)
+        if failed_sessions:
+            # Fails the job with the reason, after every other session has been downloaded.
+            raise FetchError(f"Could not read the index page{'s' if len(failed_sessions) > 1 else ''} for {', '.join(failed_sessions)}.")
+        
+    def session_papers(
+        self,
+        subject_code: str,
+        session: str,
+        year: str,
+        paper_types_filter: Optional[set],
+        paper_nums_filter: Optional[set],
+        session_folders: bool
+    ) -> List[AvailablePaper]:
+        """
+        Find the papers for a subject in a session on its index page, fetching the page if it is not cached.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            session (str): The session letter.
+            year (str): The 2 digit year.
+            paper_types_filter (Optional[set]): Allowed paper types, or None to allow all.
+            paper_nums_filter (Optional[set]): Allowed paper numbers, or None to allow all.
+            session_folders (bool): Whether to use session folders.
+
+        Returns:
+            List[AvailablePaper]: The papers.
+
+        Raises:
+            PaperError: If the index page could not be fetched.
+        """
+        return list(self.paper_client(session_folders).iter_available(subject_code, [session + year], paper_types_filter, paper_nums_filter))
+
+    def help_getmany(self) -> None:
+        """Manually print the help text for 'getmany' with color support."""
+        print(self.do_getmany.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE=EasyPaperShell.GET_MANY_USAGE, GET_MANY_EXAMPLE = EasyPaperShell.GET_MANY_EXAMPLE,
+                                            ARCHIVE_FORMATS = "/".join(ARCHIVE_FORMATS), CHECKPOINT_SAVE_PAPERS = CHECKPOINT_SAVE_PAPERS,
+                                            CHECKPOINT_SAVE_INTERVAL = f"{CHECKPOINT_SAVE_INTERVAL:g}"))
+
+    def do_merge(self, arg: str) -> None:
+        """Merge downloaded papers into one PDF per session.\n{USAGE}\
+        \n{MERGE_EXAMPLE}\
+        \nMerged PDFs are saved in a '{MERGED_FOLDER_NAME}' folder in the subject's download folder.\
+        \nOnly papers which have already been downloaded are merged.\
+        \nOptional flags:\
+        \n-i / --interleave flag: order papers by paper number (e.g. qp_12, ms_12, qp_13, ms_13) instead of by paper type.\
+        \n-t / --types option: only merge the given comma separated paper types (e.g. qp,ms).\
+        \n-p / --papers option: only merge the given comma separated paper numbers (e.g. 1,3,4x)."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        args, types_value = pop_option_value(args, ("-t", "--types"), EasyPaperShell.MERGE_USAGE)
+        if args == False:
+            return
+        args, papers_value = pop_option_value(args, ("-p", "--papers"), EasyPaperShell.MERGE_USAGE)
+        if args == False:
+            return
+        paper_types_filter = parse_paper_types_filter(types_value)
+        paper_nums_filter = parse_paper_nums_filter(papers_value)
+        if paper_types_filter == False or paper_nums_filter == False:
+            return
+        expected_flags = [("-i", "--interleave")]
+        args = [s.lower() for s in args]
+        interleave = (expected_flags[0][0] in args) or (expected_flags[0][1] in args)
+        if not merge_available():
+            print_error("Merging PDFs requires the pikepdf package", f"\nInstall it with {YELLOW}pip install pikepdf{RESET}.", None, True)
+            return
+        if args and args[0] == "last":
+            if not check_args("merge", 1, args, expected_flags, usage_string=EasyPaperShell.MERGE_USAGE):
+                return
+            if not self.last_getmany or not self.last_getmany[1]:
+                print_error("No papers from a previous getmany to merge", None, EasyPaperShell.MERGE_USAGE)
+                return
+            subject_code, paths = self.last_getmany[0], list(self.last_getmany[1]) # The job may still be adding to it.
+        else:
+            if not check_args("merge", 2, args, expected_flags, usage_string=EasyPaperShell.MERGE_USAGE):
+                return
+            subject_code, paper_range = args[0], args[1]
+            sessions = parse_sessions_range(paper_range, EasyPaperShell.MERGE_USAGE + "\n" + EasyPaperShell.MERGE_EXAMPLE)
+            if not sessions:
+                return
+            if not find_subject_exam(subject_code):
+                print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}")
+                return
+            matchers = [PaperCodeMatcher(subject_code, session[0], session[1:], paper_types_filter, paper_nums_filter) for session in sessions]
+            paths = [path for path in find_library_files(subject_download_folder(subject_code))
+                     if any(matcher.match(path) for matcher in matchers)]
+        groups = group_papers(paths, f"{subject_download_folder(subject_code)}/{MERGED_FOLDER_NAME}", interleave)
+        if not groups:
+            print_error(f"No downloaded papers found to merge for {YELLOW}'{subject_code}'{RESET}",
+                        f"\nDownload them first with {YELLOW}getmany{RESET}.", None, True)
+            return
+        print(f"\rMerging {sum(len(paths) for paths in groups.values())} papers into {len(groups)} PDF{'s' if len(groups) > 1 else ''}...")
+        for result in merge_groups(groups):
+            if result.error:
+                print_error(f"Could not merge {YELLOW}'{result.output_path}'{RED}", f"\n{result.error}", None, True)
+            else:
+                print(f"✅{GREEN} Merged {result.documents} papers ({result.pages} pages) into: {os.path.abspath(result.output_path)}{RESET}")
+
+    def help_merge(self) -> None:
+        """Manually print the help text for 'merge' with color support."""
+        print(self.do_merge.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.MERGE_USAGE, MERGE_EXAMPLE = EasyPaperShell.MERGE_EXAMPLE, MERGED_FOLDER_NAME = MERGED_FOLDER_NAME))
+
+    def do_serve(self, arg: str) -> None:
+        """Share the download folder with other machines on the network.\n{USAGE}\
+        \nPapers already downloaded are sent from the download folder.\
+        \nOther papers and pages are fetched from {BASE_URL} once, sent to every machine asking for them and kept for next time.\
+        \nDefault port is {SERVE_PORT}. Press Ctrl+C to stop serving."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        args, host = pop_option_value(args, ("--host", "--host"), EasyPaperShell.SERVE_USAGE)
+        if args == False:
+            return
+        # The port is optional, so at most one argument is expected.
+        if not check_args("serve", min(sum(not a.startswith("-") for a in args), 1), args, usage_string=EasyPaperShell.SERVE_USAGE):
+            return
+        if args and not args[0].isdigit():
+            print_error("Please specify a valid port number", None, EasyPaperShell.SERVE_USAGE)
+            return
+        port = int(args[0]) if args else SERVE_PORT
+        try:
+            server = PaperServer((host or SERVE_HOST, port),
+                                 Configuration.base_url,
+                                 Configuration.download_folder,
+                                 CACHE_FOLDER,
+                                 (Configuration.connect_timeout, Configuration.read_timeout))
+        except OSError as e:
+            print_error(f"Could not listen on port {YELLOW}{port}{RED}", f"\n{e}", None, True)
+            return
+        print(f"🌐 Serving {YELLOW}'{os.path.abspath(Configuration.download_folder)}'{RESET} on port {YELLOW}{port}{RESET}. Press Ctrl+C to stop.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("")
+        finally:
+            server.server_close()
+        print(f"{YELLOW}Stopped serving.{RESET}")
+
+    def help_serve(self) -> None:
+        """Manually print the help text for 'serve' with color support."""
+        print(self.do_serve.__doc__.format(USAGE = EasyPaperShell.SERVE_USAGE, BASE_URL = Configuration.base_url, SERVE_PORT = SERVE_PORT))
+
+    def do_jobs(self, arg: str) -> None:
+        """List download jobs and their state.\n{USAGE}\
+        \nOptional flags:\
+        \n-w / --watch flag: show the progress of every download until the jobs finish or Ctrl+C is pressed."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        expected_flags = [("-w", "--watch")]
+        args = [s.lower() for s in args]
+        if not check_args("jobs", 0, args, expected_flags, usage_string=EasyPaperShell.JOBS_USAGE):
+            return
+        if args and any(job.state != JOB_WAITING for job in self.job_queue.active_jobs()):
+            print(f"Showing downloads. Press {YELLOW}Ctrl+C{RESET} to return to the prompt.")
+            try:
+                with renderer.shown():
+                    while any(job.state != JOB_WAITING for job in self.job_queue.active_jobs()):
+                        time.sleep(0.2)
+            except KeyboardInterrupt:
+                print("")
+        jobs = list(self.job_queue.jobs.values())
+        if not jobs:
+            print("No jobs.")
+            return
+        priority_names = {value: key for key, value in PRIORITY_NAMES.items()}
+        for job in jobs:
+            state_colour = GREEN if job.state == JOB_DONE else RED if job.state in (JOB_FAILED, JOB_CANCELLED) else YELLOW
+            priority = priority_names.get(job.priority, "interactive")
+            error = f" ({job.error})" if job.error else ""
+            schedule = f" [{job.schedule.describe(datetime.datetime.now())}]" if job.schedule and not job.finished else ""
+            print(f"[{job.id}] {state_colour}{job.state:<9}{RESET} {priority:<11} {job.description}{schedule}{error}")
+
+    def help_jobs(self) -> None:
+        """Manually print the help text for 'jobs' with color support."""
+        print(self.do_jobs.__doc__.format(USAGE = EasyPaperShell.JOBS_USAGE))
+
+    def find_job(self, command: str, arg: str, usage: str) -> Optional[Job]:
+        """
+        Find the job given as the argument to a job command, printing an error if there is none.
+
+        Args:
+            command (str): The name of the command.
+            arg (str): The arguments passed to the command.
+            usage (str): Usage string for error messages.
+
+        Returns:
+            Optional[Job]: The job, or None if the argument is not a known job id.
+        """
+        args = safe_shlex_split(arg)
+        if args == False:
+            return None
+        if not args or not args[0].isdigit():
+            print_error("Please specify a job id", None, usage)
+            return None
+        job = self.job_queue.get(int(args[0]))
+        if not job:
+            print_error(f"Unknown job {YELLOW}'{args[0]}'{RED}", f"\nType {YELLOW}jobs{RESET} to see all jobs.", None, True)
+            return None
+        if job.finished:
+            print_error(f"Job {YELLOW}{job.id}{RED} has already finished", None, None, True)
+            return None
+        return job
+
+    def do_pause(self, arg: str) -> None:
+        """Pause a download job.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False or not check_args("pause", 1, args, usage_string=EasyPaperShell.JOB_ID_USAGE.format(command="pause")):
+            return
+        job = self.find_job("pause", arg, EasyPaperShell.JOB_ID_USAGE.format(command="pause"))
+        if job:
+            self.job_queue.pause(job)
+            print(f"Job {YELLOW}{job.id}{RESET} paused.")
+
+    def help_pause(self) -> None:
+        """Manually print the help text for 'pause' with color support."""
+        print(self.do_pause.__doc__.format(USAGE = EasyPaperShell.JOB_ID_USAGE.format(command="pause")))
+
+    def do_resume(self, arg: str) -> None:
+        """Resume a paused download job.\n{USAGE}\
+        \n{YELLOW}resume saved{RESET} carries on the getmany jobs which stopped before finishing, e.g. when the program was closed,\
+        \nfrom the paper they had got to."""
+        args = safe_shlex_split(arg)
+        if args == False or not check_args("resume", 1, args, usage_string=EasyPaperShell.RESUME_USAGE):
+            return
+        if args[0].lower() == "saved":
+            self.resume_saved_jobs()
+            return
+        job = self.find_job("resume", arg, EasyPaperShell.RESUME_USAGE)
+        if job:
+            self.job_queue.resume(job)
+            print(f"Job {YELLOW}{job.id}{RESET} resumed.")
+
+    def help_resume(self) -> None:
+        """Manually print the help text for 'resume' with color support."""
+        print(self.do_resume.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.RESUME_USAGE))
+
+    def resume_saved_jobs(self) -> None:
+        """
+        Start a job for every saved getmany checkpoint which no job, in this shell or another, is running.
+        """
+        running = {checkpoint.path for job_id, checkpoint in self.checkpoints.items() if not self.job_queue.get(job_id).finished}
+        resumed = 0
+        for checkpoint in saved_checkpoints():
+            if checkpoint.path in running or not checkpoint.claim():
+                continue
+            settings = checkpoint.settings
+            try:
+                subject_exam, subject_link = Configuration.find_subject(settings["subject_code"]) or (None, None)
+                schedule = BandwidthSchedule(settings["schedule"]) if settings.get("schedule") else None
+            except (KeyError, ValueError):
+                subject_link = None
+            if not subject_link:
+                checkpoint.release()
+                print_error(f"Could not carry on {YELLOW}'{settings.get('description', checkpoint.id)}'{RED}",
+                            "\nThe saved job is not valid or its subject is no longer in the catalogue.", None, True)
+                continue
+            job = self.submit_getmany(checkpoint, subject_exam, subject_link, schedule)
+            resumed += 1
+            print(f"Started job {YELLOW}{job.id}{RESET}: {job.description} ({checkpoint.done_count} papers already done).")
+        if not resumed:
+            print("No saved jobs to carry on.")
+
+    def do_cancel(self, arg: str) -> None:
+        """Cancel a download job. Only the partial files of that job are deleted.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False or not check_args("cancel", 1, args, usage_string=EasyPaperShell.JOB_ID_USAGE.format(command="cancel")):
+            return
+        job = self.find_job("cancel", arg, EasyPaperShell.JOB_ID_USAGE.format(command="cancel"))
+        if job:
+            self.job_queue.cancel(job)
+            if job.id in self.checkpoints:
+                self.checkpoints.pop(job.id).remove() # A cancelled job is not carried on by 'resume saved'.
+            print(f"Job {YELLOW}{job.id}{RESET} cancelled.")
+
+    def help_cancel(self) -> None:
+        """Manually print the help text for 'cancel' with color support."""
+        print(self.do_cancel.__doc__.format(USAGE = EasyPaperShell.JOB_ID_USAGE.format(command="cancel")))
+
+    def do_priority(self, arg: str) -> None:
+        """Change the priority of a download job. Higher priority jobs are started first.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False or not check_args("priority", 2, args, usage_string=EasyPaperShell.PRIORITY_USAGE):
+            return
+        if args[1].lower() not in PRIORITY_NAMES:
+            print_error(f"Invalid priority {YELLOW}'{args[1]}'{RED}", None, EasyPaperShell.PRIORITY_USAGE)
+            return
+        job = self.find_job("priority", arg, EasyPaperShell.PRIORITY_USAGE)
+        if job:
+            self.job_queue.set_priority(job, PRIORITY_NAMES[args[1].lower()])
+            print(f"Job {YELLOW}{job.id}{RESET} priority set to {YELLOW}{args[1].lower()}{RESET}.")
+
+    def help_priority(self) -> None:
+        """Manually print the help text for 'priority' with color support."""
+        print(self.do_priority.__doc__.format(USAGE = EasyPaperShell.PRIORITY_USAGE))
+
+    def do_sync(self, arg: str) -> None:
+        """Download only the papers published since the last sync.\n{USAGE}\
+        \nWith no subject codes, syncs every subject synced before or with a folder in the download folder.\
+        \nOnly the subject page and its recent year folders are checked, and pages which have not changed are not downloaded again.\
+        \nThe first sync of a subject records its papers and downloads only those missing from recent years.\
+        \nOptional flags:\
+        \n-a / --all flag: also check year folders older than {SYNC_RECENT_YEARS} years.\
+        \n-ns / --no-session-folders flag: do not create session folders (e.g. May-June, Feb-March, etc) in the download folder.\
+        \nThe sync runs in the background; see {YELLOW}jobs{RESET}."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        expected_flags = [("-a", "--all"), ("-ns", "--no-session-folders")]
+        args = [s.lower() for s in args]
+        subject_codes = [a for a in args if not a.startswith("-")]
+        if not check_args("sync", len(subject_codes), args, expected_flags, usage_string=EasyPaperShell.SYNC_USAGE):
+            return
+        for subject_code in subject_codes:
+            if not Configuration.find_subject(subject_code):
+                print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}", None, EasyPaperShell.SYNC_USAGE)
+                return
+        if not subject_codes:
+            synced = set(synced_subjects())
+            subject_codes = [subject_code for subject_code in Configuration.subject_index
+                             if subject_code in synced or os.path.isdir(subject_download_folder(subject_code))]
+        if not subject_codes:
+            print_error("No subjects to sync", f"\nDownload some papers or give the subject codes to sync, e.g. {YELLOW}sync 0580{RESET}", None, True)
+            return
+        check_all = (expected_flags[0][0] in args) or (expected_flags[0][1] in args)
+        session_folders = not (expected_flags[1][0] in args or expected_flags[1][1] in args)
+        job = self.job_queue.submit(f"sync {' '.join(subject_codes)}",
+                                    lambda: self.sync_subjects(subject_codes, session_folders, check_all),
+                                    PRIORITY_NORMAL)
+        print(f"Started job {YELLOW}{job.id}{RESET}: syncing {len(subject_codes)} subject{'s' if len(subject_codes) > 1 else ''}. Type {YELLOW}jobs -w{RESET} to watch its progress.")
+
+    def help_sync(self) -> None:
+        """Manually print the help text for 'sync' with color support."""
+        print(self.do_sync.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.SYNC_USAGE, SYNC_RECENT_YEARS = SYNC_RECENT_YEARS))
+
+    def sync_subjects(self, subject_codes: List[str], session_folders: bool, check_all: bool) -> None:
+        """
+        Check subjects for new papers and download them. Run as a job by 'sync'.
+
+        Args:
+            subject_codes (List[str]): The 4 digit subject codes.
+            session_folders (bool): Whether to use session folders.
+            check_all (bool): Whether to also check year folders which are not recent.
+
+        Returns:
+            None
+        """
+        subjects = []
+        for subject_code in subject_codes:
+            subject_exam, subject_link = Configuration.find_subject(subject_code)
+            subject_url = Configuration.base_url + "/" + Configuration.exam_page_links[subject_exam] + "/" + subject_link
+            subjects.append((subject_code, subject_url, subject_download_folder(subject_code)))
+        total_checked = 0
+        total_downloaded = 0
+        for plan in plan_syncs(subjects, session_folders, (Configuration.connect_timeout, Configuration.read_timeout), check_all, host_limits):
+            check_current_job()
+            total_checked += plan.checked
+            if plan.error:
+                print_error(f"Could not check {YELLOW}'{plan.subject_code}'{RED} for new papers", f"\n{plan.error}", None, True)
+                continue
+            failed: List[Addition] = []
+            for addition in plan.additions:
+                check_current_job()
+                result = download_with_progress(addition.url,
+                                                Configuration.base_url,
+                                                addition.download_folder,
+                                                addition.file_name,
+                                                False,
+                                                (Configuration.connect_timeout, Configuration.read_timeout),
+                                                fsync_policy = Configuration.fsync_policy,
+                                                preallocate = Configuration.preallocate_downloads,
+                                                manifest = self.library_manifest()
+                                                )
+                if result == FILE_DOWNLOADED:
+                    total_downloaded += 1
+                elif result == FAILED_TO_DOWNLOAD:
+                    failed.append(addition)
+            try:
+                save_snapshot(plan.subject_code, forget_links(plan.pages, failed))
+            except OSError as err:
+                print_error(f"Could not save the sync snapshot for {YELLOW}'{plan.subject_code}'{RED}", f"\n{err}", None, True)
+        print(f"✅{GREEN} Sync finished: {total_downloaded} new paper{'s' if total_downloaded != 1 else ''} downloaded, {total_checked} page{'s' if total_checked != 1 else ''} checked.{RESET}")
+
+    def do_enqueue(self, arg: str) -> None:
+        """Add papers to a work queue, to be downloaded by workers on any number of machines.\n{USAGE}\
+        \n{YELLOW}enqueue /mnt/shared/papers.sqlite all 20-24{RESET}\
+        \nPapers already in the queue are not added again, so run it again to add newly published papers.\
+        \nStart workers with {YELLOW}work (queue){RESET}, and see their progress with {YELLOW}workqueue (queue){RESET}.\
+        \nOptional flags:\
+        \n-ns / --no-session-folders flag: do not create session folders (e.g. May-June, Feb-March, etc) in the download folder.\
+        \n-t / --types option: only add the given comma separated paper types (e.g. qp,ms).\
+        \n-p / --papers option: only add the given comma separated paper numbers (e.g. 1,3,4x).\
+        \nThe papers are found in the background; see {YELLOW}jobs{RESET}."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        args, types_value = pop_option_value(args, ("-t", "--types"), EasyPaperShell.ENQUEUE_USAGE)
+        if args == False:
+            return
+        args, papers_value = pop_option_value(args, ("-p", "--papers"), EasyPaperShell.ENQUEUE_USAGE)
+        if args == False:
+            return
+        paper_types_filter = parse_paper_types_filter(types_value)
+        paper_nums_filter = parse_paper_nums_filter(papers_value)
+        if paper_types_filter == False or paper_nums_filter == False:
+            return
+        expected_flags = [("-ns", "--no-session-folders")]
+        if not check_args("enqueue", 3, args, expected_flags, usage_string=EasyPaperShell.ENQUEUE_USAGE):
+            return
+        queue_spec, subjects_value, paper_range = [a for a in args if not a.startswith("-")]
+        session_folders = not any(a.lower() in expected_flags[0] for a in args)
+        if subjects_value.lower() == "all":
+            subject_codes = list(Configuration.subject_index)
+        else:
+            subject_codes = [code.strip() for code in subjects_value.split(",") if code.strip()]
+            for subject_code in subject_codes:
+                if not Configuration.find_subject(subject_code):
+                    print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}", None, EasyPaperShell.ENQUEUE_USAGE)
+                    return
+        sessions_to_enqueue = parse_sessions_range(paper_range.lower(), EasyPaperShell.ENQUEUE_USAGE)
+        if not sessions_to_enqueue:
+            return
+        try:
+            queue = open_work_queue(queue_spec)
+        except WorkQueueError as err:
+            print_error(str(err), None, EasyPaperShell.ENQUEUE_USAGE)
+            return
+        job = self.job_queue.submit(f"enqueue {arg.strip()}",
+                                    lambda: self.enqueue_papers(queue, subject_codes, sessions_to_enqueue,
+                                                                paper_types_filter, paper_nums_filter, session_folders),
+                                    PRIORITY_NORMAL)
+        print(f"Started job {YELLOW}{job.id}{RESET}: finding papers for {len(subject_codes)} subject{'s' if len(subject_codes) > 1 else ''}. Type {YELLOW}jobs{RESET} to see its progress.")
+
+    def help_enqueue(self) -> None:
+        """Manually print the help text for 'enqueue' with color support."""
+        print(self.do_enqueue.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.ENQUEUE_USAGE))
+
+    def enqueue_papers(
+        self,
+        queue: WorkQueue,
+        subject_codes: List[str],
+        sessions_to_enqueue: List[str],
+        paper_types_filter: Optional[set],
+        paper_nums_filter: Optional[set],
+        session_folders: bool
+    ) -> None:
+        """
+        Find the papers for subjects in the given sessions and add them to a work queue. Run as a job by 'enqueue'.
+
+        Args:
+            queue (WorkQueue): The queue to add the papers to.
+            subject_codes (List[str]): The 4 digit subject codes.
+            sessions_to_enqueue (List[str]): The session codes (e.g. ['s19', 'w19']).
+            paper_types_filter (Optional[set]): Allowed paper types, or None to allow all.
+            paper_nums_filter (Optional[set]): Allowed paper numbers, or None to allow all.
+            session_folders (bool): Whether the workers should use session folders.
+
+        Returns:
+            None
+        """
+        total_found = 0
+        total_added = 0
+        for subject_code in subject_codes:
+            subject_exam, subject_link = Configuration.find_subject(subject_code)
+            items = []
+            for session_range in sessions_to_enqueue:
+                check_current_job()
+                session = session_range[0]
+                year = session_range[1:]
+                try:
+                    papers = self.session_papers(subject_code, session, year, paper_types_filter, paper_nums_filter, session_folders)
+                except PaperError:
+                    continue # Sessions missing from the website are skipped rather than stopping the whole job.
+                folder = session_folder_path(subject_link, session, year, session_folders)
+                # Workers may use another base URL or mirror, so the URL is stored relative to whichever mirror it is on.
+                items.extend(WorkItem(f"{folder}/{paper.file_name}", mirror_pool.split(paper.url).lstrip("/")) for paper in papers)
+            try:
+                added = queue.add(items)
+            except WorkQueueError as err:
+                print_error(f"Could not add the papers for {YELLOW}'{subject_code}'{RED} to the work queue", f"\n{err}", None, True)
+                return
+            total_found += len(items)
+            total_added += added
+        print(f"✅{GREEN} Found {total_found} paper{'s' if total_found != 1 else ''}, {total_added} of them new to the work queue.{RESET}")
+
+    def do_work(self, arg: str) -> None:
+        """Download papers from a work queue until it is empty, alongside workers on other machines.\n{USAGE}\
+        \nPapers are saved to this machine's download folder, which may be a shared drive.\
+        \nEach paper is leased to one worker at a time. If a worker stops responding for {LEASE} seconds, its papers are\
+        \nretried by another worker, but only once; after that they are marked as failed.\
+        \nThe worker runs in the background; see {YELLOW}jobs{RESET}. Cancelling it hands its papers back to the queue."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if not check_args("work", 1, args, usage_string=EasyPaperShell.WORK_USAGE):
+            return
+        try:
+            queue = open_work_queue(args[0])
+        except WorkQueueError as err:
+            print_error(str(err), None, EasyPaperShell.WORK_USAGE)
+            return
+        worker = Worker(queue, self.download_work_item)
+        job = self.job_queue.submit(f"work {args[0]}", lambda: self.run_worker(worker), PRIORITY_NORMAL)
+        print(f"Started job {YELLOW}{job.id}{RESET}: worker {YELLOW}{worker.name}{RESET}. Type {YELLOW}jobs -w{RESET} to watch its progress.")
+
+    def help_work(self) -> None:
+        """Manually print the help text for 'work' with color support."""
+        print(self.do_work.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.WORK_USAGE, LEASE = WORK_LEASE_SECONDS))
+
+    def run_worker(self, worker: Worker) -> None:
+        """
+        Download papers from a work queue until it is empty. Run as a job by 'work'.
+
+        Args:
+            worker (Worker): The worker.
+
+        Returns:
+            None
+        """
+        try:
+            stats = worker.run(check_current_job)
+        except WorkQueueError as err:
+            print_error("Lost the connection to the work queue", f"\n{err}", None, True)
+            return
+        print(f"✅{GREEN} Worker finished: {stats.done} paper{'s' if stats.done != 1 else ''} downloaded, {stats.failed} failed, "
+              f"{stats.lost} taken over by other workers.{RESET}")
+
+    def download_work_item(self, item: WorkItem) -> Optional[str]:
+        """
+        Download a paper from a work queue into the download folder. Papers already downloaded are not downloaded again.
+
+        Args:
+            item (WorkItem): The paper.
+
+        Returns:
+            Optional[str]: None if the paper was downloaded (or already had been), otherwise why it failed.
+        """
+        folder, _, file_name = item.path.rpartition("/")
+        result = download_with_progress(Configuration.base_url + "/" + item.url,
+                                        Configuration.base_url,
+                                        f"{Configuration.download_folder}/{folder}",
+                                        file_name,
+                                        False,
+                                        (Configuration.connect_timeout, Configuration.read_timeout),
+                                        fsync_policy = Configuration.fsync_policy,
+                                        preallocate = Configuration.preallocate_downloads,
+                                        manifest = self.library_manifest()
+                                        )
+        return None if result != FAILED_TO_DOWNLOAD else f"Could not be downloaded from {Configuration.base_url}"
+
+    def do_workqueue(self, arg: str) -> None:
+        """Show how far the workers have got through a work queue, and which papers failed.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if not check_args("workqueue", 1, args, usage_string=EasyPaperShell.WORK_QUEUE_USAGE):
+            return
+        try:
+            queue = open_work_queue(args[0])
+            counts = queue.counts()
+            failures = queue.failures(10) if counts.failed else []
+        except WorkQueueError as err:
+            print_error(str(err), None, EasyPaperShell.WORK_QUEUE_USAGE)
+            return
+        print(f"{YELLOW}{counts.queued}{RESET} queued, {YELLOW}{counts.claimed}{RESET} being downloaded, "
+              f"{GREEN}{counts.done}{RESET} done, {RED}{counts.failed}{RESET} failed.")
+        for path, error in failures:
+            print(f"{RED}✖{RESET} {path}: {error}")
+        if counts.failed > len(failures):
+            print(f"...and {counts.failed - len(failures)} more.")
+
+    def help_workqueue(self) -> None:
+        """Manually print the help text for 'workqueue' with color support."""
+        print(self.do_workqueue.__doc__.format(USAGE = EasyPaperShell.WORK_QUEUE_USAGE))
+
+    def do_verify(self, arg: str) -> None:
+        """Check that downloaded papers are complete and unchanged.\n{USAGE}\
+        \nChecks every file in the download folder, or only the files for the given subject.\
+        \nPDFs must have a PDF header and end of file marker, and files must match the checksum recorded when they were downloaded.\
+        \nFiles which fail are queued for re-download.\
+        \nOptional flags:\
+        \n-f / --fix flag: re-download every queued file."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        expected_flags = [("-f", "--fix")]
+        args = [s.lower() for s in args]
+        subject_code = next((a for a in args if not a.startswith("-")), None)
+        if not check_args("verify", 1 if subject_code else 0, args, expected_flags, usage_string=EasyPaperShell.VERIFY_USAGE):
+            return
+        fix = (expected_flags[0][0] in args) or (expected_flags[0][1] in args)
+        folder = Configuration.download_folder
+        if subject_code:
+            subject_exam = find_subject_exam(subject_code)
+            if not subject_exam:
+                print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}", None, EasyPaperShell.VERIFY_USAGE)
+                return
+            folder = subject_download_folder(subject_code)
+        paths = find_library_files(folder) if os.path.isdir(folder) else []
+        manifest = self.library_manifest()
+        if paths:
+            print(f"\rVerifying {len(paths)} file{'s' if len(paths) > 1 else ''} in {YELLOW}'{os.path.abspath(folder)}'{RESET}...")
+        failed = 0
+        for result in check_files(paths):
+            error = result.error
+            recorded = manifest.get(result.path)
+            if not error and recorded and (recorded["size"] != result.size or recorded["sha256"] != result.sha256):
+                error = "Checksum does not match the one recorded at download"
+            if error:
+                failed += 1
+                print(f"\r❌ {RED}{os.path.relpath(result.path, Configuration.download_folder)}{RESET}: {error}")
+                if result.path not in self.redownload_queue:
+                    self.redownload_queue.append(result.path)
+            elif not recorded:
+                manifest.record(result.path, result.size, result.sha256)
+        manifest.compact()
+        print(f"✅{GREEN} {len(paths) - failed} file{'s' if len(paths) - failed != 1 else ''} passed verification.{RESET}")
+        if self.redownload_queue and not fix:
+            print(f"{YELLOW}{len(self.redownload_queue)} file{'s' if len(self.redownload_queue) > 1 else ''} queued for re-download. Use {RESET}verify -f{YELLOW} to re-download.{RESET}")
+        if fix:
+            self.redownload_queued()
+
+    def help_verify(self) -> None:
+        """Manually print the help text for 'verify' with color support."""
+        print(self.do_verify.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.VERIFY_USAGE))
+
+    def do_search(self, arg: str) -> None:
+        """Search the text of the downloaded papers.\n{USAGE}\
+        \n{SEARCH_EXAMPLE}\
+        \nFinds the papers containing every word, best matches first. Put a phrase in quotation marks to search for it as a whole.\
+        \nPapers are indexed as they are downloaded; use {YELLOW}search -r{RESET} once to index papers downloaded before.\
+        \nOptional flags:\
+        \n-s / --subject option: only search the papers for the given subject code.\
+        \n-y / --year option: only search the papers from the given year (e.g. 19 or 2019).\
+        \n--session option: only search the papers from the given session letter ({SESSION_LETTERS}).\
+        \n-t / --types option: only search the given comma separated paper types (e.g. qp,ms).\
+        \n-n / --limit option: show at most this many papers (default {SEARCH_DEFAULT_LIMIT}).\
+        \n-r / --reindex flag: index every paper in the download folder in the background; see {YELLOW}jobs{RESET}."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        options = {}
+        for name, flags in (("subject", ("-s", "--subject")), ("year", ("-y", "--year")), ("session", ("--session", "--session")),
+                            ("types", ("-t", "--types")), ("limit", ("-n", "--limit"))):
+            args, options[name] = pop_option_value(args, flags, EasyPaperShell.SEARCH_USAGE)
+            if args == False:
+                return
+        expected_flags = [("-r", "--reindex")]
+        terms = [a for a in args if not a.startswith("-") or len(a) == 1]
+        if not check_args("search", len(terms), [a.lower() for a in args], expected_flags, usage_string=EasyPaperShell.SEARCH_USAGE):
+            return
+        if any(a.lower() in expected_flags[0] for a in args):
+            if terms:
+                print_error("Cannot search and reindex at the same time", None, EasyPaperShell.SEARCH_USAGE)
+                return
+            if not search_available():
+                print_error("Indexing papers requires the pypdf package", f"\nInstall it with {YELLOW}pip install pypdf{RESET}.", None, True)
+                return
+            job = self.job_queue.submit("search --reindex", self.reindex_library, PRIORITY_LOW)
+            print(f"Started job {YELLOW}{job.id}{RESET}: indexing the download folder. Type {YELLOW}jobs -w{RESET} to watch its progress.")
+            return
+        if not terms:
+            print_error("Please specify the words to search for", None, EasyPaperShell.SEARCH_USAGE + "\n" + EasyPaperShell.SEARCH_EXAMPLE)
+            return
+        subject_code = options["subject"]
+        if subject_code and not find_subject_exam(subject_code):
+            print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}", None, EasyPaperShell.SEARCH_USAGE)
+            return
+        year = options["year"]
+        if year and not (year.isdigit() and len(year) in (2, 4)):
+            print_error(f"Invalid year {YELLOW}'{year}'{RED}", f"\nThe year must be 2 or 4 digits, e.g. {YELLOW}19{RESET} or {YELLOW}2019{RESET}.")
+            return
+        session = options["session"].lower() if options["session"] else None
+        if session and session not in SESSION_LETTERS:
+            print_error(f"Invalid session {YELLOW}'{session}'{RED}", f"\nThe session must be one of {YELLOW}{', '.join(SESSION_LETTERS)}{RESET}.")
+            return
+        paper_types = parse_paper_types_filter(options["types"])
+        if paper_types == False:
+            return
+        limit = options["limit"] or str(SEARCH_DEFAULT_LIMIT)
+        if not limit.isdigit() or int(limit) < 1:
+            print_error(f"Invalid limit {YELLOW}'{limit}'{RED}", None, EasyPaperShell.SEARCH_USAGE)
+            return
+        index = self.search_index()
+        try:
+            results = index.search(terms, subject_code, year[-2:] if year else None, session, paper_types, int(limit))
+            indexed = index.count()
+        except sqlite3.Error as err:
+            print_error("Could not search the downloaded papers", f"\n{err}")
+            return
+        if not indexed:
+            print_error("No papers have been indexed yet", f"\nIndex the download folder with {YELLOW}search -r{RESET}.", None, True)
+            return
+        for result in results:
+            snippet = " ".join(result.snippet.split()).replace(SNIPPET_START, YELLOW).replace(SNIPPET_END, RESET)
+            print(f"📄 {GREEN}{os.path.relpath(result.path, Configuration.download_folder)}{RESET}\n   {snippet}")
+        print(f"{len(results)} paper{'s' if len(results) != 1 else ''} found in {indexed} indexed.")
 
+    def help_search(self) -> None:
+        """Manually print the help text for 'search' with color support."""
+        print(self.do_search.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.SEARCH_USAGE, SEARCH_EXAMPLE = EasyPaperShell.SEARCH_EXAMPLE,
+                                            SESSION_LETTERS = ", ".join(SESSION_LETTERS), SEARCH_DEFAULT_LIMIT = SEARCH_DEFAULT_LIMIT))
 
-    def do_getmany(self, arg: str) -> None:
-        """Download all past papers for a given range.\n{USAGE}\
-        \n{GET_MANY_EXAMPLE} -o -f{RESET}\
+    def reindex_library(self) -> None:
+        """
+        Index every paper in the download folder which is new or has changed, and forget papers which were deleted.
+        Run as a job by 'search --reindex'.
+
+        Returns:
+            None
+        """
+        index = self.search_index()
+        paths = find_library_files(index.library_folder) if os.path.isdir(index.library_folder) else []
+        indexed = 0
+        unreadable = 0
+        for extracted in index.update(paths, remove_missing = True):
+            check_current_job()
+            indexed += 1
+            if extracted.error:
+                unreadable += 1
+        print(f"✅{GREEN} Indexed {indexed} paper{'s' if indexed != 1 else ''} ({index.count()} in the index).{RESET}")
+        if unreadable:
+            print(f"{YELLOW}The text of {unreadable} paper{'s' if unreadable != 1 else ''} could not be read; use {RESET}verify{YELLOW} to check them.{RESET}")
+
+    def redownload_queued(self) -> None:
+        """
+        Re-download every file queued by 'verify' to the folder it was found in.
+        """
+        while self.redownload_queue:
+            path = self.redownload_queue.pop(0)
+            paper_code = parse_paper_code(path)
+            if not paper_code:
+                print_error(f"Cannot re-download {YELLOW}'{path}'{RED}", "\nThe file name is not a past paper code.", None, True)
+                continue
+            # The file was saved in a session folder if its parent folder is named after a session.
+            session_folders = os.path.basename(os.path.dirname(path)) in SESSION_MAP.values()
+            download_paper(self, str(paper_code), False, True, session_folders)
+
+    def do_relayout(self, arg: str) -> None:
+        """Move downloaded papers to the folders they would be downloaded to now, without downloading them again.\n{USAGE}\
+        \nUse this after switching between session folders and no session folders, or after changing the download folder.\
+        \nEvery paper is moved to its subject, year and (unless -ns is given) session folder in the download folder.\
+        \nPapers whose new path is already taken, and papers for unknown subjects, are left where they are.\
         \nOptional flags:\
-        \n-f / --force flag: download the files without asking for confirmation if they already exist.\
-        \n                   Re-downloads files which already exist in the download folder.\
-        \n-s / --skip-existing flag: skip downloading the files if they already exist in the download folder.\
-        \n-ns / --no-session-folders flag: do not create session folders (e.g. May-June, Feb-March, etc) in the download folder."""
+        \n-ns / --no-session-folders flag: lay papers out without session folders (e.g. May-June, Feb-March, etc).\
+        \n--from option: move the papers from an old download folder into the current one.\
+        \n-l / --link flag: hard link papers at their new path and keep them at the old one too.\
+        \n-d / --dry-run flag: only show how many papers would be moved."""
         args = safe_shlex_split(arg)
         if args == False:
             return
-        subject_code = args[0] if args else None
-        range = args[1] if len(args) > 1 else None
-        expected_flags = [ ("-f", "--force"),
-                           ("-s", "--skip-existing"),
-                           ("-ns", "--no-session-folders")]
+        args, source_folder = pop_option_value(args, ("--from", "--from"), EasyPaperShell.RELAYOUT_USAGE)
+        if args == False:
+            return
+        expected_flags = [("-ns", "--no-session-folders"), ("-l", "--link"), ("-d", "--dry-run")]
         args = [s.lower() for s in args]
-        if not subject_code:
-            print_error("Please specify a subject code and range", "\n" + EasyPaperShell.GET_MANY_USAGE)
+        if not check_args("relayout", 0, args, expected_flags, usage_string=EasyPaperShell.RELAYOUT_USAGE):
             return
-        if not range:
-            print_error("Please specify both a range and subject code", "\n" + EasyPaperShell.GET_MANY_USAGE)
+        session_folders = not (expected_flags[0][0] in args or expected_flags[0][1] in args)
+        link = (expected_flags[1][0] in args) or (expected_flags[1][1] in args)
+        dry_run = (expected_flags[2][0] in args) or (expected_flags[2][1] in args)
+        source_folder = source_folder or Configuration.download_folder
+        if not os.path.isdir(source_folder):
+            print_error(f"Folder {YELLOW}'{source_folder}'{RED} does not exist", None, EasyPaperShell.RELAYOUT_USAGE)
             return
-        range = range.lower()
-        if not check_args("getmany", 2, args, expected_flags, [(0,1)], EasyPaperShell.GET_MANY_USAGE):
+        def subject_folder(subject_code: str) -> Optional[str]:
+            return subject_download_folder(subject_code) if Configuration.find_subject(subject_code) else None
+        plan = plan_relayout(source_folder, subject_folder, session_folders)
+        for move in plan.conflicts:
+            print(f"\r{YELLOW}Skipping {move.source}{RESET}: {move.target} already exists.")
+        if plan.unknown:
+            print(f"{YELLOW}Skipping {len(plan.unknown)} paper{'s' if len(plan.unknown) > 1 else ''} for subjects not in the catalogue.{RESET}")
+        if dry_run or not plan.moves:
+            print(f"{len(plan.moves)} paper{'s' if len(plan.moves) != 1 else ''} would be {'linked' if link else 'moved'}, "
+                  f"{plan.in_place} already in place.")
             return
-        if not re.match(f"^{SUBJECT_CODE_REGEX}$", subject_code):
-            print_error(f"Invalid subject code {YELLOW}'{subject_code}'{RED} as parameter to getrange",
-                        f"\nSubject code must be a 4 digit number.", 
-                        EasyPaperShell.GET_MANY_USAGE)
+        # Papers keep their checksums and search index entries at their new paths.
+        same_library = os.path.abspath(source_folder) == os.path.abspath(Configuration.download_folder)
+        source_manifest = self.library_manifest() if same_library else LibraryManifest(source_folder)
+        target_manifest = self.library_manifest()
+        index = self.search_index() if same_library and os.path.exists(self.search_index().path) else None
+        moved = 0
+        renamed = []
+        for move, error in zip(plan.moves, apply_moves(plan.moves, link)):
+            if error:
+                print_error(f"Could not {'link' if link else 'move'} {YELLOW}'{move.source}'{RED}", f"\n{error}", None, True)
+                continue
+            moved += 1
+            recorded = source_manifest.get(move.source)
+            if recorded:
+                target_manifest.record(move.target, recorded["size"], recorded["sha256"])
+                if not link:
+                    source_manifest.remove(move.source)
+            if not link:
+                renamed.append((move.source, move.target))
+        if index and renamed:
+            try:
+                index.rename(renamed)
+            except sqlite3.Error as err:
+                print_error("Could not update the search index", f"\n{err}\nUse {YELLOW}search -r{RESET} to rebuild it.", None, True)
+        if not link:
+            remove_empty_folders(source_folder)
+        target_manifest.compact()
+        print(f"✅{GREEN} {'Linked' if link else 'Moved'} {moved} paper{'s' if moved != 1 else ''}, {plan.in_place} already in place.{RESET}")
+        if index is None and moved and search_available():
+            print(f"{YELLOW}Use {RESET}search -r{YELLOW} to add the papers to the search index.{RESET}")
+
+    def help_relayout(self) -> None:
+        """Manually print the help text for 'relayout' with color support."""
+        print(self.do_relayout.__doc__.format(USAGE = EasyPaperShell.RELAYOUT_USAGE))
+
+    def do_optimize(self, arg: str) -> None:
+        """Optimise the downloaded PDFs so they are smaller and open faster, e.g. from a network share.\n{USAGE}\
+        \nOptimises every PDF in the download folder, or only the PDFs for the given subject, using every CPU core.\
+        \nEmbedded fonts repeated in a PDF are stored once, streams are recompressed and the PDF is linearised\
+        \nfor fast web view. Nothing is lost from the PDFs, and a PDF which would get larger is left as it is.\
+        \nUse {YELLOW}setoptimize on{RESET} to optimise papers as they are downloaded.\
+        \nOptional flags:\
+        \n-f / --force flag: also optimise PDFs which are already linearised."""
+        args = safe_shlex_split(arg)
+        if args == False:
             return
-        
-        single_session_range_match = re.match(r"^([msw])(\d{2})-(\d{2})$", range)
-        range_match = re.match(r"^(\d{2})-(\d{2})$", range)
-        session_letters = "".join(SESSION_LETTERS)
-        single_session_match = re.match(rf"^([{session_letters}])(\d{{2}})$", range)
-        single_year_match = re.match(r"^(\d{2})$", range)
-
-        # Determine sessions to download
-        sessions_to_download = []
-        current_year = datetime.datetime.now().year % 100
-
-        if single_session_range_match:
-            session, start_year, end_year = single_session_range_match.groups()
-            start_year = int(start_year)
-            end_year = int(end_year)
-            if end_year < start_year:
-                print_error("End year must be greater than or equal to start year", None, EasyPaperShell.GET_MANY_USAGE)
-                return
-            if 0 >= start_year or end_year > current_year:
-                print_error(f"Year {YELLOW}'{year}'{RED} is out of valid range {YELLOW}(1 to {current_year}){RESET}")
+        expected_flags = [("-f", "--force")]
+        args = [s.lower() for s in args]
+        subject_code = next((a for a in args if not a.startswith("-")), None)
+        if not check_args("optimize", 1 if subject_code else 0, args, expected_flags, usage_string=EasyPaperShell.OPTIMIZE_USAGE):
+            return
+        force = (expected_flags[0][0] in args) or (expected_flags[0][1] in args)
+        if not optimize_available():
+            print_error("Optimising PDFs requires the pikepdf package", f"\nInstall it with {YELLOW}pip install pikepdf{RESET}.", None, True)
+            return
+        folder = Configuration.download_folder
+        if subject_code:
+            if not find_subject_exam(subject_code):
+                print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}", None, EasyPaperShell.OPTIMIZE_USAGE)
                 return
-            sessions_to_download = [f"{session}{year:02d}" for year in range(start_year, end_year + 1)]
+            folder = subject_download_folder(subject_code)
+        paths = [path for path in find_library_files(folder) if is_pdf(path)] if os.path.isdir(folder) else []
+        if not paths:
+            print_error(f"No downloaded PDFs found in {YELLOW}'{os.path.abspath(folder)}'{RESET}", None, None, True)
+            return
+        print(f"\rOptimising {len(paths)} PDF{'s' if len(paths) > 1 else ''} in {YELLOW}'{os.path.abspath(folder)}'{RESET} "
+              f"with {min(available_cores(), len(paths))} process{'es' if min(available_cores(), len(paths)) > 1 else ''}...")
+        manifest = self.library_manifest()
+        started = time.monotonic()
+        optimized = skipped = failed = 0
+        original_size = saved = 0
+        processing = 0.0
+        try:
+            for done, result in enumerate(optimize_pdfs(paths, force), 1):
+                processing += result.seconds
+                if result.error:
+                    failed += 1
+                    print(f"\r❌ {RED}{os.path.relpath(result.path, Configuration.download_folder)}{RESET}: {result.error}")
+                elif result.skipped:
+                    skipped += 1
+                else:
+                    optimized += 1
+                    original_size += result.original_size
+                    saved += result.original_size - result.size
+                    manifest.record(result.path, result.size, result.sha256)
+                print(f"\r{done}/{len(paths)} PDFs, {format_size(saved)} saved so far", end = "", flush = True)
+        except KeyboardInterrupt:
+            print(f"\n{YELLOW}Optimising stopped. PDFs already optimised are kept.{RESET}")
+        manifest.compact()
+        percent = f" ({saved / original_size:.0%})" if original_size else ""
+        print(f"\r✅{GREEN} Optimised {optimized} PDF{'s' if optimized != 1 else ''}, saving {format_size(saved)}{percent}, "
+              f"in {format_eta(time.monotonic() - started)} ({format_eta(processing)} of processing).{RESET}")
+        if skipped:
+            print(f"{YELLOW}{skipped} PDF{'s were' if skipped > 1 else ' was'} already optimised or would not get smaller.{RESET}")
+        if failed:
+            print(f"{YELLOW}{failed} PDF{'s' if failed > 1 else ''} could not be optimised and {'were' if failed > 1 else 'was'} left unchanged.{RESET}")
 
-        elif range_match:
-            start_year, end_year = map(int, range_match.groups())
-            if end_year < start_year:
-                print_error("End year must be greater than or equal to start year", None, EasyPaperShell.GET_MANY_USAGE)
-                return
-            if 0 >= start_year or end_year > current_year:
-                print_error(f"Year {YELLOW}'{year}'{RED} is out of valid range {YELLOW}(1 to {current_year}){RESET}")
-                return
-            for year in range(start_year, end_year + 1):
-                for session in SESSION_LETTERS:
-                    sessions_to_download.append(f"{session}{year:02d}")
-
-        elif single_session_match:
-            session, year = single_session_match.groups()
-            year = int(year)
-            if 0 >= year or year > current_year:
-                print_error(f"Year {YELLOW}'{year}'{RED} is out of valid range {YELLOW}(1 to {current_year}){RESET}")
-                return
-            sessions_to_download = [range]
-        elif single_year_match:   
-            year = int(single_year_match.group(1))
-            for session in SESSION_LETTERS:
-                sessions_to_download.append(f"{session}{year:02d}")
-        else:
-            print_error(f"Invalid range {YELLOW}'{range}'{RED}", None, EasyPaperShell.GET_MANY_USAGE + "\n" + EasyPaperShell.GET_MANY_EXAMPLE)
-            return
-        subject_link = None
-        subject_exam = None
-        for key, value in Configuration.subjects.items():
-            if subject_code in value.keys():
-                subject_link = value[subject_code]
-                subject_exam = key
-                break
-            
-        if not subject_link:
-            print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}")
+    def help_optimize(self) -> None:
+        """Manually print the help text for 'optimize' with color support."""
+        print(self.do_optimize.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.OPTIMIZE_USAGE))
+
+    def do_exportcache(self, arg: str) -> None:
+        """Save the subject catalogue, cached index pages and library manifest to one compressed file.\n{USAGE}\
+        \nImporting the file with {YELLOW}importcache{RESET} sets up another machine without crawling the website,\
+        \nand lets it browse the cached pages without a connection. Also available as {YELLOW}export-cache{RESET}.\
+        \nThe file is saved as {YELLOW}{DEFAULT}{RESET} in the current folder if none is given."""
+        args = safe_shlex_split(arg)
+        if args == False:
             return
-        
-        force_download = (expected_flags[0][0] in args) or (expected_flags[0][1] in args)
-        skip_existing = (expected_flags[1][0] in args) or (expected_flags[1][1] in args)
-        session_folders = not (expected_flags[2][0] in args or expected_flags[2][1] in args) # If the user specifies -ns or --no-session-folders, we will not create session folders
-        force_download = force_download if force_download else not skip_existing if skip_existing else None # If force_download is None, it means that the user did not specify any flags
-        
-        total_downloaded = 0
-        total_skipped = 0
-        for range in sessions_to_download:
-            print(f"\rPreparing for download of all past papers for {YELLOW}'{subject_code}'{RESET} in range {YELLOW}'{range}'{RESET}...")
-            session = range[0]
-            year = range[1:]
-            link_for_subject = Configuration.base_url + "/" + Configuration.exam_page_links[subject_exam] + "/" + Configuration.subjects[subject_exam][subject_code]
-            paper_year_on_site = "Specimen Papers" if session == "y" else "20" + year
-            link_for_year = link_for_subject + "/" + paper_year_on_site
-            session_folder = f"/{SESSION_MAP[session]}" if session_folders else ""
-            download_folder = f"{Configuration.download_folder}/{Configuration.subjects[subject_exam][subject_code]}/{paper_year_on_site}{session_folder}"
-
-            # Get the key for retrieving the html page for the year from the cache.
-            # If the session is specimen, we will use the session as the key, otherwise we will use the year.
-            if session == "y":
-                cache_key = (subject_code, session)
-            else:
-                cache_key = (subject_code, year)
+        if not check_args("exportcache", 1 if args else 0, args, usage_string=EasyPaperShell.EXPORT_CACHE_USAGE):
+            return
+        path = os.path.abspath(args[0] if args else DEFAULT_BUNDLE_NAME)
+        try:
+            contents = export_bundle(path, Configuration.download_folder, Configuration.base_url)
+        except OSError as err:
+            print_error(f"Could not write {YELLOW}'{path}'{RED}", f"\n{err}", None, True)
+            return
+        if not contents.catalogue:
+            print(f"{YELLOW}There is no subject catalogue to export yet, so machines importing the file will still crawl the website.{RESET}")
+        print(f"✅{GREEN} Exported {describe_bundle(contents)} to {RESET}{YELLOW}'{path}'{RESET}{GREEN} ({format_size(os.path.getsize(path))}).{RESET}")
 
-            if cache_key in self.page_cache:
-                html_for_year = self.page_cache.get(cache_key) # Get the html from the cache if present.
-            else:
-                html_for_year = safe_get_html(link_for_year, (Configuration.connect_timeout, Configuration.read_timeout), False)
-                if not html_for_year:
-                    link_for_year = link_for_subject
-                    html_for_year = get_html(link_for_year, (Configuration.connect_timeout, Configuration.read_timeout), False if session == "y" else True)
-                # To add to the cache
-                self.page_cache[cache_key] = html_for_year
+    def help_exportcache(self) -> None:
+        """Manually print the help text for 'exportcache' with color support."""
+        print(self.do_exportcache.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.EXPORT_CACHE_USAGE,
+                                                 DEFAULT = DEFAULT_BUNDLE_NAME))
 
-            successful_downloads = 0
-            skipped = 0
-            links = html_for_year.find_all('a')
-            for link in links:
-                link_str = link.get('href')
-                if (re.search(range, link_str)):
-                    file_name = link_str.strip("/") # Get the file name from the link
-                    content_response = download_with_progress(link_for_year + "/" + file_name, 
-                                                    Configuration.base_url,
-                                                    download_folder,
-                                                    file_name,
-                                                    force_download,
-                                                    (Configuration.connect_timeout, Configuration.read_timeout)
-                                                    )
-                    if content_response == FILE_DOWNLOADED:
-                        successful_downloads += 1
-                        total_downloaded += 1
-                        print("\r")
-                    elif content_response == FILE_EXISTS:
-                        skipped += 1
-                        total_skipped += 1
-            if successful_downloads > 0:
-                print(f"✅{GREEN} Successfully downloaded {successful_downloads} past paper{'s' if successful_downloads > 1 else ''} for {YELLOW}'{Configuration.subjects[subject_exam][subject_code]}'{GREEN} in session {YELLOW}'{range}'{GREEN} to {YELLOW}'{os.path.abspath(download_folder)}'{RESET}")
-            elif skipped == 0:
-                sys.stdout.write('\x1b[1A')
-                sys.stdout.write('\x1b[2K')
-                sys.stdout.flush()
-                print_error(f"Could not find any past papers for {YELLOW}'{Configuration.subjects[subject_exam][subject_code]}'{RED} in session {YELLOW}'{range}'{RESET}",
-                            f"\nMay not be available on {YELLOW}{Configuration.base_url}{RESET} or the session code does not exist.\
-                            \nMake sure you have entered the correct subject code and session code.",
-                            EasyPaperShell.GET_MANY_USAGE, True)
-        if total_downloaded == 0 and total_skipped == 0:
-            print_error(f"No past papers could be downloaded for {YELLOW}'{Configuration.subjects[subject_exam][subject_code]}'{RED} in the given session/range", None, None, True)
-        
-    def help_getmany(self) -> None:
-        """Manually print the help text for 'getmany' with color support."""
-        print(self.do_getmany.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE=EasyPaperShell.GET_MANY_USAGE, GET_MANY_EXAMPLE = EasyPaperShell.GET_MANY_EXAMPLE))
+    def do_importcache(self, arg: str) -> None:
+        """Load the subject catalogue, cached index pages and library manifest from a file saved by {YELLOW}exportcache{RESET}.\n{USAGE}\
+        \nOnly what is newer than this machine's is taken, so importing an old file loses nothing. Also available as {YELLOW}import-cache{RESET}."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if not check_args("importcache", 1, args, usage_string=EasyPaperShell.IMPORT_CACHE_USAGE):
+            return
+        contents = import_cache(args[0])
+        if contents:
+            Configuration.load_config(crawl = False)
+            self.client.layouts.clear()
+            self.library_manifest().load()
+
+    def help_importcache(self) -> None:
+        """Manually print the help text for 'importcache' with color support."""
+        print(self.do_importcache.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.IMPORT_CACHE_USAGE))
 
     def do_setconnecttimeout(self, arg: str) -> None:
         """Set the connection timeout in seconds.\n{USAGE}"""
@@ -324,8 +1619,7 @@ class EasyPaperShell(cmd.Cmd):
             return
         if not check_args("setconnecttimeout", 1, args, usage_string=EasyPaperShell.SET_CONNECT_TIMEOUT_USAGE):
             return
-        Configuration.connect_timeout = int(args[0])
-        Configuration.store_config(skip_reload=True)  # Skip reloading exam page links and subjects as they are not affected by this change
+        Configuration.update_settings(connect_timeout = int(args[0]))
         print(f"Connection timeout set to {YELLOW}{Configuration.connect_timeout}{RESET} seconds.")
     
     def help_setconnecttimeout(self) -> None:
@@ -342,8 +1636,7 @@ class EasyPaperShell(cmd.Cmd):
             return
         if not check_args("setreadtimeout", 1, args, usage_string=EasyPaperShell.SET_READ_TIMEOUT_USAGE):
             return
-        Configuration.read_timeout = int(args[0])
-        Configuration.store_config(skip_reload=True)
+        Configuration.update_settings(read_timeout = int(args[0]))
         print(f"Read timeout set to {YELLOW}{Configuration.read_timeout}{RESET} seconds.")
 
     def help_setreadtimeout(self) -> None:
@@ -360,14 +1653,167 @@ class EasyPaperShell(cmd.Cmd):
             return
         if not check_args("setbaseurl", 1, args, usage_string=EasyPaperShell.SET_BASE_URL_USAGE):
             return
-        Configuration.base_url = args[0]
-        Configuration.store_config(skip_reload=True)
+        Configuration.update_settings(base_url = args[0])
         print(f"Base URL set to {YELLOW}{Configuration.base_url}{RESET}.")
     
     def help_setbaseurl(self) -> None:
         """Manually print the help text for 'setbaseurl' with color support."""
         print(self.do_setbaseurl.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.SET_BASE_URL_USAGE))
 
+    def do_mirrors(self, arg: str) -> None:
+        """List the mirrors of the website in the order they are tried, with their recent latency.\n{USAGE}\
+        \nThe base URL is always a mirror. Requests fail over to the next mirror if one cannot be reached.\
+        \nAlso shows how many requests are sent to each host at once, which grows while the host keeps up and halves when it struggles.\
+        \nOptional flags:\
+        \n-p / --probe flag: measure the latency of every mirror now."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        expected_flags = [("-p", "--probe")]
+        args = [s.lower() for s in args]
+        if not check_args("mirrors", 0, args, expected_flags, usage_string=EasyPaperShell.MIRRORS_USAGE):
+            return
+        if args:
+            print("Probing mirrors...")
+            statuses = mirror_pool.probe((Configuration.connect_timeout, Configuration.read_timeout))
+        else:
+            statuses = mirror_pool.status()
+        for status in statuses:
+            health = f"{GREEN}up{RESET}" if status.healthy else f"{RED}down{RESET}"
+            latency = f"{status.latency * 1000:.0f}ms (p95 {status.p95 * 1000:.0f}ms)" if status.latency is not None else "latency unknown"
+            print(f"{YELLOW}{status.url}{RESET} {health} {latency}")
+        for host in host_limits.status().values():
+            throughput = f", downloads at {format_size(host.throughput)}/s" if host.throughput is not None else ""
+            print(f"{YELLOW}{host.host}{RESET}: up to {int(host.limit)} request{'s' if int(host.limit) > 1 else ''} at once ({host.in_flight} in flight){throughput}")
+        print(f"Hedged index requests are {YELLOW}{'on' if Configuration.hedge_requests else 'off'}{RESET}.")
+
+    def help_mirrors(self) -> None:
+        """Manually print the help text for 'mirrors' with color support."""
+        print(self.do_mirrors.__doc__.format(USAGE = EasyPaperShell.MIRRORS_USAGE))
+
+    def do_addmirror(self, arg: str) -> None:
+        """Add a mirror of the website. It must have the same URL layout as the base URL.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if len(args) < 1 or not args[0].startswith("http"):
+            print_error("Please specify a valid URL", None, EasyPaperShell.ADD_MIRROR_USAGE)
+            return
+        if not check_args("addmirror", 1, args, usage_string=EasyPaperShell.ADD_MIRROR_USAGE):
+            return
+        url = args[0].rstrip("/")
+        if url == Configuration.base_url.rstrip("/") or url in Configuration.mirrors:
+            print(f"{YELLOW}{url}{RESET} is already a mirror.")
+            return
+        Configuration.update_settings(mirrors = Configuration.mirrors + [url])
+        print(f"Mirror {YELLOW}{url}{RESET} added.")
+
+    def help_addmirror(self) -> None:
+        """Manually print the help text for 'addmirror' with color support."""
+        print(self.do_addmirror.__doc__.format(USAGE = EasyPaperShell.ADD_MIRROR_USAGE))
+
+    def do_removemirror(self, arg: str) -> None:
+        """Remove a mirror of the website. Use setbaseurl to change the base URL.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if not check_args("removemirror", 1, args, usage_string=EasyPaperShell.REMOVE_MIRROR_USAGE):
+            return
+        url = args[0].rstrip("/")
+        if url not in Configuration.mirrors:
+            print_error(f"{YELLOW}'{url}'{RED} is not a mirror", f"\nType {YELLOW}mirrors{RESET} to see all mirrors.", None, True)
+            return
+        Configuration.update_settings(mirrors = [mirror for mirror in Configuration.mirrors if mirror != url])
+        print(f"Mirror {YELLOW}{url}{RESET} removed.")
+
+    def help_removemirror(self) -> None:
+        """Manually print the help text for 'removemirror' with color support."""
+        print(self.do_removemirror.__doc__.format(USAGE = EasyPaperShell.REMOVE_MIRROR_USAGE))
+
+    def do_sethedging(self, arg: str) -> None:
+        """Set whether slow index page requests are also sent to the second fastest mirror.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if len(args) < 1 or args[0].lower() not in ("on", "off"):
+            print_error("Please specify on or off", None, EasyPaperShell.SET_HEDGING_USAGE)
+            return
+        if not check_args("sethedging", 1, args, usage_string=EasyPaperShell.SET_HEDGING_USAGE):
+            return
+        Configuration.update_settings(hedge_requests = args[0].lower() == "on")
+        print(f"Hedged index requests turned {YELLOW}{args[0].lower()}{RESET}.")
+
+    def help_sethedging(self) -> None:
+        """Manually print the help text for 'sethedging' with color support."""
+        print(self.do_sethedging.__doc__.format(USAGE = EasyPaperShell.SET_HEDGING_USAGE))
+
+    def do_setfsyncpolicy(self, arg: str) -> None:
+        """Set how downloaded files are flushed to disk.\n{USAGE}"""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if len(args) < 1 or args[0].lower() not in FSYNC_POLICIES:
+            print_error("Please specify a valid fsync policy", None, EasyPaperShell.SET_FSYNC_POLICY_USAGE)
+            return
+        if not check_args("setfsyncpolicy", 1, args, usage_string=EasyPaperShell.SET_FSYNC_POLICY_USAGE):
+            return
+        Configuration.update_settings(fsync_policy = args[0].lower())
+        print(f"Fsync policy set to {YELLOW}{Configuration.fsync_policy}{RESET}.")
+
+    def help_setfsyncpolicy(self) -> None:
+        """Manually print the help text for 'setfsyncpolicy' with color support."""
+        print(self.do_setfsyncpolicy.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.SET_FSYNC_POLICY_USAGE))
+
+    def do_setoptimize(self, arg: str) -> None:
+        """Set whether PDFs are optimised in the background after they are downloaded.\n{USAGE}\
+        \nOptimising makes PDFs smaller and faster to open without losing anything (see {YELLOW}help optimize{RESET}).\
+        \nIt runs in separate processes at a lower priority, so downloads do not wait for it."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if len(args) < 1 or args[0].lower() not in ("on", "off"):
+            print_error("Please specify on or off", None, EasyPaperShell.SET_OPTIMIZE_USAGE)
+            return
+        if not check_args("setoptimize", 1, args, usage_string=EasyPaperShell.SET_OPTIMIZE_USAGE):
+            return
+        if args[0].lower() == "on" and not optimize_available():
+            print_error("Optimising PDFs requires the pikepdf package", f"\nInstall it with {YELLOW}pip install pikepdf{RESET}.", None, True)
+            return
+        Configuration.update_settings(optimize_downloads = args[0].lower() == "on")
+        print(f"Optimising downloaded PDFs turned {YELLOW}{args[0].lower()}{RESET}.")
+
+    def help_setoptimize(self) -> None:
+        """Manually print the help text for 'setoptimize' with color support."""
+        print(self.do_setoptimize.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.SET_OPTIMIZE_USAGE))
+
+    def do_setprefetch(self, arg: str) -> None:
+        """Set the budget for prefetching index pages.\n{USAGE}\
+        \nWhen the shell starts and while it waits for a command, the index pages of the subjects and years you download\
+        \nfrom most often are fetched in the background, so downloading from them does not wait for the website.\
+        \nCurrent budget: {YELLOW}{REQUESTS}{RESET} requests and {YELLOW}{SIZE}{RESET} per session."""
+        args = safe_shlex_split(arg)
+        if args == False:
+            return
+        if len(args) == 1 and args[0].lower() == "off":
+            Configuration.update_settings(prefetch_requests = 0)
+            print(f"Prefetching turned {YELLOW}off{RESET}.")
+            return
+        if len(args) < 1 or not all(value.isdigit() for value in args):
+            print_error("Please specify a valid number of requests and megabytes", None, EasyPaperShell.SET_PREFETCH_USAGE)
+            return
+        if not check_args("setprefetch", min(len(args), 2), args, usage_string=EasyPaperShell.SET_PREFETCH_USAGE): # The megabytes are optional.
+            return
+        settings = {"prefetch_requests": int(args[0])}
+        if len(args) == 2:
+            settings["prefetch_bytes"] = int(args[1]) * 1024 * 1024
+        Configuration.update_settings(**settings)
+        print(f"Prefetching may use {YELLOW}{Configuration.prefetch_requests}{RESET} requests and {YELLOW}{format_size(Configuration.prefetch_bytes)}{RESET} per session.")
+
+    def help_setprefetch(self) -> None:
+        """Manually print the help text for 'setprefetch' with color support."""
+        print(self.do_setprefetch.__doc__.format(YELLOW=YELLOW, RESET=RESET, USAGE = EasyPaperShell.SET_PREFETCH_USAGE,
+                                                 REQUESTS = Configuration.prefetch_requests, SIZE = format_size(Configuration.prefetch_bytes)))
+
     def do_setdownloadfolder(self, arg: str) -> None:
         """Set the folder for Easy Past Papers to download files to.\n{USAGE}"""
         args = safe_shlex_split(arg)
@@ -376,23 +1822,25 @@ class EasyPaperShell(cmd.Cmd):
         if len(args) < 1:
             selected_folder = choose_download_folder()
             if selected_folder:
-                Configuration.download_folder = selected_folder
-                Configuration.store_config(skip_reload=True)
+                previous_folder = Configuration.download_folder
+                Configuration.update_settings(download_folder = selected_folder)
                 print(f"Download folder set to {YELLOW}{Configuration.download_folder}{RESET}.")
+                suggest_relayout(previous_folder)
             else:
                 print(f"{YELLOW}No folder selected. Download folder not changed.{RESET}")
             return
         if (os.path.exists(args[0]) and not os.path.isdir(args[0])):
             try:
                 os.makedirs(args[0], exist_ok = True)
-            except Exception as e:
+            except Exception:
                 print_error("Please specify a valid directory path", None, EasyPaperShell.SET_DOWNLOAD_FOLDER_USAGE)
                 return
         if not check_args("setdownloadfolder", 1, args, usage_string=EasyPaperShell.SET_DOWNLOAD_FOLDER_USAGE):
             return
-        Configuration.download_folder = args[0]
-        Configuration.store_config(skip_reload=True)
+        previous_folder = Configuration.download_folder
+        Configuration.update_settings(download_folder = args[0])
         print(f"Download folder set to {YELLOW}{Configuration.download_folder}{RESET}.")
+        suggest_relayout(previous_folder)
 
     def help_setdownloadfolder(self) -> None:
         """Manually print the help text for 'setdownloadfolder' with color support."""
@@ -405,12 +1853,76 @@ class EasyPaperShell(cmd.Cmd):
         Args:
             line (str): The input line.
         """
+        # Commands may also be written with hyphens, e.g. 'export-cache' for 'exportcache'.
+        command, _, arg = line.partition(" ")
+        if "-" in command and hasattr(self, "do_" + command.replace("-", "")):
+            return getattr(self, "do_" + command.replace("-", ""))(arg.strip())
         print_error(f"Unknown command: {YELLOW}'{line}'{RED}")
 
     def do_exit(self, arg: str) -> None:
-        """Exit the program."""
+        """Exit the program. Running download jobs are cancelled."""
+        self.prewarmer.cancel()
+        self.job_queue.shutdown()
+        for checkpoint in list(self.checkpoints.values()):
+            checkpoint.flush() # The jobs' threads may not get to save their progress before the program exits.
+        self.optimizer.shutdown()
         program_exit()
 
+def describe_bundle(contents: BundleContents) -> str:
+    """
+    Describe what was exported to or imported from a cache bundle, for display.
+
+    Args:
+        contents (BundleContents): What was exported or imported.
+
+    Returns:
+        str: e.g. 'the subject catalogue, 120 index pages, 3 sync snapshots and 850 manifest records'.
+    """
+    parts = ["the subject catalogue"] if contents.catalogue else []
+    parts += [f"{count} {name}{'s' if count != 1 else ''}" for count, name in
+              ((contents.pages, "index page"), (contents.snapshots, "sync snapshot"), (contents.papers, "manifest record"))]
+    return ", ".join(parts[:-1]) + " and " + parts[-1]
+
+def import_cache(path: str) -> Optional[BundleContents]:
+    """
+    Import a cache bundle into this machine's caches and the download folder's manifest, printing what was imported.
+    Used by the 'importcache' command, and by main() before the catalogue is first loaded.
+
+    Args:
+        path (str): The path of the bundle.
+
+    Returns:
+        Optional[BundleContents]: What was imported, or None if the bundle could not be imported.
+    """
+    try:
+        contents = import_bundle(path, Configuration.download_folder)
+    except BundleError as err:
+        print_error(f"Could not import {YELLOW}'{path}'{RED}", f" {err}.", None, True)
+        return None
+    except OSError as err:
+        print_error(f"Could not import {YELLOW}'{path}'{RED}", f"\n{err}", None, True)
+        return None
+    print(f"✅{GREEN} Imported {describe_bundle(contents)}.{RESET}")
+    if contents.catalogue_updated:
+        print(f"The catalogue is from {YELLOW}{time.strftime('%Y-%m-%d', time.localtime(contents.catalogue_updated))}{RESET}"
+              f"{'' if contents.catalogue else ', but this machine already had a newer one'}.")
+    if contents.base_url and contents.base_url.rstrip("/") != Configuration.base_url.rstrip("/"):
+        print(f"{YELLOW}The pages were cached from {RESET}{contents.base_url}{YELLOW}, so they are only used after "
+              f"{RESET}setbaseurl {contents.base_url}{YELLOW}.{RESET}")
+    return contents
+
+def suggest_relayout(previous_folder: str) -> None:
+    """
+    Tell the user how to move their papers after the download folder has changed, if the old one has any.
+
+    Args:
+        previous_folder (str): The download folder before it was changed.
+    """
+    if os.path.abspath(previous_folder) == os.path.abspath(Configuration.download_folder) or not os.path.isdir(previous_folder):
+        return
+    if find_library_files(previous_folder):
+        print(f"Papers already downloaded to {YELLOW}'{previous_folder}'{RESET} can be moved with {YELLOW}relayout --from \"{previous_folder}\"{RESET}.")
+
 def choose_download_folder() -> Optional[str]:
     """
     Open a dialog to choose a download folder using Tkinter.
@@ -521,6 +2033,180 @@ def safe_shlex_split(arg: str) -> Any:
         print_error("Invalid input", f"\n{e}{RESET}")
         return False
 
+def pop_option_value(args: List[str], option: Tuple[str, str], usage_string: Optional[str] = None) -> Tuple[Any, Optional[str]]:
+    """
+    Remove an option that takes a value (e.g. '-t qp,ms') from the argument list.
+
+    Args:
+        args (List[str]): The list of arguments.
+        option (Tuple[str, str]): The short and long form of the option.
+        usage_string (Optional[str], optional): Usage string for error messages.
+
+    Returns:
+        Tuple[Any, Optional[str]]: The remaining arguments (or False if the option is missing its value)
+        and the value of the option (or None if the option was not given).
+    """
+    for index, arg in enumerate(args):
+        if arg.lower() not in option:
+            continue
+        if index + 1 >= len(args) or args[index + 1].startswith("-"):
+            print_error(f"Option {YELLOW}'{arg}'{RED} requires a value", None, usage_string)
+            return False, None
+        return args[:index] + args[index + 2:], args[index + 1]
+    return args, None
+
+def parse_paper_types_filter(value: Optional[str]) -> Any:
+    """
+    Parse a comma separated list of paper types (e.g. 'qp,ms').
+
+    Args:
+        value (Optional[str]): The value passed to the types option.
+
+    Returns:
+        Any: A set of paper types, None if no filter was given, or False if a paper type is invalid.
+    """
+    if value is None:
+        return None
+    all_paper_types = SPECIMEN_PAPER_TYPES.union(NON_SPECIMEN_PAPER_TYPES)
+    paper_types = {paper_type.strip().lower() for paper_type in value.split(",") if paper_type.strip()}
+    invalid_paper_types = paper_types - all_paper_types
+    if not paper_types or invalid_paper_types:
+        all_paper_types_joined = f"'{RESET}, {YELLOW}'".join(sorted(all_paper_types))
+        print_error(f"Invalid paper type filter {YELLOW}'{value}'{RED}",
+                    f"\nPaper types must be one of {YELLOW}'{all_paper_types_joined}'{RESET}.")
+        return False
+    return paper_types
+
+def parse_paper_nums_filter(value: Optional[str]) -> Any:
+    """
+    Parse a comma separated list of paper numbers (e.g. '1,3,4x').
+    A single digit, or a digit followed by 'x', matches every variant of that paper.
+
+    Args:
+        value (Optional[str]): The value passed to the papers option.
+
+    Returns:
+        Any: A set of paper number prefixes/identifiers, None if no filter was given, or False if a paper number is invalid.
+    """
+    if value is None:
+        return None
+    paper_nums = set()
+    for paper_num in value.split(","):
+        paper_num = paper_num.strip().lower()
+        if not paper_num:
+            continue
+        if not re.match(r"^\d[a-z0-9]?$", paper_num):
+            print_error(f"Invalid paper number filter {YELLOW}'{value}'{RED}",
+                        f"\nPaper numbers must be a digit, optionally followed by a digit, a letter or {YELLOW}x{RESET} for any variant.")
+            return False
+        paper_nums.add(paper_num.rstrip("x"))
+    if not paper_nums:
+        print_error(f"Invalid paper number filter {YELLOW}'{value}'{RED}")
+        return False
+    return paper_nums
+
+def parse_sessions_range(paper_range: str, usage_string: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Parse a range such as 's19', '19', 's19-21' or '19-21' into the session codes it covers.
+
+    Args:
+        paper_range (str): The range entered by the user.
+        usage_string (Optional[str], optional): Usage string for error messages.
+
+    Returns:
+        Optional[List[str]]: The session codes (e.g. ['s19', 's20']), or None if the range is invalid.
+    """
+    single_session_range_match = re.match(r"^([msw])(\d{2})-(\d{2})$", paper_range)
+    range_match = re.match(r"^(\d{2})-(\d{2})$", paper_range)
+    session_letters = "".join(SESSION_LETTERS)
+    single_session_match = re.match(rf"^([{session_letters}])(\d{{2}})$", paper_range)
+    single_year_match = re.match(r"^(\d{2})$", paper_range)
+
+    sessions_to_download = []
+    current_year = datetime.datetime.now().year % 100
+
+    if single_session_range_match:
+        session, start_year, end_year = single_session_range_match.groups()
+        start_year = int(start_year)
+        end_year = int(end_year)
+        if end_year < start_year:
+            print_error("End year must be greater than or equal to start year", None, usage_string)
+            return None
+        if 0 >= start_year or end_year > current_year:
+            print_error(f"Range {YELLOW}'{paper_range}'{RED} is out of valid range {YELLOW}(1 to {current_year}){RESET}")
+            return None
+        sessions_to_download = [f"{session}{year:02d}" for year in range(start_year, end_year + 1)]
+
+    elif range_match:
+        start_year, end_year = map(int, range_match.groups())
+        if end_year < start_year:
+            print_error("End year must be greater than or equal to start year", None, usage_string)
+            return None
+        if 0 >= start_year or end_year > current_year:
+            print_error(f"Range {YELLOW}'{paper_range}'{RED} is out of valid range {YELLOW}(1 to {current_year}){RESET}")
+            return None
+        for year in range(start_year, end_year + 1):
+            for session in SESSION_LETTERS:
+                sessions_to_download.append(f"{session}{year:02d}")
+
+    elif single_session_match:
+        session, year = single_session_match.groups()
+        year = int(year)
+        if 0 >= year or year > current_year:
+            print_error(f"Year {YELLOW}'{year}'{RED} is out of valid range {YELLOW}(1 to {current_year}){RESET}")
+            return None
+        sessions_to_download = [paper_range]
+    elif single_year_match:   
+        year = int(single_year_match.group(1))
+        for session in SESSION_LETTERS:
+            sessions_to_download.append(f"{session}{year:02d}")
+    else:
+        print_error(f"Invalid range {YELLOW}'{paper_range}'{RED}", None, usage_string)
+        return None
+    return sessions_to_download
+
+def find_subject_exam(subject_code: str) -> Optional[str]:
+    """
+    Find the exam (e.g. 'igcse') a subject belongs to.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+
+    Returns:
+        Optional[str]: The exam, or None if the subject code is unknown.
+    """
+    subject = Configuration.find_subject(subject_code)
+    return subject[0] if subject else None
+
+def subject_download_folder(subject_code: str) -> str:
+    """
+    Get the folder a subject's papers are downloaded to.
+
+    Args:
+        subject_code (str): The 4 digit subject code. Must be a known subject.
+
+    Returns:
+        str: The path of the folder.
+    """
+    return f"{Configuration.download_folder}/{Configuration.find_subject(subject_code)[1]}"
+
+def session_folder_path(subject_link: str, session: str, year: str, session_folders: bool) -> str:
+    """
+    Get the folder the papers of a subject in a session are downloaded to, relative to the download folder.
+
+    Args:
+        subject_link (str): The link to the subject page.
+        session (str): The session letter.
+        year (str): The 2 digit year.
+        session_folders (bool): Whether to use session folders.
+
+    Returns:
+        str: The path of the folder, with '/' separators.
+    """
+    year_folder = SPECIMEN_FOLDER_NAME if session == "y" else "20" + year[:2]
+    session_folder = f"/{SESSION_MAP[session]}" if session_folders else ""
+    return f"{subject_link}/{year_folder}{session_folder}"
+
 def download_paper(
     shell: Any,
     file_name: str,
@@ -535,124 +2221,77 @@ def download_paper(
         shell (Any): The shell instance.
         file_name (str): The file name to download.
         open_after (bool): Whether to open the file after download.
-        force_download (Optional[bool]): Whether to overwrite files already downloaded.
+        force_download (Optional[bool]): Whether to overwrite files already downloaded. None means ask the user.
         session_folders (bool): Whether to use session folders.
 
     Returns:
         None
     """
-    match = PAST_PAPER_PATTERN.search(file_name)
-    if not match:
-        print_error(f"Invalid file {YELLOW}'{file_name}'{RED} as parameter to get",
-        f"\nEnter a valid file name.\n{EasyPaperShell.PAPER_CODE_EXAMPLE}")
-        return
-    subject_code, session, year, paper_type, paper_num = match.groups()
-    session = session.lower()
-    paper_type = paper_type.lower()
-
-    subject_link = None
-    subject_exam = None
-    for key, value in Configuration.subjects.items():
-        if subject_code in value.keys():
-            subject_link = value[subject_code]
-            subject_exam = key
-            break
-        
-    if not subject_link:
-        print_error(f"Unknown subject code {YELLOW}'{subject_code}'{RESET}")
-        return
-    
-    if session == "y" and paper_type not in SPECIMEN_PAPER_TYPES:
-        specimen_paper_types_joined = f"'{RESET}, {YELLOW}'".join(SPECIMEN_PAPER_TYPES)
-        print_error(f"Invalid file {YELLOW}'{file_name}'{RED} as parameter to get",
-                    f"\nSpecimen paper cannot have paper type {YELLOW}'{paper_type}'{RESET}\
-                    \nMust be one of {YELLOW}'{specimen_paper_types_joined}'{RESET}.\
-                    \nEnter a valid file.")
+    client = shell.paper_client(session_folders)
+    try:
+        paper_code = client.parse(file_name)
+    except InvalidPaperCodeError as err:
+        example = "" if PAST_PAPER_PATTERN.search(file_name.strip()) else f"\nEnter a valid file name.\n{EasyPaperShell.PAPER_CODE_EXAMPLE}"
+        print_error(f"Invalid file {YELLOW}'{file_name}'{RED} as parameter to get", f"\n{err}{example}")
         return
-    
-    if session != "y" and paper_type in SPECIMEN_PAPER_TYPES:
-        non_specimen_paper_types_joined = f"'{RESET}, {YELLOW}'".join(NON_SPECIMEN_PAPER_TYPES)
-        print_error(f"Invalid file {YELLOW}'{file_name}'{RED} as parameter to get",
-                    f"\nNon specimen paper cannot have paper type {YELLOW}'{paper_type}'{RESET}\
-                    \nMust be one of {YELLOW}'{non_specimen_paper_types_joined}'{RESET}.\
-                    \nEnter a valid file.")
+    if not client.catalogue.find_subject(paper_code.subject_code):
+        print_error(f"Unknown subject code {YELLOW}'{paper_code.subject_code}'{RESET}")
         return
 
-    if paper_type not in PAPER_TYPES_WITHOUT_PAPER_NUM and not paper_num:
-        print_error(f"Invalid file {YELLOW}'{file_name}'{RED} as parameter to get",
-                    f"\nPaper of type {YELLOW}'{paper_type}'{RESET} must have paper number.")
+    shell.history.record([year_page_cache_key(paper_code.subject_code, paper_code.session, paper_code.year)])
+    print(f"\rPreparing for download of {file_name}...")
+
+    # Look for the paper under either layout, whatever its extension, before going to the network.
+    existing_paper = None if force_download else client.find_downloaded(paper_code)
+    if existing_paper and (force_download is False or
+                           os.path.dirname(os.path.abspath(existing_paper)) != os.path.abspath(client.paper_folder(paper_code))):
+        print(f"\r{YELLOW}File already exists at path '{os.path.abspath(existing_paper)}'; cancelling download. Use -f or --force to download it again.{RESET}")
+        if open_after:
+            open_file(existing_paper)
         return
-    
-    if paper_type in PAPER_TYPES_WITHOUT_PAPER_NUM and paper_num:
-        print_error(f"Invalid file {YELLOW}'{file_name}'{RED} as parameter to get",
-                    f"\nPaper of type {YELLOW}'{paper_type}'{RESET} cannot have paper number.")
+    if existing_paper and not ask_to_overwrite(existing_paper):
         return
-    
-    if paper_type not in PAPER_TYPES_WITH_2_YEARS and re.search(r"\d{2}-\d{2}", year):
-        two_year_paper_types_joined = f"'{RESET}, {YELLOW}'".join(PAPER_TYPES_WITH_2_YEARS)
-        print(f"Invalid file {YELLOW}'{file_name}'{RED} as parameter to get",
-              f"\nPaper of type {YELLOW}'{paper_type}'{RESET} must not have a range of years.\
-                \nMust be one of {YELLOW}'{two_year_paper_types_joined}'{RESET}.")
+
+    # The client only counts bytes; the renderer draws the progress from its own thread.
+    transfers = {}
+    def on_event(event: ProgressEvent) -> None:
+        if event.kind == EVENT_STARTED:
+            transfers[event.file_name] = renderer.start(event.file_name, event.total)
+        elif event.kind == EVENT_PROGRESS and event.file_name in transfers:
+            transfers[event.file_name].update(event.received - transfers[event.file_name].done)
+        elif event.kind == EVENT_ENDED and event.file_name in transfers:
+            renderer.finish(transfers.pop(event.file_name))
+    result = client.download(paper_code, True, session_folders, on_event)[0]
+    if not report_download(result, file_name):
         return
-    
-    print(f"\rPreparing for download of {file_name}...")
+    if open_after:
+        open_file(result.path)
 
-    link_for_subject = Configuration.base_url + "/" + Configuration.exam_page_links[subject_exam] + "/" + Configuration.subjects[subject_exam][subject_code]
-    paper_year_on_site = "Specimen Papers" if session == "y" else "20" + year
-    link_for_year = link_for_subject + "/" + paper_year_on_site
-    pdf_link_prediction = link_for_year + "/" + file_name + ".pdf" # Most files will be pdfs so for efficiency we will try to download the pdf first
-    session_folder = f"/{SESSION_MAP[session]}" if session_folders else ""
-    download_folder = f"{Configuration.download_folder}/{Configuration.subjects[subject_exam][subject_code]}/{paper_year_on_site}{session_folder}"
+def report_download(result: DownloadResult, file_name: str) -> bool:
+    """
+    Print what happened to a paper downloaded by the client, and pass it to the download listeners (e.g. the search index).
 
-    content_response = download_with_progress(pdf_link_prediction, 
-                                                Configuration.base_url, #For error message purposes
-                                                download_folder,
-                                                file_name + ".pdf",
-                                                force_download,
-                                                (Configuration.connect_timeout, Configuration.read_timeout),
-                                                False)
-    if content_response != FAILED_TO_DOWNLOAD:
-        if open_after:
-            open_file(download_folder + "/" + file_name + ".pdf")
-        return
-    
-    # Get the key for retrieving the html page for the year from the cache.
-    # If the session is specimen, we will use the session as the key, otherwise we will use the year.
-    if session == "y":
-        cache_key = (subject_code, session)
-    else:
-        cache_key = (subject_code, year)
+    Args:
+        result (DownloadResult): The result of the download.
+        file_name (str): The paper code the user asked for.
 
-    if cache_key in shell.page_cache:
-        html_for_year = shell.page_cache.get(cache_key) # Get the html from the cache if present.
-    else:
-        html_for_year = safe_get_html(link_for_year, (Configuration.connect_timeout, Configuration.read_timeout), False)
-        if not html_for_year:
-            link_for_year = link_for_subject
-            html_for_year = get_html(link_for_year, (Configuration.connect_timeout, Configuration.read_timeout))
-        # To add to the cache
-        shell.page_cache[cache_key] = html_for_year
-
-    # Get the links for papers for that year.
-    links = html_for_year.find_all('a')
-    found_file_name = None
-    for link in links:
-        link_str = link.get('href')
-        # now to find the file with the regex
-        if (re.search(file_name, link_str)):
-            # To get the link to the requested paper.
-            found_file_name = link_str.strip("/")
-            break
-    if not found_file_name:
+    Returns:
+        bool: True if the paper is now in the download folder.
+    """
+    saved_name = os.path.basename(result.path) if result.path else file_name
+    if result.status == DOWNLOAD_DOWNLOADED:
+        for listener in download_listeners:
+            listener(result.path)
+        print(f"\r✅{GREEN} {saved_name} saved to: {result.path}{RESET}")
+        return True
+    if result.status == DOWNLOAD_EXISTS:
+        print(f"\r✅{GREEN} {saved_name} was saved to {result.path} by another download.{RESET}")
+        return True
+    if isinstance(result.error, PaperNotFoundError):
         print_error(f"Could not find file {YELLOW}'{file_name}'{RED} on {YELLOW}'{Configuration.base_url}'{RESET}")
-        return
-    
-    # If the file is found, we will download it.
-    content_response = download_with_progress(link_for_year + "/" + found_file_name, 
-                                                Configuration.base_url,
-                                                download_folder,
-                                                found_file_name,
-                                                force_download,
-                                                (Configuration.connect_timeout, Configuration.read_timeout))
-    if content_response != FAILED_TO_DOWNLOAD and open_after:
-        open_file(download_folder + "/" + file_name)
\ No newline at end of file
+    elif isinstance(result.error, FetchError):
+        print_error(f"Could not download {YELLOW}'{file_name}'{RED}",
+                    f"\n{result.error}\n{YELLOW}Make sure you are connected to the internet.{RESET}")
+    else:
+        print_error(f"Download of {YELLOW}'{file_name}'{RED} failed", f"\n{result.error}")
+    return False
@@ -0,0 +1,167 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from constants import HISTORY_HALF_LIFE, HISTORY_MAX_PAGES
+from store import FileLock, atomic_write_json, lock_path, read_json
+
+class UsageHistory:
+    """
+    A compact history of which index pages the user downloads papers from, used to prefetch the pages
+    they are likely to need when the shell starts.
+
+    Each page is kept as a score and the time it was last used. The score decays by half every
+    HISTORY_HALF_LIFE seconds, so pages used often and recently come first. Only the HISTORY_MAX_PAGES
+    highest scoring pages are kept, so the file stays small however long the program is used.
+
+    The history is shared by every shell on the machine: each change is merged into the file under its lock.
+
+    Attributes:
+        path (str): The path of the history file.
+        pages (Dict[str, List[float]]): Mapping of page keys (e.g. '0620/20') to [score, last used time].
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize the UsageHistory, reading the history file if it exists.
+
+        Args:
+            path (str): The path of the history file.
+        """
+        self.path: str = path
+        self.pages: Dict[str, List[float]] = pages_from_json(read_json(path))
+        self._lock = threading.Lock()
+
+    def record(self, page_keys: Iterable[Tuple[str, str]], weight: float = 1.0) -> None:
+        """
+        Record that papers were downloaded from some index pages. The weight is shared between the pages,
+        so a 'getmany' over many years counts as much as a single 'get'.
+
+        Args:
+            page_keys (Iterable[Tuple[str, str]]): The page cache keys of the pages (see year_page_cache_key).
+            weight (float): How much the use counts in total.
+        """
+        keys = {"/".join(page_key) for page_key in page_keys}
+        if not keys:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                with FileLock(lock_path(self.path)):
+                    pages = pages_from_json(read_json(self.path)) # Merge with what other shells recorded.
+                    self.pages = add_use(pages, keys, weight / len(keys), now)
+                    atomic_write_json(self.path, {"pages": self.pages})
+            except OSError:
+                self.pages = add_use(self.pages, keys, weight / len(keys), now) # Remembered for this session only.
+
+    def top(self, count: int) -> List[Tuple[str, str]]:
+        """
+        Get the pages most likely to be needed, most likely first.
+
+        Args:
+            count (int): The number of pages to get.
+
+        Returns:
+            List[Tuple[str, str]]: The page cache keys of the pages.
+        """
+        now = time.time()
+        with self._lock:
+            ranked = sorted(self.pages.items(), key = lambda item: decayed_score(item[1], now), reverse = True)
+        return [tuple(key.split("/", 1)) for key, _ in ranked[:count]]
+
+def pages_from_json(obj: Optional[dict]) -> Dict[str, List[float]]:
+    """
+    Get the pages from a loaded history file, dropping any entries which are not valid.
+
+    Args:
+        obj (Optional[dict]): The contents of the history file, or None if it could not be read.
+
+    Returns:
+        Dict[str, List[float]]: Mapping of page keys to [score, last used time].
+    """
+    pages = (obj or {}).get("pages")
+    if not isinstance(pages, dict):
+        return {}
+    return {key: value for key, value in pages.items()
+            if "/" in key and isinstance(value, list) and len(value) == 2 and all(isinstance(x, (int, float)) for x in value)}
+
+def decayed_score(entry: List[float], now: float) -> float:
+    """
+    Get the score of a page as of now.
+
+    Args:
+        entry (List[float]): The page's [score, last used time].
+        now (float): The current time.
+
+    Returns:
+        float: The score, halved for every HISTORY_HALF_LIFE seconds since the page was last used.
+    """
+    score, last_used = entry
+    return score * 0.5 ** (max(0.0, now - last_used) / HISTORY_HALF_LIFE)
+
+def add_use(pages: Dict[str, List[float]], keys: Iterable[str], weight: float, now: float) -> Dict[str, List[float]]:
+    """
+    Add a use of some pages to a history, forgetting the lowest scoring pages beyond HISTORY_MAX_PAGES.
+
+    Args:
+        pages (Dict[str, List[float]]): Mapping of page keys to [score, last used time].
+        keys (Iterable[str]): The pages used.
+        weight (float): How much the use counts for each page.
+        now (float): The current time.
+
+    Returns:
+        Dict[str, List[float]]: The new history.
+    """
+    pages = dict(pages)
+    for key in keys:
+        entry = pages.get(key)
+        pages[key] = [round((decayed_score(entry, now) if entry else 0.0) + weight, 4), round(now)]
+    if len(pages) > HISTORY_MAX_PAGES:
+        ranked = sorted(pages.items(), key = lambda item: decayed_score(item[1], now), reverse = True)
+        pages = dict(ranked[:HISTORY_MAX_PAGES])
+    return pages
+
+class PrefetchBudget:
+    """
+    The number of requests and bytes prefetching may use, so guessing wrong never costs much bandwidth.
+
+    Attributes:
+        max_requests (int): The requests allowed.
+        max_bytes (int): The bytes allowed.
+        requests (int): The requests made so far.
+        bytes (int): The bytes downloaded so far.
+    """
+
+    def __init__(self, max_requests: int, max_bytes: int) -> None:
+        """
+        Initialize the PrefetchBudget.
+
+        Args:
+            max_requests (int): The requests allowed.
+            max_bytes (int): The bytes allowed.
+        """
+        self.max_requests: int = max_requests
+        self.max_bytes: int = max_bytes
+        self.requests: int = 0
+        self.bytes: int = 0
+        self._lock = threading.Lock()
+
+    def exhausted(self) -> bool:
+        """
+        Check whether the budget has been used up.
+
+        Returns:
+            bool: True if no more requests should be made.
+        """
+        with self._lock:
+            return self.requests >= self.max_requests or self.bytes >= self.max_bytes
+
+    def spend(self, size: int) -> None:
+        """
+        Record a request made by prefetching.
+
+        Args:
+            size (int): The number of bytes downloaded (0 if the request failed).
+        """
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
@@ -0,0 +1,313 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+from constants import (PDF_HEADER, PDF_TRAILER, PDF_TRAILER_WINDOW, MANIFEST_COMPACT_MIN_LINES, MANIFEST_FILE_NAME,
+                       PARTIAL_DOWNLOAD_SUFFIX)
+from store import FileLock, lock_path
+
+HASH_CHUNK_SIZE: int = 1024 * 1024 # Read files in 1MB chunks when hashing
+
+class IntegrityError(Exception):
+    """
+    Raised when a downloaded file fails an integrity check.
+    """
+
+class FileCheck(NamedTuple):
+    """
+    The result of checking one file in the library.
+
+    Attributes:
+        path (str): The path of the file.
+        size (int): The size of the file in bytes.
+        sha256 (str): The SHA-256 checksum of the file ('' if it could not be read).
+        error (Optional[str]): Why the file is invalid, or None if it passed.
+    """
+    path: str
+    size: int
+    sha256: str
+    error: Optional[str]
+
+class StreamVerifier:
+    """
+    Checksums a download while it streams and checks its content once it ends,
+    without holding more than the start and end of the file in memory.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the StreamVerifier.
+        """
+        self._hash = hashlib.sha256()
+        self._head: bytes = b""
+        self._tail: bytes = b""
+        self.size: int = 0
+
+    def update(self, chunk: bytes) -> None:
+        """
+        Feed the next chunk of the download.
+
+        Args:
+            chunk (bytes): The data received.
+        """
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        if len(self._head) < len(PDF_HEADER):
+            self._head += chunk[:len(PDF_HEADER) - len(self._head)]
+        self._tail = (self._tail + chunk)[-PDF_TRAILER_WINDOW:]
+
+    def verify(self, file_name: str, expected_size: int = 0) -> str:
+        """
+        Check the download is complete and, for PDFs, that it is a whole PDF document.
+
+        Args:
+            file_name (str): The name of the downloaded file (used to decide whether it is a PDF).
+            expected_size (int): The Content-Length of the download (0 if unknown).
+
+        Returns:
+            str: The SHA-256 checksum of the download.
+
+        Raises:
+            IntegrityError: If the download fails a check.
+        """
+        if expected_size and self.size != expected_size:
+            raise IntegrityError(f"Expected {expected_size} bytes but received {self.size}")
+        if is_pdf(file_name):
+            error = check_pdf_structure(self._head, self._tail)
+            if error:
+                raise IntegrityError(error)
+        return self.checksum()
+
+    def checksum(self) -> str:
+        """
+        Get the SHA-256 checksum of the data fed so far.
+
+        Returns:
+            str: The hex digest.
+        """
+        return self._hash.hexdigest()
+
+def is_pdf(path: str) -> bool:
+    """
+    Check whether a path has a PDF file extension.
+
+    Args:
+        path (str): The file path or name.
+
+    Returns:
+        bool: True if the file is a PDF.
+    """
+    return path.lower().endswith(".pdf")
+
+def check_pdf_structure(head: bytes, tail: bytes) -> Optional[str]:
+    """
+    Check the start and end of a file look like a complete PDF document.
+
+    Args:
+        head (bytes): The first bytes of the file.
+        tail (bytes): The last PDF_TRAILER_WINDOW bytes of the file.
+
+    Returns:
+        Optional[str]: A description of the problem, or None if the file looks valid.
+    """
+    if not head.startswith(PDF_HEADER):
+        if head.lstrip().lower().startswith(b"<"):
+            return "File is an HTML page, not a PDF"
+        return "File does not start with a PDF header"
+    if PDF_TRAILER not in tail:
+        return "PDF is truncated (no end of file marker)"
+    return None
+
+def check_file(path: str) -> FileCheck:
+    """
+    Hash a file and check its structure. Runs in a worker process, so it must not print or touch shared state.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        FileCheck: The result of the check.
+    """
+    verifier = StreamVerifier()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                verifier.update(chunk)
+        sha256 = verifier.verify(path)
+        return FileCheck(path, verifier.size, sha256, None)
+    except IntegrityError as err:
+        return FileCheck(path, verifier.size, verifier.checksum(), str(err))
+    except OSError as err:
+        return FileCheck(path, 0, "", f"Could not read file: {err}")
+
+def find_library_files(folder: str) -> List[str]:
+    """
+    List every downloaded file below a folder, skipping partial downloads and the manifest.
+
+    Args:
+        folder (str): The folder to scan.
+
+    Returns:
+        List[str]: The paths of the files.
+    """
+    paths = []
+    for root, _, files in os.walk(folder):
+        for file_name in files:
+            if file_name.startswith(".") or file_name.endswith(PARTIAL_DOWNLOAD_SUFFIX):
+                continue
+            paths.append(os.path.join(root, file_name))
+    return paths
+
+def check_files(paths: List[str], max_workers: Optional[int] = None) -> Iterator[FileCheck]:
+    """
+    Check many files in parallel across a process pool.
+
+    Args:
+        paths (List[str]): The paths of the files.
+        max_workers (Optional[int]): The number of worker processes (defaults to the number of CPUs).
+
+    Returns:
+        Iterator[FileCheck]: The results, in the same order as the paths.
+    """
+    if len(paths) <= 1:
+        yield from map(check_file, paths)
+        return
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        yield from executor.map(check_file, paths, chunksize = 8)
+
+class LibraryManifest:
+    """
+    Records the size and checksum of every file downloaded into a library folder.
+
+    The manifest is an append-only file of JSON lines at the root of the library, so
+    recording a download never rewrites the whole manifest. The latest line for a path wins.
+    Appending and compacting hold the manifest's file lock, so no shell (or server) loses another's lines.
+
+    Attributes:
+        library_folder (str): The root folder of the library.
+        path (str): The path of the manifest file.
+        entries (Dict[str, Dict[str, Any]]): Mapping of paths relative to the library folder to their records.
+    """
+
+    def __init__(self, library_folder: str) -> None:
+        """
+        Initialize the LibraryManifest and load any existing records.
+
+        Args:
+            library_folder (str): The root folder of the library.
+        """
+        self.library_folder: str = library_folder
+        self.path: str = os.path.join(library_folder, MANIFEST_FILE_NAME)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lines: int = 0
+        self.load()
+
+    def load(self) -> None:
+        """
+        Load the records from the manifest file, ignoring lines that were only partly written.
+        """
+        self.entries = {}
+        self._lines = 0
+        try:
+            with open(self.path, "r", encoding = "utf-8") as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        entry = json.loads(line)
+                        self._apply(entry)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        if entry.get("removed"):
+            self.entries.pop(entry["path"], None)
+        else:
+            self.entries[entry["path"]] = entry
+
+    def relative_path(self, path: str) -> str:
+        """
+        Get the key for a file in the manifest.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            str: The path relative to the library folder, with '/' separators.
+        """
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.library_folder)).replace(os.sep, "/")
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the record for a file.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            Optional[Dict[str, Any]]: The record, or None if the file is not in the manifest.
+        """
+        return self.entries.get(self.relative_path(path))
+
+    def record(self, path: str, size: int, sha256: str) -> None:
+        """
+        Record the size and checksum of a file.
+
+        Args:
+            path (str): The path of the file.
+            size (int): The size of the file in bytes.
+            sha256 (str): The SHA-256 checksum of the file.
+        """
+        self._append({"path": self.relative_path(path), "size": size, "sha256": sha256})
+
+    def remove(self, path: str) -> None:
+        """
+        Remove the record for a file.
+
+        Args:
+            path (str): The path of the file.
+        """
+        self._append({"path": self.relative_path(path), "removed": True})
+
+    @property
+    def superseded(self) -> int:
+        """
+        The number of lines in the manifest which are no longer the latest for their file, as of the last load.
+        """
+        return max(self._lines - len(self.entries), 0)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        os.makedirs(self.library_folder, exist_ok = True)
+        with FileLock(lock_path(self.path)):
+            with open(self.path, "a", encoding = "utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii = False) + "\n")
+        self._lines += 1
+        self._apply(entry)
+
+    def compact(self, force: bool = False) -> bool:
+        """
+        Rewrite the manifest with only the latest record for each file, if enough of its lines are superseded
+        for that to be worth it (see MANIFEST_COMPACT_MIN_LINES). The manifest is read again while its lock is held,
+        so lines appended by other processes since it was loaded are kept.
+
+        Args:
+            force (bool): Whether to rewrite the manifest however few lines are superseded.
+
+        Returns:
+            bool: True if the manifest was rewritten.
+        """
+        if not os.path.exists(self.path):
+            return False
+        with FileLock(lock_path(self.path)):
+            self.load()
+            if not force and self.superseded < max(MANIFEST_COMPACT_MIN_LINES, len(self.entries)):
+                return False
+            temp_path = self.path + PARTIAL_DOWNLOAD_SUFFIX
+            with open(temp_path, "w", encoding = "utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii = False) + "\n")
+            os.replace(temp_path, self.path)
+            self._lines = len(self.entries)
+            return True
@@ -0,0 +1,445 @@
+import datetime
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from constants import (JOB_WORKERS, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, SCHEDULE_POLL_INTERVAL,
+                       JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_WAITING)
+from schedule import BandwidthSchedule, RateLimiter
+
+_local = threading.local()
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job's thread when the job is cancelled, so it stops at the next check.
+    """
+
+class JobDeferred(BaseException):
+    """
+    Raised inside a job's thread when its schedule does not let it download now. The job gives up its
+    worker and is run again from the start when its time window opens, so it must be able to carry on
+    from where it stopped (e.g. from a JobCheckpoint).
+    """
+
+class Job:
+    """
+    A unit of work run by a JobQueue, such as a 'get' or a 'getmany'.
+
+    Jobs check in regularly with check() (e.g. after every chunk downloaded), which is
+    where they are paused or cancelled. Downloads started by a job register their
+    writers with it, so cancelling a job only discards that job's partial files.
+
+    A job may have a BandwidthSchedule: its downloads are kept to the rate the schedule allows with
+    throttle(), and outside its time windows it stops at its next wait_for_window() until they open.
+
+    Attributes:
+        id (int): The job's number, shown by 'jobs'.
+        description (str): What the job is doing, e.g. the command that started it.
+        priority (int): Lower numbers run first. Jobs above PRIORITY_INTERACTIVE give way to interactive jobs between downloads.
+        state (str): One of JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_CANCELLED, JOB_DONE or JOB_FAILED.
+        background (bool): Whether the job runs on a worker thread rather than in front of the prompt.
+        writers (set): The unfinished downloads started by the job.
+        error (Optional[str]): Why the job failed, if it did.
+        schedule (Optional[BandwidthSchedule]): When the job may download, and how fast, or None for any time at full speed.
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        description: str,
+        func: Callable[[], Any],
+        priority: int,
+        queue: "JobQueue",
+        background: bool = True,
+        schedule: Optional[BandwidthSchedule] = None
+    ) -> None:
+        """
+        Initialize the Job.
+
+        Args:
+            job_id (int): The job's number.
+            description (str): What the job is doing.
+            func (Callable[[], Any]): The work to run.
+            priority (int): The job's priority.
+            queue (JobQueue): The queue the job belongs to.
+            background (bool): Whether the job runs on a worker thread.
+            schedule (Optional[BandwidthSchedule]): When the job may download, and how fast.
+        """
+        self.id: int = job_id
+        self.description: str = description
+        self.func: Callable[[], Any] = func
+        self.priority: int = priority
+        self.state: str = JOB_QUEUED
+        self.background: bool = background
+        self.writers: set = set()
+        self.error: Optional[str] = None
+        self.started: bool = False
+        self.schedule: Optional[BandwidthSchedule] = schedule
+        self._active: bool = False # Whether a thread is running the job now
+        self._rate_limiter = RateLimiter()
+        self._queue: "JobQueue" = queue
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def check(self, give_way: bool = True, before_wait: Optional[Callable[[], None]] = None) -> None:
+        """
+        Stop here while the job is paused or an interactive job is running, and raise if it was cancelled.
+
+        Jobs only give way to interactive jobs where they hold nothing an interactive job may need, i.e. between
+        downloads: a download's host slot and claim are held until it finishes, so an interactive job waiting
+        for them would wait for the job waiting for it.
+
+        Args:
+            give_way (bool): Whether to stop while an interactive job is running. False in the middle of a download.
+            before_wait (Optional[Callable[[], None]]): Called once before stopping while the job is paused,
+                e.g. to give back the host's request slot so other requests are not held up meanwhile.
+
+        Raises:
+            JobCancelled: If the job has been cancelled.
+        """
+        while True:
+            if self._cancelled.is_set():
+                raise JobCancelled()
+            if not self._resumed.is_set():
+                if before_wait:
+                    before_wait()
+                    before_wait = None
+                self._resumed.wait(0.5)
+                continue
+            if give_way and self.priority > PRIORITY_INTERACTIVE and not self._queue.interactive_idle.is_set():
+                self._queue.interactive_idle.wait(0.5)
+                continue
+            return
+
+    def rate(self) -> Optional[float]:
+        """
+        Get the rate the job's schedule allows now.
+
+        Returns:
+            Optional[float]: The bytes per second, 0 if the job may not download now, or None for full speed.
+        """
+        return self.schedule.rate_at(datetime.datetime.now()) if self.schedule else None
+
+    def wait_for_window(self) -> None:
+        """
+        Check in, and stop here if the job's schedule does not let it download now. Called between downloads,
+        so a time window closing never cuts a download short.
+
+        Raises:
+            JobCancelled: If the job has been cancelled.
+            JobDeferred: If the job is outside its time windows, so it gives up its worker until they open.
+        """
+        self.check()
+        if self.rate() == 0:
+            raise JobDeferred()
+
+    def throttle(self, size: int, before_wait: Optional[Callable[[], None]] = None) -> None:
+        """
+        Wait long enough after receiving some bytes to keep the job's downloads to the rate its schedule allows.
+        A download running when the job's time window closes is finished at full speed.
+
+        Args:
+            size (int): The number of bytes received.
+            before_wait (Optional[Callable[[], None]]): Called before waiting, if there is a wait,
+                e.g. to give back the host's request slot so other requests are not held up meanwhile.
+
+        Raises:
+            JobCancelled: If the job is cancelled while waiting.
+        """
+        if not self.schedule:
+            return
+        delay = self._rate_limiter.delay(size, self.rate())
+        if delay > 0 and before_wait:
+            before_wait()
+        until = time.monotonic() + delay
+        while (remaining := until - time.monotonic()) > 0:
+            self.check(give_way = False)
+            self._cancelled.wait(min(remaining, 0.5))
+
+    def run(self) -> None:
+        """
+        Run the job's work in the current thread.
+        """
+        _local.job = self
+        self.started = True
+        self._active = True
+        self.state = JOB_RUNNING if self._resumed.is_set() else JOB_PAUSED
+        try:
+            self.func()
+            self.state = JOB_DONE
+        except JobCancelled:
+            self.state = JOB_CANCELLED
+        except JobDeferred:
+            self.state = JOB_WAITING if self._resumed.is_set() else JOB_PAUSED
+        except Exception as err:
+            self.state = JOB_FAILED
+            self.error = str(err) or type(err).__name__
+        finally:
+            # Anything still registered was left unfinished by the job.
+            for writer in list(self.writers):
+                writer.abort()
+            self._active = False
+            _local.job = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (JOB_CANCELLED, JOB_DONE, JOB_FAILED)
+
+class JobQueue:
+    """
+    Runs jobs on a pool of worker threads, lowest priority number first, then oldest first.
+
+    Attributes:
+        jobs (Dict[int, Job]): Every job submitted, by id.
+        interactive_idle (threading.Event): Cleared while an interactive job is running.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS) -> None:
+        """
+        Initialize the JobQueue and start its worker threads.
+
+        Args:
+            workers (int): The number of jobs that can run at once.
+        """
+        self.jobs: Dict[int, Job] = {}
+        self.interactive_idle = threading.Event()
+        self.interactive_idle.set()
+        self._next_id: int = 1
+        self._condition = threading.Condition()
+        self._stopped: bool = False
+        for _ in range(workers):
+            threading.Thread(target = self._work, daemon = True).start()
+
+    def _new_job(
+        self,
+        description: str,
+        func: Callable[[], Any],
+        priority: int,
+        background: bool,
+        schedule: Optional[BandwidthSchedule] = None
+    ) -> Job:
+        with self._condition:
+            job = Job(self._next_id, description, func, priority, self, background, schedule)
+            self.jobs[job.id] = job
+            self._next_id += 1
+            return job
+
+    def submit(
+        self,
+        description: str,
+        func: Callable[[], Any],
+        priority: int = PRIORITY_NORMAL,
+        schedule: Optional[BandwidthSchedule] = None
+    ) -> Job:
+        """
+        Queue a job to run in the background.
+
+        Args:
+            description (str): What the job is doing.
+            func (Callable[[], Any]): The work to run.
+            priority (int): The job's priority.
+            schedule (Optional[BandwidthSchedule]): When the job may download, and how fast.
+
+        Returns:
+            Job: The queued job.
+        """
+        job = self._new_job(description, func, priority, True, schedule)
+        with self._condition:
+            self._condition.notify()
+        return job
+
+    def run_foreground(self, description: str, func: Callable[[], Any]) -> Job:
+        """
+        Run an interactive job in the calling thread. Background jobs give way to it until it finishes.
+        Ctrl+C cancels only this job.
+
+        Args:
+            description (str): What the job is doing.
+            func (Callable[[], Any]): The work to run.
+
+        Returns:
+            Job: The finished job.
+        """
+        job = self._new_job(description, func, PRIORITY_INTERACTIVE, False)
+        self.interactive_idle.clear()
+        try:
+            job.run()
+        except KeyboardInterrupt:
+            # The job's partial downloads have already been discarded by Job.run.
+            job.state = JOB_CANCELLED
+        finally:
+            self.interactive_idle.set()
+        return job
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                job = None
+                while not job:
+                    if self._stopped:
+                        return
+                    # Jobs waiting for their time window are run again once it opens.
+                    queued = [job for job in self.jobs.values()
+                              if job.state == JOB_QUEUED or (job.state == JOB_WAITING and job.rate() != 0)]
+                    job = min(queued, key = lambda job: (job.priority, job.id), default = None)
+                    if not job:
+                        waiting = any(job.state == JOB_WAITING for job in self.jobs.values())
+                        self._condition.wait(SCHEDULE_POLL_INTERVAL if waiting else None)
+                job.state = JOB_RUNNING
+                job.started = True
+                job._active = True
+            job.run()
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """
+        Get a job by id.
+
+        Args:
+            job_id (int): The job's number.
+
+        Returns:
+            Optional[Job]: The job, or None if there is no such job.
+        """
+        return self.jobs.get(job_id)
+
+    def pause(self, job: Job) -> None:
+        """
+        Pause a job. A running job stops at its next check; a queued job is not started.
+
+        Args:
+            job (Job): The job.
+        """
+        with self._condition:
+            job._resumed.clear()
+            if job.state in (JOB_QUEUED, JOB_RUNNING, JOB_WAITING):
+                job.state = JOB_PAUSED
+
+    def resume(self, job: Job) -> None:
+        """
+        Resume a paused job.
+
+        Args:
+            job (Job): The job.
+        """
+        with self._condition:
+            if job.state == JOB_PAUSED:
+                # A job which gave up its worker goes back in the queue, and waits again if its window is still closed.
+                job.state = JOB_RUNNING if job._active else JOB_QUEUED
+            job._resumed.set()
+            self._condition.notify()
+
+    def cancel(self, job: Job) -> None:
+        """
+        Cancel a job. A running job stops at its next check and discards its own partial downloads.
+
+        Args:
+            job (Job): The job.
+        """
+        with self._condition:
+            job._cancelled.set()
+            job._resumed.set()
+            if not job._active and not job.finished:
+                job.state = JOB_CANCELLED
+
+    def set_priority(self, job: Job, priority: int) -> None:
+        """
+        Change the priority of a job.
+
+        Args:
+            job (Job): The job.
+            priority (int): The new priority.
+        """
+        with self._condition:
+            job.priority = priority
+            self._condition.notify()
+
+    def active_jobs(self) -> List[Job]:
+        """
+        Get the jobs which have not finished.
+
+        Returns:
+            List[Job]: The jobs, oldest first.
+        """
+        return [job for job in self.jobs.values() if not job.finished]
+
+    def shutdown(self) -> None:
+        """
+        Cancel every job and stop the worker threads.
+        """
+        with self._condition:
+            self._stopped = True
+            for job in self.jobs.values():
+                job._cancelled.set()
+                job._resumed.set()
+            self._condition.notify_all()
+
+def current_job() -> Optional[Job]:
+    """
+    Get the job running in the current thread.
+
+    Returns:
+        Optional[Job]: The job, or None if the current thread is not running a job.
+    """
+    return getattr(_local, "job", None)
+
+def wait_for_current_window() -> None:
+    """
+    Give the job running in the current thread (if any) the chance to pause, be cancelled or stop for its schedule.
+
+    Raises:
+        JobCancelled: If the job has been cancelled.
+        JobDeferred: If the job is outside its time windows.
+    """
+    job = current_job()
+    if job:
+        job.wait_for_window()
+
+def throttle_current_job(size: int, before_wait: Optional[Callable[[], None]] = None) -> None:
+    """
+    Keep the job running in the current thread (if any) to the rate its schedule allows.
+
+    Args:
+        size (int): The number of bytes just received.
+        before_wait (Optional[Callable[[], None]]): Called before waiting, if there is a wait.
+    """
+    job = current_job()
+    if job:
+        job.throttle(size, before_wait)
+
+def current_job_rate_limited() -> bool:
+    """
+    Check whether the job running in the current thread (if any) is held to a rate below full speed.
+
+    Returns:
+        bool: True if the job's downloads are throttled now.
+    """
+    job = current_job()
+    return bool(job and job.rate() is not None)
+
+def check_current_job() -> None:
+    """
+    Give the job running in the current thread (if any) the chance to pause or be cancelled,
+    or to give way to an interactive job. Only called between downloads.
+
+    Raises:
+        JobCancelled: If the job has been cancelled.
+    """
+    job = current_job()
+    if job:
+        job.check()
+
+def check_current_download(before_wait: Optional[Callable[[], None]] = None) -> None:
+    """
+    Give the job running in the current thread (if any) the chance to pause or be cancelled in the middle of
+    a download (or while waiting to start one). It does not give way to interactive jobs here, as they may
+    be waiting for the download's host slot or claim.
+
+    Args:
+        before_wait (Optional[Callable[[], None]]): Called once before stopping while the job is paused.
+
+    Raises:
+        JobCancelled: If the job has been cancelled.
+    """
+    job = current_job()
+    if job:
+        job.check(False, before_wait)
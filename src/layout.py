@@ -0,0 +1,181 @@
+import os
+import shutil
+from typing import Callable, Iterator, List, NamedTuple, Optional
+from constants import SESSION_MAP, SPECIMEN_FOLDER_NAME, PARTIAL_DOWNLOAD_SUFFIX
+from integrity import find_library_files
+from papercode import PaperCode, parse_paper_code
+
+class Move(NamedTuple):
+    """
+    A paper to be moved (or linked) to where the chosen layout puts it.
+
+    Attributes:
+        source (str): The path the paper is at.
+        target (str): The path the layout puts it at.
+    """
+    source: str
+    target: str
+
+class RelayoutPlan(NamedTuple):
+    """
+    What relaying out a library would do.
+
+    Attributes:
+        moves (List[Move]): The papers which are not where the layout puts them.
+        in_place (int): The number of papers already where the layout puts them.
+        conflicts (List[Move]): Papers whose target is already taken by another file, which are left alone.
+        unknown (List[str]): Papers for subjects which are not in the catalogue, which are left alone.
+    """
+    moves: List[Move]
+    in_place: int
+    conflicts: List[Move]
+    unknown: List[str]
+
+def paper_folder(subject_folder: str, paper_code: PaperCode, session_folders: bool) -> str:
+    """
+    Get the folder a paper is downloaded to: the year (or specimen papers) folder, then the session folder if used.
+
+    Args:
+        subject_folder (str): The subject's download folder.
+        paper_code (PaperCode): The paper.
+        session_folders (bool): Whether session folders are used.
+
+    Returns:
+        str: The path of the folder.
+    """
+    year_folder = SPECIMEN_FOLDER_NAME if paper_code.session == "y" else "20" + paper_code.year[:2]
+    session_folder = f"/{SESSION_MAP[paper_code.session]}" if session_folders else ""
+    return f"{subject_folder}/{year_folder}{session_folder}"
+
+def layout_paths(path: str) -> List[str]:
+    """
+    Get the paths a downloaded file could be at under either layout: with and without session folders.
+
+    Args:
+        path (str): The path the file is being downloaded to.
+
+    Returns:
+        List[str]: The path itself first, then the same file under the other layout.
+    """
+    paper_code = parse_paper_code(os.path.basename(path))
+    if not paper_code:
+        return [path]
+    folder, file_name = os.path.split(path)
+    session_folder = SESSION_MAP[paper_code.session]
+    if os.path.basename(folder) == session_folder:
+        return [path, os.path.join(os.path.dirname(folder), file_name)]
+    return [path, os.path.join(folder, session_folder, file_name)]
+
+def find_existing(path: str) -> Optional[str]:
+    """
+    Find a downloaded file under either layout.
+
+    Args:
+        path (str): The path the file is being downloaded to.
+
+    Returns:
+        Optional[str]: The path the file exists at, or None if it has not been downloaded.
+    """
+    return next((candidate for candidate in layout_paths(path) if os.path.exists(candidate)), None)
+
+def find_paper(subject_folder: str, paper_code: PaperCode) -> Optional[str]:
+    """
+    Find a downloaded paper under either layout, whatever its file extension.
+
+    Args:
+        subject_folder (str): The subject's download folder.
+        paper_code (PaperCode): The paper.
+
+    Returns:
+        Optional[str]: The path of the paper, or None if it has not been downloaded.
+    """
+    for session_folders in (True, False):
+        folder = paper_folder(subject_folder, paper_code, session_folders)
+        try:
+            file_names = os.listdir(folder)
+        except OSError:
+            continue
+        for file_name in file_names:
+            if file_name.startswith(".") or file_name.endswith(PARTIAL_DOWNLOAD_SUFFIX):
+                continue
+            if parse_paper_code(file_name) == paper_code:
+                return f"{folder}/{file_name}"
+    return None
+
+def plan_relayout(
+    source_folder: str,
+    subject_folder: Callable[[str], Optional[str]],
+    session_folders: bool
+) -> RelayoutPlan:
+    """
+    Work out where every paper in a library belongs under a layout, in a single scan.
+
+    Args:
+        source_folder (str): The library to scan.
+        subject_folder (Callable[[str], Optional[str]]): Returns the download folder for a subject code,
+            or None if the subject is unknown.
+        session_folders (bool): Whether the layout uses session folders.
+
+    Returns:
+        RelayoutPlan: The papers to move.
+    """
+    moves = []
+    conflicts = []
+    unknown = []
+    in_place = 0
+    claimed = set()
+    for path in sorted(find_library_files(source_folder)):
+        paper_code = parse_paper_code(os.path.basename(path))
+        if not paper_code:
+            continue # Not a paper, e.g. a merged PDF.
+        folder = subject_folder(paper_code.subject_code)
+        if not folder:
+            unknown.append(path)
+            continue
+        target = f"{paper_folder(folder, paper_code, session_folders)}/{os.path.basename(path)}"
+        if os.path.abspath(target) == os.path.abspath(path):
+            in_place += 1
+        elif os.path.exists(target) or os.path.abspath(target) in claimed:
+            conflicts.append(Move(path, target))
+        else:
+            claimed.add(os.path.abspath(target))
+            moves.append(Move(path, target))
+    return RelayoutPlan(moves, in_place, conflicts, unknown)
+
+def apply_moves(moves: List[Move], link: bool) -> Iterator[Optional[OSError]]:
+    """
+    Move (or hard link) papers to their new paths.
+
+    Args:
+        moves (List[Move]): The papers to move.
+        link (bool): Whether to hard link each paper at its new path and keep the old one, rather than moving it.
+
+    Returns:
+        Iterator[Optional[OSError]]: For each move, in order, None if it succeeded or the error if it failed.
+    """
+    for move in moves:
+        try:
+            os.makedirs(os.path.dirname(move.target), exist_ok = True)
+            if link:
+                os.link(move.source, move.target)
+            else:
+                shutil.move(move.source, move.target) # A rename, unless the target is on another drive.
+            yield None
+        except OSError as err:
+            yield err
+
+def remove_empty_folders(folder: str) -> None:
+    """
+    Remove the folders left empty below a folder, e.g. session folders emptied by a relayout.
+    The folder itself is kept.
+
+    Args:
+        folder (str): The folder to tidy.
+    """
+    for root, _, _ in os.walk(folder, topdown = False):
+        if os.path.abspath(root) == os.path.abspath(folder):
+            continue
+        try:
+            os.rmdir(root) # Only succeeds if the folder is empty.
+        except OSError:
+            pass
@@ -1,5 +1,6 @@
 from easypapershell import *
 from configuration import Configuration
+from progress import clear_previous_lines
 import sys
 
 def main() -> None:
@@ -8,14 +9,22 @@ def main() -> None:
 
     Sets up the environment, loads configuration, and starts the command loop.
     Handles keyboard interrupts and ensures incomplete downloads are cleaned up.
+
+    'main.py importcache (bundle file)' imports a cache bundle and exits instead, without crawling
+    the website first, so new machines can be set up from a bundle by a script.
     """
     try:
+        args = sys.argv[1:]
+        if args and args[0].replace("-", "") == "importcache":
+            Configuration.load_config(crawl = False)
+            if len(args) != 2:
+                print_error("Expected the bundle file to import", None, EasyPaperShell.IMPORT_CACHE_USAGE, True)
+                raise SystemExit(2)
+            raise SystemExit(0 if import_cache(args[1]) else 1)
         print("Setting up...")
         Configuration.load_config()
         # Move cursor up 1 line and clear the line
-        sys.stdout.write('\x1b[1A')  # Move cursor up
-        sys.stdout.write('\x1b[2K')  # Clear entire line
-        sys.stdout.flush()
+        clear_previous_lines()
         EasyPaperShell().cmdloop()
     except KeyboardInterrupt:
         print("")
@@ -24,6 +33,9 @@ def main() -> None:
         delete_incomplete_download()
 
 if __name__ == '__main__':
+    # Needed for the process pools used by 'verify' when bundled with pyinstaller.
+    import multiprocessing
+    multiprocessing.freeze_support()
     try:
         import readline
     except ImportError:
@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from constants import MERGE_BATCH_SIZE, MERGE_PAPER_TYPE_ORDER, PARTIAL_DOWNLOAD_SUFFIX
+from papercode import PaperCode, parse_paper_code
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None # Merging is optional, so pikepdf is only needed for the 'merge' command.
+
+class MergeResult(NamedTuple):
+    """
+    The result of writing one merged PDF.
+
+    Attributes:
+        output_path (str): The path of the merged PDF.
+        documents (int): The number of PDFs merged into it.
+        pages (int): The number of pages in it.
+        error (Optional[str]): Why the merge failed, or None if it succeeded.
+    """
+    output_path: str
+    documents: int
+    pages: int
+    error: Optional[str]
+
+def merge_available() -> bool:
+    """
+    Check whether the PDF library needed for merging is installed.
+
+    Returns:
+        bool: True if PDFs can be merged.
+    """
+    return pikepdf is not None
+
+def paper_sort_key(paper_code: PaperCode, interleave: bool) -> tuple:
+    """
+    Get the key used to order papers within a merged PDF.
+
+    Args:
+        paper_code (PaperCode): The paper.
+        interleave (bool): If True, papers are grouped by paper number (e.g. qp_12, ms_12, qp_13, ms_13),
+            otherwise by paper type (e.g. qp_12, qp_13, ms_12, ms_13).
+
+    Returns:
+        tuple: The sort key.
+    """
+    type_order = MERGE_PAPER_TYPE_ORDER.index(paper_code.paper_type) if paper_code.paper_type in MERGE_PAPER_TYPE_ORDER else len(MERGE_PAPER_TYPE_ORDER)
+    if interleave:
+        # Papers without a paper number (e.g. examiner reports) go after all the numbered papers.
+        return (not paper_code.paper_num, paper_code.paper_num, type_order, paper_code.paper_type)
+    return (type_order, paper_code.paper_type, paper_code.paper_num)
+
+def group_papers(paths: List[str], output_folder: str, interleave: bool) -> Dict[str, List[str]]:
+    """
+    Group PDFs into one merged output per subject and session, ordered within each output.
+
+    Args:
+        paths (List[str]): The paths of the PDFs to merge. Files which are not past papers are ignored.
+        output_folder (str): The folder to write the merged PDFs to.
+        interleave (bool): Whether to interleave paper types per paper number.
+
+    Returns:
+        Dict[str, List[str]]: Mapping of output paths to the ordered paths of the PDFs to merge into them.
+    """
+    groups: Dict[str, List[tuple]] = {}
+    for path in paths:
+        paper_code = parse_paper_code(path)
+        if not paper_code or not path.lower().endswith(".pdf"):
+            continue
+        output_path = os.path.join(output_folder, f"{paper_code.subject_code}_{paper_code.session}{paper_code.year}_merged.pdf")
+        groups.setdefault(output_path, []).append((paper_sort_key(paper_code, interleave), path))
+    return {output_path: [path for _, path in sorted(papers)] for output_path, papers in groups.items()}
+
+def merge_pdfs(output_path: str, paths: List[str]) -> MergeResult:
+    """
+    Merge PDFs into one file. Runs in a worker process, so it must not print or touch shared state.
+
+    Only MERGE_BATCH_SIZE source documents are open at once: each batch is appended to the
+    partially merged file, which is saved and reopened lazily before the next batch, so memory
+    use does not grow with the number of documents. The output is renamed into place when complete.
+
+    Args:
+        output_path (str): The path to write the merged PDF to.
+        paths (List[str]): The ordered paths of the PDFs to merge.
+
+    Returns:
+        MergeResult: The result of the merge.
+    """
+    temp_paths = [f"{output_path}.{index}{PARTIAL_DOWNLOAD_SUFFIX}" for index in range(2)]
+    current = None
+    pages = 0
+    try:
+        for batch_index, start in enumerate(range(0, len(paths), MERGE_BATCH_SIZE)):
+            output = pikepdf.open(current) if current else pikepdf.new()
+            sources = []
+            try:
+                for path in paths[start:start + MERGE_BATCH_SIZE]:
+                    source = pikepdf.open(path)
+                    sources.append(source)
+                    output.pages.extend(source.pages)
+                # Alternate between two temporary files, as the previous one is still being read from.
+                current = temp_paths[batch_index % 2]
+                output.save(current)
+                pages = len(output.pages)
+            finally:
+                for source in sources:
+                    source.close()
+                output.close()
+        if current:
+            os.replace(current, output_path)
+        return MergeResult(output_path, len(paths), pages, None)
+    except Exception as err:
+        return MergeResult(output_path, len(paths), pages, str(err))
+    finally:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+def merge_groups(groups: Dict[str, List[str]], max_workers: Optional[int] = None) -> Iterator[MergeResult]:
+    """
+    Write every merged PDF, one output file per worker process.
+
+    Args:
+        groups (Dict[str, List[str]]): Mapping of output paths to the ordered paths of the PDFs to merge into them.
+        max_workers (Optional[int]): The number of worker processes (defaults to the number of CPUs).
+
+    Returns:
+        Iterator[MergeResult]: The result for each output, in the same order as the groups.
+    """
+    for output_path in groups:
+        os.makedirs(os.path.dirname(output_path), exist_ok = True)
+    if len(groups) <= 1:
+        yield from (merge_pdfs(output_path, paths) for output_path, paths in groups.items())
+        return
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        yield from executor.map(merge_pdfs, groups.keys(), groups.values())
@@ -0,0 +1,373 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+import requests
+from requests.exceptions import ConnectionError, RequestException, Timeout
+from constants import (MIRROR_FAILURE_COOLDOWN, MIRROR_HEDGE_DEFAULT_DELAY, MIRROR_HEDGE_MIN_DELAY,
+                       MIRROR_LATENCY_SAMPLES, MIRROR_PROBE_INTERVAL)
+
+class MirrorStatus(NamedTuple):
+    """
+    What is known about a mirror, as shown by the 'mirrors' command.
+
+    Attributes:
+        url (str): The mirror's base URL.
+        healthy (bool): False while the mirror is cooling down after a failure.
+        latency (Optional[float]): The median latency of recent requests in seconds, or None if unknown.
+        p95 (Optional[float]): The 95th percentile latency of recent requests in seconds, or None if unknown.
+    """
+    url: str
+    healthy: bool
+    latency: Optional[float]
+    p95: Optional[float]
+
+class Mirror:
+    """
+    A copy of the website with the same URL layout, and the latencies of recent requests to it.
+
+    Attributes:
+        url (str): The mirror's base URL, without a trailing '/'.
+        samples (Deque[float]): The latencies of the last MIRROR_LATENCY_SAMPLES successful requests.
+        down_until (float): The time until which the mirror is skipped after a failure.
+    """
+
+    def __init__(self, url: str) -> None:
+        """
+        Initialize the Mirror.
+
+        Args:
+            url (str): The mirror's base URL.
+        """
+        self.url: str = url.rstrip("/")
+        self.samples: Deque[float] = deque(maxlen = MIRROR_LATENCY_SAMPLES)
+        self.down_until: float = 0
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self) -> bool:
+        return time.time() >= self.down_until
+
+    def record(self, latency: Optional[float]) -> None:
+        """
+        Record the result of a request to the mirror.
+
+        Args:
+            latency (Optional[float]): How long the request took in seconds, or None if it failed.
+        """
+        with self._lock:
+            if latency is None:
+                self.down_until = time.time() + MIRROR_FAILURE_COOLDOWN
+            else:
+                self.samples.append(latency)
+                self.down_until = 0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Get a percentile of the recent latencies.
+
+        Args:
+            fraction (float): The percentile as a fraction (e.g. 0.95).
+
+        Returns:
+            Optional[float]: The latency in seconds, or None if there are no samples.
+        """
+        with self._lock:
+            ordered = sorted(self.samples) # Sorted under the lock, as requests on other threads record samples.
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class MirrorPool:
+    """
+    An ordered list of mirrors of the website. Requests for a URL on any of them go to the fastest
+    healthy mirror and fail over to the next one if it cannot be reached or returns a server error.
+
+    Index pages can be hedged: if the fastest mirror has not answered within its usual (95th percentile)
+    latency, the same request is sent to the second fastest, and whichever answers first is used.
+
+    Mirrors are probed in the background every MIRROR_PROBE_INTERVAL seconds, and every request
+    also updates the latency of the mirror that answered.
+
+    Attributes:
+        mirrors (List[Mirror]): The mirrors, in the order they were configured.
+        hedge (bool): Whether index page requests are hedged.
+    """
+
+    def __init__(self, urls: List[str], hedge: bool = True) -> None:
+        """
+        Initialize the MirrorPool.
+
+        Args:
+            urls (List[str]): The mirrors' base URLs, preferred first.
+            hedge (bool): Whether to hedge index page requests.
+        """
+        self.mirrors: List[Mirror] = []
+        self.hedge: bool = hedge
+        # One session for every request, so connections (and their TLS handshakes) are reused.
+        self.session: requests.Session = requests.Session()
+        self._lock = threading.Lock()
+        self._last_probe: float = 0
+        self.set_mirrors(urls)
+
+    def set_mirrors(self, urls: List[str]) -> None:
+        """
+        Change the mirrors, keeping what is known about any which were already in the pool.
+
+        Args:
+            urls (List[str]): The mirrors' base URLs, preferred first.
+        """
+        with self._lock:
+            known = {mirror.url: mirror for mirror in self.mirrors}
+            self.mirrors = [known.get(url.rstrip("/")) or Mirror(url) for url in dict.fromkeys(urls)]
+
+    def ranked(self) -> List[Mirror]:
+        """
+        Get the mirrors in the order they should be tried: healthy first, then fastest first.
+        Mirrors without any latency samples keep their configured order after those with samples.
+
+        Returns:
+            List[Mirror]: The mirrors.
+        """
+        with self._lock:
+            mirrors = list(self.mirrors)
+        order = {mirror.url: index for index, mirror in enumerate(mirrors)}
+        def key(mirror: Mirror) -> Tuple[bool, float, int]:
+            latency = mirror.percentile(0.5)
+            return (not mirror.healthy, latency if latency is not None else float("inf"), order[mirror.url])
+        return sorted(mirrors, key = key)
+
+    def split(self, url: str) -> Optional[str]:
+        """
+        Get the path of a URL on one of the mirrors.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            Optional[str]: The path (starting with '/' unless empty), or None if the URL is not on a mirror.
+        """
+        with self._lock:
+            mirrors = list(self.mirrors)
+        for mirror in mirrors:
+            if url == mirror.url or url.startswith(mirror.url + "/"):
+                return url[len(mirror.url):]
+        return None
+
+    def locate(self, url: str) -> str:
+        """
+        Get the URL a request for a URL on any of the mirrors goes to first: the same path on the best mirror.
+        Requesting it still fails over to the other mirrors.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            str: The URL on the best mirror, or the URL itself if it is not on a mirror.
+        """
+        path = self.split(url)
+        if path is None:
+            return url
+        mirrors = self.ranked()
+        return mirrors[0].url + path if mirrors else url
+
+    def record(self, mirror: Mirror, latency: Optional[float]) -> None:
+        """
+        Record the result of a request to a mirror.
+
+        Args:
+            mirror (Mirror): The mirror.
+            latency (Optional[float]): How long the request took in seconds, or None if it failed.
+        """
+        mirror.record(latency)
+
+    def _request(self, mirror: Mirror, path: str, timeouts: Tuple[int, int], stream: bool,
+                 headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        start = time.monotonic()
+        try:
+            response = self.session.get(mirror.url + path, stream = stream, timeout = timeouts, headers = headers)
+        except (ConnectionError, Timeout):
+            self.record(mirror, None)
+            raise
+        if response.status_code >= 500:
+            self.record(mirror, None)
+        else:
+            self.record(mirror, time.monotonic() - start)
+        return response
+
+    def get(
+        self,
+        url: str,
+        timeouts: Tuple[int, int],
+        stream: bool = False,
+        hedge: bool = False,
+        headers: Optional[Dict[str, str]] = None
+    ) -> requests.Response:
+        """
+        Request a URL from the best mirror, failing over to the others.
+
+        Args:
+            url (str): The URL, on any of the mirrors.
+            timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+            stream (bool): Whether to stream the body rather than reading it all.
+            hedge (bool): Whether the request may be hedged. Only used for small pages, not for downloads.
+            headers (Optional[Dict[str, str]]): Extra request headers, e.g. a Range header.
+
+        Returns:
+            requests.Response: The first response which is not a server error. Client errors such as 404
+                are returned as they are, as every mirror has the same files.
+
+        Raises:
+            RequestException: If no mirror could answer.
+        """
+        path = self.split(url)
+        if path is None:
+            return self.session.get(url, stream = stream, timeout = timeouts, headers = headers)
+        self.probe_if_due(timeouts)
+        mirrors = self.ranked()
+        if hedge and self.hedge and len(mirrors) > 1 and not stream and not headers:
+            return self._hedged_get(mirrors, path, timeouts)
+        return self._get_in_order(mirrors, path, timeouts, stream, headers)
+
+    def _get_in_order(self, mirrors: List[Mirror], path: str, timeouts: Tuple[int, int], stream: bool,
+                      headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        error: Optional[Exception] = None
+        response: Optional[requests.Response] = None
+        for mirror in mirrors:
+            try:
+                if response is not None:
+                    response.close()
+                response = self._request(mirror, path, timeouts, stream, headers)
+                if response.status_code < 500:
+                    return response
+            except RequestException as err:
+                error = err
+        if response is not None:
+            return response # Every mirror returned a server error; let the caller report it.
+        raise error or ConnectionError("No mirrors are configured")
+
+    def _hedged_get(self, mirrors: List[Mirror], path: str, timeouts: Tuple[int, int]) -> requests.Response:
+        results: "queue.Queue[Tuple[Optional[requests.Response], Optional[Exception]]]" = queue.Queue()
+        settled = threading.Event()
+        lock = threading.Lock()
+        def run(mirror: Mirror) -> None:
+            try:
+                response = self._request(mirror, path, timeouts, False)
+            except RequestException as err:
+                results.put((None, err))
+                return
+            with lock:
+                if not settled.is_set():
+                    results.put((response, None))
+                    return
+            response.close() # Answered after another mirror's response was used.
+        def settle(keep: Optional[requests.Response]) -> None:
+            # Close every response except the one returned, including any which arrived meanwhile.
+            with lock:
+                settled.set()
+            while True:
+                try:
+                    response, _ = results.get_nowait()
+                except queue.Empty:
+                    break
+                if response is not None and response is not keep:
+                    response.close()
+        # Wait as long as the fastest mirror usually takes before asking the next one too.
+        delay = mirrors[0].percentile(0.95)
+        delay = MIRROR_HEDGE_DEFAULT_DELAY if delay is None else max(delay, MIRROR_HEDGE_MIN_DELAY)
+        threading.Thread(target = run, args = (mirrors[0],), daemon = True).start()
+        started = 1
+        finished = 0
+        last: Tuple[Optional[requests.Response], Optional[Exception]] = (None, None)
+        previous: Optional[requests.Response] = None # The latest server error, returned if every mirror fails.
+        while finished < started:
+            try:
+                last = results.get(timeout = delay if started < 2 else None)
+            except queue.Empty:
+                threading.Thread(target = run, args = (mirrors[1],), daemon = True).start()
+                started += 1
+                continue
+            finished += 1
+            response, _ = last
+            if response is not None and response.status_code < 500:
+                settle(response)
+                return response
+            if response is not None:
+                if previous is not None:
+                    previous.close()
+                previous = response
+            if started < 2:
+                # The fastest mirror failed outright, so ask the next one straight away.
+                threading.Thread(target = run, args = (mirrors[1],), daemon = True).start()
+                started += 1
+        settle(previous)
+        if len(mirrors) > 2:
+            if previous is not None:
+                previous.close()
+            return self._get_in_order(mirrors[2:], path, timeouts, False)
+        if previous is not None:
+            return previous
+        raise last[1]
+
+    def warm(self, timeouts: Tuple[int, int]) -> None:
+        """
+        Open a connection to the best mirror so the next request does not wait for DNS, TCP and TLS.
+        The connection is kept in the session's pool.
+
+        Args:
+            timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+
+        Raises:
+            RequestException: If the mirror could not be reached.
+        """
+        mirrors = self.ranked()
+        if mirrors:
+            self._request(mirrors[0], "", timeouts, True).close()
+
+    def probe_if_due(self, timeouts: Tuple[int, int]) -> None:
+        """
+        Start probing the mirrors in the background if they have not been probed recently.
+
+        Args:
+            timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        """
+        with self._lock:
+            if len(self.mirrors) < 2 or time.time() - self._last_probe < MIRROR_PROBE_INTERVAL:
+                return
+            self._last_probe = time.time()
+        threading.Thread(target = self.probe, args = (timeouts,), daemon = True).start()
+
+    def probe(self, timeouts: Tuple[int, int]) -> List[MirrorStatus]:
+        """
+        Request the home page of every mirror at once to measure its latency and health.
+
+        Args:
+            timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+
+        Returns:
+            List[MirrorStatus]: The status of each mirror after probing, in the order they will be tried.
+        """
+        with self._lock:
+            mirrors = list(self.mirrors)
+            self._last_probe = time.time()
+        def run(mirror: Mirror) -> None:
+            try:
+                self._request(mirror, "", timeouts, True).close()
+            except RequestException:
+                pass # Already recorded as a failure.
+        threads = [threading.Thread(target = run, args = (mirror,), daemon = True) for mirror in mirrors]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.status()
+
+    def status(self) -> List[MirrorStatus]:
+        """
+        Get the status of every mirror.
+
+        Returns:
+            List[MirrorStatus]: The status of each mirror, in the order they will be tried.
+        """
+        return [MirrorStatus(mirror.url, mirror.healthy, mirror.percentile(0.5), mirror.percentile(0.95)) for mirror in self.ranked()]
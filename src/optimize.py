@@ -0,0 +1,228 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from constants import OPTIMIZE_MAX_GROWTH, OPTIMIZE_NICENESS, PARTIAL_DOWNLOAD_SUFFIX
+from integrity import check_file, is_pdf
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None # Optimising is optional, so pikepdf is only needed for the 'optimize' command and setting.
+
+FONT_FILE_KEYS: Tuple[str, ...] = ("/FontFile", "/FontFile2", "/FontFile3")
+
+class OptimizeResult(NamedTuple):
+    """
+    The result of optimising one PDF.
+
+    Attributes:
+        path (str): The path of the PDF.
+        original_size (int): The size of the PDF before optimising, in bytes.
+        size (int): The size of the PDF now, in bytes.
+        sha256 (str): The SHA-256 checksum of the PDF now, or '' if it was not changed.
+        seconds (float): The time spent on the PDF.
+        shared_fonts (int): The number of duplicate embedded fonts replaced by one copy.
+        skipped (bool): Whether the PDF was left as it was because it was already optimised,
+            or because optimising it would make it larger.
+        error (Optional[str]): Why the PDF could not be optimised, or None if it was.
+    """
+    path: str
+    original_size: int
+    size: int
+    sha256: str
+    seconds: float
+    shared_fonts: int
+    skipped: bool
+    error: Optional[str]
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.sha256)
+
+def optimize_available() -> bool:
+    """
+    Check whether the PDF library needed for optimising is installed.
+
+    Returns:
+        bool: True if PDFs can be optimised.
+    """
+    return pikepdf is not None
+
+def available_cores() -> int:
+    """
+    Get the number of CPU cores this process may run on.
+
+    Returns:
+        int: The number of cores.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def share_duplicate_fonts(pdf: "pikepdf.Pdf") -> int:
+    """
+    Point every embedding of the same font program at one copy, so the duplicates are not saved.
+    Scanned and merged papers often embed the same font again on every page.
+
+    Args:
+        pdf (pikepdf.Pdf): The open PDF.
+
+    Returns:
+        int: The number of duplicate font programs dropped.
+    """
+    first: Dict[Tuple[str, str, str], "pikepdf.Object"] = {}
+    digests: Dict[Tuple[int, int], str] = {}
+    shared = 0
+    for page in pdf.pages:
+        resources = page.obj.get("/Resources")
+        fonts = resources.get("/Font") if resources is not None else None
+        if fonts is None:
+            continue
+        for _, font in fonts.items():
+            descriptors = [font.get("/FontDescriptor")]
+            descriptors += [descendant.get("/FontDescriptor") for descendant in font.get("/DescendantFonts", [])]
+            for descriptor in descriptors:
+                if descriptor is None:
+                    continue
+                for key in FONT_FILE_KEYS:
+                    stream = descriptor.get(key)
+                    if stream is None or not stream.is_indirect:
+                        continue
+                    if stream.objgen not in digests:
+                        digests[stream.objgen] = hashlib.sha256(stream.read_raw_bytes()).hexdigest()
+                    # Streams are only the same font if they are stored the same way too.
+                    identity = (key, str(stream.get("/Filter")), digests[stream.objgen])
+                    kept = first.setdefault(identity, stream)
+                    if kept.objgen != stream.objgen:
+                        descriptor[key] = kept
+                        shared += 1
+    return shared
+
+def optimize_pdf(path: str, force: bool = False) -> OptimizeResult:
+    """
+    Optimise a PDF in place without losing anything from it: duplicate embedded fonts are shared,
+    streams are recompressed, objects are packed into object streams and the file is linearised,
+    so viewers can show the first page before the whole file has been read from a network share.
+    Runs in a worker process, so it must not print or touch shared state.
+
+    The optimised file is written next to the PDF, checked, and renamed over it, so the PDF is never
+    left half written. It is kept only if it is no more than OPTIMIZE_MAX_GROWTH larger than the original.
+
+    Args:
+        path (str): The path of the PDF.
+        force (bool): Whether to optimise PDFs which are already linearised (and so assumed to be optimised).
+
+    Returns:
+        OptimizeResult: The result of optimising the PDF.
+    """
+    started = time.monotonic()
+    temp_path = f"{path}.optimize{PARTIAL_DOWNLOAD_SUFFIX}"
+    original_size = 0
+    shared = 0
+    try:
+        original_size = os.path.getsize(path)
+        with pikepdf.open(path) as pdf:
+            if pdf.is_linearized and not force:
+                return OptimizeResult(path, original_size, original_size, "", time.monotonic() - started, 0, True, None)
+            shared = share_duplicate_fonts(pdf)
+            pdf.save(temp_path, linearize = True, compress_streams = True, recompress_flate = True,
+                     object_stream_mode = pikepdf.ObjectStreamMode.generate)
+        check = check_file(temp_path)
+        if check.error:
+            raise ValueError(f"The optimised PDF failed verification: {check.error}")
+        if check.size > original_size * (1 + OPTIMIZE_MAX_GROWTH):
+            return OptimizeResult(path, original_size, original_size, "", time.monotonic() - started, shared, True, None)
+        os.replace(temp_path, path)
+        return OptimizeResult(path, original_size, check.size, check.sha256, time.monotonic() - started, shared, False, None)
+    except Exception as err:
+        return OptimizeResult(path, original_size, original_size, "", time.monotonic() - started, shared, False, str(err))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def lower_priority() -> None:
+    """
+    Make the current process run at a lower priority, so optimising does not slow down downloads or the shell.
+    """
+    try:
+        os.nice(OPTIMIZE_NICENESS)
+    except (AttributeError, OSError):
+        pass # Not supported on Windows.
+
+def optimize_pdfs(paths: List[str], force: bool = False, max_workers: Optional[int] = None) -> Iterator[OptimizeResult]:
+    """
+    Optimise many PDFs in parallel across a process pool with one worker per available core.
+
+    Args:
+        paths (List[str]): The paths of the files. Files which are not PDFs are ignored.
+        force (bool): Whether to optimise PDFs which are already linearised.
+        max_workers (Optional[int]): The number of worker processes (defaults to the number of available cores).
+
+    Returns:
+        Iterator[OptimizeResult]: The result for each PDF, in the same order as the paths.
+    """
+    paths = [path for path in paths if is_pdf(path)]
+    if len(paths) <= 1:
+        yield from (optimize_pdf(path, force) for path in paths)
+        return
+    executor = ProcessPoolExecutor(max_workers = max_workers or available_cores(), initializer = lower_priority)
+    try:
+        yield from executor.map(optimize_pdf, paths, [force] * len(paths), chunksize = 4)
+    finally:
+        # Don't wait for the rest of the library if optimising was cancelled part way through.
+        executor.shutdown(cancel_futures = True)
+
+class BackgroundOptimizer:
+    """
+    Optimises PDFs in a process pool as they are downloaded, without making the downloads wait.
+
+    The pool is only started when the first PDF arrives, and its processes run at a lower priority.
+    """
+
+    def __init__(self, on_optimized: Callable[[OptimizeResult], None], max_workers: Optional[int] = None) -> None:
+        """
+        Initialize the BackgroundOptimizer.
+
+        Args:
+            on_optimized (Callable[[OptimizeResult], None]): Called with the result for each PDF optimised,
+                from a background thread (e.g. to record the new checksum).
+            max_workers (Optional[int]): The number of worker processes (defaults to the number of available cores).
+        """
+        self.on_optimized: Callable[[OptimizeResult], None] = on_optimized
+        self.max_workers: int = max_workers or available_cores()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def add(self, path: str) -> None:
+        """
+        Queue a downloaded file to be optimised.
+
+        Args:
+            path (str): The path of the file. Files which are not PDFs are ignored.
+        """
+        if not is_pdf(path):
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers = self.max_workers, initializer = lower_priority)
+            future = self._executor.submit(optimize_pdf, path)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: Future) -> None:
+        if future.cancelled() or future.exception():
+            return # e.g. the pool was shut down; the PDF is optimised by the next 'optimize'.
+        result = future.result()
+        if result.changed:
+            self.on_optimized(result)
+
+    def shutdown(self) -> None:
+        """
+        Stop the process pool, letting the PDFs being optimised finish but dropping the ones still queued.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(cancel_futures = True)
@@ -0,0 +1,130 @@
+import os
+from typing import NamedTuple, Optional, Set
+from constants import PAST_PAPER_PATTERN
+
+class PaperCode(NamedTuple):
+    """
+    The structured fields of a past paper code such as '0452_s19_qp_12'.
+
+    Attributes:
+        subject_code (str): The 4 digit subject code.
+        session (str): The session letter (see SESSION_MAP).
+        year (str): The 2 digit year code, or a range of 2 digit years (e.g. '20-21').
+        paper_type (str): The paper type (e.g. 'qp', 'ms').
+        paper_num (str): The paper identifier, or an empty string if the paper type has none.
+    """
+    subject_code: str
+    session: str
+    year: str
+    paper_type: str
+    paper_num: str
+
+    def __str__(self) -> str:
+        code = f"{self.subject_code}_{self.session}{self.year}_{self.paper_type}"
+        return f"{code}_{self.paper_num}" if self.paper_num else code
+
+def parse_paper_code(text: Optional[str]) -> Optional[PaperCode]:
+    """
+    Parse a paper code, a file name or a link into its structured fields.
+    Any leading path and the file extension are ignored.
+
+    Args:
+        text (Optional[str]): The paper code, file name or link (e.g. '0452_s19_qp_12.pdf').
+
+    Returns:
+        Optional[PaperCode]: The parsed paper code, or None if the text is not a past paper.
+    """
+    if not text:
+        return None
+    file_name = text.strip("/").rsplit("/", 1)[-1]
+    match = PAST_PAPER_PATTERN.match(os.path.splitext(file_name)[0])
+    if not match:
+        return None
+    subject_code, session, year, paper_type, paper_num = match.groups()
+    return PaperCode(subject_code, session.lower(), year, paper_type.lower(), (paper_num or "").lower())
+
+class PaperCodeMatcher:
+    """
+    Matches links on a page against a requested paper code or session, using the
+    parsed fields of PAST_PAPER_PATTERN rather than searching the raw link text.
+
+    Build one matcher per command and reuse it for every link on the page.
+
+    Attributes:
+        subject_code (str): The subject code links must belong to.
+        session (Optional[str]): The session letter to match, or None to match any session.
+        year (Optional[str]): The 2 digit year to match, or None to match any year.
+        paper_types (Optional[Set[str]]): Allowed paper types, or None to allow all.
+        paper_nums (Optional[Set[str]]): Allowed paper numbers, or None to allow all.
+            Single digit entries match every variant of that paper.
+        exact_paper (Optional[PaperCode]): If set, only this exact paper is matched.
+    """
+
+    def __init__(
+        self,
+        subject_code: str,
+        session: Optional[str] = None,
+        year: Optional[str] = None,
+        paper_types: Optional[Set[str]] = None,
+        paper_nums: Optional[Set[str]] = None
+    ) -> None:
+        """
+        Initialize the PaperCodeMatcher.
+
+        Args:
+            subject_code (str): The subject code links must belong to.
+            session (Optional[str]): The session letter to match.
+            year (Optional[str]): The 2 digit year to match.
+            paper_types (Optional[Set[str]]): Allowed paper types.
+            paper_nums (Optional[Set[str]]): Allowed paper numbers.
+        """
+        self.subject_code: str = subject_code
+        self.session: Optional[str] = session.lower() if session else None
+        self.year: Optional[str] = year
+        self.paper_types: Optional[Set[str]] = paper_types
+        self.paper_nums: Optional[Set[str]] = paper_nums
+        self.exact_paper: Optional[PaperCode] = None
+
+    @classmethod
+    def for_paper(cls, paper_code: PaperCode) -> "PaperCodeMatcher":
+        """
+        Create a matcher that only matches one exact paper.
+
+        Args:
+            paper_code (PaperCode): The paper to match.
+
+        Returns:
+            PaperCodeMatcher: The matcher.
+        """
+        matcher = cls(paper_code.subject_code, paper_code.session, paper_code.year)
+        matcher.exact_paper = paper_code
+        return matcher
+
+    def match(self, link: Optional[str]) -> Optional[PaperCode]:
+        """
+        Check whether a link points to a paper accepted by this matcher.
+
+        Args:
+            link (Optional[str]): The href of the link.
+
+        Returns:
+            Optional[PaperCode]: The parsed paper code if the link matches, else None.
+        """
+        paper_code = parse_paper_code(link)
+        if not paper_code or paper_code.subject_code != self.subject_code:
+            return None
+        if self.exact_paper:
+            return paper_code if paper_code == self.exact_paper else None
+        if self.session and paper_code.session != self.session:
+            return None
+        # Two year specimen papers (e.g. 'y20-21') belong to the first year of the range.
+        if self.year and paper_code.year != self.year and paper_code.year.split("-")[0] != self.year:
+            return None
+        if self.paper_types is not None and paper_code.paper_type not in self.paper_types:
+            return None
+        if self.paper_nums is not None:
+            if not paper_code.paper_num:
+                return None
+            if paper_code.paper_num not in self.paper_nums and paper_code.paper_num[0] not in self.paper_nums:
+                return None
+        return paper_code
@@ -0,0 +1,77 @@
+import queue
+import threading
+from typing import Any, Callable, Hashable, Set, Tuple
+from constants import PREWARM_QUEUE_SIZE
+
+class Prewarmer:
+    """
+    Does speculative work, such as opening connections and fetching index pages the user is
+    likely to need next, on one background thread while the shell waits for input.
+
+    The work is bounded: at most PREWARM_QUEUE_SIZE tasks wait at once (new tasks are dropped
+    when the queue is full), each task is only ever run once, and cancel() drops everything
+    which has not started yet. Nothing here ever blocks the shell.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the Prewarmer and start its thread.
+        """
+        self._tasks: "queue.Queue[Tuple[Hashable, Callable[[], Any]]]" = queue.Queue(maxsize = PREWARM_QUEUE_SIZE)
+        self._seen: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        threading.Thread(target = self._work, daemon = True).start()
+
+    def submit(self, key: Hashable, task: Callable[[], Any]) -> bool:
+        """
+        Queue a task unless a task with the same key was already queued.
+
+        Args:
+            key (Hashable): Identifies the task, e.g. the page being fetched.
+            task (Callable[[], Any]): The work to do. Exceptions are ignored, as the work is only speculative.
+
+        Returns:
+            bool: True if the task was queued.
+        """
+        with self._lock:
+            if self._cancelled.is_set() or key in self._seen:
+                return False
+            try:
+                self._tasks.put_nowait((key, task))
+            except queue.Full:
+                return False
+            self._seen.add(key)
+            return True
+
+    def forget(self, key: Hashable) -> None:
+        """
+        Allow a task to be queued again, e.g. after the page it fetched was dropped from the cache.
+
+        Args:
+            key (Hashable): Identifies the task.
+        """
+        with self._lock:
+            self._seen.discard(key)
+
+    def cancel(self) -> None:
+        """
+        Drop every task which has not started and stop accepting new ones.
+        """
+        with self._lock:
+            self._cancelled.set()
+            while True:
+                try:
+                    self._tasks.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _work(self) -> None:
+        while not self._cancelled.is_set():
+            _, task = self._tasks.get()
+            if self._cancelled.is_set():
+                return
+            try:
+                task()
+            except Exception:
+                pass # Speculative work failing only means the user waits as they would have anyway.
@@ -0,0 +1,314 @@
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Iterator, List, Optional, TextIO, Tuple
+from constants import (GREEN, YELLOW, RESET, PROGRESS_FPS, PROGRESS_BAR_WIDTH, PROGRESS_LINE_INTERVAL,
+                       PROGRESS_RATE_WINDOW, PROGRESS_MAX_ROWS)
+
+def format_size(size: float) -> str:
+    """
+    Format a number of bytes for display.
+
+    Args:
+        size (float): The number of bytes.
+
+    Returns:
+        str: The size, e.g. '1.4 MB'.
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def format_eta(seconds: Optional[float]) -> str:
+    """
+    Format a remaining time for display.
+
+    Args:
+        seconds (Optional[float]): The remaining time, or None if unknown.
+
+    Returns:
+        str: The time, e.g. '1m05s', or '--' if unknown.
+    """
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    return f"{seconds // 60}m{seconds % 60:02d}s" if seconds >= 60 else f"{seconds}s"
+
+class Transfer:
+    """
+    One download being tracked by the ProgressRenderer. The download loop only adds to a counter;
+    all drawing is done by the renderer's thread.
+
+    Attributes:
+        name (str): The name shown for the transfer, e.g. the file name.
+        total (int): The expected size in bytes (0 if unknown).
+        done (int): The number of bytes received so far.
+        started (float): When the transfer started (time.monotonic).
+    """
+
+    def __init__(self, name: str, total: int) -> None:
+        """
+        Initialize the Transfer.
+
+        Args:
+            name (str): The name shown for the transfer.
+            total (int): The expected size in bytes (0 if unknown).
+        """
+        self.name: str = name
+        self.total: int = total
+        self.done: int = 0
+        self.started: float = time.monotonic()
+
+    def update(self, size: int) -> None:
+        """
+        Record that more of the transfer has been received.
+
+        Args:
+            size (int): The number of bytes received.
+        """
+        self.done += size
+
+    def rate(self, now: float) -> float:
+        """
+        Get the average speed of the transfer.
+
+        Args:
+            now (float): The current time (time.monotonic).
+
+        Returns:
+            float: The speed in bytes per second.
+        """
+        elapsed = now - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+class _RendererStream:
+    """
+    Stands in for sys.stdout while the renderer is shown, so anything printed by any thread
+    appears above the progress bars instead of being drawn over by them.
+    """
+
+    def __init__(self, renderer: "ProgressRenderer", stream: TextIO) -> None:
+        self._renderer = renderer
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        with self._renderer.lock:
+            self._renderer.erase()
+            self._stream.write(text)
+            self._stream.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        with self._renderer.lock:
+            self._stream.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+class ProgressRenderer:
+    """
+    Draws the progress of every active download from one thread, at a fixed frame rate.
+
+    Downloads register a Transfer and only update its byte count, so a fast download never waits on the terminal.
+    While the renderer is shown, each frame has a bar per transfer (up to PROGRESS_MAX_ROWS), followed by the total
+    throughput and the number of queued jobs. When stdout is not a terminal, a plain progress line is printed
+    for each transfer every PROGRESS_LINE_INTERVAL seconds instead.
+
+    Attributes:
+        lock (threading.RLock): Held while writing to the terminal.
+        queue_depth (Callable[[], int]): Returns the number of jobs waiting to start.
+    """
+
+    def __init__(self, stream: TextIO = sys.stdout) -> None:
+        """
+        Initialize the ProgressRenderer. Its thread is started when the first transfer begins.
+
+        Args:
+            stream (TextIO): The terminal to draw on.
+        """
+        self.lock = threading.RLock()
+        self.queue_depth: Callable[[], int] = lambda: 0
+        self._stream: TextIO = stream
+        self._transfers: List[Transfer] = []
+        self._shown: int = 0
+        self._suspended: int = 0
+        self._lines_drawn: int = 0
+        self._samples: Deque[Tuple[float, int]] = deque()
+        self._finished_bytes: int = 0
+        self._last_line_time: float = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_tty(self) -> bool:
+        return hasattr(self._stream, "isatty") and self._stream.isatty()
+
+    def start(self, name: str, total: int) -> Transfer:
+        """
+        Start tracking a transfer.
+
+        Args:
+            name (str): The name shown for the transfer.
+            total (int): The expected size in bytes (0 if unknown).
+
+        Returns:
+            Transfer: The transfer, to be updated as data is received.
+        """
+        transfer = Transfer(name, total)
+        with self.lock:
+            self._transfers.append(transfer)
+            if not self._thread:
+                self._thread = threading.Thread(target = self._run, daemon = True)
+                self._thread.start()
+        return transfer
+
+    def finish(self, transfer: Transfer) -> None:
+        """
+        Stop tracking a transfer, whether it completed or not.
+
+        Args:
+            transfer (Transfer): The transfer.
+        """
+        with self.lock:
+            if transfer in self._transfers:
+                self._transfers.remove(transfer)
+                self._finished_bytes += transfer.done
+
+    def show(self) -> None:
+        """
+        Start drawing progress, e.g. while a download runs in front of the prompt. Calls can be nested.
+        """
+        with self.lock:
+            self._shown += 1
+            if self._shown == 1:
+                sys.stdout = _RendererStream(self, self._stream)
+
+    def hide(self) -> None:
+        """
+        Stop drawing progress and remove the bars, so the prompt can be shown.
+        """
+        with self.lock:
+            self._shown = max(0, self._shown - 1)
+            if self._shown == 0:
+                self.erase()
+                self._stream.flush()
+                if isinstance(sys.stdout, _RendererStream):
+                    sys.stdout = self._stream
+
+    @contextmanager
+    def shown(self) -> Iterator[None]:
+        """
+        Draw progress for the duration of a with block.
+        """
+        self.show()
+        try:
+            yield
+        finally:
+            self.hide()
+
+    @contextmanager
+    def suspended(self) -> Iterator[None]:
+        """
+        Stop drawing for the duration of a with block, e.g. while asking the user a question.
+        """
+        with self.lock:
+            self._suspended += 1
+            self.erase()
+            self._stream.flush()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._suspended -= 1
+
+    def erase(self) -> None:
+        """
+        Remove the last frame drawn. The caller must hold the lock.
+        """
+        if self._lines_drawn:
+            # Move to the start of the first line of the frame and clear to the end of the screen.
+            self._stream.write(f"\x1b[{self._lines_drawn}F\x1b[J")
+            self._lines_drawn = 0
+
+    def throughput(self, now: float) -> float:
+        """
+        Get the total speed of all transfers over the last PROGRESS_RATE_WINDOW seconds.
+
+        Args:
+            now (float): The current time (time.monotonic).
+
+        Returns:
+            float: The speed in bytes per second.
+        """
+        with self.lock:
+            total = self._finished_bytes + sum(transfer.done for transfer in self._transfers)
+        self._samples.append((now, total))
+        while len(self._samples) > 1 and now - self._samples[0][0] > PROGRESS_RATE_WINDOW:
+            self._samples.popleft()
+        first_time, first_total = self._samples[0]
+        return (total - first_total) / (now - first_time) if now > first_time else 0.0
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(1 / PROGRESS_FPS)
+            now = time.monotonic()
+            rate = self.throughput(now)
+            with self.lock:
+                if not self._shown or self._suspended:
+                    continue
+                if self.is_tty:
+                    self._draw_frame(now, rate)
+                elif now - self._last_line_time >= PROGRESS_LINE_INTERVAL:
+                    self._last_line_time = now
+                    self._write_lines(now)
+
+    def _draw_frame(self, now: float, rate: float) -> None:
+        lines = [self._bar(transfer, now) for transfer in self._transfers[:PROGRESS_MAX_ROWS]]
+        hidden = len(self._transfers) - len(lines)
+        if hidden > 0:
+            lines.append(f"   ... and {hidden} more")
+        queued = self.queue_depth()
+        if len(self._transfers) > 1 or queued:
+            lines.append(f"   {len(self._transfers)} active, {queued} queued, {format_size(rate)}/s total")
+        self.erase()
+        for line in lines:
+            self._stream.write(f"\x1b[2K{line}\n")
+        self._lines_drawn = len(lines)
+        self._stream.flush()
+
+    def _bar(self, transfer: Transfer, now: float) -> str:
+        rate = transfer.rate(now)
+        if transfer.total:
+            fraction = min(1.0, transfer.done / transfer.total)
+            filled = int(fraction * PROGRESS_BAR_WIDTH)
+            bar = "█" * filled + "░" * (PROGRESS_BAR_WIDTH - filled)
+            eta = (transfer.total - transfer.done) / rate if rate > 0 else None
+            return (f"📥 {transfer.name} {GREEN}{bar}{RESET} {int(fraction * 100):3d}% "
+                    f"{format_size(rate)}/s ETA {format_eta(eta)}")
+        return f"📥 {transfer.name} {YELLOW}{format_size(transfer.done)}{RESET} {format_size(rate)}/s"
+
+    def _write_lines(self, now: float) -> None:
+        for transfer in self._transfers:
+            percent = f"{int(transfer.done / transfer.total * 100)}%" if transfer.total else format_size(transfer.done)
+            self._stream.write(f"Downloading {transfer.name}: {percent} ({format_size(transfer.rate(now))}/s)\n")
+        self._stream.flush()
+
+# Shared by every download, so parallel downloads are drawn together.
+renderer: ProgressRenderer = ProgressRenderer()
+
+def clear_previous_lines(count: int = 1) -> None:
+    """
+    Remove lines already printed, e.g. a 'Preparing...' message once it is no longer needed.
+    Does nothing when stdout is not a terminal, where the escape codes would be printed as text.
+
+    Args:
+        count (int): The number of lines to remove.
+    """
+    stream = sys.stdout
+    if not (hasattr(stream, "isatty") and stream.isatty()):
+        return
+    stream.write("\x1b[1A\x1b[2K" * count)
+    stream.flush()
@@ -1,21 +1,38 @@
 import requests
 from constants import *
 from utils import print_error
-from requests.exceptions import HTTPError, ConnectionError
+from requests.exceptions import HTTPError, ConnectionError, Timeout
 from bs4 import BeautifulSoup
 from bs4 import FeatureNotFound
+from congestion import AdaptiveLimiter
+from downloadwriter import DownloadWriter, IncompleteDownloadError, abort_active_downloads, flush_pending_syncs
+from integrity import IntegrityError, LibraryManifest, StreamVerifier
+from layout import find_existing
+from archive import ArchiveEntryWriter, ArchiveWriter
+from jobs import check_current_download, current_job_rate_limited, throttle_current_job
+from mirrors import MirrorPool
+from progress import renderer, clear_previous_lines
+from segmented import SegmentedDownload, ranges_supported
+from sharedcache import DownloadClaim, SharedPageCache, SingleFlight
 import os
-import sys
 import time
-from typing import Optional, Tuple
-
-download_file: Optional[str] = None
-download_file_expected_size: int = 0
+from typing import Callable, List, Optional, Tuple
 
 FILE_DOWNLOADED: int = 0
 FAILED_TO_DOWNLOAD: int = 1
 FILE_EXISTS: int = 2
 
+# Every request for a page or paper on the website goes through the mirrors, so any of them can answer it.
+mirror_pool: MirrorPool = MirrorPool([BASE_URL] + MIRRORS, HEDGE_REQUESTS)
+# Concurrent requests for the same page or file share one fetch.
+page_flight: SingleFlight = SingleFlight()
+download_flight: SingleFlight = SingleFlight()
+shared_pages: SharedPageCache = SharedPageCache(PAGE_CACHE_FOLDER, PAGE_CACHE_TTL)
+# Limits the requests in flight to each host and adapts the limit and timeouts to how the host is coping.
+host_limits: AdaptiveLimiter = AdaptiveLimiter()
+# Called with the path of every file downloaded, e.g. to add it to the search index.
+download_listeners: List[Callable[[str], None]] = []
+
 def download_with_progress(
     url: str,
     base_url: str,
@@ -23,10 +40,16 @@ def download_with_progress(
     file_name: str,
     force_download: Optional[bool],
     timeouts: Tuple[int, int],
-    log_errors: bool = True
+    log_errors: bool = True,
+    fsync_policy: str = FSYNC_POLICY,
+    preallocate: bool = PREALLOCATE_DOWNLOADS,
+    manifest: Optional[LibraryManifest] = None,
+    archive: Optional[ArchiveWriter] = None
  ) -> int:
     """
     Downloads a file from the given URL with progress indication.
+    The file is streamed into a temporary file and only renamed to its final path once complete
+    and, for PDFs, once it has been checked to be a whole PDF document.
 
     Args:
         url (str): The URL to download from.
@@ -36,102 +59,283 @@ def download_with_progress(
         force_download (Optional[bool]): Whether to overwrite existing files. None means prompt the user.
         timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
         log_errors (bool): Whether to print errors.
+        fsync_policy (str): One of FSYNC_POLICIES, controlling how the file is flushed to disk.
+        preallocate (bool): Whether to reserve the file's size on disk before writing.
+        manifest (Optional[LibraryManifest]): The manifest to record the file's checksum in.
+        archive (Optional[ArchiveWriter]): The archive to write the file into instead of the download folder.
+            The file is skipped if the archive already has it.
 
     Returns:
         int: FILE_DOWNLOADED, FILE_EXISTS, or FAILED_TO_DOWNLOAD.
     """
-    global download_file
-    global download_file_expected_size
     download_file = download_folder + "/" + file_name
     abs_download_path = os.path.abspath(download_file)
-    os.makedirs(download_folder, exist_ok = True)
-    if os.path.exists(download_file) and not force_download:
-        user_response = None
+    if archive:
+        if archive.contains(download_file):
+            print(f"\r{YELLOW}{archive.entry_name(download_file)} is already in the archive '{os.path.abspath(archive.path)}'; skipping.{RESET}")
+            return FILE_EXISTS
+        return stream_to_file(url, base_url, download_file, file_name, timeouts, log_errors, fsync_policy, preallocate, None, archive)
+    # The file may have been downloaded with or without session folders, so look under both layouts.
+    existing_file = find_existing(download_file)
+    if existing_file and not force_download and os.path.abspath(existing_file) != abs_download_path:
+        print(f"\r{YELLOW}File already exists at path '{os.path.abspath(existing_file)}'; cancelling download. "
+              f"Use relayout to move your papers to one layout, or -f or --force to download it again.{RESET}")
+        return FILE_EXISTS
+    if existing_file and not force_download:
         if force_download is not None: #This means force download was purposefully set to False
             print(f"\r{YELLOW}File already exists at path '{abs_download_path}'; cancelling download. Use -f or --force to overwrite.{RESET}")
             return FILE_EXISTS
-        while (not user_response) or user_response.lower() != "y" or user_response.lower() != "n":
-            print(f"\rFile at path {YELLOW}'{abs_download_path}'{RESET} already exists.")
+        if not ask_to_overwrite(download_file):
+            return FILE_EXISTS
+    os.makedirs(download_folder, exist_ok = True)
+    # Threads of this process asking for the same file share one download, and other processes wait for it.
+    return download_flight.do(abs_download_path, lambda: claimed_download(url, base_url, download_file, file_name, timeouts,
+                                                                          log_errors, fsync_policy, preallocate, manifest))
+
+def ask_to_overwrite(path: str) -> bool:
+    """
+    Asks the user whether to overwrite a file which already exists.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        bool: True if the file should be overwritten.
+    """
+    abs_path = os.path.abspath(path)
+    while True:
+        print(f"\rFile at path {YELLOW}'{abs_path}'{RESET} already exists.")
+        with renderer.suspended():
             user_response = input("\rDo you want to overwrite this? [Y for yes and N for no]: ")
-            if user_response.lower() == "n":
-                sys.stdout.write('\x1b[1A')
-                sys.stdout.write('\x1b[2K')
-                sys.stdout.write('\x1b[1A')
-                sys.stdout.write('\x1b[2K')
-                sys.stdout.flush()
-                print(f"\rDownload of file to {YELLOW}'{abs_download_path}'{RESET} cancelled as it already exists.")
+        if user_response.lower() == "n":
+            clear_previous_lines(2)
+            print(f"\rDownload of file to {YELLOW}'{abs_path}'{RESET} cancelled as it already exists.")
+            return False
+        elif user_response.lower() == "y":
+            return True
+
+def claimed_download(
+    url: str,
+    base_url: str,
+    download_file: str,
+    file_name: str,
+    timeouts: Tuple[int, int],
+    log_errors: bool,
+    fsync_policy: str,
+    preallocate: bool,
+    manifest: Optional[LibraryManifest]
+) -> int:
+    """
+    Downloads a file while holding the claim on it, so no other process on the machine downloads it at the same time.
+    If another process is already downloading it, waits for that download instead of starting another.
+
+    Args:
+        url (str): The URL to download from.
+        base_url (str): The base URL (for error messages).
+        download_file (str): The path to save the file to.
+        file_name (str): The name of the file.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        log_errors (bool): Whether to print errors.
+        fsync_policy (str): One of FSYNC_POLICIES, controlling how the file is flushed to disk.
+        preallocate (bool): Whether to reserve the file's size on disk before writing.
+        manifest (Optional[LibraryManifest]): The manifest to record the file's checksum in.
+
+    Returns:
+        int: FILE_DOWNLOADED, FILE_EXISTS, or FAILED_TO_DOWNLOAD.
+    """
+    abs_download_path = os.path.abspath(download_file)
+    def on_wait(first: bool) -> None:
+        check_current_download() # Waiting can be cancelled like downloading.
+        if first:
+            print(f"\rWaiting for another download of {YELLOW}{file_name}{RESET} to finish...")
+    try:
+        claim = DownloadClaim(CLAIMS_FOLDER, download_file, on_wait)
+        with claim:
+            if claim.published_meanwhile():
+                print(f"\r✅{GREEN} {file_name} was saved to {abs_download_path} by another download.{RESET}")
                 return FILE_EXISTS
-            elif user_response.lower() == "y":
-                break
+            return stream_to_file(url, base_url, download_file, file_name, timeouts, log_errors, fsync_policy, preallocate, manifest)
+    except OSError:
+        # The claims folder cannot be written to, so download without a claim (stream_to_file handles its own errors).
+        return stream_to_file(url, base_url, download_file, file_name, timeouts, log_errors, fsync_policy, preallocate, manifest)
+
+def stream_to_file(
+    url: str,
+    base_url: str,
+    download_file: str,
+    file_name: str,
+    timeouts: Tuple[int, int],
+    log_errors: bool,
+    fsync_policy: str,
+    preallocate: bool,
+    manifest: Optional[LibraryManifest],
+    archive: Optional[ArchiveWriter] = None
+) -> int:
+    """
+    Streams a download into a temporary file (or an archive entry), verifies it and publishes it, printing any errors.
+
+    Args:
+        url (str): The URL to download from.
+        base_url (str): The base URL (for error messages).
+        download_file (str): The path to save the file to.
+        file_name (str): The name of the file.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        log_errors (bool): Whether to print errors.
+        fsync_policy (str): One of FSYNC_POLICIES, controlling how the file is flushed to disk.
+        preallocate (bool): Whether to reserve the file's size on disk before writing.
+        manifest (Optional[LibraryManifest]): The manifest to record the file's checksum in.
+        archive (Optional[ArchiveWriter]): The archive to write the file into instead of download_file.
+
+    Returns:
+        int: FILE_DOWNLOADED or FAILED_TO_DOWNLOAD.
+    """
+    abs_download_path = os.path.abspath(download_file)
     try:
-        with requests.get(url, stream = True, timeout = timeouts) as response:
-            response.raise_for_status()
-            download_file_expected_size = int(response.headers.get('content-length', 0))
-            chunk_size = 8192 # Read in 8KB chunks
-            downloaded = 0
-            update_threshold = 64 * 1024 # Update the percentage every 64KB
-            update_interval = 0.5 # Have an update interval so the download does not appear frozen on very slow connections.
-            last_update_time = time.time()
-            progressed_bytes = 0
-                
-            with open(download_file, 'wb') as f:
-                sys.stdout.write('\x1b[1A')  # Move cursor up
-                sys.stdout.write('\x1b[2K')
-                for chunk in response.iter_content(chunk_size = chunk_size):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        progressed_bytes += len(chunk)
-                        now = time.time()
-                        if progressed_bytes >= update_threshold or now - last_update_time >= update_interval:
-                            percent = (downloaded / download_file_expected_size) * 100 if download_file_expected_size else 0
-                            sys.stdout.write('\x1b[2K')  # Clear entire line
-                            sys.stdout.write(f"\r📥 Downloading {file_name}... ({int(percent):d})%")
-                            sys.stdout.flush() 
-                            progressed_bytes = 0
-                            last_update_time = now
-            sys.stdout.write('\x1b[2K')  # Clear entire line 
-            sys.stdout.write(f"\r✅{GREEN} {file_name} saved to: {abs_download_path}{RESET}\n")
-            sys.stdout.flush()
-            download_file = None
-            download_file_expected_size = 0
+        # The renderer draws the progress of every download from its own thread, so this only counts bytes.
+        transfers = []
+        def progress(received: int, expected_size: int) -> None:
+            if not transfers:
+                transfers.append(renderer.start(file_name, expected_size))
+            transfers[0].update(received - transfers[0].done)
+        try:
+            size, sha256 = fetch_to_file(url, download_file, timeouts, fsync_policy, preallocate, progress, archive = archive)
+        finally:
+            if transfers:
+                renderer.finish(transfers[0])
+        if archive:
+            print(f"\r✅{GREEN} {file_name} saved to archive: {os.path.abspath(archive.path)}{RESET}")
             return FILE_DOWNLOADED
+        if manifest:
+            manifest.record(download_file, size, sha256)
+        for listener in download_listeners:
+            listener(abs_download_path)
+        print(f"\r✅{GREEN} {file_name} saved to: {abs_download_path}{RESET}")
+        return FILE_DOWNLOADED
+    except Timeout as timeout_err:
+        if not log_errors:
+            return FAILED_TO_DOWNLOAD
+        print_error(f"Timed out downloading {YELLOW}{url}{RED}", f"\n{timeout_err}\n{YELLOW}The website may be busy; try again later.{RESET}")
+        return FAILED_TO_DOWNLOAD
     except ConnectionError as conn_err:
         if not log_errors:
             return FAILED_TO_DOWNLOAD
-        sys.stdout.write('\x1b[2K')
         print_error(f"Connection error while downloading {YELLOW}{url}{RED}", f"\n{conn_err}\n{YELLOW}Make sure you are connected to the internet.{RESET}")
         return FAILED_TO_DOWNLOAD
     except HTTPError as http_err:
         if not log_errors:
             return FAILED_TO_DOWNLOAD
-        sys.stdout.write('\x1b[2K')
         print_error("HTTP error downloading", f"\n{http_err}\n{YELLOW}This paper might not be on {base_url}{RESET}")
         return FAILED_TO_DOWNLOAD
+    except (IncompleteDownloadError, IntegrityError) as integrity_err:
+        if not log_errors:
+            return FAILED_TO_DOWNLOAD
+        print_error(f"Invalid download of {YELLOW}{url}{RED}", f"\n{integrity_err}\n{YELLOW}The downloaded file was discarded.{RESET}")
+        return FAILED_TO_DOWNLOAD
     except (PermissionError, FileNotFoundError, OSError) as file_err:
-        sys.stdout.write('\x1b[2K')
         print_error("File system error", f"\n{file_err}")
         return FAILED_TO_DOWNLOAD 
     except Exception as err:
-        sys.stdout.write('\x1b[2K')
         print_error("Unexpected error occured while downloading", f"\n{err}")
         return FAILED_TO_DOWNLOAD
-    
-    finally:
-        delete_incomplete_download()
+
+def fetch_to_file(
+    url: str,
+    download_file: str,
+    timeouts: Tuple[int, int],
+    fsync_policy: str = FSYNC_POLICY,
+    preallocate: bool = PREALLOCATE_DOWNLOADS,
+    progress: Optional[Callable[[int, int], None]] = None,
+    pool: Optional[MirrorPool] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+    archive: Optional[ArchiveWriter] = None
+) -> Tuple[int, str]:
+    """
+    Streams a download into a temporary file (or an archive entry), verifies it and publishes it, without printing anything.
+
+    Args:
+        url (str): The URL to download from.
+        download_file (str): The path to save the file to.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        fsync_policy (str): One of FSYNC_POLICIES, controlling how the file is flushed to disk.
+        preallocate (bool): Whether to reserve the file's size on disk before writing.
+        progress (Optional[Callable[[int, int], None]]): Called with the bytes received so far and the expected size
+            (0 if unknown), first when the response arrives and then after every chunk.
+        pool (Optional[MirrorPool]): The mirrors to download from. Defaults to the shared mirror pool.
+        limiter (Optional[AdaptiveLimiter]): The limiter of requests to each host. Defaults to the shared limiter.
+        archive (Optional[ArchiveWriter]): The archive to write the file into instead of download_file.
+
+    Returns:
+        Tuple[int, str]: The size of the file in bytes and its SHA-256 checksum.
+
+    Raises:
+        Timeout, ConnectionError, HTTPError: If the download failed.
+        IncompleteDownloadError, IntegrityError: If the download was not a whole file; nothing is published.
+        OSError: If the file could not be written.
+    """
+    pool = pool or mirror_pool
+    limiter = limiter or host_limits
+    # The slot is taken on the host of the mirror the request goes to, not the configured website.
+    url = pool.locate(url)
+    with limiter.slot(url, check_current_download) as slot, \
+         pool.get(url, slot.limiter.timeouts(timeouts), stream = True) as response:
+        slot.record(response)
+        response.raise_for_status()
+        expected_size = int(response.headers.get('content-length', 0))
+        verifier = StreamVerifier()
+        # Give up on a download running far slower than downloads from this host usually do, rather than after a fixed time.
+        # Downloads held to a job's bandwidth schedule are slow on purpose, so they have no deadline and are not measured.
+        rate_limited = current_job_rate_limited()
+        deadline = None if rate_limited else slot.limiter.deadline(expected_size, slot.limiter.timeouts(timeouts)[1])
+        body_started = time.monotonic()
+
+        def check() -> None:
+            check_current_download(slot.release) # Pause or cancel between chunks, giving back the host's slot while paused
+            if deadline and time.monotonic() - body_started > deadline:
+                raise Timeout(f"Download did not finish within {deadline:.0f} seconds")
+
+        if progress:
+            progress(0, expected_size)
+        writer = (ArchiveEntryWriter(archive, download_file, expected_size) if archive
+                  else DownloadWriter(download_file, expected_size, fsync_policy, preallocate))
+        with writer:
+            segmented = False
+            if not archive and not rate_limited and ranges_supported(response, expected_size):
+                # Large files are fetched in parts over several connections, if the host has room for them.
+                download = SegmentedDownload(url, writer, expected_size, pool, slot.limiter, slot.limiter.timeouts(timeouts))
+                segmented = download.run(response, check, lambda received: progress(received, expected_size) if progress else None)
+            if segmented:
+                # The parts arrived out of order, so the finished file is read back to check it.
+                writer.flush()
+                with open(writer.temp_path, "rb") as file:
+                    for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        verifier.update(chunk)
+            else:
+                for chunk in response.iter_content(chunk_size = DOWNLOAD_CHUNK_SIZE):
+                    check()
+                    if chunk:
+                        writer.write(chunk)
+                        verifier.update(chunk)
+                        if progress:
+                            progress(verifier.size, expected_size)
+                        # Keep to the job's bandwidth schedule, giving back the host's slot before waiting on purpose.
+                        throttle_current_job(len(chunk), slot.release)
+            sha256 = verifier.verify(os.path.basename(download_file), expected_size)
+            writer.publish()
+        if not rate_limited and slot.held:
+            slot.limiter.transferred(verifier.size, time.monotonic() - body_started)
+        return verifier.size, sha256
 
 def delete_incomplete_download() -> None:
     """
-    Deletes an incomplete download file if the download did not finish.
+    Deletes the temporary files of downloads which did not finish and flushes any batched writes to disk.
+    Files at their final path are always complete, so they are never touched.
 
     Returns:
         None
     """
-    # Check if download completed
-    if (not download_file) or (not os.path.exists(download_file)) or os.path.getsize(download_file) >= download_file_expected_size:
-        return
     try:
-        os.remove(download_file)
+        abort_active_downloads()
+        flush_pending_syncs()
     except Exception as cleanup_err:
         # Shouldn't ever really happen
         print_error("Failed to clean up partial file", f"\n{cleanup_err}")
@@ -149,9 +353,7 @@ def safe_get_response(url: str, timeouts: Tuple[int, int], print_output: bool =
         Optional[requests.Response]: The response object, or None if failed.
     """
     try:
-        response = requests.get(url, timeout = timeouts)
-        response.raise_for_status()
-        return response
+        return fetch_page(url, timeouts)
     except ConnectionError as conn_err:
         if not print_output:
             return
@@ -165,6 +367,36 @@ def safe_get_response(url: str, timeouts: Tuple[int, int], print_output: bool =
             return
         print_error("Unexpected error occured", f"\n{err}")
     
+def fetch_page(
+    url: str,
+    timeouts: Tuple[int, int],
+    pool: Optional[MirrorPool] = None,
+    limiter: Optional[AdaptiveLimiter] = None
+) -> requests.Response:
+    """
+    Gets an index page through the mirrors without printing anything.
+
+    Args:
+        url (str): The URL to request.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        pool (Optional[MirrorPool]): The mirrors to request the page from. Defaults to the shared mirror pool.
+        limiter (Optional[AdaptiveLimiter]): The limiter of requests to each host. Defaults to the shared limiter.
+
+    Returns:
+        requests.Response: The response object.
+
+    Raises:
+        Timeout, ConnectionError, HTTPError: If the request failed.
+    """
+    pool = pool or mirror_pool
+    limiter = limiter or host_limits
+    url = pool.locate(url) # The slot is taken on the host of the mirror the request goes to.
+    with limiter.slot(url, check_current_download) as slot:
+        response = pool.get(url, slot.limiter.timeouts(timeouts), hedge = True) # Only index pages are fetched here, so they can be hedged.
+        slot.record(response)
+    response.raise_for_status()
+    return response
+
 def get_response(url: str, timeouts: Tuple[int, int], print_output: bool = True) -> requests.Response:
     """
     Gets a response from a URL or exits if it fails.
@@ -185,7 +417,12 @@ def get_response(url: str, timeouts: Tuple[int, int], print_output: bool = True)
         raise SystemExit(1)
     return response
 
-def safe_get_html(url: str, timeouts: Tuple[int, int], print_output: bool = True) -> Optional[BeautifulSoup]:
+def safe_get_html(
+    url: str,
+    timeouts: Tuple[int, int],
+    print_output: bool = True,
+    on_fetch: Optional[Callable[[int], None]] = None
+) -> Optional[BeautifulSoup]:
     """
     Safely gets and parses HTML from a URL.
 
@@ -193,16 +430,26 @@ def safe_get_html(url: str, timeouts: Tuple[int, int], print_output: bool = True
         url (str): The URL to request.
         timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
         print_output (bool): Whether to print errors.
+        on_fetch (Optional[Callable[[int], None]]): Called with the size of the page in bytes (0 if the request failed)
+            when the page is requested from the website, rather than read from the cache shared between processes.
 
     Returns:
         Optional[BeautifulSoup]: The parsed HTML, or None if failed.
     """
-    try:
+    def fetch() -> Optional[str]:
         response = safe_get_response(url, timeouts, print_output)
+        if on_fetch:
+            on_fetch(len(response.content) if response else 0)
         if not response:
             return None
         response.encoding = "utf-8"
-        return BeautifulSoup(response.text, 'html.parser') # Parse the text as html
+        return response.text
+    try:
+        # Pages are shared through a cache on disk, so other threads and processes asking for the same page wait for one fetch.
+        text = page_flight.do(url, lambda: shared_pages.get_or_fetch(url, fetch))
+        if text is None:
+            return None
+        return BeautifulSoup(text, 'html.parser') # Parse the text as html
     except FeatureNotFound as parser_err:
         if not print_output:
             return
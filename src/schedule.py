@@ -0,0 +1,203 @@
+import datetime
+import re
+import threading
+import time
+from typing import List, NamedTuple, Optional
+from constants import THROTTLE_BURST_SECONDS
+
+RATE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*(b|k|kb|m|mb)?(?:/s)?$")
+WINDOW_PATTERN = re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})(?:=(.+))?$")
+RATE_UNITS = {"b": 1, "k": 1024, "kb": 1024, "m": 1024 * 1024, "mb": 1024 * 1024}
+
+class TimeWindow(NamedTuple):
+    """
+    A time of day during which a job may download at a given rate.
+
+    Attributes:
+        start (int): The start of the window, in minutes after midnight.
+        end (int): The end of the window, in minutes after midnight (up to 24:00). Windows with an end
+            before their start go on past midnight (e.g. 18:00-07:00).
+        rate (Optional[float]): The bytes per second allowed during the window, 0 to pause, or None for full speed.
+    """
+    start: int
+    end: int
+    rate: Optional[float]
+
+    def contains(self, minute: int) -> bool:
+        """
+        Check whether a time of day is in the window.
+
+        Args:
+            minute (int): The time of day, in minutes after midnight.
+
+        Returns:
+            bool: True if the time is in the window.
+        """
+        if self.start < self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+def parse_rate(value: str) -> Optional[float]:
+    """
+    Parse a download rate.
+
+    Args:
+        value (str): 'full', 'pause', or a number of bytes per second with an optional unit (B, K/KB or M/MB,
+            defaulting to KB), e.g. '100KB' or '1.5M/s'.
+
+    Returns:
+        Optional[float]: The bytes per second, 0 to pause, or None for full speed.
+
+    Raises:
+        ValueError: If the rate is not valid.
+    """
+    value = value.strip().lower()
+    if value in ("full", "unlimited"):
+        return None
+    if value in ("pause", "off"):
+        return 0
+    match = RATE_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Invalid rate '{value}'")
+    return float(match.group(1)) * RATE_UNITS[match.group(2) or "kb"]
+
+def format_rate(rate: Optional[float]) -> str:
+    """
+    Format a download rate for display.
+
+    Args:
+        rate (Optional[float]): The bytes per second, 0 to pause, or None for full speed.
+
+    Returns:
+        str: The rate, e.g. 'full speed', 'paused' or '100 KB/s'.
+    """
+    if rate is None:
+        return "full speed"
+    if not rate:
+        return "paused"
+    for unit in ("B", "KB", "MB"):
+        if rate < 1024 or unit == "MB":
+            return f"{rate:.0f} {unit}/s"
+        rate /= 1024
+    return f"{rate:.0f} MB/s"
+
+class BandwidthSchedule:
+    """
+    When a job may download, and how fast: a rate for each time window, and one for the rest of the day.
+
+    Written as comma separated windows, each with an optional rate (full speed if not given), and
+    optionally a rate for outside every window (paused if not given), e.g. '18:00-07:00,100KB' downloads
+    at full speed from 18:00 to 07:00 and at 100 KB/s the rest of the day, and '18:00-07:00' only downloads
+    from 18:00 to 07:00. The first window containing a time gives its rate.
+
+    Attributes:
+        spec (str): The schedule as it was written.
+        windows (List[TimeWindow]): The windows, in the order they were written.
+        other_rate (Optional[float]): The rate outside every window.
+    """
+
+    def __init__(self, spec: str) -> None:
+        """
+        Initialize the BandwidthSchedule.
+
+        Args:
+            spec (str): The schedule, e.g. '18:00-07:00,100KB'.
+
+        Raises:
+            ValueError: If the schedule is not valid.
+        """
+        self.spec: str = spec
+        self.windows: List[TimeWindow] = []
+        self.other_rate: Optional[float] = 0
+        parts = [part.strip() for part in spec.split(",") if part.strip()]
+        for index, part in enumerate(parts):
+            match = WINDOW_PATTERN.match(part)
+            if match:
+                start_hour, start_minute, end_hour, end_minute, rate = match.groups()
+                start = int(start_hour) * 60 + int(start_minute)
+                end = int(end_hour) * 60 + int(end_minute)
+                if start >= 24 * 60 or end > 24 * 60 or int(start_minute) > 59 or int(end_minute) > 59:
+                    raise ValueError(f"Invalid time in '{part}'")
+                if start == end:
+                    raise ValueError(f"Window '{part}' is empty")
+                self.windows.append(TimeWindow(start, end, parse_rate(rate) if rate else None))
+            elif index == len(parts) - 1:
+                self.other_rate = parse_rate(part) # Only the last part may be a rate on its own.
+            else:
+                raise ValueError(f"Invalid window '{part}'; windows are written as HH:MM-HH:MM")
+        if not self.windows:
+            raise ValueError("The schedule has no time windows")
+
+    def rate_at(self, when: datetime.datetime) -> Optional[float]:
+        """
+        Get the rate allowed at a time.
+
+        Args:
+            when (datetime.datetime): The time.
+
+        Returns:
+            Optional[float]: The bytes per second, 0 if paused, or None for full speed.
+        """
+        minute = when.hour * 60 + when.minute
+        return next((window.rate for window in self.windows if window.contains(minute)), self.other_rate)
+
+    def next_change(self, when: datetime.datetime) -> datetime.datetime:
+        """
+        Get the next time the rate may change, i.e. the next start or end of a window.
+
+        Args:
+            when (datetime.datetime): The time to look from.
+
+        Returns:
+            datetime.datetime: The time of the change.
+        """
+        minute = when.hour * 60 + when.minute
+        boundaries = {boundary % (24 * 60) for window in self.windows for boundary in (window.start, window.end)}
+        wait = min((boundary - minute - 1) % (24 * 60) + 1 for boundary in boundaries)
+        return when.replace(second = 0, microsecond = 0) + datetime.timedelta(minutes = wait)
+
+    def describe(self, when: datetime.datetime) -> str:
+        """
+        Describe what the schedule allows at a time, for display.
+
+        Args:
+            when (datetime.datetime): The time.
+
+        Returns:
+            str: e.g. 'paused until 18:00'.
+        """
+        return f"{format_rate(self.rate_at(when))} until {self.next_change(when):%H:%M}"
+
+class RateLimiter:
+    """
+    A token bucket limiting the bytes downloaded per second, shared by every download of a job.
+    Up to THROTTLE_BURST_SECONDS' worth of bytes can be received at once after a quiet spell.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the RateLimiter.
+        """
+        self._lock = threading.Lock()
+        self._allowance: float = 0.0
+        self._updated: float = time.monotonic()
+
+    def delay(self, size: int, rate: Optional[float]) -> float:
+        """
+        Take bytes from the bucket.
+
+        Args:
+            size (int): The number of bytes received.
+            rate (Optional[float]): The bytes per second allowed now, or None (or 0) for no limit.
+
+        Returns:
+            float: The seconds to wait before receiving more, to keep to the rate.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not rate:
+                self._allowance, self._updated = 0.0, now
+                return 0.0
+            self._allowance = min(rate * THROTTLE_BURST_SECONDS, self._allowance + (now - self._updated) * rate) - size
+            self._updated = now
+            return -self._allowance / rate if self._allowance < 0 else 0.0
@@ -0,0 +1,376 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from constants import SEARCH_INDEX_FILE_NAME, SEARCH_COMMIT_BATCH, SEARCH_INDEX_DELAY, SEARCH_SNIPPET_TOKENS
+from papercode import parse_paper_code
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None # Searching is optional, so pypdf is only needed for the 'search' command.
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS papers (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    subject_code TEXT NOT NULL,
+    session TEXT NOT NULL,
+    year TEXT NOT NULL,
+    paper_type TEXT NOT NULL,
+    paper_num TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS papers_filters ON papers (subject_code, year, session, paper_type);
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_text USING fts5 (text, tokenize = 'porter unicode61');
+"""
+
+class ExtractedText(NamedTuple):
+    """
+    The text of one PDF.
+
+    Attributes:
+        path (str): The path of the PDF.
+        text (str): The text of every page, or an empty string if it could not be read.
+        size (int): The size of the file in bytes.
+        mtime (float): The modification time of the file.
+        error (Optional[str]): Why the text could not be read, or None if it could.
+    """
+    path: str
+    text: str
+    size: int
+    mtime: float
+    error: Optional[str]
+
+class SearchResult(NamedTuple):
+    """
+    A paper matching a search.
+
+    Attributes:
+        path (str): The path of the paper.
+        snippet (str): The text around the match, with the matched words between SNIPPET_START and SNIPPET_END.
+    """
+    path: str
+    snippet: str
+
+SNIPPET_START: str = "\x02"
+SNIPPET_END: str = "\x03"
+
+def search_available() -> bool:
+    """
+    Check whether the PDF library needed to extract text is installed.
+
+    Returns:
+        bool: True if papers can be indexed.
+    """
+    return pypdf is not None
+
+def extract_text(path: str) -> ExtractedText:
+    """
+    Extract the text of a PDF. Runs in a worker process, so it must not print or touch shared state.
+
+    Args:
+        path (str): The path of the PDF.
+
+    Returns:
+        ExtractedText: The text of the PDF.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError as err:
+        return ExtractedText(path, "", 0, 0, str(err))
+    try:
+        reader = pypdf.PdfReader(path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+        return ExtractedText(path, text, stat.st_size, stat.st_mtime, None)
+    except Exception as err:
+        # Still recorded, so a broken file is not retried until it changes.
+        return ExtractedText(path, "", stat.st_size, stat.st_mtime, str(err))
+
+def extract_texts(paths: List[str], max_workers: Optional[int] = None) -> Iterator[ExtractedText]:
+    """
+    Extract the text of many PDFs in parallel across a process pool.
+
+    Args:
+        paths (List[str]): The paths of the PDFs.
+        max_workers (Optional[int]): The number of worker processes (defaults to the number of CPUs).
+
+    Returns:
+        Iterator[ExtractedText]: The text of each PDF, in the same order as the paths.
+    """
+    if len(paths) <= 1:
+        yield from map(extract_text, paths)
+        return
+    executor = ProcessPoolExecutor(max_workers = max_workers)
+    try:
+        yield from executor.map(extract_text, paths, chunksize = 16)
+    finally:
+        # Don't wait for the rest of the library if indexing was cancelled part way through.
+        executor.shutdown(cancel_futures = True)
+
+def build_query(terms: List[str]) -> str:
+    """
+    Build an FTS5 query matching papers containing all of the terms.
+    Each term is quoted so punctuation in it is searched for rather than treated as query syntax.
+
+    Args:
+        terms (List[str]): The words or phrases to search for.
+
+    Returns:
+        str: The FTS5 query.
+    """
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms if term.strip())
+
+class SearchIndex:
+    """
+    A persistent full-text index of the papers in a download folder, stored in an SQLite database
+    in the folder itself. SQLite's FTS5 module keeps an inverted index of the words in each paper,
+    so searches take milliseconds however large the library is, and the paper code fields are kept
+    in an indexed table so results can be filtered without reading any text.
+
+    Each thread uses its own connection, and the database is in WAL mode so searches are not
+    blocked while papers are being indexed.
+
+    Attributes:
+        library_folder (str): The download folder indexed.
+        path (str): The path of the database.
+    """
+
+    def __init__(self, library_folder: str) -> None:
+        """
+        Initialize the SearchIndex.
+
+        Args:
+            library_folder (str): The download folder to index.
+        """
+        self.library_folder: str = library_folder
+        self.path: str = os.path.join(library_folder, SEARCH_INDEX_FILE_NAME)
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Get the calling thread's connection to the database, creating the database if it does not exist.
+
+        Returns:
+            sqlite3.Connection: The connection.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(self.library_folder, exist_ok = True)
+            connection = sqlite3.connect(self.path, timeout = 30)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def relative_path(self, path: str) -> str:
+        """
+        Get the path of a file relative to the download folder, as stored in the index.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            str: The relative path, with '/' separators.
+        """
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.library_folder)).replace(os.sep, "/")
+
+    def stale_paths(self, paths: List[str]) -> List[str]:
+        """
+        Find the papers which are not indexed, or have changed since they were indexed.
+
+        Args:
+            paths (List[str]): The paths of the files. Files which are not past paper PDFs are ignored.
+
+        Returns:
+            List[str]: The paths of the papers to index.
+        """
+        indexed = {path: (size, mtime) for path, size, mtime in self.connection().execute("SELECT path, size, mtime FROM papers")}
+        stale = []
+        for path in paths:
+            if not path.lower().endswith(".pdf") or not parse_paper_code(path):
+                continue
+            if self.relative_path(path).startswith("../"):
+                continue # Downloaded before the download folder was changed.
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if indexed.get(self.relative_path(path)) != (stat.st_size, stat.st_mtime):
+                stale.append(path)
+        return stale
+
+    def add(self, extracted: ExtractedText) -> None:
+        """
+        Add or replace a paper in the index. The caller commits.
+
+        Args:
+            extracted (ExtractedText): The text of the paper.
+        """
+        paper_code = parse_paper_code(extracted.path)
+        if not paper_code:
+            return
+        connection = self.connection()
+        relative_path = self.relative_path(extracted.path)
+        self.remove(relative_path)
+        cursor = connection.execute(
+            "INSERT INTO papers (path, subject_code, session, year, paper_type, paper_num, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (relative_path, paper_code.subject_code, paper_code.session, paper_code.year[:2], paper_code.paper_type,
+             paper_code.paper_num, extracted.size, extracted.mtime))
+        connection.execute("INSERT INTO papers_text (rowid, text) VALUES (?, ?)", (cursor.lastrowid, extracted.text))
+
+    def remove(self, relative_path: str) -> None:
+        """
+        Remove a paper from the index. The caller commits.
+
+        Args:
+            relative_path (str): The path of the paper relative to the download folder.
+        """
+        connection = self.connection()
+        row = connection.execute("SELECT id FROM papers WHERE path = ?", (relative_path,)).fetchone()
+        if row:
+            connection.execute("DELETE FROM papers_text WHERE rowid = ?", row)
+            connection.execute("DELETE FROM papers WHERE id = ?", row)
+
+    def rename(self, moves: List[Tuple[str, str]]) -> None:
+        """
+        Record that papers were moved within the download folder, so they do not need indexing again.
+
+        Args:
+            moves (List[Tuple[str, str]]): The path each paper was at and the path it is at now.
+        """
+        connection = self.connection()
+        connection.executemany("UPDATE papers SET path = ? WHERE path = ?",
+                               [(self.relative_path(new_path), self.relative_path(old_path)) for old_path, new_path in moves])
+        connection.commit()
+
+    def update(self, paths: List[str], remove_missing: bool = False) -> Iterator[ExtractedText]:
+        """
+        Index the papers which are new or have changed, extracting their text across a process pool.
+
+        Args:
+            paths (List[str]): The paths of the files to consider.
+            remove_missing (bool): Whether to also remove indexed papers which are not in paths,
+                e.g. when paths is every file in the download folder.
+
+        Returns:
+            Iterator[ExtractedText]: The text of each paper indexed, as it is indexed.
+        """
+        connection = self.connection()
+        if remove_missing:
+            present = {self.relative_path(path) for path in paths}
+            for (relative_path,) in connection.execute("SELECT path FROM papers").fetchall():
+                if relative_path not in present:
+                    self.remove(relative_path)
+            connection.commit()
+        pending = 0
+        try:
+            for extracted in extract_texts(self.stale_paths(paths)):
+                self.add(extracted)
+                pending += 1
+                if pending >= SEARCH_COMMIT_BATCH:
+                    connection.commit()
+                    pending = 0
+                yield extracted
+        finally:
+            connection.commit()
+
+    def count(self) -> int:
+        """
+        Get the number of papers in the index.
+
+        Returns:
+            int: The number of papers.
+        """
+        return self.connection().execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+    def search(
+        self,
+        terms: List[str],
+        subject_code: Optional[str] = None,
+        year: Optional[str] = None,
+        session: Optional[str] = None,
+        paper_types: Optional[Set[str]] = None,
+        limit: int = 20
+    ) -> List[SearchResult]:
+        """
+        Find the papers containing all of the terms, best matches first.
+
+        Args:
+            terms (List[str]): The words or phrases to search for.
+            subject_code (Optional[str]): Only return papers for this subject.
+            year (Optional[str]): Only return papers from this 2 digit year.
+            session (Optional[str]): Only return papers from this session letter.
+            paper_types (Optional[Set[str]]): Only return papers of these types.
+            limit (int): The most results to return.
+
+        Returns:
+            List[SearchResult]: The matching papers.
+
+        Raises:
+            sqlite3.Error: If the query is invalid.
+        """
+        query = build_query(terms)
+        if not query:
+            return []
+        conditions = ["papers_text MATCH ?"]
+        parameters: List[object] = [query]
+        for column, value in (("subject_code", subject_code), ("year", year), ("session", session)):
+            if value:
+                conditions.append(f"papers.{column} = ?")
+                parameters.append(value)
+        if paper_types:
+            conditions.append(f"papers.paper_type IN ({', '.join('?' * len(paper_types))})")
+            parameters.extend(sorted(paper_types))
+        parameters.append(limit)
+        rows = self.connection().execute(
+            f"SELECT papers.path, snippet(papers_text, 0, '{SNIPPET_START}', '{SNIPPET_END}', '...', {SEARCH_SNIPPET_TOKENS}) "
+            f"FROM papers_text JOIN papers ON papers.id = papers_text.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY bm25(papers_text) LIMIT ?", parameters)
+        return [SearchResult(os.path.join(self.library_folder, *path.split("/")), snippet) for path, snippet in rows]
+
+class IndexUpdater:
+    """
+    Adds papers to a SearchIndex in the background as they are downloaded.
+
+    Paths are collected for SEARCH_INDEX_DELAY seconds after the first one arrives, so a
+    'getmany' indexes its papers in batches rather than one process pool per file.
+    """
+
+    def __init__(self, get_index: Callable[[], SearchIndex]) -> None:
+        """
+        Initialize the IndexUpdater and start its thread.
+
+        Args:
+            get_index (Callable[[], SearchIndex]): Returns the index to add papers to, which changes with the download folder.
+        """
+        self.get_index: Callable[[], SearchIndex] = get_index
+        self._pending: List[str] = []
+        self._condition = threading.Condition()
+        threading.Thread(target = self._work, daemon = True).start()
+
+    def add(self, path: str) -> None:
+        """
+        Queue a downloaded file to be indexed.
+
+        Args:
+            path (str): The path of the file.
+        """
+        with self._condition:
+            self._pending.append(path)
+            self._condition.notify()
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+            threading.Event().wait(SEARCH_INDEX_DELAY)
+            with self._condition:
+                paths, self._pending = self._pending, []
+            try:
+                for _ in self.get_index().update(paths):
+                    pass
+            except (OSError, sqlite3.Error):
+                pass # The papers are picked up by the next 'search --reindex'.
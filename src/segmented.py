@@ -0,0 +1,241 @@
+import threading
+from typing import Callable, List, Optional, Tuple
+import requests
+from requests.exceptions import ConnectionError, RequestException, Timeout
+from constants import (DOWNLOAD_CHUNK_SIZE, SEGMENTED_MIN_SIZE, SEGMENT_CONNECTIONS, SEGMENT_ATTEMPTS, SEGMENT_POLL_INTERVAL)
+from congestion import HostLimiter, HostSlot
+from downloadwriter import DownloadWriter, IncompleteDownloadError
+from mirrors import MirrorPool
+
+class RangeNotSatisfiedError(IncompleteDownloadError):
+    """
+    Raised when the website answers a request for part of a file with something else, so retrying will not help.
+    """
+
+def ranges_supported(response: requests.Response, expected_size: int) -> bool:
+    """
+    Check whether a download is large enough to split into parts, and whether the website lets it be fetched in parts.
+
+    Args:
+        response (requests.Response): The response to a request for the whole file.
+        expected_size (int): The Content-Length of the response (0 if unknown).
+
+    Returns:
+        bool: True if the file can be downloaded over several connections.
+    """
+    return (response.status_code == 200 and expected_size >= SEGMENTED_MIN_SIZE
+            and response.headers.get("accept-ranges", "").lower() == "bytes"
+            and "content-encoding" not in response.headers) # Ranges of a compressed response are ranges of the compressed bytes.
+
+def split_ranges(size: int, count: int) -> List[Tuple[int, int]]:
+    """
+    Split a file into parts of (nearly) equal size.
+
+    Args:
+        size (int): The size of the file in bytes.
+        count (int): The number of parts.
+
+    Returns:
+        List[Tuple[int, int]]: The (start, end) of each part, end exclusive.
+    """
+    bounds = [size * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(count)]
+
+class Segment:
+    """
+    One part of a file being downloaded in parts.
+
+    Attributes:
+        start (int): The offset of the part in the file.
+        end (int): The offset just after the part.
+        received (int): The number of bytes of the part written so far.
+        error (Optional[BaseException]): Why the part could not be downloaded, if it could not.
+    """
+
+    def __init__(self, start: int, end: int) -> None:
+        """
+        Initialize the Segment.
+
+        Args:
+            start (int): The offset of the part in the file.
+            end (int): The offset just after the part.
+        """
+        self.start: int = start
+        self.end: int = end
+        self.received: int = 0
+        self.error: Optional[BaseException] = None
+
+    @property
+    def offset(self) -> int:
+        return self.start + self.received
+
+    @property
+    def done(self) -> bool:
+        return self.offset >= self.end
+
+class SegmentedDownload:
+    """
+    Downloads a large file as several byte ranges at once, so one slow connection does not set the speed.
+
+    The response already received for the whole file is read for the first part, and each other part is requested
+    with a Range header on a connection of its own, through the mirror pool's session so the connections are reused.
+    The extra connections only use slots of the host's limiter which are free, so a busy host is not asked for more.
+    Each part is written at its offset in the (preallocated) temporary file, and a part which fails is retried up to
+    SEGMENT_ATTEMPTS times, carrying on from the last byte received.
+
+    The thread calling run() does all the checking (e.g. for the job being cancelled) and progress reporting;
+    the other parts stop as soon as it stops.
+
+    Attributes:
+        url (str): The URL of the file.
+        size (int): The size of the file in bytes.
+        received (int): The number of bytes written so far, across every part.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        writer: DownloadWriter,
+        size: int,
+        pool: MirrorPool,
+        host: HostLimiter,
+        timeouts: Tuple[float, float]
+    ) -> None:
+        """
+        Initialize the SegmentedDownload.
+
+        Args:
+            url (str): The URL of the file.
+            writer (DownloadWriter): The writer of the temporary file.
+            size (int): The size of the file in bytes.
+            pool (MirrorPool): The mirrors to request the parts from.
+            host (HostLimiter): The limiter of the file's host.
+            timeouts (Tuple[float, float]): (connect_timeout, read_timeout) for each request.
+        """
+        self.url: str = url
+        self.size: int = size
+        self.received: int = 0
+        self._writer = writer
+        self._pool = pool
+        self._host = host
+        self._timeouts = timeouts
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self, response: requests.Response, check: Callable[[], None], on_progress: Callable[[int], None]) -> bool:
+        """
+        Download the file in parts, if the host has room for more connections.
+
+        Args:
+            response (requests.Response): The response to the request for the whole file, of which nothing has been read.
+            check (Callable[[], None]): Called regularly; it may raise to stop the download (e.g. when the job is cancelled).
+            on_progress (Callable[[int], None]): Called with the number of bytes received so far, from the calling thread.
+
+        Returns:
+            bool: True if the file was downloaded, or False if no other connections were free, in which case
+                nothing was read from the response.
+
+        Raises:
+            RequestException, IncompleteDownloadError: If a part could not be downloaded.
+            OSError: If the file could not be written.
+        """
+        extra = 0
+        while extra < SEGMENT_CONNECTIONS - 1 and self._host.try_acquire():
+            extra += 1
+        if not extra:
+            return False
+        self._writer.reserve(self.size)
+        segments = [Segment(start, end) for start, end in split_ranges(self.size, extra + 1)]
+        threads = [threading.Thread(target = self._run_reserved, args = (segment,), daemon = True) for segment in segments[1:]]
+        for thread in threads:
+            thread.start()
+        try:
+            self._run_segment(segments[0], response, check, on_progress)
+            while any(thread.is_alive() for thread in threads):
+                check()
+                on_progress(self.received)
+                if self._stop.wait(SEGMENT_POLL_INTERVAL):
+                    break # Another part failed.
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            # The writer must not be closed while the other parts may still write to it.
+            for thread in threads:
+                thread.join()
+        for segment in segments:
+            if segment.error:
+                raise segment.error
+        on_progress(self.received)
+        return True
+
+    def _run_reserved(self, segment: Segment) -> None:
+        try:
+            with HostSlot(self._host, reserved = True) as slot:
+                self._run_segment(segment, None, None, None, slot)
+        except BaseException as err:
+            segment.error = err
+            self._stop.set() # The file cannot be completed, so stop the other parts too.
+
+    def _run_segment(
+        self,
+        segment: Segment,
+        response: Optional[requests.Response],
+        check: Optional[Callable[[], None]],
+        on_progress: Optional[Callable[[int], None]],
+        slot: Optional[HostSlot] = None
+    ) -> None:
+        attempts = 0
+        while not segment.done and not self._stop.is_set():
+            attempts += 1
+            try:
+                if response is None:
+                    response = self._request(segment, slot)
+                self._read(segment, response, check, on_progress)
+                if not segment.done and not self._stop.is_set():
+                    raise IncompleteDownloadError(f"Part ended after {segment.received} of {segment.end - segment.start} bytes")
+            except (RequestException, IncompleteDownloadError) as err:
+                if isinstance(err, (Timeout, ConnectionError)):
+                    self._host.overloaded()
+                if attempts >= SEGMENT_ATTEMPTS or isinstance(err, RangeNotSatisfiedError):
+                    raise
+            finally:
+                if response is not None:
+                    response.close() # The first part's response goes on past the part, so it is not read to the end.
+                    response = None
+
+    def _request(self, segment: Segment, slot: Optional[HostSlot]) -> requests.Response:
+        response = self._pool.get(self.url, self._timeouts, stream = True,
+                                  headers = {"Range": f"bytes={segment.offset}-{segment.end - 1}"})
+        if slot:
+            slot.record(response)
+        response.raise_for_status()
+        content_range = response.headers.get("content-range", "")
+        if response.status_code != 206 or not content_range.startswith(f"bytes {segment.offset}-"):
+            response.close()
+            raise RangeNotSatisfiedError(f"The website ignored the request for bytes {segment.offset}-{segment.end - 1}")
+        return response
+
+    def _read(
+        self,
+        segment: Segment,
+        response: requests.Response,
+        check: Optional[Callable[[], None]],
+        on_progress: Optional[Callable[[int], None]]
+    ) -> None:
+        for chunk in response.iter_content(chunk_size = DOWNLOAD_CHUNK_SIZE):
+            if check:
+                check()
+            if self._stop.is_set():
+                return
+            chunk = chunk[:segment.end - segment.offset]
+            if not chunk:
+                continue
+            self._writer.write_at(segment.offset, chunk)
+            segment.received += len(chunk)
+            with self._lock:
+                self.received += len(chunk)
+            if on_progress:
+                on_progress(self.received)
+            if segment.done:
+                return
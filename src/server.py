@@ -0,0 +1,384 @@
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+import requests
+from requests.exceptions import RequestException
+from constants import SESSION_MAP, SERVE_INDEX_TTL, SERVE_CHUNK_SIZE
+from downloadwriter import DownloadWriter
+from integrity import StreamVerifier, IntegrityError, LibraryManifest
+from papercode import parse_paper_code
+
+class SharedFetch:
+    """
+    A single upstream fetch which any number of clients stream from while it downloads.
+
+    The body is written to a temporary file; each client reads up to the number of bytes
+    written so far and waits for more. The file is published once the fetch has finished
+    and the last client has stopped reading from it.
+
+    Attributes:
+        url (str): The upstream URL.
+        final_path (str): Where the body is published once complete.
+        status (int): The upstream HTTP status code (0 if the request failed).
+        content_type (str): The upstream Content-Type.
+        content_length (int): The upstream Content-Length (0 if unknown).
+        written (int): The number of bytes of the body received so far.
+        done (bool): Whether the fetch has finished.
+        failed (bool): Whether the fetch failed part way through.
+        sha256 (str): The checksum of the body once it has been published.
+    """
+
+    def __init__(self, url: str, final_path: str, timeouts: Tuple[int, int], on_finish) -> None:
+        """
+        Initialize the SharedFetch.
+
+        Args:
+            url (str): The upstream URL.
+            final_path (str): Where the body is published once complete.
+            timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+            on_finish: Called with this fetch once it is finished and published.
+        """
+        self.url: str = url
+        self.final_path: str = final_path
+        self.timeouts: Tuple[int, int] = timeouts
+        self.on_finish = on_finish
+        self.status: int = 0
+        self.content_type: str = "application/octet-stream"
+        self.content_length: int = 0
+        self.written: int = 0
+        self.done: bool = False
+        self.failed: bool = False
+        self.sha256: str = ""
+        self.temp_path: Optional[str] = None
+        self.readers: int = 0
+        self.headers_ready = threading.Event()
+        self.condition = threading.Condition()
+        self._writer: Optional[DownloadWriter] = None
+        self._verifier = StreamVerifier()
+        self._published: bool = False
+
+    def start(self) -> None:
+        """
+        Start fetching in a background thread, so the fetch completes even if the client that started it disconnects.
+        """
+        threading.Thread(target = self._run, daemon = True).start()
+
+    def _run(self) -> None:
+        try:
+            with requests.get(self.url, stream = True, timeout = self.timeouts) as response:
+                self.status = response.status_code
+                self.content_type = response.headers.get("content-type", self.content_type)
+                self.content_length = int(response.headers.get("content-length", 0))
+                if response.ok:
+                    os.makedirs(os.path.dirname(self.final_path), exist_ok = True)
+                    self._writer = DownloadWriter(self.final_path, self.content_length)
+                    self.temp_path = self._writer.temp_path
+                self.headers_ready.set()
+                if not self._writer:
+                    return
+                for chunk in response.iter_content(chunk_size = SERVE_CHUNK_SIZE):
+                    if chunk:
+                        self._writer.write(chunk)
+                        self._writer.flush() # Make the data visible to the clients reading the temporary file
+                        self._verifier.update(chunk)
+                        with self.condition:
+                            self.written += len(chunk)
+                            self.condition.notify_all()
+        except (RequestException, OSError):
+            self.failed = True
+        finally:
+            self.headers_ready.set()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+            self._release()
+
+    def acquire(self) -> bool:
+        """
+        Register a client which is about to read the body.
+
+        Returns:
+            bool: False if the fetch has already been published, so the client must not read from it.
+        """
+        with self.condition:
+            if self._published:
+                return False
+            self.readers += 1
+            return True
+
+    def release(self) -> None:
+        """
+        Unregister a client which has finished reading the body.
+        """
+        with self.condition:
+            self.readers -= 1
+        self._release()
+
+    def _release(self) -> None:
+        # Publish (or discard) only once nothing is reading the temporary file, as open files cannot be renamed on Windows.
+        with self.condition:
+            if not self.done or self.readers > 0 or self._published:
+                return
+            self._published = True
+        if self._writer:
+            try:
+                if self.failed:
+                    raise IntegrityError("Upstream fetch failed")
+                self.sha256 = self._verifier.verify(self.final_path, self.content_length)
+                self._writer.publish()
+            except (IntegrityError, OSError):
+                self.failed = True
+            finally:
+                self._writer.abort()
+        self.on_finish(self)
+
+    def read_from(self, f: BinaryIO, position: int, timeout: float) -> Optional[bytes]:
+        """
+        Read the next available part of the body, waiting for it to be downloaded.
+
+        Args:
+            f (BinaryIO): The client's handle on the temporary file.
+            position (int): The offset to read from.
+            timeout (float): How long to wait for more data.
+
+        Returns:
+            Optional[bytes]: The data (empty once the whole body has been read), or None if the fetch stalled or failed.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.written > position or self.done, timeout):
+                return None
+            available = self.written - position
+            if available <= 0:
+                return None if self.failed else b""
+        f.seek(position)
+        return f.read(min(available, SERVE_CHUNK_SIZE))
+
+def safe_path_part(part: str) -> bool:
+    """
+    Check whether a part of a request path can be used as the name of a file or folder in the library.
+
+    Args:
+        part (str): The part, between two '/'.
+
+    Returns:
+        bool: False if it could name a file outside its folder ('.', '..', or containing '/', '\\' or NUL).
+    """
+    return part not in (".", "..") and not any(char in part for char in "/\\\0")
+
+class PaperServer(ThreadingHTTPServer):
+    """
+    Serves the download library and the website's index pages over HTTP, with the same URL layout as the website,
+    so other machines can use it as their base URL.
+
+    Papers already in the library are sent straight from disk. Anything else is fetched from the upstream website
+    once, streamed to every client asking for it at the same time, and kept for the next client.
+
+    Attributes:
+        upstream_url (str): The base URL of the website.
+        library_folder (str): The download folder served.
+        cache_folder (str): The folder index pages are cached in.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout) for upstream requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], upstream_url: str, library_folder: str, cache_folder: str, timeouts: Tuple[int, int]) -> None:
+        """
+        Initialize the PaperServer.
+
+        Args:
+            address (Tuple[str, int]): The host and port to listen on.
+            upstream_url (str): The base URL of the website.
+            library_folder (str): The download folder to serve.
+            cache_folder (str): The folder to cache index pages in.
+            timeouts (Tuple[int, int]): (connect_timeout, read_timeout) for upstream requests.
+        """
+        super().__init__(address, PaperRequestHandler)
+        self.upstream_url: str = upstream_url.rstrip("/")
+        self.library_folder: str = library_folder
+        self.cache_folder: str = cache_folder
+        self.timeouts: Tuple[int, int] = timeouts
+        self.manifest: LibraryManifest = LibraryManifest(library_folder)
+        self.in_flight: Dict[str, SharedFetch] = {}
+        self.in_flight_lock = threading.Lock()
+
+    def is_served(self, path: str) -> bool:
+        """
+        Check whether a file is inside the library or cache folder, after following any symbolic links,
+        so it may be sent to clients or written with an upstream body.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            bool: True if the file is inside one of the folders served.
+        """
+        real_path = os.path.realpath(path)
+        for folder in (self.library_folder, self.cache_folder):
+            real_folder = os.path.realpath(folder)
+            if os.path.commonpath([real_folder, real_path]) == real_folder and real_path != real_folder:
+                return True
+        return False
+
+    def library_candidates(self, parts: List[str]) -> List[str]:
+        """
+        Get the paths a paper could be stored at in the library for a request path.
+
+        Args:
+            parts (List[str]): The request path split on '/', e.g. [exam, subject, year, file].
+
+        Returns:
+            List[str]: The candidate paths, with the unquoted session folder layout first. Empty if the path is not a paper.
+        """
+        paper_code = parse_paper_code(unquote(parts[-1])) if len(parts) >= 3 else None
+        if not paper_code:
+            return []
+        candidates = []
+        # Folder names are created from the links before they are quoted for the request (e.g. 'Specimen Papers'),
+        # so try the path unquoted and as requested.
+        for folder_parts in ([unquote(part) for part in parts], parts):
+            # The library layout is <subject>/<year>[/<session>]/<file>, or <subject>[/<session>]/<file> for papers listed on the subject page.
+            folder = os.path.join(self.library_folder, *folder_parts[1:-1])
+            for candidate in (os.path.join(folder, SESSION_MAP[paper_code.session], folder_parts[-1]), os.path.join(folder, folder_parts[-1])):
+                if candidate not in candidates:
+                    candidates.append(candidate)
+        return candidates
+
+    def index_cache_path(self, path: str) -> str:
+        """
+        Get the cache file for an index page.
+
+        Args:
+            path (str): The request path.
+
+        Returns:
+            str: The path of the cache file.
+        """
+        return os.path.join(self.cache_folder, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".html")
+
+    def shared_fetch(self, path: str, final_path: str) -> SharedFetch:
+        """
+        Get the in-flight upstream fetch for a path, starting one if there is none.
+
+        Args:
+            path (str): The request path.
+            final_path (str): Where the body should be stored once complete.
+
+        Returns:
+            SharedFetch: The fetch, already registered for the calling client.
+        """
+        with self.in_flight_lock:
+            fetch = self.in_flight.get(path)
+            if fetch and fetch.acquire():
+                return fetch
+            fetch = SharedFetch(self.upstream_url + path, final_path, self.timeouts, lambda finished: self.finish_fetch(path, finished))
+            self.in_flight[path] = fetch
+            fetch.acquire()
+            fetch.start()
+        return fetch
+
+    def finish_fetch(self, path: str, fetch: SharedFetch) -> None:
+        """
+        Forget a finished fetch and record newly stored papers in the library manifest.
+
+        Args:
+            path (str): The request path.
+            fetch (SharedFetch): The finished fetch.
+        """
+        with self.in_flight_lock:
+            if self.in_flight.get(path) is fetch:
+                del self.in_flight[path]
+        if not fetch.failed and fetch.status == 200 and fetch.final_path.startswith(self.library_folder):
+            self.manifest.record(fetch.final_path, fetch.written, fetch.sha256)
+
+class PaperRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles GET requests for a PaperServer.
+    """
+    server: PaperServer
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        parts = [part for part in path.split("/") if part]
+        # Parts are checked as the files are named, i.e. unquoted, so '%2e%2e' cannot leave the library either.
+        if any(not safe_path_part(part) or not safe_path_part(unquote(part)) for part in parts):
+            self.send_error(400)
+            return
+        candidates = self.server.library_candidates(parts)
+        if not all(self.server.is_served(candidate) for candidate in candidates):
+            self.send_error(400)
+            return
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                self.send_file(candidate, "application/pdf" if candidate.lower().endswith(".pdf") else "application/octet-stream")
+                return
+        if candidates:
+            self.stream_fetch(path, candidates[0])
+            return
+        cache_path = self.server.index_cache_path(path)
+        if not self.server.is_served(cache_path):
+            self.send_error(400)
+            return
+        if os.path.isfile(cache_path) and time.time() - os.path.getmtime(cache_path) < SERVE_INDEX_TTL:
+            self.send_file(cache_path, "text/html; charset=utf-8")
+            return
+        self.stream_fetch(path, cache_path)
+
+    def send_file(self, path: str, content_type: str) -> None:
+        """
+        Send a file from disk. socket.sendfile uses the zero-copy sendfile system call where available.
+
+        Args:
+            path (str): The path of the file.
+            content_type (str): The Content-Type to send.
+        """
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            try:
+                self.wfile.flush()
+                self.connection.sendfile(f)
+            except (ConnectionError, OSError):
+                pass # The client disconnected.
+
+    def stream_fetch(self, path: str, final_path: str) -> None:
+        """
+        Stream an upstream fetch to the client, sharing it with any other client requesting the same path.
+
+        Args:
+            path (str): The request path.
+            final_path (str): Where the body should be stored once complete.
+        """
+        fetch = self.server.shared_fetch(path, final_path)
+        try:
+            fetch.headers_ready.wait(self.server.timeouts[0] + self.server.timeouts[1])
+            if fetch.status != 200 or not fetch.temp_path:
+                self.send_error(fetch.status or 502)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", fetch.content_type)
+            if fetch.content_length:
+                self.send_header("Content-Length", str(fetch.content_length))
+            self.end_headers()
+            position = 0
+            with open(fetch.temp_path, "rb") as f:
+                while True:
+                    data = fetch.read_from(f, position, self.server.timeouts[1])
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    position += len(data)
+        except (ConnectionError, OSError):
+            pass # The client disconnected; the fetch carries on for the other clients.
+        finally:
+            fetch.release()
+
+    def log_message(self, format: str, *args) -> None:
+        # Keep the shell output readable; only errors are worth showing.
+        pass
@@ -0,0 +1,278 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+from constants import CLAIM_POLL_INTERVAL
+from store import FileLock, atomic_write_text, bucket_lock_path, key_lock_path
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Makes concurrent calls for the same key share one call: the first caller runs it and
+    every caller arriving while it runs waits for and gets the same result (or exception).
+
+    If the first caller is interrupted (e.g. its job is cancelled, or Ctrl+C is pressed),
+    the waiting callers are not interrupted with it; one of them makes the call instead.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the SingleFlight.
+        """
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, call: Callable[[], Any]) -> Any:
+        """
+        Run a call, or wait for the same call already running.
+
+        Args:
+            key (Hashable): Identifies the call, e.g. the URL being fetched.
+            call (Callable[[], Any]): The call to make.
+
+        Returns:
+            Any: The result of the call.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._flights[key] = flight
+            if leader:
+                try:
+                    flight.result = call()
+                except BaseException as err:
+                    flight.error = err
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+                return flight.result
+            flight.done.wait()
+            if flight.error is None:
+                return flight.result
+            if isinstance(flight.error, Exception):
+                raise flight.error
+            # The leader was interrupted rather than failing, so try again.
+
+class SharedPageCache:
+    """
+    Index pages cached on disk for a fixed time, shared by every shell and cron job on the machine.
+
+    Each entry is guarded by a file lock, so when several processes ask for the same missing page,
+    one fetches it while the others wait and then read what it wrote. Entries are written atomically.
+
+    Attributes:
+        folder (str): The folder the pages are cached in.
+        ttl (int): How long a cached page is used for, in seconds.
+    """
+
+    def __init__(self, folder: str, ttl: int) -> None:
+        """
+        Initialize the SharedPageCache.
+
+        Args:
+            folder (str): The folder to cache pages in.
+            ttl (int): How long a cached page is used for, in seconds.
+        """
+        self.folder: str = folder
+        self.ttl: int = ttl
+
+    def entry_path(self, url: str) -> str:
+        """
+        Get the file a page is cached in.
+
+        Args:
+            url (str): The URL of the page.
+
+        Returns:
+            str: The path of the cache file.
+        """
+        return os.path.join(self.folder, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+
+    def read(self, url: str, max_age: Optional[float] = None) -> Optional[str]:
+        """
+        Read a page from the cache.
+
+        Args:
+            url (str): The URL of the page.
+            max_age (Optional[float]): How old a cached page may be, in seconds (defaults to the cache's TTL).
+
+        Returns:
+            Optional[str]: The page, or None if it is not cached or is too old.
+        """
+        path = self.entry_path(url)
+        try:
+            if time.time() - os.path.getmtime(path) >= (self.ttl if max_age is None else max_age):
+                return None
+            with open(path, "r", encoding = "utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get_or_fetch(self, url: str, fetch: Callable[[], Optional[str]]) -> Optional[str]:
+        """
+        Get a page from the cache, fetching and caching it if it is missing or has expired.
+        If it cannot be fetched, an expired copy is used if there is one, so pages cached earlier
+        (or imported from a bundle) can still be browsed without a connection to the website.
+
+        Args:
+            url (str): The URL of the page.
+            fetch (Callable[[], Optional[str]]): Fetches the page, returning None if it could not be fetched.
+
+        Returns:
+            Optional[str]: The page, or None if it could not be fetched and is not cached.
+        """
+        text = self.read(url)
+        if text is not None:
+            return text
+        try:
+            lock = FileLock(bucket_lock_path(os.path.join(self.folder, "locks"), url))
+            lock.acquire()
+        except OSError:
+            # The cache folder is not writable, so do without it.
+            text = fetch()
+            return text if text is not None else self.read(url, max_age = float("inf"))
+        try:
+            # Another process may have fetched the page while this one waited for the lock.
+            text = self.read(url)
+            if text is not None:
+                return text
+            text = fetch()
+            if text is not None:
+                try:
+                    atomic_write_text(self.entry_path(url), text)
+                except OSError:
+                    pass # The page is still returned, just not cached.
+                return text
+            return self.read(url, max_age = float("inf"))
+        finally:
+            lock.release()
+
+class _PathLock:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.users: int = 0 # Threads holding or waiting for the lock
+
+# The locks of the paths threads of this process are claiming, forgotten once no thread needs them.
+_path_locks: Dict[str, _PathLock] = {}
+_path_locks_lock = threading.Lock()
+
+class DownloadClaim:
+    """
+    A claim on downloading a file, held for the whole download so no other process downloads it at the same time.
+
+    Used as a context manager. If another process (or thread) holds the claim, this one waits for it and
+    can then check whether the file was published in the meantime.
+
+    Each file has its own claim, so a download never waits for one of another file: claims are held for as long
+    as a download takes, which may be a long time if its job is paused. Threads of this process take a lock on the
+    path before the claim's lock file, as file locks do not keep threads of the same process apart on every
+    platform. The lock file is removed when the claim is given back, so the claims folder does not grow.
+
+    Attributes:
+        path (str): The absolute path of the file being downloaded.
+        waited (bool): Whether the claim was held by another process or thread when it was requested.
+    """
+
+    def __init__(self, folder: str, path: str, on_wait: Optional[Callable[[bool], None]] = None) -> None:
+        """
+        Initialize the DownloadClaim.
+
+        Args:
+            folder (str): The folder holding the claim lock files.
+            path (str): The path of the file being downloaded.
+            on_wait (Optional[Callable[[bool], None]]): Called every CLAIM_POLL_INTERVAL seconds while waiting for
+                another process's (or thread's) claim, with True the first time. It may raise to stop waiting.
+        """
+        self.path: str = os.path.abspath(path)
+        self.waited: bool = False
+        self._on_wait = on_wait
+        self._mtime_before: Optional[float] = None
+        self._lock_path: str = key_lock_path(folder, self.path)
+        self._lock: Optional[FileLock] = None
+        self._path_lock: Optional[_PathLock] = None
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def published_meanwhile(self) -> bool:
+        """
+        Check whether another process published the file while this one waited for the claim.
+
+        Returns:
+            bool: True if the file was published (or replaced) while waiting.
+        """
+        mtime = self._mtime()
+        return self.waited and mtime is not None and mtime != self._mtime_before
+
+    def _wait(self) -> None:
+        if self._on_wait:
+            self._on_wait(not self.waited)
+        self.waited = True
+
+    def _take_path_lock(self) -> None:
+        with _path_locks_lock:
+            self._path_lock = _path_locks.setdefault(self.path, _PathLock())
+            self._path_lock.users += 1
+        try:
+            while not self._path_lock.lock.acquire(timeout = CLAIM_POLL_INTERVAL):
+                self._wait()
+        except BaseException:
+            self._forget_path_lock()
+            raise
+
+    def _forget_path_lock(self) -> None:
+        with _path_locks_lock:
+            self._path_lock.users -= 1
+            if not self._path_lock.users:
+                del _path_locks[self.path]
+        self._path_lock = None
+
+    def _take_file_lock(self) -> None:
+        while True:
+            lock = FileLock(self._lock_path)
+            if lock.acquire(blocking = False):
+                if lock.is_current():
+                    self._lock = lock
+                    return
+                # The holder removed the lock file when it was done, so lock the one now at the path.
+                lock.release()
+                continue
+            self._wait()
+            time.sleep(CLAIM_POLL_INTERVAL)
+
+    def __enter__(self) -> "DownloadClaim":
+        self._mtime_before = self._mtime()
+        self._take_path_lock()
+        try:
+            self._take_file_lock()
+        except BaseException:
+            self._path_lock.lock.release()
+            self._forget_path_lock()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            try:
+                os.remove(self._lock_path) # Removed while still locked, so a process waiting for it locks a new one.
+            except OSError:
+                pass # e.g. open files cannot be removed on Windows; the file is reused next time.
+            self._lock.release()
+            self._lock = None
+        finally:
+            self._path_lock.lock.release()
+            self._forget_path_lock()
@@ -0,0 +1,201 @@
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote
+from constants import CATALOGUE_PATH, LAYOUT_RECHECK_AGE
+from papercode import PaperCodeMatcher
+from store import FileLock, atomic_write_json, lock_path, read_json
+
+YEAR_FOLDER_PATTERN: re.Pattern = re.compile(r"^(?:19|20)(\d{2})$")
+SPECIMEN_FOLDER_PATTERN: re.Pattern = re.compile(r"specimen", re.IGNORECASE)
+SPECIMEN_KEY: str = "y"
+
+def page_key(session: str, year: str) -> str:
+    """
+    Get the key of the page listing a session's papers in a subject's layout.
+    Specimen papers are all on one page, so they share a key, as for year_page_cache_key.
+
+    Args:
+        session (str): The session letter.
+        year (str): The 2 digit year, or a range of 2 digit years (e.g. '20-21').
+
+    Returns:
+        str: 'y' for specimen papers, or the 2 digit (first) year.
+    """
+    return SPECIMEN_KEY if session == "y" else year[:2]
+
+def find_folders(links: Iterable[str]) -> Tuple[Dict[str, str], Optional[str]]:
+    """
+    Find the folders linked from a subject page which hold its papers: one for each year, and one for specimen papers.
+
+    Args:
+        links (Iterable[str]): The hrefs of the links on the subject page.
+
+    Returns:
+        Tuple[Dict[str, str], Optional[str]]: Mapping of 2 digit years to the names of their folders,
+            and the name of the specimen papers folder, or None if there is none.
+    """
+    year_folders = {}
+    specimen_folder = None
+    for link in links:
+        if not link:
+            continue
+        folder = unquote(link.strip("/").rsplit("/", 1)[-1])
+        if "." in folder:
+            continue # A file, not a folder.
+        match = YEAR_FOLDER_PATTERN.match(folder)
+        if match:
+            year_folders.setdefault(match.group(1), folder)
+        elif specimen_folder is None and SPECIMEN_FOLDER_PATTERN.search(folder):
+            specimen_folder = folder
+    return year_folders, specimen_folder
+
+class SubjectLayout(NamedTuple):
+    """
+    Where a subject's papers are on the website, learned from the links on its subject page.
+
+    Most subjects have a folder for each year and one for specimen papers, but some list some or all of their
+    papers on the subject page itself, and the specimen folder is not always named the same way.
+    Pages which are not in the layout are known not to exist, so they are never requested.
+
+    Attributes:
+        year_folders (Dict[str, str]): Mapping of 2 digit years to the names of their folders (e.g. '19' to '2019').
+        specimen_folder (Optional[str]): The name of the specimen papers folder, or None if there is none.
+        flat (List[str]): The keys (see page_key) of the sessions with papers linked from the subject page itself.
+        learned (float): When the subject page was read.
+    """
+    year_folders: Dict[str, str]
+    specimen_folder: Optional[str]
+    flat: List[str]
+    learned: float
+
+    def folder(self, session: str, year: str) -> Optional[str]:
+        """
+        Get the folder of the page listing a session's papers.
+
+        Args:
+            session (str): The session letter.
+            year (str): The 2 digit year.
+
+        Returns:
+            Optional[str]: The name of the folder, '' if the papers are on the subject page itself,
+                or None if the subject has no papers for the session.
+        """
+        key = page_key(session, year)
+        folder = self.specimen_folder if key == SPECIMEN_KEY else self.year_folders.get(key)
+        if folder:
+            return folder
+        return "" if key in self.flat else None
+
+    def is_stale(self) -> bool:
+        """
+        Check whether the layout is old enough that pages missing from it should be looked for again,
+        e.g. because the folder for a new year may have been added since.
+
+        Returns:
+            bool: True if the subject page should be read again before deciding a page does not exist.
+        """
+        return time.time() - self.learned > LAYOUT_RECHECK_AGE
+
+def learn_layout(subject_code: str, links: Iterable[str]) -> SubjectLayout:
+    """
+    Learn a subject's layout from the links on its subject page.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+        links (Iterable[str]): The hrefs of the links on the subject page.
+
+    Returns:
+        SubjectLayout: The layout.
+    """
+    links = [link for link in links if link]
+    year_folders, specimen_folder = find_folders(links)
+    matcher = PaperCodeMatcher(subject_code)
+    flat = {page_key(paper.session, paper.year) for paper in map(matcher.match, links) if paper}
+    return SubjectLayout(year_folders, specimen_folder, sorted(flat), time.time())
+
+class SiteLayouts:
+    """
+    The layouts learned for each subject, shared by every client in the process and saved in the catalogue file,
+    so they are learned once per machine rather than once per session (and are exported with the catalogue).
+
+    Attributes:
+        path (str): The path of the catalogue file the layouts are saved in.
+    """
+
+    def __init__(self, path: str = CATALOGUE_PATH) -> None:
+        """
+        Initialize the SiteLayouts.
+
+        Args:
+            path (str): The path of the catalogue file.
+        """
+        self.path: str = path
+        self._layouts: Optional[Dict[str, SubjectLayout]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, SubjectLayout]:
+        layouts = {}
+        for subject_code, layout in ((read_json(self.path) or {}).get("layouts") or {}).items():
+            try:
+                layouts[subject_code] = SubjectLayout(dict(layout["year_folders"]), layout["specimen_folder"],
+                                                      list(layout["flat"]), float(layout["learned"]))
+            except (KeyError, TypeError, ValueError):
+                continue # Learned again when it is next needed.
+        return layouts
+
+    def get(self, subject_code: str) -> Optional[SubjectLayout]:
+        """
+        Get the layout learned for a subject.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+
+        Returns:
+            Optional[SubjectLayout]: The layout, or None if it has not been learned.
+        """
+        with self._lock:
+            if self._layouts is None:
+                self._layouts = self._load()
+            layout = self._layouts.get(subject_code)
+            if layout is None:
+                # Another process may have learned it since the file was read.
+                layout = self._load().get(subject_code)
+                if layout is not None:
+                    self._layouts[subject_code] = layout
+            return layout
+
+    def learn(self, subject_code: str, links: Iterable[str]) -> SubjectLayout:
+        """
+        Learn a subject's layout from the links on its subject page, and save it.
+
+        Args:
+            subject_code (str): The 4 digit subject code.
+            links (Iterable[str]): The hrefs of the links on the subject page.
+
+        Returns:
+            SubjectLayout: The layout.
+        """
+        layout = learn_layout(subject_code, links)
+        with self._lock:
+            if self._layouts is None:
+                self._layouts = self._load()
+            self._layouts[subject_code] = layout
+        try:
+            with FileLock(lock_path(self.path)):
+                catalogue = read_json(self.path) or {}
+                layouts: Dict[str, Any] = catalogue.get("layouts") or {}
+                layouts[subject_code] = layout._asdict()
+                catalogue["layouts"] = layouts
+                atomic_write_json(self.path, catalogue)
+        except OSError:
+            pass # The layout is still used by this process, just learned again by the next.
+        return layout
+
+    def clear(self) -> None:
+        """
+        Forget the layouts loaded, so they are read from the catalogue file again, e.g. after a new one is imported.
+        """
+        with self._lock:
+            self._layouts = None
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional
+from constants import LOCK_BUCKETS
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+class FileLock:
+    """
+    An exclusive lock held on a lock file, shared between processes on the same machine.
+
+    Used as a context manager around reading and rewriting a file so that two shells
+    writing at once cannot lose each other's changes.
+
+    Attributes:
+        path (str): The path of the lock file.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize the FileLock.
+
+        Args:
+            path (str): The path of the lock file. It is created if it does not exist.
+        """
+        self.path: str = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Take the lock.
+
+        Args:
+            blocking (bool): Whether to wait for the lock if another process (or thread) holds it.
+
+        Returns:
+            bool: True if the lock was taken, False if it is held elsewhere and blocking is False.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.name == "nt":
+                # msvcrt.LK_LOCK retries for 10 seconds before failing, so keep trying until the lock is free.
+                while True:
+                    try:
+                        msvcrt.locking(self._fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise BlockingIOError()
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._fd)
+            self._fd = None
+            return False
+        return True
+
+    def is_current(self) -> bool:
+        """
+        Check whether the lock file the lock is held on is still the one at its path, i.e. it was not removed
+        (and perhaps created again) by another holder while this one waited for it.
+
+        Returns:
+            bool: True if the lock is held on the file at its path.
+        """
+        try:
+            return os.path.samestat(os.fstat(self._fd), os.stat(self.path))
+        except OSError:
+            return False
+
+    def release(self) -> None:
+        """
+        Release the lock.
+        """
+        self.__exit__(None, None, None)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if os.name == "nt":
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+def lock_path(path: str) -> str:
+    """
+    Get the path of the lock file guarding a file.
+
+    Args:
+        path (str): The path of the guarded file.
+
+    Returns:
+        str: The path of the lock file.
+    """
+    return path + ".lock"
+
+def bucket_lock_path(folder: str, key: str) -> str:
+    """
+    Get the lock file guarding a key, such as a URL or a download path, out of a fixed set of lock files.
+    Lock files cannot safely be deleted while other processes may be waiting on them, so sharing a
+    bounded number of them keeps the folder from growing with every key ever locked.
+
+    Args:
+        folder (str): The folder holding the lock files.
+        key (str): The key to lock.
+
+    Returns:
+        str: The path of the lock file.
+    """
+    bucket = int(hashlib.sha1(key.encode("utf-8")).hexdigest(), 16) % LOCK_BUCKETS
+    return os.path.join(folder, f"{bucket:03d}.lock")
+
+def key_lock_path(folder: str, key: str) -> str:
+    """
+    Get a lock file guarding only one key, for locks held long enough that sharing a lock file with other keys
+    would hold those up too. The lock file must be removed by its holder once done (see FileLock.is_current).
+
+    Args:
+        folder (str): The folder holding the lock files.
+        key (str): The key to lock.
+
+    Returns:
+        str: The path of the lock file.
+    """
+    return os.path.join(folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".lock")
+
+def read_json(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read a JSON object from a file.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        Optional[Dict[str, Any]]: The object, or None if the file does not exist or is not valid JSON.
+    """
+    try:
+        with open(path, "r", encoding = "utf-8") as f:
+            obj = json.load(f)
+        return obj if isinstance(obj, dict) else None
+    except (FileNotFoundError, ValueError):
+        return None
+
+def atomic_write_json(path: str, obj: Dict[str, Any], indent: Optional[int] = None) -> None:
+    """
+    Write a JSON object to a temporary file and atomically rename it over the target,
+    so readers only ever see the old or the new contents.
+
+    Args:
+        path (str): The path of the file.
+        obj (Dict[str, Any]): The object to write.
+        indent (Optional[int]): The indentation to use. None writes compact JSON.
+
+    Raises:
+        OSError: If the file could not be written.
+    """
+    if indent is None:
+        text = json.dumps(obj, ensure_ascii = False, separators = (",", ":"))
+    else:
+        text = json.dumps(obj, ensure_ascii = False, indent = indent)
+    atomic_write_text(path, text)
+
+def atomic_write_text(path: str, text: str) -> None:
+    """
+    Write text to a temporary file and atomically rename it over the target,
+    so readers only ever see the old or the new contents.
+
+    Args:
+        path (str): The path of the file.
+        text (str): The text to write.
+
+    Raises:
+        OSError: If the file could not be written.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok = True)
+    fd, temp_path = tempfile.mkstemp(prefix = f".{os.path.basename(path)}.", suffix = ".tmp", dir = folder)
+    try:
+        with os.fdopen(fd, "w", encoding = "utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_json(path: str, obj: Dict[str, Any], indent: Optional[int] = None) -> None:
+    """
+    Replace a JSON file while holding its lock.
+
+    Args:
+        path (str): The path of the file.
+        obj (Dict[str, Any]): The object to write.
+        indent (Optional[int]): The indentation to use. None writes compact JSON.
+
+    Raises:
+        OSError: If the file could not be written.
+    """
+    with FileLock(lock_path(path)):
+        atomic_write_json(path, obj, indent)
+
+def update_json(path: str, updates: Dict[str, Any], indent: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Change only the given keys of a JSON file, keeping any other keys written by other processes.
+
+    Args:
+        path (str): The path of the file.
+        updates (Dict[str, Any]): The keys and values to set.
+        indent (Optional[int]): The indentation to use. None writes compact JSON.
+
+    Returns:
+        Dict[str, Any]: The full object that was written.
+
+    Raises:
+        OSError: If the file could not be written.
+    """
+    with FileLock(lock_path(path)):
+        obj = read_json(path) or {}
+        obj.update(updates)
+        atomic_write_json(path, obj, indent)
+        return obj
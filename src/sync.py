@@ -0,0 +1,321 @@
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+import requests
+from bs4 import BeautifulSoup
+from congestion import AdaptiveLimiter
+from layout import find_existing
+from constants import SESSION_MAP, SPECIMEN_FOLDER_NAME, SYNC_FOLDER, SYNC_RECENT_YEARS, SYNC_WORKERS
+from mirrors import MirrorPool
+from papercode import PaperCodeMatcher
+from requesthandler import mirror_pool
+from sitelayout import find_folders
+from store import read_json, write_json
+
+class PageSnapshot(NamedTuple):
+    """
+    The links on an index page the last time it was fetched, with the validators needed to ask whether it has changed.
+
+    Attributes:
+        etag (Optional[str]): The page's ETag header.
+        last_modified (Optional[str]): The page's Last-Modified header.
+        links (List[str]): The hrefs of the links on the page.
+    """
+    etag: Optional[str]
+    last_modified: Optional[str]
+    links: List[str]
+
+class Addition(NamedTuple):
+    """
+    A paper which has appeared on an index page since the last sync.
+
+    Attributes:
+        page_url (str): The URL of the index page listing the paper.
+        url (str): The URL of the paper.
+        download_folder (str): The folder to download the paper to.
+        file_name (str): The name of the paper's file.
+    """
+    page_url: str
+    url: str
+    download_folder: str
+    file_name: str
+
+class SyncPlan(NamedTuple):
+    """
+    What a sync of one subject found.
+
+    Attributes:
+        subject_code (str): The 4 digit subject code.
+        additions (List[Addition]): The papers to download.
+        pages (Dict[str, PageSnapshot]): The new snapshot of every page known for the subject.
+        checked (int): The number of pages requested.
+        changed (int): The number of pages which had changed.
+        error (Optional[str]): Why the subject page could not be checked, if it could not.
+    """
+    subject_code: str
+    additions: List[Addition]
+    pages: Dict[str, PageSnapshot]
+    checked: int
+    changed: int
+    error: Optional[str]
+
+def snapshot_path(subject_code: str) -> str:
+    """
+    Get the file a subject's snapshot is stored in.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+
+    Returns:
+        str: The path of the snapshot file.
+    """
+    return os.path.join(SYNC_FOLDER, f"{subject_code}.json")
+
+def load_snapshot(subject_code: str) -> Dict[str, PageSnapshot]:
+    """
+    Load the snapshot of a subject's index pages.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+
+    Returns:
+        Dict[str, PageSnapshot]: Mapping of page URLs to their snapshots. Empty if the subject has never been synced.
+    """
+    pages = (read_json(snapshot_path(subject_code)) or {}).get("pages", {})
+    return {url: PageSnapshot(page.get("etag"), page.get("last_modified"), page.get("links", [])) for url, page in pages.items()}
+
+def save_snapshot(subject_code: str, pages: Dict[str, PageSnapshot]) -> None:
+    """
+    Save the snapshot of a subject's index pages.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+        pages (Dict[str, PageSnapshot]): Mapping of page URLs to their snapshots.
+
+    Raises:
+        OSError: If the snapshot could not be written.
+    """
+    write_json(snapshot_path(subject_code), {"pages": {url: page._asdict() for url, page in pages.items()}})
+
+def synced_subjects() -> List[str]:
+    """
+    Get the subjects which have been synced before.
+
+    Returns:
+        List[str]: The subject codes.
+    """
+    if not os.path.isdir(SYNC_FOLDER):
+        return []
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(SYNC_FOLDER) if name.endswith(".json"))
+
+def fetch_if_changed(
+    pool: MirrorPool,
+    url: str,
+    previous: Optional[PageSnapshot],
+    timeouts: Tuple[int, int],
+    limiter: Optional[AdaptiveLimiter] = None
+) -> Optional[PageSnapshot]:
+    """
+    Fetch an index page only if it has changed since it was last fetched, using a conditional request.
+
+    Args:
+        pool (MirrorPool): The mirrors to request the page from, failing over between them.
+        url (str): The URL of the page.
+        previous (Optional[PageSnapshot]): The page's last snapshot, or None if it has never been fetched.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        limiter (Optional[AdaptiveLimiter]): Limits the requests in flight to the website, if given.
+
+    Returns:
+        Optional[PageSnapshot]: The new snapshot, or None if the page has not changed.
+
+    Raises:
+        requests.RequestException: If the page could not be fetched.
+    """
+    headers = {}
+    if previous and previous.etag:
+        headers["If-None-Match"] = previous.etag
+    if previous and previous.last_modified:
+        headers["If-Modified-Since"] = previous.last_modified
+    url = pool.locate(url) # The slot is taken on the host of the mirror the request goes to.
+    if limiter is None:
+        response = pool.get(url, timeouts, headers = headers)
+    else:
+        with limiter.slot(url) as slot:
+            response = pool.get(url, slot.limiter.timeouts(timeouts), headers = headers)
+            slot.record(response)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    response.encoding = "utf-8"
+    html = BeautifulSoup(response.text, "html.parser")
+    links = [link.get("href") for link in html.find_all("a") if link.get("href")]
+    return PageSnapshot(response.headers.get("etag"), response.headers.get("last-modified"), links)
+
+def is_recent(folder: str) -> bool:
+    """
+    Check whether papers can still be added to a year folder. Old years are not polled unless asked to.
+
+    Args:
+        folder (str): The name of the year folder (e.g. '2024' or 'Specimen Papers').
+
+    Returns:
+        bool: True if the folder is for one of the last SYNC_RECENT_YEARS years or for specimen papers.
+    """
+    if not folder.isdigit():
+        return True # Specimen papers are published ahead of the exams, at any time.
+    return int(folder) > datetime.date.today().year - SYNC_RECENT_YEARS
+
+def find_additions(
+    subject_code: str,
+    page_url: str,
+    links: List[str],
+    previous_links: Set[str],
+    download_root: str,
+    session_folders: bool
+) -> List[Addition]:
+    """
+    Find the papers of a subject which are linked from a page but were not the last time it was fetched,
+    and which have not already been downloaded.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+        page_url (str): The URL of the page.
+        links (List[str]): The hrefs of the links on the page.
+        previous_links (Set[str]): The hrefs of the links on the page when it was last fetched.
+        download_root (str): The subject's download folder.
+        session_folders (bool): Whether papers are downloaded into session folders.
+
+    Returns:
+        List[Addition]: The papers to download.
+    """
+    matcher = PaperCodeMatcher(subject_code)
+    additions = []
+    for link in links:
+        paper_code = matcher.match(link)
+        if not paper_code or link in previous_links:
+            continue
+        # Keep the same layout as 'getmany', whichever page the paper is listed on.
+        year_folder = SPECIMEN_FOLDER_NAME if paper_code.session == "y" else "20" + paper_code.year[:2]
+        session_folder = f"/{SESSION_MAP[paper_code.session]}" if session_folders else ""
+        download_folder = f"{download_root}/{year_folder}{session_folder}"
+        file_name = link.strip("/")
+        if not find_existing(download_folder + "/" + file_name):
+            additions.append(Addition(page_url, page_url + "/" + file_name, download_folder, file_name))
+    return additions
+
+def plan_sync(
+    subject_code: str,
+    subject_url: str,
+    download_root: str,
+    session_folders: bool,
+    timeouts: Tuple[int, int],
+    check_all: bool = False,
+    limiter: Optional[AdaptiveLimiter] = None,
+    pool: Optional[MirrorPool] = None
+) -> SyncPlan:
+    """
+    Check which of a subject's papers are new since the last sync.
+
+    The subject page is always checked. Its year folders are checked only if they have not been seen before,
+    are recent, or check_all is set. Every check is a conditional request, so unchanged pages cost no download.
+
+    On the first sync of a page only its missing papers in recent years are downloaded; older pages are
+    only recorded, so the first sync of a subject does not turn into a full download of its history.
+
+    Args:
+        subject_code (str): The 4 digit subject code.
+        subject_url (str): The URL of the subject page.
+        download_root (str): The subject's download folder.
+        session_folders (bool): Whether papers are downloaded into session folders.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        check_all (bool): Whether to also check year folders which are not recent.
+        limiter (Optional[AdaptiveLimiter]): Limits the requests in flight to the website, if given.
+        pool (Optional[MirrorPool]): The mirrors to request the pages from. Defaults to the shared mirror pool.
+
+    Returns:
+        SyncPlan: The papers to download and the new snapshot.
+    """
+    pool = pool or mirror_pool
+    previous = load_snapshot(subject_code)
+    pages = dict(previous)
+    additions = []
+    checked = 0
+    changed = 0
+    def check_page(url: str, recent: bool) -> Optional[PageSnapshot]:
+        nonlocal checked, changed
+        checked += 1
+        snapshot = fetch_if_changed(pool, url, previous.get(url), timeouts, limiter)
+        if not snapshot:
+            return pages[url]
+        changed += 1
+        pages[url] = snapshot
+        if url in previous or recent:
+            previous_links = set(previous[url].links) if url in previous else set()
+            additions.extend(find_additions(subject_code, url, snapshot.links, previous_links, download_root, session_folders))
+        return snapshot
+
+    try:
+        subject_page = check_page(subject_url, True)
+    except requests.RequestException as err:
+        return SyncPlan(subject_code, [], previous, checked, changed, str(err))
+    year_folders, specimen_folder = find_folders(subject_page.links)
+    for folder in list(year_folders.values()) + ([specimen_folder] if specimen_folder else []):
+        url = subject_url + "/" + folder
+        recent = is_recent(folder)
+        if url in previous and not recent and not check_all:
+            continue
+        try:
+            check_page(url, recent)
+        except requests.RequestException:
+            pass # Checked again next time, as the snapshot of this page is unchanged.
+    return SyncPlan(subject_code, additions, pages, checked, changed, None)
+
+def plan_syncs(
+    subjects: List[Tuple[str, str, str]],
+    session_folders: bool,
+    timeouts: Tuple[int, int],
+    check_all: bool = False,
+    limiter: Optional[AdaptiveLimiter] = None,
+    pool: Optional[MirrorPool] = None
+) -> Iterator[SyncPlan]:
+    """
+    Check several subjects at once. Checking is almost entirely waiting on the network, so threads are used,
+    and the limiter (if given) keeps the number of requests actually in flight to what the website is coping with.
+
+    Args:
+        subjects (List[Tuple[str, str, str]]): The subject code, subject page URL and download folder of each subject.
+        session_folders (bool): Whether papers are downloaded into session folders.
+        timeouts (Tuple[int, int]): (connect_timeout, read_timeout).
+        check_all (bool): Whether to also check year folders which are not recent.
+        limiter (Optional[AdaptiveLimiter]): Limits the requests in flight to the website, if given.
+        pool (Optional[MirrorPool]): The mirrors to request the pages from. Defaults to the shared mirror pool.
+
+    Returns:
+        Iterator[SyncPlan]: The plan for each subject, in the same order as the subjects.
+    """
+    with ThreadPoolExecutor(max_workers = SYNC_WORKERS) as executor:
+        futures = [executor.submit(plan_sync, subject_code, subject_url, download_root, session_folders, timeouts, check_all, limiter, pool)
+                   for subject_code, subject_url, download_root in subjects]
+        for future in futures:
+            yield future.result()
+
+def forget_links(pages: Dict[str, PageSnapshot], failed: List[Addition]) -> Dict[str, PageSnapshot]:
+    """
+    Remove papers which failed to download from a snapshot, and its validators from their pages,
+    so the next sync fetches those pages in full and tries the papers again.
+
+    Args:
+        pages (Dict[str, PageSnapshot]): The new snapshot.
+        failed (List[Addition]): The papers which failed to download.
+
+    Returns:
+        Dict[str, PageSnapshot]: The snapshot to save.
+    """
+    pages = dict(pages)
+    for addition in failed:
+        page = pages.get(addition.page_url)
+        if page:
+            links = [link for link in page.links if link.strip("/") != addition.file_name]
+            pages[addition.page_url] = PageSnapshot(None, None, links)
+    return pages
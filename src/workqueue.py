@@ -0,0 +1,588 @@
+import abc
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Set, Tuple
+from constants import (WORK_LEASE_SECONDS, WORK_HEARTBEAT_INTERVAL, WORK_MAX_ATTEMPTS, WORK_CLAIM_BATCH,
+                       WORK_POLL_INTERVAL, WORK_QUEUE_TIMEOUT)
+
+WORK_QUEUED: str = "queued"
+WORK_CLAIMED: str = "claimed"
+WORK_DONE: str = "done"
+WORK_FAILED: str = "failed"
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS items (
+    path TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    token TEXT,
+    lease_until REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_until);
+"""
+
+class WorkItem(NamedTuple):
+    """
+    A paper to be downloaded by a worker.
+
+    Attributes:
+        path (str): The path to download it to, relative to the download folder. Identifies the item.
+        url (str): The URL of the paper relative to the base URL, so each worker can use its own base URL and mirrors.
+    """
+    path: str
+    url: str
+
+class Claim(NamedTuple):
+    """
+    A worker's lease on an item.
+
+    Attributes:
+        item (WorkItem): The item claimed.
+        token (str): Identifies this lease. Only the holder of the current lease can complete the item.
+        attempt (int): Which attempt at the item this is, starting at 1.
+    """
+    item: WorkItem
+    token: str
+    attempt: int
+
+class QueueCounts(NamedTuple):
+    """
+    The number of items in each state.
+    """
+    queued: int
+    claimed: int
+    done: int
+    failed: int
+
+class WorkQueueError(Exception):
+    """
+    Raised when the queue cannot be reached or gives an invalid answer.
+    """
+
+class WorkQueue(abc.ABC):
+    """
+    A queue of papers shared by a coordinator, which adds them, and any number of workers on any number
+    of machines, which claim, download and complete them.
+
+    A claimed item is leased to its worker, which must renew the lease with heartbeat() until it completes
+    the item. If the lease runs out (the worker crashed, or lost its connection), the item goes back to the
+    queue to be retried, but only once: after WORK_MAX_ATTEMPTS leases have run out, it is marked as failed
+    rather than being handed to worker after worker. Completing an item needs the token of its current lease,
+    so a worker which was presumed lost cannot complete an item another worker is now retrying.
+
+    This is the interface shared by the backends; see SQLiteWorkQueue and TCPWorkQueue.
+    """
+
+    @abc.abstractmethod
+    def add(self, items: Iterable[WorkItem]) -> int:
+        """
+        Add items to the queue. Items already in the queue, in any state, are left alone.
+
+        Args:
+            items (Iterable[WorkItem]): The items to add.
+
+        Returns:
+            int: The number of items added.
+        """
+
+    @abc.abstractmethod
+    def claim(self, worker: str, count: int, lease: float = WORK_LEASE_SECONDS) -> List[Claim]:
+        """
+        Claim queued items, first requeuing (or failing) any item whose lease has run out.
+
+        Args:
+            worker (str): Identifies the worker, for display.
+            count (int): The most items to claim.
+            lease (float): How long the lease lasts, in seconds, unless renewed.
+
+        Returns:
+            List[Claim]: The items claimed, oldest first. Empty if none are queued.
+        """
+
+    @abc.abstractmethod
+    def heartbeat(self, tokens: List[str], lease: float = WORK_LEASE_SECONDS) -> List[str]:
+        """
+        Renew leases.
+
+        Args:
+            tokens (List[str]): The tokens of the leases.
+            lease (float): How long the leases last from now, in seconds.
+
+        Returns:
+            List[str]: The tokens still held. The others have run out and the worker should give up their items.
+        """
+
+    @abc.abstractmethod
+    def complete(self, token: str, error: Optional[str] = None) -> bool:
+        """
+        Finish an item.
+
+        Args:
+            token (str): The token of the item's lease.
+            error (Optional[str]): Why the item failed, or None if it was downloaded.
+
+        Returns:
+            bool: True if the lease was still held, so the item was finished. False if it had run out.
+        """
+
+    @abc.abstractmethod
+    def release(self, tokens: List[str]) -> None:
+        """
+        Give items back to the queue without counting an attempt, e.g. when a worker is stopped.
+
+        Args:
+            tokens (List[str]): The tokens of the leases.
+        """
+
+    @abc.abstractmethod
+    def counts(self) -> QueueCounts:
+        """
+        Count the items in each state.
+
+        Returns:
+            QueueCounts: The counts.
+        """
+
+    @abc.abstractmethod
+    def failures(self, limit: int) -> List[Tuple[str, str]]:
+        """
+        Get the items which failed.
+
+        Args:
+            limit (int): The most items to get.
+
+        Returns:
+            List[Tuple[str, str]]: The path of each item and why it failed.
+        """
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    A WorkQueue stored in an SQLite database, which can be on a filesystem shared between machines (e.g. NFS or SMB).
+
+    Every change is a short transaction, so workers only hold the database lock for milliseconds. The database
+    uses SQLite's default rollback journal, as WAL mode needs shared memory and does not work over a network filesystem.
+    Leases are measured by the clocks of the machines, so they should be roughly in sync (to well within WORK_LEASE_SECONDS).
+
+    Attributes:
+        path (str): The path of the database.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize the SQLiteWorkQueue.
+
+        Args:
+            path (str): The path of the database. It is created if it does not exist.
+        """
+        self.path: str = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Get the calling thread's connection to the database, creating the database if it does not exist.
+
+        Returns:
+            sqlite3.Connection: The connection, in autocommit mode so transactions are started explicitly.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(folder, exist_ok = True)
+            connection = sqlite3.connect(self.path, timeout = WORK_QUEUE_TIMEOUT, isolation_level = None)
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def transaction(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+        """
+        Run some work in a write transaction, taking the database lock up front so two workers cannot claim the same item.
+
+        Args:
+            work (Callable[[sqlite3.Connection], Any]): The work, given the connection.
+
+        Returns:
+            Any: What the work returned.
+
+        Raises:
+            WorkQueueError: If the database could not be used.
+        """
+        try:
+            connection = self.connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(connection)
+                connection.execute("COMMIT")
+                return result
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as err:
+            raise WorkQueueError(f"Could not use the work queue '{self.path}': {err}")
+
+    def add(self, items: Iterable[WorkItem]) -> int:
+        def work(connection: sqlite3.Connection) -> int:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO items (path, url, state) VALUES (?, ?, ?)",
+                                   ((item.path, item.url, WORK_QUEUED) for item in items))
+            return connection.total_changes - before
+        return self.transaction(work)
+
+    def claim(self, worker: str, count: int, lease: float = WORK_LEASE_SECONDS) -> List[Claim]:
+        def work(connection: sqlite3.Connection) -> List[Claim]:
+            now = time.time()
+            # Items whose worker has gone quiet are retried, unless they have already used up their attempts.
+            connection.execute("UPDATE items SET state = ?, error = 'Lost its worker too many times', token = NULL "
+                               "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                               (WORK_FAILED, WORK_CLAIMED, now, WORK_MAX_ATTEMPTS))
+            connection.execute("UPDATE items SET state = ?, token = NULL WHERE state = ? AND lease_until < ?",
+                               (WORK_QUEUED, WORK_CLAIMED, now))
+            rows = connection.execute("SELECT path, url, attempts FROM items WHERE state = ? ORDER BY rowid LIMIT ?",
+                                      (WORK_QUEUED, count)).fetchall()
+            claims = []
+            for path, url, attempts in rows:
+                token = uuid.uuid4().hex
+                connection.execute("UPDATE items SET state = ?, worker = ?, token = ?, lease_until = ?, attempts = ? WHERE path = ?",
+                                   (WORK_CLAIMED, worker, token, now + lease, attempts + 1, path))
+                claims.append(Claim(WorkItem(path, url), token, attempts + 1))
+            return claims
+        return self.transaction(work)
+
+    def heartbeat(self, tokens: List[str], lease: float = WORK_LEASE_SECONDS) -> List[str]:
+        def work(connection: sqlite3.Connection) -> List[str]:
+            held = []
+            for token in tokens:
+                cursor = connection.execute("UPDATE items SET lease_until = ? WHERE token = ? AND state = ?",
+                                            (time.time() + lease, token, WORK_CLAIMED))
+                if cursor.rowcount:
+                    held.append(token)
+            return held
+        return self.transaction(work)
+
+    def complete(self, token: str, error: Optional[str] = None) -> bool:
+        def work(connection: sqlite3.Connection) -> bool:
+            cursor = connection.execute("UPDATE items SET state = ?, error = ?, token = NULL WHERE token = ? AND state = ?",
+                                        (WORK_FAILED if error else WORK_DONE, error, token, WORK_CLAIMED))
+            return cursor.rowcount > 0
+        return self.transaction(work)
+
+    def release(self, tokens: List[str]) -> None:
+        def work(connection: sqlite3.Connection) -> None:
+            connection.executemany("UPDATE items SET state = ?, token = NULL, attempts = attempts - 1 WHERE token = ? AND state = ?",
+                                   ((WORK_QUEUED, token, WORK_CLAIMED) for token in tokens))
+        self.transaction(work)
+
+    def counts(self) -> QueueCounts:
+        try:
+            rows = dict(self.connection().execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+        except sqlite3.Error as err:
+            raise WorkQueueError(f"Could not use the work queue '{self.path}': {err}")
+        return QueueCounts(rows.get(WORK_QUEUED, 0), rows.get(WORK_CLAIMED, 0), rows.get(WORK_DONE, 0), rows.get(WORK_FAILED, 0))
+
+    def failures(self, limit: int) -> List[Tuple[str, str]]:
+        try:
+            return self.connection().execute("SELECT path, error FROM items WHERE state = ? ORDER BY rowid LIMIT ?",
+                                             (WORK_FAILED, limit)).fetchall()
+        except sqlite3.Error as err:
+            raise WorkQueueError(f"Could not use the work queue '{self.path}': {err}")
+
+class WorkQueueRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one connection to a WorkQueueServer: one JSON request per line, answered with one JSON response per line.
+    """
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                method = request["method"]
+                if method not in WorkQueueServer.METHODS:
+                    raise ValueError(f"Unknown method: {method}")
+                response = {"result": to_json(getattr(self.server.queue, method)(*from_json(method, request["args"])))}
+            except Exception as err:
+                response = {"error": str(err)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+class WorkQueueServer(socketserver.ThreadingTCPServer):
+    """
+    Serves a WorkQueue over TCP, for workers which cannot share a filesystem with it.
+    Nothing is authenticated, so it is only meant for a trusted network or for testing on one machine.
+
+    Attributes:
+        queue (WorkQueue): The queue served.
+    """
+    METHODS: Set[str] = {"add", "claim", "heartbeat", "complete", "release", "counts", "failures"}
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], queue: WorkQueue) -> None:
+        """
+        Initialize the WorkQueueServer.
+
+        Args:
+            address (Tuple[str, int]): The host and port to listen on. Port 0 picks a free port.
+            queue (WorkQueue): The queue to serve.
+        """
+        super().__init__(address, WorkQueueRequestHandler)
+        self.queue: WorkQueue = queue
+
+class TCPWorkQueue(WorkQueue):
+    """
+    A WorkQueue served by a WorkQueueServer. Thread-safe; requests share one connection, which is reopened if it drops.
+
+    Attributes:
+        address (Tuple[str, int]): The host and port of the server.
+    """
+
+    def __init__(self, address: Tuple[str, int]) -> None:
+        """
+        Initialize the TCPWorkQueue. The connection is opened by the first request.
+
+        Args:
+            address (Tuple[str, int]): The host and port of the server.
+        """
+        self.address: Tuple[str, int] = address
+        self._lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._file = None
+
+    def call(self, method: str, *args: Any) -> Any:
+        """
+        Call a method of the queue on the server.
+
+        Args:
+            method (str): The name of the method.
+            *args: The arguments.
+
+        Returns:
+            Any: What the method returned, as JSON.
+
+        Raises:
+            WorkQueueError: If the server could not be reached or the method failed.
+        """
+        request = json.dumps({"method": method, "args": to_json(list(args))}).encode("utf-8") + b"\n"
+        with self._lock:
+            try:
+                if self._socket is None:
+                    self._socket = socket.create_connection(self.address, timeout = WORK_QUEUE_TIMEOUT)
+                    self._file = self._socket.makefile("rb")
+                self._socket.sendall(request)
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionError("Connection closed by the server")
+                response = json.loads(line)
+            except (OSError, ValueError) as err:
+                self.close()
+                raise WorkQueueError(f"Could not reach the work queue at {self.address[0]}:{self.address[1]}: {err}")
+        if "error" in response:
+            raise WorkQueueError(response["error"])
+        return response["result"]
+
+    def close(self) -> None:
+        """
+        Close the connection to the server.
+        """
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = None
+            self._file = None
+
+    def add(self, items: Iterable[WorkItem]) -> int:
+        return self.call("add", list(items))
+
+    def claim(self, worker: str, count: int, lease: float = WORK_LEASE_SECONDS) -> List[Claim]:
+        return [Claim(WorkItem(*item), token, attempt) for item, token, attempt in self.call("claim", worker, count, lease)]
+
+    def heartbeat(self, tokens: List[str], lease: float = WORK_LEASE_SECONDS) -> List[str]:
+        return self.call("heartbeat", tokens, lease)
+
+    def complete(self, token: str, error: Optional[str] = None) -> bool:
+        return self.call("complete", token, error)
+
+    def release(self, tokens: List[str]) -> None:
+        self.call("release", tokens)
+
+    def counts(self) -> QueueCounts:
+        return QueueCounts(*self.call("counts"))
+
+    def failures(self, limit: int) -> List[Tuple[str, str]]:
+        return [tuple(failure) for failure in self.call("failures", limit)]
+
+def to_json(value: Any) -> Any:
+    """
+    Convert a value returned by (or passed to) a WorkQueue method to plain JSON. Named tuples become lists.
+
+    Args:
+        value (Any): The value.
+
+    Returns:
+        Any: The value as JSON.
+    """
+    if isinstance(value, (list, tuple)):
+        return [to_json(element) for element in value]
+    return value
+
+def from_json(method: str, args: List[Any]) -> List[Any]:
+    """
+    Convert the arguments of a request to a WorkQueueServer back to what the method takes.
+
+    Args:
+        method (str): The name of the method.
+        args (List[Any]): The arguments as JSON.
+
+    Returns:
+        List[Any]: The arguments.
+    """
+    if method == "add":
+        return [[WorkItem(*item) for item in args[0]]]
+    return args
+
+def open_work_queue(spec: str) -> WorkQueue:
+    """
+    Open a work queue from its location as given by the user.
+
+    Args:
+        spec (str): 'tcp://host:port' for a WorkQueueServer, otherwise the path of an SQLite database.
+
+    Returns:
+        WorkQueue: The queue.
+
+    Raises:
+        WorkQueueError: If a TCP address is not valid.
+    """
+    if spec.lower().startswith("tcp://"):
+        host, _, port = spec[len("tcp://"):].rstrip("/").rpartition(":")
+        if not host or not port.isdigit():
+            raise WorkQueueError(f"Invalid work queue address '{spec}'. Expected tcp://host:port")
+        return TCPWorkQueue((host, int(port)))
+    return SQLiteWorkQueue(os.path.expanduser(spec))
+
+def worker_name() -> str:
+    """
+    Get a name for a new worker which is unique across machines.
+
+    Returns:
+        str: The host name, process id and a random suffix.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+class WorkerStats(NamedTuple):
+    """
+    What a worker did.
+
+    Attributes:
+        done (int): Items downloaded.
+        failed (int): Items which could not be downloaded.
+        lost (int): Items whose lease ran out before they were finished, so another worker took them over.
+    """
+    done: int
+    failed: int
+    lost: int
+
+class Worker:
+    """
+    Claims items from a WorkQueue and processes them until the queue is empty, renewing its leases from a
+    background thread so that the items it holds are not given to another worker while it works on them.
+
+    Attributes:
+        queue (WorkQueue): The queue to work from.
+        name (str): Identifies the worker.
+    """
+
+    def __init__(self, queue: WorkQueue, process: Callable[[WorkItem], Optional[str]], name: Optional[str] = None) -> None:
+        """
+        Initialize the Worker.
+
+        Args:
+            queue (WorkQueue): The queue to work from.
+            process (Callable[[WorkItem], Optional[str]]): Downloads an item, returning None if it succeeded or why it failed.
+            name (Optional[str]): Identifies the worker. A unique name is made up if not given.
+        """
+        self.queue: WorkQueue = queue
+        self.name: str = name or worker_name()
+        self._process = process
+        self._held: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _heartbeat(self) -> None:
+        while not self._stopped.wait(WORK_HEARTBEAT_INTERVAL):
+            with self._lock:
+                tokens = list(self._held)
+            if not tokens:
+                continue
+            try:
+                held = set(self.queue.heartbeat(tokens))
+            except WorkQueueError:
+                continue # The lease may still be renewed next time, before it runs out.
+            with self._lock:
+                self._held.difference_update(set(tokens) - held)
+
+    def run(self, check: Callable[[], None] = lambda: None) -> WorkerStats:
+        """
+        Work until no items are queued or claimed by other workers.
+
+        Args:
+            check (Callable[[], None]): Called between items and while waiting. It may raise to stop the worker,
+                in which case the items it holds are given back to the queue.
+
+        Returns:
+            WorkerStats: What the worker did.
+
+        Raises:
+            WorkQueueError: If the queue could not be reached.
+        """
+        done = failed = lost = 0
+        heartbeat = threading.Thread(target = self._heartbeat, daemon = True)
+        heartbeat.start()
+        try:
+            while True:
+                check()
+                claims = self.queue.claim(self.name, WORK_CLAIM_BATCH)
+                if not claims:
+                    counts = self.queue.counts()
+                    if not counts.queued and not counts.claimed:
+                        break
+                    # Other workers hold the rest; wait in case their leases run out and the items come back.
+                    waited = 0.0
+                    while waited < WORK_POLL_INTERVAL:
+                        check()
+                        time.sleep(0.5)
+                        waited += 0.5
+                    continue
+                with self._lock:
+                    self._held.update(claim.token for claim in claims)
+                for claim in claims:
+                    check()
+                    with self._lock:
+                        still_held = claim.token in self._held
+                    error = self._process(claim.item) if still_held else None
+                    with self._lock:
+                        self._held.discard(claim.token)
+                    if not still_held or not self.queue.complete(claim.token, error):
+                        lost += 1
+                    elif error:
+                        failed += 1
+                    else:
+                        done += 1
+        finally:
+            self._stopped.set()
+            with self._lock:
+                tokens = list(self._held)
+                self._held.clear()
+            if tokens:
+                try:
+                    self.queue.release(tokens)
+                except WorkQueueError:
+                    pass # The leases will run out and the items will be retried.
+        return WorkerStats(done, failed, lost)
@@ -0,0 +1,44 @@
+import json
+import checkpoint
+from checkpoint import JobCheckpoint, saved_checkpoints
+
+def saved_done(job_checkpoint):
+    with open(job_checkpoint.path) as f:
+        return json.load(f)["done"]
+
+def test_done_papers_are_saved_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_SAVE_PAPERS", 10)
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_SAVE_INTERVAL", 3600)
+    job_checkpoint = JobCheckpoint.create({"subject": "0620"}, str(tmp_path))
+    for i in range(25):
+        job_checkpoint.mark_done(f"https://x/p{i}.pdf")
+    assert len(saved_done(job_checkpoint)) == 20
+    assert job_checkpoint.is_done("https://x/p24.pdf")
+    job_checkpoint.flush()
+    assert len(saved_done(job_checkpoint)) == 25
+
+def test_done_papers_are_saved_after_the_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_SAVE_PAPERS", 1000)
+    now = [100.0]
+    monkeypatch.setattr(checkpoint.time, "monotonic", lambda: now[0])
+    job_checkpoint = JobCheckpoint.create({}, str(tmp_path))
+    job_checkpoint.mark_done("a")
+    assert saved_done(job_checkpoint) == []
+    now[0] += checkpoint.CHECKPOINT_SAVE_INTERVAL
+    job_checkpoint.mark_done("b")
+    assert saved_done(job_checkpoint) == ["a", "b"]
+
+def test_release_saves_progress_for_the_next_job(tmp_path):
+    job_checkpoint = JobCheckpoint.create({"subject": "0620"}, str(tmp_path))
+    job_checkpoint.mark_done("a")
+    job_checkpoint.release()
+    [saved] = saved_checkpoints(str(tmp_path))
+    assert saved.claim()
+    assert saved.is_done("a") and saved.settings == {"subject": "0620"}
+
+def test_removed_checkpoint_is_not_saved_again(tmp_path):
+    job_checkpoint = JobCheckpoint.create({}, str(tmp_path))
+    job_checkpoint.mark_done("a")
+    job_checkpoint.remove()
+    job_checkpoint.flush()
+    assert saved_checkpoints(str(tmp_path)) == []
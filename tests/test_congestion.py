@@ -0,0 +1,120 @@
+import threading
+import pytest
+from requests.exceptions import Timeout
+import congestion
+from congestion import AdaptiveLimiter, HostLimiter, retry_after_seconds
+from constants import ADAPTIVE_INITIAL_CONCURRENCY, ADAPTIVE_MAX_CONCURRENCY, ADAPTIVE_MIN_CONCURRENCY
+
+class FakeResponse:
+    def __init__(self, status_code, headers = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def test_limit_grows_by_about_one_per_round_of_fast_requests():
+    host = HostLimiter("x")
+    rounds = 3
+    for _ in range(rounds):
+        for _ in range(int(host.limit)):
+            host.succeeded(0.1)
+    assert ADAPTIVE_INITIAL_CONCURRENCY + rounds - 1 <= host.limit <= ADAPTIVE_INITIAL_CONCURRENCY + rounds
+
+def test_limit_does_not_grow_while_latency_rises():
+    host = HostLimiter("x")
+    host.succeeded(0.1)
+    limit = host.limit
+    for _ in range(10):
+        host.succeeded(1.0)
+    assert host.limit == limit
+
+def test_limit_is_capped():
+    host = HostLimiter("x")
+    for _ in range(1000):
+        host.succeeded(0.1)
+    assert host.limit == ADAPTIVE_MAX_CONCURRENCY
+
+def test_overload_halves_the_limit_once_per_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(congestion.time, "monotonic", lambda: now[0])
+    host = HostLimiter("x")
+    host.overloaded()
+    assert host.limit == ADAPTIVE_INITIAL_CONCURRENCY / 2
+    host.overloaded() # The same burst of failures.
+    assert host.limit == ADAPTIVE_INITIAL_CONCURRENCY / 2
+    now[0] += congestion.ADAPTIVE_DECREASE_INTERVAL
+    host.overloaded()
+    assert host.limit == ADAPTIVE_INITIAL_CONCURRENCY / 4
+    for _ in range(10):
+        now[0] += congestion.ADAPTIVE_DECREASE_INTERVAL
+        host.overloaded()
+    assert host.limit == ADAPTIVE_MIN_CONCURRENCY
+
+def test_slots_are_limited_to_the_whole_part_of_the_limit():
+    host = HostLimiter("x")
+    host.limit = 2.9
+    assert host.try_acquire()
+    assert host.try_acquire()
+    assert not host.try_acquire()
+    host.release()
+    assert host.try_acquire()
+
+def test_retry_after_blocks_new_requests(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(congestion.time, "monotonic", lambda: now[0])
+    host = HostLimiter("x")
+    host.overloaded(retry_after = 30)
+    assert not host.try_acquire()
+    now[0] += 30
+    assert host.try_acquire()
+
+def test_slot_records_responses_and_errors():
+    limiter = AdaptiveLimiter()
+    with limiter.slot("https://Example.com/a") as slot:
+        assert slot.limiter.in_flight == 1
+        slot.record(FakeResponse(429, {"retry-after": "0"}))
+    host = limiter.for_url("https://example.com/b")
+    assert host is slot.limiter
+    assert host.in_flight == 0
+    assert host.limit == ADAPTIVE_INITIAL_CONCURRENCY / 2
+    host._last_decrease -= congestion.ADAPTIVE_DECREASE_INTERVAL
+    with pytest.raises(Timeout):
+        with limiter.slot("https://example.com/c"):
+            raise Timeout()
+    assert host.limit == ADAPTIVE_INITIAL_CONCURRENCY / 4
+    assert host.in_flight == 0
+
+def test_slot_released_early_is_given_back_once():
+    limiter = AdaptiveLimiter()
+    with limiter.slot("https://example.com/a") as slot:
+        slot.release()
+        assert not slot.held
+        assert slot.limiter.in_flight == 0
+    assert slot.limiter.in_flight == 0
+
+def test_acquire_waits_for_a_free_slot():
+    host = HostLimiter("x")
+    host.limit = 1
+    host.acquire()
+    acquired = threading.Event()
+    thread = threading.Thread(target = lambda: (host.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.3)
+    host.release()
+    assert acquired.wait(5)
+    thread.join(5)
+
+def test_timeouts_and_deadline_follow_the_host():
+    host = HostLimiter("x")
+    assert host.timeouts((5, 30)) == (5, 30)
+    assert host.deadline(10 ** 6, 30) is None
+    for _ in range(20):
+        host.succeeded(1.0)
+    assert host.timeouts((5, 30)) == (5, 1.0 * congestion.ADAPTIVE_TIMEOUT_MULTIPLIER)
+    assert host.timeouts((5, 2)) == (5, 2)
+    host.transferred(10 ** 6, 1.0)
+    assert host.deadline(10 ** 6, 3) == pytest.approx(3 + congestion.ADAPTIVE_DEADLINE_SLACK)
+
+def test_retry_after_seconds():
+    assert retry_after_seconds("12") == 12
+    assert retry_after_seconds("-3") == 0
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") is None
+    assert retry_after_seconds(None) is None
@@ -0,0 +1,48 @@
+import builtins
+import sys
+import threading
+from collections import Counter
+import pytest
+import downloadwriter
+from constants import FSYNC_BATCHED
+from downloadwriter import DownloadWriter, flush_pending_syncs
+
+@pytest.fixture
+def frequent_thread_switches():
+    # Makes races between threads far more likely to show up.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+def test_batched_syncs_sync_each_file_once_across_threads(tmp_path, monkeypatch, frequent_thread_switches):
+    monkeypatch.setattr(downloadwriter, "FSYNC_BATCH_SIZE", 7)
+    synced = Counter()
+    lock = threading.Lock()
+    def recording_open(path, mode = "r", *args, **kwargs):
+        if mode == "rb":
+            with lock:
+                synced[path] += 1
+        return builtins.open(path, mode, *args, **kwargs)
+    monkeypatch.setattr(downloadwriter, "open", recording_open, raising = False)
+    start = threading.Barrier(8)
+    errors = []
+    def publish(thread):
+        start.wait()
+        try:
+            for i in range(50):
+                with DownloadWriter(str(tmp_path / f"{thread}_{i}.pdf"), fsync_policy = FSYNC_BATCHED) as writer:
+                    writer.write(b"%PDF-")
+                    writer.publish()
+        except Exception as err:
+            errors.append(err)
+    threads = [threading.Thread(target = publish, args = (thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    flush_pending_syncs()
+    assert errors == []
+    assert len(synced) == 400
+    assert set(synced.values()) == {1}
+    assert downloadwriter.pending_syncs == []
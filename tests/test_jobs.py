@@ -0,0 +1,78 @@
+import threading
+import time
+from congestion import AdaptiveLimiter
+from jobs import JobQueue, check_current_download, check_current_job
+
+URL = "https://x/a.pdf"
+
+def wait_until(condition, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+def test_jobs_give_way_to_interactive_jobs_between_downloads():
+    queue = JobQueue(workers = 0)
+    job = queue.submit("getmany", lambda: None)
+    queue.interactive_idle.clear()
+    job.check(give_way = False) # In the middle of a download, so it carries on.
+    thread = threading.Thread(target = job.check)
+    thread.start()
+    time.sleep(0.2)
+    assert thread.is_alive()
+    queue.interactive_idle.set()
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_paused_download_gives_back_its_host_slot():
+    queue = JobQueue(workers = 0)
+    limiter = AdaptiveLimiter()
+    limiter.for_url(URL).limit = 1
+    job = queue.submit("getmany", lambda: None)
+    queue.pause(job)
+    released = []
+    with limiter.slot(URL) as slot:
+        def release():
+            released.append(True)
+            slot.release()
+        thread = threading.Thread(target = job.check, args = (False, release))
+        thread.start()
+        wait_until(lambda: released)
+        assert limiter.for_url(URL).try_acquire()
+        limiter.for_url(URL).release()
+        queue.resume(job)
+        thread.join(5)
+    assert released == [True] and not thread.is_alive()
+
+def test_background_downloads_do_not_hold_up_an_interactive_download():
+    # Both of the host's slots are taken by background downloads when an interactive download starts.
+    queue = JobQueue(workers = 2)
+    limiter = AdaptiveLimiter()
+    limiter.for_url(URL).limit = 2
+    started = threading.Semaphore(0)
+    interactive_started = threading.Event()
+
+    def background_download():
+        for _ in range(3):
+            check_current_job()
+            with limiter.slot(URL, check_current_download) as slot:
+                started.release()
+                for _ in range(20): # Chunks
+                    check_current_download(slot.release)
+                    interactive_started.wait(0.01)
+
+    background = [queue.submit("getmany", background_download) for _ in range(2)]
+    started.acquire()
+    started.acquire()
+
+    def interactive_download():
+        interactive_started.set()
+        with limiter.slot(URL, check_current_download):
+            pass
+
+    foreground = threading.Thread(target = queue.run_foreground, args = ("get", interactive_download))
+    foreground.start()
+    foreground.join(10)
+    assert not foreground.is_alive()
+    wait_until(lambda: all(job.finished for job in background))
+    queue.shutdown()
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import integrity
+from integrity import LibraryManifest
+
+def manifest_lines(manifest):
+    with open(manifest.path, encoding = "utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_records_are_appended_and_the_latest_wins(tmp_path):
+    manifest = LibraryManifest(str(tmp_path))
+    paper = str(tmp_path / "Chem-0620" / "2020" / "0620_s20_qp_1.pdf")
+    manifest.record(paper, 10, "aa")
+    manifest.record(paper, 12, "bb")
+    manifest.record(str(tmp_path / "other.pdf"), 5, "cc")
+    manifest.remove(str(tmp_path / "other.pdf"))
+    assert len(manifest_lines(manifest)) == 4
+    assert manifest.get(paper) == {"path": "Chem-0620/2020/0620_s20_qp_1.pdf", "size": 12, "sha256": "bb"}
+    reloaded = LibraryManifest(str(tmp_path))
+    assert reloaded.entries == manifest.entries
+    assert reloaded.superseded == 3
+
+def test_partly_written_lines_are_ignored(tmp_path):
+    manifest = LibraryManifest(str(tmp_path))
+    manifest.record(str(tmp_path / "a.pdf"), 10, "aa")
+    with open(manifest.path, "a", encoding = "utf-8") as f:
+        f.write('{"path": "b.pdf", "si')
+    assert list(LibraryManifest(str(tmp_path)).entries) == ["a.pdf"]
+
+def test_compact_keeps_only_the_latest_records(tmp_path):
+    manifest = LibraryManifest(str(tmp_path))
+    for size in range(5):
+        manifest.record(str(tmp_path / "a.pdf"), size, "aa")
+    manifest.record(str(tmp_path / "b.pdf"), 1, "bb")
+    manifest.remove(str(tmp_path / "b.pdf"))
+    assert manifest.compact(force = True)
+    assert manifest_lines(manifest) == [{"path": "a.pdf", "size": 4, "sha256": "aa"}]
+    assert manifest.superseded == 0
+
+def test_compact_waits_until_enough_lines_are_superseded(tmp_path, monkeypatch):
+    monkeypatch.setattr(integrity, "MANIFEST_COMPACT_MIN_LINES", 10)
+    manifest = LibraryManifest(str(tmp_path))
+    for i in range(20):
+        manifest.record(str(tmp_path / f"p{i}.pdf"), i, "aa")
+    for i in range(15):
+        manifest.record(str(tmp_path / "p0.pdf"), i, "bb")
+    assert not manifest.compact() # 15 superseded lines, but fewer than the 20 records.
+    assert len(manifest_lines(manifest)) == 35
+    for i in range(5):
+        manifest.record(str(tmp_path / "p0.pdf"), i, "cc")
+    assert manifest.compact()
+    assert len(manifest_lines(manifest)) == 20
+
+def test_compact_keeps_lines_appended_by_another_process(tmp_path):
+    manifest = LibraryManifest(str(tmp_path))
+    manifest.record(str(tmp_path / "a.pdf"), 1, "aa")
+    manifest.record(str(tmp_path / "a.pdf"), 2, "aa")
+    other = LibraryManifest(str(tmp_path))
+    other.record(str(tmp_path / "b.pdf"), 3, "bb")
+    assert manifest.compact(force = True)
+    assert {entry["path"] for entry in manifest_lines(manifest)} == {"a.pdf", "b.pdf"}
+    assert set(manifest.entries) == {"a.pdf", "b.pdf"}
+
+def test_concurrent_appends_and_compacts_lose_no_records(tmp_path):
+    library = str(tmp_path)
+    def append(worker):
+        manifest = LibraryManifest(library)
+        for i in range(50):
+            manifest.record(os.path.join(library, f"w{worker}", f"p{i}.pdf"), i, "aa")
+    def compact():
+        manifest = LibraryManifest(library)
+        for _ in range(20):
+            manifest.compact(force = True)
+    threads = [threading.Thread(target = append, args = (worker,)) for worker in range(4)]
+    threads.append(threading.Thread(target = compact))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert len(LibraryManifest(library).entries) == 4 * 50
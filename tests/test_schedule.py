@@ -0,0 +1,88 @@
+import datetime
+import pytest
+import schedule
+from schedule import BandwidthSchedule, RateLimiter, TimeWindow, format_rate, parse_rate
+
+def at(hour, minute = 0):
+    return datetime.datetime(2024, 5, 1, hour, minute, 30)
+
+@pytest.mark.parametrize("value, rate", [
+    ("full", None), ("Unlimited", None), ("pause", 0), ("off", 0),
+    ("100", 100 * 1024), ("100KB", 100 * 1024), ("100k/s", 100 * 1024), ("512b", 512), ("1.5M/s", 1.5 * 1024 * 1024),
+])
+def test_parse_rate(value, rate):
+    assert parse_rate(value) == rate
+
+@pytest.mark.parametrize("value", ["zoom", "-5KB", "5GB", ""])
+def test_parse_rate_rejects_invalid_rates(value):
+    with pytest.raises(ValueError):
+        parse_rate(value)
+
+def test_format_rate():
+    assert format_rate(None) == "full speed"
+    assert format_rate(0) == "paused"
+    assert format_rate(512) == "512 B/s"
+    assert format_rate(100 * 1024) == "100 KB/s"
+    assert format_rate(3 * 1024 * 1024) == "3 MB/s"
+
+def test_window_contains():
+    assert TimeWindow(9 * 60, 17 * 60, None).contains(9 * 60)
+    assert not TimeWindow(9 * 60, 17 * 60, None).contains(17 * 60)
+    overnight = TimeWindow(18 * 60, 7 * 60, None)
+    assert overnight.contains(23 * 60) and overnight.contains(0) and overnight.contains(6 * 60 + 59)
+    assert not overnight.contains(12 * 60)
+
+def test_schedule_with_windows_only_pauses_outside_them():
+    bandwidth = BandwidthSchedule("18:00-07:00")
+    assert bandwidth.rate_at(at(23)) is None
+    assert bandwidth.rate_at(at(3)) is None
+    assert bandwidth.rate_at(at(12)) == 0
+
+def test_schedule_rates_inside_and_outside_windows():
+    bandwidth = BandwidthSchedule("09:00-17:00=50KB, 17:00-24:00=full, 1MB")
+    assert bandwidth.rate_at(at(10)) == 50 * 1024
+    assert bandwidth.rate_at(at(17)) is None
+    assert bandwidth.rate_at(at(23, 59)) is None
+    assert bandwidth.rate_at(at(8, 59)) == 1024 * 1024
+
+def test_first_window_containing_a_time_gives_its_rate():
+    bandwidth = BandwidthSchedule("00:00-12:00=pause,06:00-18:00=10KB")
+    assert bandwidth.rate_at(at(8)) == 0
+    assert bandwidth.rate_at(at(13)) == 10 * 1024
+
+@pytest.mark.parametrize("spec, message", [
+    ("10:00-10:00", "empty"),
+    ("100KB", "no time windows"),
+    ("100KB,18:00-07:00", "windows are written as"),
+    ("18:00-24:30", "Invalid time"),
+    ("25:00-26:00", "Invalid time"),
+    ("09:61-10:00", "Invalid time"),
+    ("09:00-10:00=zoom", "Invalid rate"),
+])
+def test_schedule_rejects_invalid_specs(spec, message):
+    with pytest.raises(ValueError, match = message):
+        BandwidthSchedule(spec)
+
+def test_next_change_is_the_next_window_boundary():
+    bandwidth = BandwidthSchedule("18:00-07:00,100KB")
+    assert bandwidth.next_change(at(12, 15)) == datetime.datetime(2024, 5, 1, 18, 0)
+    assert bandwidth.next_change(at(18)) == datetime.datetime(2024, 5, 2, 7, 0)
+    assert bandwidth.next_change(at(23, 59)) == datetime.datetime(2024, 5, 2, 7, 0)
+    assert bandwidth.describe(at(12)) == "100 KB/s until 18:00"
+    assert BandwidthSchedule("18:00-07:00").describe(at(12)) == "paused until 18:00"
+
+def test_rate_limiter_allows_a_burst_then_spaces_out_bytes(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(schedule.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter()
+    rate = 1000
+    now[0] += 10 # A quiet spell fills the bucket, up to the burst.
+    assert limiter.delay(int(rate * schedule.THROTTLE_BURST_SECONDS), rate) == 0
+    assert limiter.delay(500, rate) == pytest.approx(0.5)
+    now[0] += 0.5
+    assert limiter.delay(1000, rate) == pytest.approx(1.0)
+
+def test_rate_limiter_does_not_wait_at_full_speed():
+    limiter = RateLimiter()
+    assert limiter.delay(10 ** 9, None) == 0
+    assert limiter.delay(10 ** 9, 0) == 0
@@ -0,0 +1,125 @@
+import os
+import random
+import threading
+import pytest
+from requests.exceptions import ConnectionError
+from constants import SEGMENT_ATTEMPTS, SEGMENT_CONNECTIONS
+from congestion import HostLimiter
+from downloadwriter import DownloadWriter
+from segmented import RangeNotSatisfiedError, SegmentedDownload, ranges_supported, split_ranges
+
+DATA = bytes(random.Random(0).randrange(256) for _ in range(100000))
+CHUNK = 1000
+
+class FakeResponse:
+    def __init__(self, body, status_code = 200, headers = None, fail_after = None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.fail_after = fail_after
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), CHUNK):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise ConnectionError("Connection reset")
+            yield self.body[start:start + CHUNK]
+
+    def close(self):
+        self.closed = True
+
+class FakePool:
+    """
+    Answers requests for the whole file and for ranges of it. Requests for ranges starting at one of the offsets
+    in failing_starts fail part way through, once for each offset, or every time if always_fail is set.
+    """
+
+    def __init__(self, failing_starts = (), always_fail = False, ignore_ranges = False):
+        self.failing_starts = set(failing_starts)
+        self.always_fail = always_fail
+        self.ignore_ranges = ignore_ranges
+        self.ranges = []
+        self._lock = threading.Lock()
+
+    def whole(self):
+        return FakeResponse(DATA, headers = {"content-length": str(len(DATA)), "accept-ranges": "bytes"})
+
+    def get(self, url, timeouts, stream = False, hedge = False, headers = None):
+        if self.ignore_ranges:
+            return self.whole()
+        start, end = map(int, headers["Range"][len("bytes="):].split("-"))
+        with self._lock:
+            self.ranges.append((start, end))
+            fail = self.always_fail or start in self.failing_starts
+            self.failing_starts.discard(start)
+        return FakeResponse(DATA[start:end + 1], 206, {"content-range": f"bytes {start}-{end}/{len(DATA)}"},
+                            fail_after = 3 * CHUNK if fail else None)
+
+def download(tmp_path, pool, host = None):
+    path = str(tmp_path / "paper.pdf")
+    progress = []
+    with DownloadWriter(path, len(DATA)) as writer:
+        segmented = SegmentedDownload("https://x/paper.pdf", writer, len(DATA), pool, host or HostLimiter("x"), (5, 5))
+        done = segmented.run(pool.whole(), lambda: None, progress.append)
+        if done:
+            writer.publish()
+    return path, done, progress
+
+def test_split_ranges_covers_the_file():
+    assert split_ranges(10, 3) == [(0, 3), (3, 6), (6, 10)]
+    ranges = split_ranges(len(DATA), SEGMENT_CONNECTIONS)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(DATA)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+
+def test_ranges_supported_needs_a_large_uncompressed_file(monkeypatch):
+    import segmented
+    monkeypatch.setattr(segmented, "SEGMENTED_MIN_SIZE", 1000)
+    assert ranges_supported(FakePool().whole(), len(DATA))
+    assert not ranges_supported(FakePool().whole(), 999)
+    assert not ranges_supported(FakeResponse(DATA, headers = {"accept-ranges": "none"}), len(DATA))
+    assert not ranges_supported(FakeResponse(DATA, headers = {"accept-ranges": "bytes", "content-encoding": "gzip"}), len(DATA))
+
+def test_parts_are_reassembled_in_order(tmp_path):
+    pool = FakePool()
+    host = HostLimiter("x")
+    path, done, progress = download(tmp_path, pool, host)
+    assert done
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert len(pool.ranges) == SEGMENT_CONNECTIONS - 1 # The first part is read from the response for the whole file.
+    assert progress[-1] == len(DATA)
+    assert host.in_flight == 0
+
+def test_failed_parts_carry_on_from_the_last_byte_received(tmp_path):
+    starts = [start for start, _ in split_ranges(len(DATA), SEGMENT_CONNECTIONS)][1:]
+    pool = FakePool(failing_starts = starts[:2])
+    path, done, _ = download(tmp_path, pool)
+    assert done
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    retries = sorted(start for start, _ in pool.ranges if start not in starts)
+    assert retries == [start + 3 * CHUNK for start in starts[:2]]
+
+def test_a_part_failing_every_attempt_fails_the_download(tmp_path):
+    pool = FakePool(always_fail = True)
+    with pytest.raises(ConnectionError):
+        download(tmp_path, pool)
+    assert len(pool.ranges) <= (SEGMENT_CONNECTIONS - 1) * SEGMENT_ATTEMPTS
+    assert os.listdir(tmp_path) == []
+
+def test_a_host_ignoring_ranges_is_not_retried(tmp_path):
+    pool = FakePool(ignore_ranges = True)
+    with pytest.raises(RangeNotSatisfiedError):
+        download(tmp_path, pool)
+    assert os.listdir(tmp_path) == []
+
+def test_nothing_is_read_without_free_slots(tmp_path):
+    host = HostLimiter("x")
+    host.limit = 1
+    host.acquire() # The slot of the request for the whole file.
+    _, done, progress = download(tmp_path, FakePool(), host)
+    assert not done
+    assert progress == []
@@ -0,0 +1,56 @@
+import http.client
+import threading
+import pytest
+from server import PaperServer, safe_path_part
+
+@pytest.fixture
+def server(tmp_path):
+    # The upstream website is unreachable, so anything not served from disk fails rather than being fetched.
+    paper_server = PaperServer(("127.0.0.1", 0), "http://127.0.0.1:9", str(tmp_path / "library"), str(tmp_path / "cache"), (1, 1))
+    thread = threading.Thread(target = paper_server.serve_forever, args = (0.05,), daemon = True)
+    thread.start()
+    yield paper_server
+    paper_server.shutdown()
+    paper_server.server_close()
+
+def get(paper_server, path):
+    connection = http.client.HTTPConnection(*paper_server.server_address, timeout = 10)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+def test_papers_are_sent_from_the_library(server, tmp_path):
+    folder = tmp_path / "library" / "Chem-0620" / "2019" / "May-June"
+    folder.mkdir(parents = True)
+    (folder / "0620_s19_qp_1.pdf").write_bytes(b"%PDF-paper")
+    assert get(server, "/igcse/Chem-0620/2019/0620_s19_qp_1.pdf") == (200, b"%PDF-paper")
+
+@pytest.mark.parametrize("path", [
+    "/x/%2e%2e/%2e%2e/%2e%2e/tmp/0452_s19_qp_12.pdf",
+    "/x/%2E%2E/outside/2019/0452_s19_qp_12.pdf",
+    "/x/../outside/0452_s19_qp_12.pdf",
+    "/x/..%2f..%2foutside/0452_s19_qp_12.pdf",
+    "/x/a%5c..%5c..%5coutside/0452_s19_qp_12.pdf",
+    "/x/a%00/2019/0452_s19_qp_12.pdf",
+])
+def test_paths_leaving_the_library_are_refused(server, tmp_path, path):
+    outside = tmp_path / "outside" / "May-June"
+    outside.mkdir(parents = True)
+    (outside / "0452_s19_qp_12.pdf").write_bytes(b"secret")
+    status, body = get(server, path)
+    assert status == 400 and b"secret" not in body
+    assert not (tmp_path / "library").exists()
+
+def test_symbolic_links_out_of_the_library_are_refused(server, tmp_path):
+    (tmp_path / "outside" / "May-June").mkdir(parents = True)
+    (tmp_path / "outside" / "May-June" / "0452_s19_qp_12.pdf").write_bytes(b"secret")
+    (tmp_path / "library").mkdir()
+    (tmp_path / "library" / "Link").symlink_to(tmp_path / "outside")
+    assert get(server, "/x/Link/0452_s19_qp_12.pdf")[0] == 400
+
+def test_safe_path_part():
+    assert safe_path_part("Specimen Papers")
+    assert not any(map(safe_path_part, [".", "..", "a/b", "a\\b", "a\0b"]))
@@ -0,0 +1,133 @@
+import threading
+import time
+import pytest
+import sharedcache
+from sharedcache import DownloadClaim, SingleFlight
+
+def test_single_flight_shares_one_call_between_concurrent_callers():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "page"
+    results = []
+    leader = threading.Thread(target = lambda: results.append(flight.do("url", call)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target = lambda: results.append(flight.do("url", call))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert results == ["page"] * 4
+    assert len(calls) == 1
+
+def test_single_flight_calls_again_once_the_call_has_finished():
+    flight = SingleFlight()
+    calls = []
+    assert flight.do("url", lambda: calls.append(1) or len(calls)) == 1
+    assert flight.do("url", lambda: calls.append(1) or len(calls)) == 2
+
+def test_single_flight_shares_errors_with_waiting_callers():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    def call():
+        started.set()
+        release.wait(5)
+        raise ValueError("not found")
+    errors = []
+    def run():
+        try:
+            flight.do("url", call)
+        except ValueError as err:
+            errors.append(str(err))
+    leader = threading.Thread(target = run)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target = run)
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ["not found", "not found"]
+
+def test_single_flight_retries_when_the_leader_is_interrupted():
+    class Interrupted(BaseException):
+        pass
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    def interrupted_call():
+        started.set()
+        release.wait(5)
+        raise Interrupted()
+    def leader():
+        with pytest.raises(Interrupted):
+            flight.do("url", interrupted_call)
+    results = []
+    leader_thread = threading.Thread(target = leader)
+    leader_thread.start()
+    started.wait(5)
+    follower = threading.Thread(target = lambda: results.append(flight.do("url", lambda: "page")))
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader_thread.join(5)
+    follower.join(5)
+    assert results == ["page"]
+
+def test_download_claim_makes_a_second_claim_wait(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharedcache, "CLAIM_POLL_INTERVAL", 0.01)
+    claims = str(tmp_path / "claims")
+    path = str(tmp_path / "paper.pdf")
+    waits = []
+    entered = threading.Event()
+    def second():
+        with DownloadClaim(claims, path, waits.append) as claim:
+            entered.set()
+            assert claim.waited
+            assert claim.published_meanwhile()
+    with DownloadClaim(claims, path) as first:
+        assert not first.waited
+        thread = threading.Thread(target = second)
+        thread.start()
+        time.sleep(0.1)
+        assert not entered.is_set()
+        with open(path, "wb") as f:
+            f.write(b"%PDF-")
+    thread.join(5)
+    assert entered.is_set()
+    assert waits[0] is True and all(first is False for first in waits[1:])
+
+def test_download_claim_does_not_wait_for_another_file(tmp_path):
+    claims = str(tmp_path / "claims")
+    with DownloadClaim(claims, str(tmp_path / "0452_s19_qp_12.pdf")):
+        with DownloadClaim(claims, str(tmp_path / "9702_w81_qp_281.pdf")) as other:
+            assert not other.waited
+            assert not other.published_meanwhile()
+
+def test_download_claim_removes_its_lock_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharedcache, "CLAIM_POLL_INTERVAL", 0.01)
+    claims = tmp_path / "claims"
+    path = str(tmp_path / "paper.pdf")
+    entered = []
+    def second():
+        with DownloadClaim(str(claims), path):
+            entered.append(len(list(claims.iterdir())))
+    with DownloadClaim(str(claims), path):
+        assert len(list(claims.iterdir())) == 1
+        thread = threading.Thread(target = second)
+        thread.start()
+        time.sleep(0.1)
+    thread.join(5)
+    assert entered == [1]
+    assert list(claims.iterdir()) == []
+    assert sharedcache._path_locks == {}
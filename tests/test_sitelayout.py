@@ -0,0 +1,127 @@
+import json
+import pytest
+from bs4 import BeautifulSoup
+import sitelayout
+from client import Catalogue, ClientSettings, NoIndexPageError, PaperClient, PaperNotFoundError
+from sitelayout import SiteLayouts, SubjectLayout, find_folders, learn_layout, page_key
+
+SUBJECT_PAGE = "https://x/igcse/Chem-0620"
+
+def links(*hrefs):
+    return "".join(f'<a href="{href}"></a>' for href in hrefs)
+
+def test_page_key():
+    assert page_key("s", "19") == "19"
+    assert page_key("m", "20-21") == "20"
+    assert page_key("y", "23") == "y"
+
+def test_find_folders():
+    year_folders, specimen_folder = find_folders(
+        ["2019/", "https://x/igcse/Chem-0620/2020", "Specimen%20Paper%202023/", "0620_s18_qp_1.pdf", "../", "", "1999/"])
+    assert year_folders == {"19": "2019", "20": "2020", "99": "1999"}
+    assert specimen_folder == "Specimen Paper 2023"
+
+def test_learned_layout_finds_each_sessions_page():
+    layout = learn_layout("0620", ["2019/", "2020/", "Specimen Papers/", "0620_w18_qp_1.pdf", "0620_s18_ms_1.pdf", "0621_s17_qp_1.pdf"])
+    assert layout.folder("s", "19") == "2019"
+    assert layout.folder("w", "20") == "2020"
+    assert layout.folder("y", "23") == "Specimen Papers"
+    assert layout.folder("w", "18") == "" # Listed on the subject page itself.
+    assert layout.folder("s", "17") is None # Only another subject's papers.
+    assert layout.folder("s", "21") is None
+    assert not layout.is_stale()
+
+def test_layout_without_specimen_folder_has_no_specimen_page():
+    assert learn_layout("0620", ["2019/"]).folder("y", "19") is None
+
+def test_layout_goes_stale(monkeypatch):
+    layout = learn_layout("0620", ["2019/"])
+    monkeypatch.setattr(sitelayout.time, "time", lambda: layout.learned + sitelayout.LAYOUT_RECHECK_AGE + 1)
+    assert layout.is_stale()
+
+def test_layouts_are_saved_in_the_catalogue(tmp_path):
+    path = str(tmp_path / "catalogue.json")
+    with open(path, "w") as f:
+        json.dump({"subjects": {"IGCSE": {}}}, f)
+    learned = SiteLayouts(path).learn("0620", ["2019/", "0620_w18_qp_1.pdf"])
+    with open(path) as f:
+        catalogue = json.load(f)
+    assert catalogue["subjects"] == {"IGCSE": {}}
+    assert SiteLayouts(path).get("0620") == learned
+    assert SiteLayouts(path).get("0625") is None
+
+def test_layouts_learned_by_another_process_are_found(tmp_path):
+    path = str(tmp_path / "catalogue.json")
+    layouts = SiteLayouts(path)
+    assert layouts.get("0620") is None
+    SiteLayouts(path).learn("0620", ["2019/"])
+    assert layouts.get("0620").folder("s", "19") == "2019"
+
+def test_invalid_saved_layouts_are_learned_again(tmp_path):
+    path = str(tmp_path / "catalogue.json")
+    with open(path, "w") as f:
+        json.dump({"layouts": {"0620": {"year_folders": {}}, "0625": SubjectLayout({"19": "2019"}, None, [], 1.0)._asdict()}}, f)
+    layouts = SiteLayouts(path)
+    assert layouts.get("0620") is None
+    assert layouts.get("0625").year_folders == {"19": "2019"}
+
+class FakeSite:
+    """
+    Serves index pages to a PaperClient in place of the website, recording every page requested.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.fetched = []
+
+    def fetch_html(self, url, on_fetch = None, settings = None):
+        self.fetched.append(url)
+        if url not in self.pages:
+            raise AssertionError(f"Requested a page which does not exist: {url}")
+        return BeautifulSoup(self.pages[url], "html.parser")
+
+@pytest.fixture
+def site(tmp_path):
+    return FakeSite({
+        SUBJECT_PAGE: links("2019/", "2020/", "Specimen%20Paper%202023/", "0620_w18_qp_1.pdf"),
+        SUBJECT_PAGE + "/2019": links("0620_s19_qp_1.pdf", "0620_s19_in_5.docx"),
+        SUBJECT_PAGE + "/2020": links("0620_s20_qp_1.pdf", "0620_w20_qp_1.pdf"),
+        SUBJECT_PAGE + "/Specimen Paper 2023": links("0620_y23_sp_1.pdf"),
+    })
+
+@pytest.fixture
+def client(tmp_path, site):
+    paper_client = PaperClient(ClientSettings(base_url = "https://x", mirrors = [], download_folder = str(tmp_path / "library")),
+                               Catalogue({"IGCSE": "igcse"}, {"0620": ("IGCSE", "Chem-0620")}),
+                               layouts = SiteLayouts(str(tmp_path / "catalogue.json")))
+    paper_client.fetch_html = site.fetch_html
+    return paper_client
+
+def test_papers_are_found_on_the_page_the_layout_gives(client, site):
+    assert client.resolve("0620_s19_qp_1").url == SUBJECT_PAGE + "/2019/0620_s19_qp_1.pdf"
+    assert client.resolve("0620_s19_in_5").url == SUBJECT_PAGE + "/2019/0620_s19_in_5.docx"
+    assert client.resolve("0620_y23_sp_1").url == SUBJECT_PAGE + "/Specimen Paper 2023/0620_y23_sp_1.pdf"
+    assert client.resolve("0620_w18_qp_1").url == SUBJECT_PAGE + "/0620_w18_qp_1.pdf"
+    # The subject page is read once to learn the layout, and again as the index page of the papers listed on it.
+    assert site.fetched == [SUBJECT_PAGE, SUBJECT_PAGE + "/2019", SUBJECT_PAGE + "/Specimen Paper 2023", SUBJECT_PAGE]
+
+def test_years_missing_from_the_layout_are_never_requested(client, site):
+    with pytest.raises(NoIndexPageError):
+        client.year_page("0620", "s", "16")
+    with pytest.raises(PaperNotFoundError):
+        client.resolve("0620_s16_qp_1")
+    available = [paper.file_name for paper in client.iter_available("0620", ["s16", "s19", "w20", "s21"])]
+    assert available == ["0620_s19_qp_1.pdf", "0620_s19_in_5.docx", "0620_w20_qp_1.pdf"]
+    assert site.fetched == [SUBJECT_PAGE, SUBJECT_PAGE + "/2019", SUBJECT_PAGE + "/2020"]
+
+def test_stale_layout_is_learned_again_before_a_year_is_taken_to_be_missing(client, site, monkeypatch):
+    client.resolve("0620_s19_qp_1")
+    site.pages[SUBJECT_PAGE] += links("2021/")
+    site.pages[SUBJECT_PAGE + "/2021"] = links("0620_s21_qp_1.pdf")
+    with pytest.raises(NoIndexPageError):
+        client.resolve("0620_s21_qp_1") # Not stale yet, so the new folder is not looked for.
+    learned = client.layouts.get("0620").learned
+    monkeypatch.setattr(sitelayout.time, "time", lambda: learned + sitelayout.LAYOUT_RECHECK_AGE + 1)
+    site.fetched.clear()
+    assert client.resolve("0620_s21_qp_1").url == SUBJECT_PAGE + "/2021/0620_s21_qp_1.pdf"
+    assert site.fetched == [SUBJECT_PAGE, SUBJECT_PAGE + "/2021"]
@@ -0,0 +1,128 @@
+import threading
+import pytest
+import workqueue
+from constants import WORK_MAX_ATTEMPTS
+from workqueue import (QueueCounts, SQLiteWorkQueue, WorkItem, WorkQueue, WorkQueueError, WorkQueueServer, Worker,
+                       open_work_queue)
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(workqueue.time, "time", lambda: now[0])
+    return now
+
+@pytest.fixture(params = ["sqlite", "tcp"])
+def queue(request, tmp_path):
+    database = SQLiteWorkQueue(str(tmp_path / "queue.sqlite"))
+    if request.param == "sqlite":
+        yield database
+        return
+    server = WorkQueueServer(("127.0.0.1", 0), database)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    queue = open_work_queue(f"tcp://127.0.0.1:{server.server_address[1]}")
+    yield queue
+    queue.close()
+    server.shutdown()
+    server.server_close()
+
+def items(count):
+    return [WorkItem(f"Chem-0620/2020/p{i}.pdf", f"igcse/Chem-0620/2020/p{i}.pdf") for i in range(count)]
+
+def test_work_queue_is_abstract():
+    with pytest.raises(TypeError):
+        WorkQueue()
+
+def test_items_are_added_once(queue):
+    assert queue.add(items(3)) == 3
+    assert queue.add(items(4)) == 1
+    assert queue.counts() == QueueCounts(4, 0, 0, 0)
+
+def test_claims_are_handed_out_once_in_order(queue):
+    queue.add(items(3))
+    first = queue.claim("a", 2)
+    second = queue.claim("b", 2)
+    assert [claim.item for claim in first + second] == items(3)
+    assert [claim.attempt for claim in first + second] == [1, 1, 1]
+    assert len({claim.token for claim in first + second}) == 3
+    assert queue.claim("c", 2) == []
+
+def test_completing_needs_the_current_token(queue):
+    queue.add(items(2))
+    done, failed = queue.claim("a", 2)
+    assert queue.complete(done.token)
+    assert not queue.complete(done.token) # Already finished.
+    assert not queue.complete("not a token")
+    assert queue.complete(failed.token, "404")
+    assert queue.counts() == QueueCounts(0, 0, 1, 1)
+    assert queue.failures(10) == [(failed.item.path, "404")]
+
+def test_expired_lease_is_requeued_and_its_old_token_is_refused(queue, clock):
+    queue.add(items(1))
+    [lost] = queue.claim("crashed", 1, lease = 10)
+    clock[0] += 11
+    [retry] = queue.claim("b", 1, lease = 10)
+    assert retry.item == lost.item
+    assert retry.attempt == 2
+    assert retry.token != lost.token
+    assert not queue.complete(lost.token)
+    assert queue.heartbeat([lost.token, retry.token]) == [retry.token]
+    assert queue.complete(retry.token)
+    assert queue.counts() == QueueCounts(0, 0, 1, 0)
+
+def test_item_fails_after_losing_its_worker_too_many_times(queue, clock):
+    queue.add(items(1))
+    for _ in range(WORK_MAX_ATTEMPTS):
+        assert queue.claim("crashed", 1, lease = 10)
+        clock[0] += 11
+    assert queue.claim("b", 1) == []
+    assert queue.counts() == QueueCounts(0, 0, 0, 1)
+    assert queue.failures(10) == [(items(1)[0].path, "Lost its worker too many times")]
+
+def test_heartbeat_keeps_the_lease(queue, clock):
+    queue.add(items(1))
+    [claim] = queue.claim("a", 1, lease = 10)
+    clock[0] += 8
+    assert queue.heartbeat([claim.token], lease = 10) == [claim.token]
+    clock[0] += 8
+    assert queue.claim("b", 1) == []
+    assert queue.complete(claim.token)
+
+def test_release_requeues_without_counting_an_attempt(queue):
+    queue.add(items(1))
+    [claim] = queue.claim("a", 1)
+    queue.release([claim.token])
+    assert not queue.complete(claim.token)
+    [again] = queue.claim("b", 1)
+    assert again.attempt == 1
+
+def test_worker_drains_the_queue(queue):
+    queue.add(items(5))
+    processed = []
+    def process(item):
+        processed.append(item.path)
+        return "404" if item.path.endswith("p4.pdf") else None
+    stats = Worker(queue, process, "w").run()
+    assert (stats.done, stats.failed, stats.lost) == (4, 1, 0)
+    assert sorted(processed) == sorted(item.path for item in items(5))
+    assert queue.counts() == QueueCounts(0, 0, 4, 1)
+
+def test_stopped_worker_gives_its_items_back(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.sqlite"))
+    queue.add(items(3))
+    class Stop(BaseException):
+        pass
+    processed = []
+    def process(item):
+        processed.append(item)
+        if len(processed) == 2:
+            raise Stop()
+    with pytest.raises(Stop):
+        Worker(queue, process, "w").run()
+    assert queue.counts() == QueueCounts(2, 0, 1, 0)
+    assert [claim.attempt for claim in queue.claim("b", 2)] == [1, 1]
+
+def test_open_work_queue_checks_tcp_addresses(tmp_path):
+    assert isinstance(open_work_queue(str(tmp_path / "q.sqlite")), SQLiteWorkQueue)
+    with pytest.raises(WorkQueueError):
+        open_work_queue("tcp://localhost")